@@ -1,14 +1,47 @@
 """Handles the set up of the app."""
 
+from datetime import date
 from http import HTTPStatus
-from flask import Flask
-from typing import Self
+from flask import Flask, current_app, g, json, jsonify, request, stream_with_context
+from typing import IO, Iterator, Self
 from flask.views import MethodView
+from werkzeug import Response
 from flask_smorest import Blueprint, abort, Api
-from exceptions import NoReceiptFoundException
-from receipt_service import ReceiptData, ReceiptTracker
-from schema import ReceiptInputSchema, OutputIDSchema, OutputPointsSchema, InputIDSchema
+from dedup import DedupIndex
+from exceptions import IngestQueueFullException, NoReceiptFoundException
+from ingest_queue import IngestQueue
+from metrics import REGISTRY, REQUEST_SECONDS, RESPONSES
+from receipt_codecs import ReceiptCodec, get_codec
+from receipt_stats import ReceiptStatsIndex
+from shared_store import SharedReceiptStatsIndex, SharedReceiptStore
+from receipt_service import CapacityPolicy, ReceiptData, ReceiptTracker, points_trace
+from rules import DEFAULT_RULES_VERSION, load_rule_sets
+from snapshot import ReceiptSnapshot, SnapshotWriter
+from storage import AppendOnlyLogBackend, SqliteSpillStore
+from schema import (
+    ReceiptBaseSchema,
+    OutputBatchSchema,
+    OutputBatchPointsSchema,
+    OutputIDSchema,
+    OutputIngestStatsSchema,
+    OutputPointsSchema,
+    OutputStatsSchema,
+    OutputRetailerStatsSchema,
+    OutputDateRangeStatsSchema,
+    OutputHourStatsSchema,
+    OutputPointsBandStatsSchema,
+    InputIDSchema,
+    InputIDsSchema,
+    InputRetailerStatsSchema,
+    InputDateRangeSchema,
+)
+import atexit
 import logging
+import marshmallow as ma
+import os
+import random
+import tempfile
+from time import perf_counter
 
 # Configure our logger.
 logging.basicConfig(level=logging.INFO)
@@ -22,13 +55,255 @@ def create_app() -> Flask:
         "API_TITLE": "Receipt Processor",
         "API_VERSION": "v1.0.0",
         "OPENAPI_VERSION": "3.0.3",
+        "RECEIPTS_EAGER_POINTS": False,
+        "RECEIPTS_MAX_BATCH_SIZE": 10000,
+        # /process/stream stores receipts in batches of this many as they're read, and skips lines longer than the max.
+        "RECEIPTS_STREAM_BATCH_SIZE": 100,
+        "RECEIPTS_STREAM_MAX_LINE_BYTES": 1024 * 1024,
+        # Path of the append-only log receipts are persisted to. Receipts are only kept in memory if this isn't set.
+        "RECEIPTS_STORAGE_PATH": None,
+        "RECEIPTS_STORAGE_COMMIT_INTERVAL": 0.0,
+        "RECEIPTS_STORAGE_WAIT_FOR_COMMIT": True,
+        # Path of the snapshot the tracker is restored from on startup, if it's there, and written to every interval
+        # seconds and on exit. No snapshots are written if this isn't set.
+        "RECEIPTS_SNAPSHOT_PATH": None,
+        "RECEIPTS_SNAPSHOT_INTERVAL": 300.0,
+        # Limits on the receipts kept in memory. Receipts past them are spilled to an SQLite database at the spill
+        # path, or a temporary file if it isn't set.
+        "RECEIPTS_MAX_ENTRIES": None,
+        "RECEIPTS_MAX_BYTES": None,
+        "RECEIPTS_TTL": None,
+        "RECEIPTS_SPILL_PATH": None,
+        # Points rules version new receipts are scored with, and a JSON file of rule sets to register beyond the
+        # default version "1".
+        "RECEIPTS_RULES_VERSION": DEFAULT_RULES_VERSION,
+        "RECEIPTS_RULES_PATH": None,
+        # How many submissions to remember for deduplication. Resubmitted receipts get their original ID back rather
+        # than being stored again, matched by Idempotency-Key header or receipt content. Off if not set.
+        "RECEIPTS_DEDUP_MAX_ENTRIES": None,
+        # Whether running totals of the receipts are kept up to date for /receipts/stats, and how many points wide the
+        # bands its totals by points are.
+        "RECEIPTS_STATS_ENABLED": True,
+        "RECEIPTS_STATS_POINTS_BAND_WIDTH": 25,
+        # Unix socket of a Redis-protocol store (store_server.py, or Redis) for worker processes to share receipts and
+        # stats through, and how many connections each process pools to it. Receipts are per process if not set.
+        "RECEIPTS_SHARED_STORE_PATH": None,
+        "RECEIPTS_SHARED_STORE_MAX_CONNECTIONS": 8,
+        # With async ingest on, receipts posted to /process are queued and added to the tracker by background workers.
+        "RECEIPTS_ASYNC_INGEST": False,
+        "RECEIPTS_INGEST_QUEUE_SIZE": 10000,
+        "RECEIPTS_INGEST_WORKERS": 4,
+        "RECEIPTS_INGEST_BATCH_SIZE": 100,
+        "RECEIPTS_INGEST_ENQUEUE_TIMEOUT": 0.1,
+        # How many times a batch the tracker fails to add is tried before its receipts are given up on, and the file
+        # they're then appended to as JSON lines, to be resubmitted. They're only logged if not set.
+        "RECEIPTS_INGEST_MAX_ATTEMPTS": 3,
+        "RECEIPTS_INGEST_DEAD_LETTER_PATH": None,
+        # How long a points lookup waits for a still queued receipt before telling the client to retry.
+        "RECEIPTS_PENDING_WAIT": 0.5,
+        # Whether request and stage timings are recorded and served at /metrics.
+        "RECEIPTS_METRICS_ENABLED": True,
+        # Fraction of requests whose points calculations are traced rule by rule and logged, for debugging.
+        "RECEIPTS_TRACE_SAMPLE_RATE": 0.0,
+        # Codec /process and /<id>/points decode receipts and encode responses with: marshmallow (the schemas), orjson
+        # or msgspec. See receipt_codecs.py.
+        "RECEIPTS_CODEC": "marshmallow",
     }
     app.config.update(config)
+    # Settings can be overridden with FLASK_ prefixed environment variables, e.g. FLASK_RECEIPTS_EAGER_POINTS=true
+    app.config.from_prefixed_env()
+    app.extensions["receipt_codec"] = get_codec(app.config["RECEIPTS_CODEC"])
+    # The tracker is shared by every app in the process, so a writer started for an app made earlier is stopped, with
+    # a last snapshot of the tracker as it was, before the tracker is reconfigured and another started.
+    stop_snapshot_writer()
+    configure_tracker(app)
+    # Closes the tracker's storage, spill store and shared store on exit. Registered once however many apps are made.
+    atexit.unregister(ReceiptTracker().close)
+    atexit.register(ReceiptTracker().close)
+    if app.config["RECEIPTS_SNAPSHOT_PATH"] is not None:
+        start_snapshot_writer(app.config["RECEIPTS_SNAPSHOT_PATH"], app.config["RECEIPTS_SNAPSHOT_INTERVAL"])
+        app.extensions["receipt_snapshot_writer"] = _snapshot_writer
+    if app.config["RECEIPTS_ASYNC_INGEST"]:
+        ingest_queue = IngestQueue(
+            max_size=app.config["RECEIPTS_INGEST_QUEUE_SIZE"],
+            num_workers=app.config["RECEIPTS_INGEST_WORKERS"],
+            batch_size=app.config["RECEIPTS_INGEST_BATCH_SIZE"],
+            enqueue_timeout=app.config["RECEIPTS_INGEST_ENQUEUE_TIMEOUT"],
+            max_attempts=app.config["RECEIPTS_INGEST_MAX_ATTEMPTS"],
+            dead_letter_path=app.config["RECEIPTS_INGEST_DEAD_LETTER_PATH"],
+        )
+        # Registered after the tracker's close, so it runs first: the queue is drained into the tracker before the
+        # tracker's storage is closed.
+        atexit.register(ingest_queue.close)
+        app.extensions["receipt_ingest_queue"] = ingest_queue
+    REGISTRY.enabled = app.config["RECEIPTS_METRICS_ENABLED"]
     api = Api(app)
     api.register_blueprint(receipts_blp)
+    app.add_url_rule("/metrics", view_func=metrics)
     return app
 
 
+# The one writer snapshotting the tracker, if any.
+_snapshot_writer: SnapshotWriter | None = None
+
+
+def start_snapshot_writer(path: str, interval: float) -> None:
+    """Starts writing snapshots of the tracker to path every interval seconds, and when the process exits."""
+    global _snapshot_writer
+    _snapshot_writer = SnapshotWriter(ReceiptTracker(), path, interval=interval)
+    atexit.register(_snapshot_writer.close)
+
+
+def stop_snapshot_writer() -> None:
+    """Stops the tracker's snapshot writer, if it has one, writing a last snapshot. This has to happen before the
+    tracker is closed, as closing it lets go of the snapshot it was restored from."""
+    global _snapshot_writer
+    if _snapshot_writer is not None:
+        atexit.unregister(_snapshot_writer.close)
+        _snapshot_writer.close()
+        _snapshot_writer = None
+
+
+def configure_tracker(app: Flask) -> None:
+    """Configures the receipt tracker from the app settings, opening the storage backend if one is set."""
+    tracker = ReceiptTracker()
+    storage = tracker.storage
+    storage_path = app.config["RECEIPTS_STORAGE_PATH"]
+    if storage_path is None:
+        storage = None
+    elif storage is None or storage.path != storage_path:
+        storage = AppendOnlyLogBackend(
+            storage_path,
+            commit_interval=app.config["RECEIPTS_STORAGE_COMMIT_INTERVAL"],
+            wait_for_commit=app.config["RECEIPTS_STORAGE_WAIT_FOR_COMMIT"],
+        )
+
+    capacity = spill = None
+    if any(app.config[key] is not None for key in ("RECEIPTS_MAX_ENTRIES", "RECEIPTS_MAX_BYTES", "RECEIPTS_TTL")):
+        capacity = CapacityPolicy(
+            max_entries=app.config["RECEIPTS_MAX_ENTRIES"],
+            max_bytes=app.config["RECEIPTS_MAX_BYTES"],
+            ttl=app.config["RECEIPTS_TTL"],
+        )
+        spill = tracker.spill
+        spill_path = app.config["RECEIPTS_SPILL_PATH"]
+        if spill is None or (spill_path is not None and spill.path != spill_path):
+            if spill_path is None:
+                # Deleted when the tracker closes it, on exit or when it's replaced.
+                file_descriptor, spill_path = tempfile.mkstemp(prefix="receipts-spill-", suffix=".db")
+                os.close(file_descriptor)
+                spill = SqliteSpillStore(spill_path, temporary=True)
+            else:
+                spill = SqliteSpillStore(spill_path)
+
+    dedup = tracker.dedup
+    dedup_max_entries = app.config["RECEIPTS_DEDUP_MAX_ENTRIES"]
+    if dedup_max_entries is None:
+        dedup = None
+    elif dedup is None or dedup.max_entries != dedup_max_entries:
+        dedup = DedupIndex(dedup_max_entries)
+
+    shared = tracker.shared
+    shared_path = app.config["RECEIPTS_SHARED_STORE_PATH"]
+    if shared_path is None:
+        shared = None
+    elif shared is None or shared.path != shared_path:
+        shared = SharedReceiptStore(shared_path, max_connections=app.config["RECEIPTS_SHARED_STORE_MAX_CONNECTIONS"])
+        shared.ping()
+
+    snapshot = tracker.snapshot
+    snapshot_path = app.config["RECEIPTS_SNAPSHOT_PATH"]
+    if snapshot_path is None:
+        snapshot = None
+    elif snapshot is None or snapshot.path != snapshot_path:
+        snapshot = ReceiptSnapshot(snapshot_path) if os.path.exists(snapshot_path) else None
+
+    stats = tracker.stats
+    points_band_width = app.config["RECEIPTS_STATS_POINTS_BAND_WIDTH"]
+    if not app.config["RECEIPTS_STATS_ENABLED"]:
+        stats = None
+    elif shared is not None:
+        # Kept in the shared store so every worker's receipts are counted.
+        if (
+            not isinstance(stats, SharedReceiptStatsIndex)
+            or stats.store is not shared
+            or stats.points_band_width != points_band_width
+        ):
+            stats = SharedReceiptStatsIndex(shared, points_band_width)
+    elif type(stats) is not ReceiptStatsIndex or stats.points_band_width != points_band_width:
+        stats = ReceiptStatsIndex(points_band_width)
+
+    if app.config["RECEIPTS_RULES_PATH"] is not None:
+        load_rule_sets(app.config["RECEIPTS_RULES_PATH"])
+
+    tracker.configure(
+        eager_points=app.config["RECEIPTS_EAGER_POINTS"],
+        storage=storage,
+        capacity=capacity,
+        spill=spill,
+        # Environment overrides are parsed as JSON, so a version like 2 comes through as a number.
+        rules_version=str(app.config["RECEIPTS_RULES_VERSION"]),
+        dedup=dedup,
+        stats=stats,
+        shared=shared,
+        snapshot=snapshot,
+    )
+
+
+def get_ingest_queue() -> IngestQueue | None:
+    """Returns the current app's async ingest queue, or None if receipts are added synchronously."""
+    return current_app.extensions.get("receipt_ingest_queue", None)
+
+
+def get_codec_for_app() -> ReceiptCodec:
+    """Returns the codec the current app decodes receipts and encodes responses with."""
+    return current_app.extensions["receipt_codec"]
+
+
+def get_stats_index() -> ReceiptStatsIndex:
+    """Returns the tracker's stats index, or aborts with a 404 if stats aren't enabled."""
+    stats = ReceiptTracker().stats
+    if stats is None:
+        abort(http_status_code=HTTPStatus.NOT_FOUND, message="Receipt stats aren't enabled.")
+    return stats
+
+
+def metrics() -> Response:
+    """Serves the app's metrics in the Prometheus text format."""
+    if not REGISTRY.enabled:
+        abort(http_status_code=HTTPStatus.NOT_FOUND, message="Metrics aren't enabled.")
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+REGISTRY.gauge(
+    "receipts_stored", "Receipts held in the tracker's memory.", lambda: ReceiptTracker().cache_stats()["entries"]
+)
+REGISTRY.gauge(
+    "receipts_stored_bytes",
+    "Estimated bytes of the receipts held in the tracker's memory, if a capacity policy is set.",
+    lambda: ReceiptTracker().cache_stats()["bytes"],
+)
+REGISTRY.callback_counter(
+    "receipts_cache_hits_total",
+    "Points lookups answered from the tracker's memory.",
+    lambda: ReceiptTracker().cache_stats()["hits"],
+)
+REGISTRY.callback_counter(
+    "receipts_cache_misses_total",
+    "Points lookups answered from the spill store, as the receipt had been evicted from memory.",
+    lambda: ReceiptTracker().cache_stats()["misses"],
+)
+REGISTRY.callback_counter(
+    "receipts_cache_evictions_total",
+    "Receipts evicted from the tracker's memory by its capacity policy.",
+    lambda: ReceiptTracker().cache_stats()["evictions"],
+)
+REGISTRY.callback_counter(
+    "receipts_spill_reads_total",
+    "Lookups of receipts in the spill store, whether or not they were found.",
+    lambda: ReceiptTracker().cache_stats()["spill_reads"],
+)
+
 receipts_blp = Blueprint(
     name="receipts",
     import_name="receipts",
@@ -37,22 +312,237 @@ receipts_blp = Blueprint(
 )
 
 
+@receipts_blp.before_request
+def start_request() -> None:
+    """Notes when the request started so its latency can be recorded, and samples whether to trace its scoring."""
+    g.request_start = perf_counter()
+    sample_rate = current_app.config["RECEIPTS_TRACE_SAMPLE_RATE"]
+    if sample_rate and random.random() < sample_rate:
+        g.points_trace_token = points_trace.set([])
+
+
+@receipts_blp.after_request
+def finish_request(response: Response) -> Response:
+    """Records the latency and status of the request, including requests rejected with a 400 or 404, and logs the
+    rule breakdown of any receipts scored if the request was sampled for tracing. The latency of a streamed response
+    is recorded once it's been streamed, when it's closed."""
+    endpoint = request.url_rule.rule
+    method = request.method
+    status = str(response.status_code)
+    start = g.request_start
+    if response.is_streamed:
+        response.call_on_close(lambda: REQUEST_SECONDS.observe(perf_counter() - start, endpoint, method, status))
+    else:
+        REQUEST_SECONDS.observe(perf_counter() - start, endpoint, method, status)
+    RESPONSES.inc(endpoint, status)
+    if "points_trace_token" in g:
+        logger.info("Points trace for %s %s: %s", request.method, request.path, points_trace.get())
+    return response
+
+
+@receipts_blp.teardown_request
+def reset_points_trace(error: BaseException | None) -> None:
+    """Stops collecting the points trace, even if the request failed."""
+    token = g.pop("points_trace_token", None)
+    if token is not None:
+        points_trace.reset(token)
+
+
 @receipts_blp.route("/process")
 class ReceiptProcessResource(MethodView):
     """Defines the process post endpoint."""
 
     @receipts_blp.doc(
         summary="Submits a receipt for processing.",
-        description="Submits a receipt for processing.",
+        description="Submits a receipt for processing. With async ingest on, the receipt is queued and its ID returned "
+        "straight away; a full queue is answered with a 503 and a Retry-After header. With deduplication on, a "
+        "receipt submitted again, or with an Idempotency-Key seen before, gets the ID it was given the first time.",
+        parameters=[
+            {
+                "in": "header",
+                "name": "Idempotency-Key",
+                "required": False,
+                "schema": {"type": "string"},
+                "description": "Identifies the submission so retries of it get the same ID, if deduplication is on.",
+            }
+        ],
+        # The receipt is decoded by the app's codec rather than by flask-smorest, so the body is documented here.
+        requestBody={"required": True, "content": {"application/json": {"schema": ReceiptBaseSchema}}},
     )
-    @receipts_blp.arguments(schema=ReceiptInputSchema, location="json")
     @receipts_blp.response(status_code=HTTPStatus.OK, schema=OutputIDSchema)
-    def post(self: Self, receipt: dict) -> dict:
+    @receipts_blp.alt_response(
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE, description="The ingest queue is full, retry later."
+    )
+    def post(self: Self) -> dict | Response:
         """Submits a receipt for processing."""
-        receipt_model = ReceiptData(**receipt)
-        receipt_id = ReceiptTracker().add_receipt(receipt_model)
-        return {"id": receipt_id}
-        # 400 error response handled in schema.py by Marshmallow validation check
+        codec = get_codec_for_app()
+        receipt = codec.decode_receipt(request)
+        idempotency_key = request.headers.get("Idempotency-Key", None)
+        ingest_queue = get_ingest_queue()
+        if ingest_queue is None:
+            return codec.respond({"id": ReceiptTracker().add_receipt(receipt, idempotency_key=idempotency_key)})
+        try:
+            return codec.respond({"id": ingest_queue.submit(receipt, idempotency_key=idempotency_key)})
+        except IngestQueueFullException:
+            abort(
+                http_status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+                message="Too many receipts are waiting to be processed.",
+                headers={"Retry-After": "1"},
+            )
+        # 400 error response handled by the codec, in schema.py for the marshmallow codec
+
+
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonl")
+# Stands in for a line of an NDJSON body that isn't valid JSON.
+INVALID_JSON_LINE = object()
+
+# Shared by every batch request rather than building the schema for each receipt.
+receipt_batch_item_schema = ReceiptBaseSchema()
+
+
+def _read_batch_body() -> list:
+    """Reads the receipts in a batch request from either a JSON array or an NDJSON body.
+
+    Lines of an NDJSON body that aren't valid JSON are kept so they get reported as invalid receipts."""
+    if request.mimetype in NDJSON_MIMETYPES:
+        receipts = []
+        for line in request.get_data().splitlines():
+            if not line.strip():
+                continue
+            try:
+                receipts.append(json.loads(line))
+            except ValueError:
+                receipts.append(INVALID_JSON_LINE)
+        return receipts
+    receipts = request.get_json(silent=True)
+    if not isinstance(receipts, list):
+        abort(http_status_code=HTTPStatus.BAD_REQUEST, message="The batch must be a JSON array of receipts.")
+    return receipts
+
+
+@receipts_blp.route("/process/batch")
+class ReceiptBatchProcessResource(MethodView):
+    """Defines the batch process post endpoint."""
+
+    @receipts_blp.doc(
+        summary="Submits a batch of receipts for processing.",
+        description="Submits a JSON array or NDJSON stream of receipts for processing. Returns the ID of each valid "
+        "receipt and the validation errors for each invalid one.",
+        requestBody={
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"type": "array", "items": ReceiptBaseSchema}},
+                "application/x-ndjson": {"schema": ReceiptBaseSchema},
+            },
+        },
+    )
+    @receipts_blp.response(status_code=HTTPStatus.OK, schema=OutputBatchSchema)
+    def post(self: Self) -> dict:
+        """Submits a batch of receipts for processing."""
+        receipts = _read_batch_body()
+        if len(receipts) > current_app.config["RECEIPTS_MAX_BATCH_SIZE"]:
+            abort(
+                http_status_code=HTTPStatus.BAD_REQUEST,
+                message=f"The batch can have at most {current_app.config['RECEIPTS_MAX_BATCH_SIZE']} receipts.",
+            )
+
+        valid_positions = []
+        valid_receipts = []
+        errors = {}
+        for position, receipt in enumerate(receipts):
+            if receipt is INVALID_JSON_LINE:
+                errors[str(position)] = {"_schema": ["Invalid JSON."]}
+                continue
+            try:
+                valid_receipts.append(receipt_batch_item_schema.load(receipt))
+                valid_positions.append(position)
+            except ma.ValidationError as err:
+                errors[str(position)] = err.messages
+
+        ids = [None] * len(receipts)
+        for position, receipt_id in zip(valid_positions, ReceiptTracker().add_receipts(valid_receipts)):
+            ids[position] = receipt_id
+        return {"ids": ids, "errors": errors}
+
+
+def _read_stream_lines(stream: IO[bytes], max_line_bytes: int) -> Iterator[tuple[int, bytes | None]]:
+    """Reads a streamed NDJSON body a line at a time, yielding the number and contents of each non-blank line.
+
+    A line longer than the max, not counting its line ending, is read through and dropped rather than held in memory,
+    and yielded as None."""
+    line_number = 0
+    # Room for a line of the max length and its line ending, or one byte past the max to tell a line is too long.
+    while line := stream.readline(max_line_bytes + 2):
+        line_number += 1
+        if len(line.removesuffix(b"\n").removesuffix(b"\r")) > max_line_bytes:
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(max_line_bytes + 2)
+            yield line_number, None
+        elif line.strip():
+            yield line_number, line
+
+
+def _load_stream_line(line_number: int, line: bytes | None) -> ReceiptData | dict:
+    """Returns the receipt on a streamed line, or the line's number and errors if it isn't a valid receipt."""
+    if line is None:
+        return {"line": line_number, "errors": {"_schema": ["Line too long."]}}
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return {"line": line_number, "errors": {"_schema": ["Invalid JSON."]}}
+    try:
+        return receipt_batch_item_schema.load(data)
+    except ma.ValidationError as err:
+        return {"line": line_number, "errors": err.messages}
+
+
+def _process_stream(lines: Iterator[tuple[int, bytes | None]], batch_size: int) -> Iterator[bytes]:
+    """Validates and stores the receipts on each line as they're read, yielding a result line for each one.
+
+    Results are yielded a batch of lines at a time, valid or not, with the valid receipts among them stored together,
+    so the results are yielded a batch behind the lines read, in order."""
+    tracker = ReceiptTracker()
+    # The result for each line read since the last batch was stored: a receipt to store, or the line's errors.
+    pending: list[ReceiptData | dict] = []
+    valid_receipts: list[ReceiptData] = []
+
+    def flush() -> Iterator[bytes]:
+        receipt_ids = iter(tracker.add_receipts(valid_receipts) if valid_receipts else [])
+        for result in pending:
+            yield json.dumps(result if isinstance(result, dict) else {"id": next(receipt_ids)}).encode() + b"\n"
+        pending.clear()
+        valid_receipts.clear()
+
+    for line_number, line in lines:
+        result = _load_stream_line(line_number, line)
+        pending.append(result)
+        if not isinstance(result, dict):
+            valid_receipts.append(result)
+        if len(pending) >= batch_size:
+            yield from flush()
+    yield from flush()
+
+
+@receipts_blp.route("/process/stream")
+class ReceiptStreamProcessResource(MethodView):
+    """Defines the streaming process post endpoint."""
+
+    @receipts_blp.doc(
+        summary="Submits a stream of receipts for processing.",
+        description="Submits an NDJSON stream of receipts, e.g. as a chunked upload, for processing. The body is read "
+        "and stored a line at a time rather than all at once, so it can be any size. The response streams back a line "
+        'for each receipt in order: {"id": ...} if it\'s valid, or {"line": ..., "errors": {...}} with its line '
+        "number in the body if not. Results are written while the body is still being read, so clients should read the "
+        "response as they upload rather than after.",
+        requestBody={"required": True, "content": {"application/x-ndjson": {"schema": ReceiptBaseSchema}}},
+    )
+    @receipts_blp.response(status_code=HTTPStatus.OK, description="One JSON line per receipt.")
+    def post(self: Self) -> Response:
+        """Submits a stream of receipts for processing."""
+        lines = _read_stream_lines(request.stream, current_app.config["RECEIPTS_STREAM_MAX_LINE_BYTES"])
+        results = _process_stream(lines, current_app.config["RECEIPTS_STREAM_BATCH_SIZE"])
+        # The request is read as the response is written, so the request context is kept until the stream ends.
+        return Response(stream_with_context(results), mimetype="application/x-ndjson")
 
 
 @receipts_blp.route("/<string:id>/points")
@@ -61,19 +551,154 @@ class ReceiptPointsGetResource(MethodView):
 
     @receipts_blp.doc(
         summary="Returns the points awarded for the receipt.",
-        description="Returns the points awarded for the receipt.",
+        description="Returns the points awarded for the receipt. A receipt still queued for async ingest is waited "
+        "on briefly, then answered with a 202 and a Retry-After header.",
     )
     @receipts_blp.arguments(schema=InputIDSchema, location="path", as_kwargs=True)
     @receipts_blp.response(status_code=HTTPStatus.OK, schema=OutputPointsSchema)
-    def get(self: Self, id: str) -> dict:
+    @receipts_blp.alt_response(status_code=HTTPStatus.ACCEPTED, description="The receipt is still being processed.")
+    def get(self: Self, id: str) -> dict | Response:
         """Returns the points awarded for the receipt."""
+        ingest_queue = get_ingest_queue()
+        if ingest_queue is not None and not ingest_queue.wait_for(id, current_app.config["RECEIPTS_PENDING_WAIT"]):
+            # Returning a response rather than a dict skips the points schema.
+            response = jsonify({"message": "The receipt is still being processed."})
+            response.status_code = HTTPStatus.ACCEPTED
+            response.headers["Retry-After"] = "1"
+            return response
         try:
-            logger.debug(f"Received ID: {id}")
+            logger.debug("Received ID: %s", id)
             points = ReceiptTracker().get_points_for_receipt(id)
-            logger.debug(f"Calculated points: {points}")
-            return {"points": points}
+            logger.debug("Calculated points: %d", points)
+            return get_codec_for_app().respond({"points": points})
         except NoReceiptFoundException:
             abort(http_status_code=HTTPStatus.NOT_FOUND, message="No receipt found for that ID.")
 
 
+@receipts_blp.route("/points")
+class ReceiptBatchPointsResource(MethodView):
+    """Defines the batch points post endpoint."""
+
+    @receipts_blp.doc(
+        summary="Returns the points awarded for a batch of receipts.",
+        description="Returns the points awarded for each receipt found, and lists the IDs that weren't found rather "
+        "than failing the whole request.",
+    )
+    @receipts_blp.arguments(schema=InputIDsSchema, location="json")
+    @receipts_blp.response(status_code=HTTPStatus.OK, schema=OutputBatchPointsSchema)
+    def post(self: Self, body: dict) -> dict:
+        """Returns the points awarded for a batch of receipts."""
+        if len(body["ids"]) > current_app.config["RECEIPTS_MAX_BATCH_SIZE"]:
+            abort(
+                http_status_code=HTTPStatus.BAD_REQUEST,
+                message=f"The batch can have at most {current_app.config['RECEIPTS_MAX_BATCH_SIZE']} IDs.",
+            )
+        points, not_found = ReceiptTracker().get_points_for_receipts(body["ids"])
+        return {"points": points, "notFound": not_found}
+
+
+@receipts_blp.route("/ingest/stats")
+class ReceiptIngestStatsResource(MethodView):
+    """Defines the ingest queue stats get endpoint."""
+
+    @receipts_blp.doc(
+        summary="Returns backpressure metrics for the async ingest queue.",
+        description="Returns the queue depth, enqueue latency and drain rate of the async ingest queue. Returns a 404 "
+        "if async ingest is off.",
+    )
+    @receipts_blp.response(status_code=HTTPStatus.OK, schema=OutputIngestStatsSchema)
+    def get(self: Self) -> dict:
+        """Returns backpressure metrics for the async ingest queue."""
+        ingest_queue = get_ingest_queue()
+        if ingest_queue is None:
+            abort(http_status_code=HTTPStatus.NOT_FOUND, message="Async ingest isn't enabled.")
+        return ingest_queue.stats()
+
+
+@receipts_blp.route("/stats")
+class ReceiptStatsResource(MethodView):
+    """Defines the stats get endpoint."""
+
+    @receipts_blp.doc(
+        summary="Returns the running totals of every receipt stored.",
+        description="Returns how many receipts are stored, the total spent on them and the points awarded for them. "
+        "Stats are kept up to date as receipts are added, so this takes the same time however many are stored. "
+        "Returns a 404 if stats are off.",
+    )
+    @receipts_blp.response(status_code=HTTPStatus.OK, schema=OutputStatsSchema)
+    def get(self: Self) -> dict:
+        """Returns the running totals of every receipt stored."""
+        return get_stats_index().totals().to_dict()
+
+
+@receipts_blp.route("/stats/retailers")
+class ReceiptRetailerStatsResource(MethodView):
+    """Defines the retailer stats get endpoint."""
+
+    @receipts_blp.doc(
+        summary="Returns the running totals of each retailer's receipts.",
+        description="Returns the count, total spent and points of each retailer's receipts, or only of the retailer "
+        "asked for. Returns a 404 if stats are off.",
+    )
+    @receipts_blp.arguments(schema=InputRetailerStatsSchema, location="query", as_kwargs=True)
+    @receipts_blp.response(status_code=HTTPStatus.OK, schema=OutputRetailerStatsSchema)
+    def get(self: Self, retailer: str | None = None) -> dict:
+        """Returns the running totals of each retailer's receipts."""
+        by_retailer = get_stats_index().by_retailer(retailer)
+        return {"retailers": {name: aggregate.to_dict() for name, aggregate in by_retailer.items()}}
+
+
+@receipts_blp.route("/stats/dates")
+class ReceiptDateStatsResource(MethodView):
+    """Defines the purchase date stats get endpoint."""
+
+    @receipts_blp.doc(
+        summary="Returns the running totals of the receipts purchased in a range of dates.",
+        description="Returns the count, total spent and points of the receipts purchased from the start date to the "
+        "end date inclusive. Either can be left out to leave that end of the range open. Takes time in proportion to "
+        "the number of days in the range, not the receipts. Returns a 404 if stats are off.",
+    )
+    @receipts_blp.arguments(schema=InputDateRangeSchema, location="query", as_kwargs=True)
+    @receipts_blp.response(status_code=HTTPStatus.OK, schema=OutputDateRangeStatsSchema)
+    def get(self: Self, start: date | None = None, end: date | None = None) -> dict:
+        """Returns the running totals of the receipts purchased in a range of dates."""
+        return {"start": start, "end": end, **get_stats_index().by_date_range(start, end).to_dict()}
+
+
+@receipts_blp.route("/stats/hours")
+class ReceiptHourStatsResource(MethodView):
+    """Defines the hour of purchase stats get endpoint."""
+
+    @receipts_blp.doc(
+        summary="Returns the running totals of the receipts purchased in each hour of the day.",
+        description="Returns the count, total spent and points of the receipts purchased in each hour of the day "
+        "that has any, from 0 (midnight to 1am) to 23. Returns a 404 if stats are off.",
+    )
+    @receipts_blp.response(status_code=HTTPStatus.OK, schema=OutputHourStatsSchema)
+    def get(self: Self) -> dict:
+        """Returns the running totals of the receipts purchased in each hour of the day."""
+        return {"hours": {str(hour): aggregate.to_dict() for hour, aggregate in get_stats_index().by_hour().items()}}
+
+
+@receipts_blp.route("/stats/points")
+class ReceiptPointsBandStatsResource(MethodView):
+    """Defines the points band stats get endpoint."""
+
+    @receipts_blp.doc(
+        summary="Returns the running totals of the receipts in each band of points.",
+        description="Returns the count, total spent and points of the receipts in each band of points that has any, "
+        "e.g. 0-24 and 25-49 points. Bands are FLASK_RECEIPTS_STATS_POINTS_BAND_WIDTH points wide. Returns a 404 if "
+        "stats are off.",
+    )
+    @receipts_blp.response(status_code=HTTPStatus.OK, schema=OutputPointsBandStatsSchema)
+    def get(self: Self) -> dict:
+        """Returns the running totals of the receipts in each band of points."""
+        return {
+            "bands": [
+                {"min": low, "max": high, **aggregate.to_dict()}
+                for low, high, aggregate in get_stats_index().by_points_band()
+            ]
+        }
+
+
 app = create_app()
@@ -0,0 +1,123 @@
+"""Measures the latency and throughput of /receipts/process and /receipts/<id>/points.
+
+Run from the repository root with `python -m benchmarks.bench_api_latency`. A seeded corpus is replayed against
+`create_app()` twice: in-process through the Flask test client, which measures the app alone, and over a real socket
+to a threaded server on localhost, which adds HTTP parsing and the network stack. Pass --url to load an already
+running server instead, e.g. gunicorn. Each client thread keeps one connection open, submits its share of the corpus
+and then gets the points of every receipt it submitted.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import json
+import logging
+import threading
+import time
+from typing import Callable
+from urllib.parse import urlsplit
+
+from werkzeug.serving import make_server
+
+from app import create_app
+from benchmarks.corpus import generate_corpus
+from benchmarks.timing import latency_summary
+from receipt_service import ReceiptTracker
+
+
+def in_process_client(app: object) -> Callable[[str, str, bytes | None], bytes]:
+    """Returns a function making requests through the Flask test client."""
+    client = app.test_client()
+
+    def request(method: str, path: str, body: bytes | None = None) -> bytes:
+        response = client.open(path, method=method, data=body, content_type="application/json")
+        return response.get_data()
+
+    return request
+
+
+def socket_client(host: str, port: int) -> Callable[[str, str, bytes | None], bytes]:
+    """Returns a function making requests over one keep-alive HTTP connection."""
+    connection = http.client.HTTPConnection(host, port)
+
+    def request(method: str, path: str, body: bytes | None = None) -> bytes:
+        connection.request(method, path, body, {"Content-Type": "application/json"})
+        return connection.getresponse().read()
+
+    return request
+
+
+def submit_receipts(request: Callable[[str, str, bytes | None], bytes], bodies: list[bytes]) -> list[tuple[float, str]]:
+    """Submits each receipt, returning the latency of each request and the ID it returned."""
+    results = []
+    for body in bodies:
+        start = time.perf_counter()
+        response = request("POST", "/receipts/process", body)
+        results.append((time.perf_counter() - start, json.loads(response)["id"]))
+    return results
+
+
+def get_points(request: Callable[[str, str, bytes | None], bytes], receipt_ids: list[str]) -> list[float]:
+    """Gets the points of each receipt, returning the latency of each request."""
+    latencies = []
+    for receipt_id in receipt_ids:
+        start = time.perf_counter()
+        request("GET", f"/receipts/{receipt_id}/points")
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def replay(
+    name: str, make_client: Callable[[], Callable[[str, str, bytes | None], bytes]], clients: int, bodies: list[bytes]
+) -> None:
+    """Replays the corpus with the client threads and prints the latency and throughput of each endpoint.
+
+    Every client submits its receipts before any gets points, so each endpoint's throughput is measured alone."""
+    requests = [make_client() for _ in range(clients)]
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        start = time.perf_counter()
+        submitted = list(executor.map(submit_receipts, requests, [bodies[index::clients] for index in range(clients)]))
+        process_elapsed = time.perf_counter() - start
+
+        receipt_ids = [[receipt_id for _, receipt_id in results] for results in submitted]
+        start = time.perf_counter()
+        points_latencies = list(executor.map(get_points, requests, receipt_ids))
+        points_elapsed = time.perf_counter() - start
+
+    process_latencies = [latency for results in submitted for latency, _ in results]
+    print(f"{name} ({clients} clients):")
+    print(f"  POST /receipts/process      {latency_summary(process_latencies, process_elapsed)}")
+    print(f"  GET  /receipts/<id>/points  {latency_summary(sum(points_latencies, []), points_elapsed)}")
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=5000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", default=None, help="Load this server instead, e.g. http://127.0.0.1:5001")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    bodies = [json.dumps(body).encode() for body in generate_corpus(args.receipts, seed=args.seed)]
+    if args.url is not None:
+        url = urlsplit(args.url)
+        replay(args.url, lambda: socket_client(url.hostname, url.port), args.clients, bodies)
+        return
+
+    app = create_app()
+    replay("in-process", lambda: in_process_client(app), args.clients, bodies)
+    ReceiptTracker().clear()
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        replay("socket", lambda: socket_client("127.0.0.1", server.server_port), args.clients, bodies)
+    finally:
+        server.shutdown()
+        ReceiptTracker().clear()
+
+
+if __name__ == "__main__":
+    main()
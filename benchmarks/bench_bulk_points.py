@@ -0,0 +1,42 @@
+"""Compares scoring receipts one at a time with calculate_points against the vectorized calculate_points_batch.
+
+Run from the repository root with `python -m benchmarks.bench_bulk_points`.
+"""
+
+import argparse
+import time
+
+from benchmarks.corpus import generate_corpus
+from bulk_points import ReceiptColumns, calculate_points_batch
+from schema import ReceiptBaseSchema
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--receipts", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    schema = ReceiptBaseSchema()
+    receipts = [schema.load(body) for body in generate_corpus(args.receipts, seed=args.seed)]
+
+    start = time.perf_counter()
+    expected = [receipt.calculate_points() for receipt in receipts]
+    per_receipt = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columns = ReceiptColumns.from_receipts(receipts)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    points = calculate_points_batch(columns)
+    batch = time.perf_counter() - start
+
+    assert points.tolist() == expected
+    print(f"calculate_points:        {per_receipt / len(receipts) * 1e9:8.0f} ns/receipt")
+    print(f"building columns:        {build / len(receipts) * 1e9:8.0f} ns/receipt")
+    print(f"calculate_points_batch:  {batch / len(receipts) * 1e9:8.0f} ns/receipt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""A/B compares the receipt codecs the process and points endpoints can be configured with.
+
+Run from the repository root with `python -m benchmarks.bench_codecs`. Replays a seeded corpus through the Flask test
+client under each codec in alternating rounds, submitting each receipt and getting its points, and reports the best
+CPU time per request of each. Also times each codec decoding a receipt and encoding a response on its own, in a bare
+request context; for the marshmallow codec encoding only hands back the dict, as its schema dump happens in
+flask-smorest and is counted in the per request figure. The tracker runs in eager points mode so the comparison isn't drowned out by receipt storage.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+from flask import Flask, request
+
+from app import create_app
+from benchmarks.corpus import generate_corpus
+from receipt_codecs import CODECS
+from receipt_service import ReceiptTracker
+
+
+def cpu_per_request(app: Flask, bodies: list[bytes]) -> float:
+    """Returns the CPU time in microseconds per request to submit each receipt and get its points."""
+    client = app.test_client()
+    ReceiptTracker().clear()
+    start = time.process_time()
+    for body in bodies:
+        receipt_id = client.post("/receipts/process", data=body, content_type="application/json").json["id"]
+        client.get(f"/receipts/{receipt_id}/points")
+    return (time.process_time() - start) / (2 * len(bodies)) * 1e6
+
+
+def codec_cost(app: Flask, bodies: list[bytes]) -> tuple[float, float]:
+    """Returns the CPU time in microseconds for the codec to decode a receipt and to encode a points response."""
+    codec = app.extensions["receipt_codec"]
+    decode = encode = 0.0
+    for body in bodies:
+        with app.test_request_context("/receipts/process", method="POST", data=body, content_type="application/json"):
+            start = time.process_time()
+            codec.decode_receipt(request)
+            decode += time.process_time() - start
+            start = time.process_time()
+            codec.respond({"points": 100})
+            encode += time.process_time() - start
+    return decode / len(bodies) * 1e6, encode / len(bodies) * 1e6
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--codecs", nargs="+", default=list(CODECS), choices=list(CODECS))
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    bodies = [json.dumps(body).encode() for body in generate_corpus(args.receipts, seed=args.seed)]
+    apps = {}
+    for name in args.codecs:
+        os.environ["FLASK_RECEIPTS_CODEC"] = json.dumps(name)
+        apps[name] = create_app()
+    del os.environ["FLASK_RECEIPTS_CODEC"]
+    ReceiptTracker().configure(eager_points=True)
+
+    best = {name: float("inf") for name in args.codecs}
+    best_codec = {name: (float("inf"), float("inf")) for name in args.codecs}
+    for _ in range(args.rounds):
+        for name, app in apps.items():
+            best[name] = min(best[name], cpu_per_request(app, bodies))
+            decode, encode = codec_cost(app, bodies)
+            best_codec[name] = (min(best_codec[name][0], decode), min(best_codec[name][1], encode))
+    ReceiptTracker().configure()
+    ReceiptTracker().clear()
+
+    baseline = best[args.codecs[0]]
+    for name in args.codecs:
+        decode, encode = best_codec[name]
+        print(
+            f"{name:12} {best[name]:8.1f} us CPU/request ({baseline / best[name]:4.2f}x)  "
+            f"decode {decode:7.1f} us  encode {encode:6.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
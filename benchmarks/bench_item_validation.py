@@ -0,0 +1,58 @@
+"""Measures how receipt validation scales with the number of items, with and without the one-pass items check.
+
+Run from the repository root with `python -m benchmarks.bench_item_validation`. Loads receipts with 1, 10, 100 and
+1000 items through ReceiptBaseSchema, and through the same schema loading each item with the nested item schema as it
+did before, and reports the CPU time per receipt of each.
+"""
+
+import argparse
+import time
+
+import marshmallow as ma
+
+from benchmarks.corpus import generate_corpus
+from schema import ReceiptBaseSchema
+
+
+class NestedItemsSchema(ReceiptBaseSchema):
+    """The receipt schema as it was, loading every item through the nested item schema."""
+
+    items = ma.fields.List(
+        ma.fields.Nested(ReceiptBaseSchema.ItemSchema),
+        required=True,
+        validate=ma.validate.Length(min=1),
+    )
+
+
+def cpu_per_receipt(schema: ma.Schema, corpus: list[dict], rounds: int) -> float:
+    """Returns the best CPU time in microseconds per receipt over `rounds` passes of the corpus."""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.process_time()
+        for body in corpus:
+            schema.load(body)
+        best = min(best, time.process_time() - start)
+    return best / len(corpus) * 1e6
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--item-budget", type=int, default=20_000, help="Items in each corpus, spread over receipts.")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    schema = ReceiptBaseSchema()
+    nested_schema = NestedItemsSchema()
+    print(f"{'items':>6} {'nested':>12} {'one pass':>12} {'speedup':>8}")
+    for num_items in args.items:
+        corpus = list(generate_corpus(max(1, args.item_budget // num_items), seed=args.seed, num_items=num_items))
+        before = cpu_per_receipt(nested_schema, corpus, args.rounds)
+        after = cpu_per_receipt(schema, corpus, args.rounds)
+        print(f"{num_items:>6} {before:9.1f} us {after:9.1f} us {before / after:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Measures what recording metrics adds to the cost of a request, to show it's cheap enough to leave on.
+
+Run from the repository root with `python -m benchmarks.bench_metrics_overhead`. Replays a seeded corpus through the
+Flask test client, submitting each receipt and getting its points, with metrics switched on and off in alternating
+rounds, each going first in every other round, and compares the best CPU time per request of each. Also times a single
+histogram observation and counter increment. The tracker runs in eager points mode so the comparison isn't drowned out
+by lazy mode's receipt storage.
+"""
+
+import argparse
+import json
+import logging
+import time
+
+from app import create_app
+from benchmarks.corpus import generate_corpus
+from metrics import REGISTRY, RESPONSES, STAGE_SECONDS
+from receipt_service import ReceiptTracker
+
+
+def cpu_per_request(client: object, bodies: list[bytes]) -> float:
+    """Returns the CPU time in microseconds per request to submit each receipt and get its points."""
+    ReceiptTracker().clear()
+    start = time.process_time()
+    for body in bodies:
+        receipt_id = client.post("/receipts/process", data=body, content_type="application/json").json["id"]
+        client.get(f"/receipts/{receipt_id}/points")
+    return (time.process_time() - start) / (2 * len(bodies)) * 1e6
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    bodies = [json.dumps(body).encode() for body in generate_corpus(args.receipts, seed=args.seed)]
+    client = create_app().test_client()
+    ReceiptTracker().configure(eager_points=True)
+    best = {True: float("inf"), False: float("inf")}
+    for round_number in range(args.rounds):
+        # Whichever runs second in a round runs slower, so which goes first alternates.
+        for enabled in (False, True) if round_number % 2 else (True, False):
+            REGISTRY.enabled = enabled
+            best[enabled] = min(best[enabled], cpu_per_request(client, bodies))
+    REGISTRY.enabled = True
+    ReceiptTracker().configure()
+    ReceiptTracker().clear()
+
+    calls = 1_000_000
+    start = time.perf_counter()
+    for _ in range(calls):
+        STAGE_SECONDS.observe(0.001, "benchmark")
+    observe = (time.perf_counter() - start) / calls * 1e9
+    start = time.perf_counter()
+    for _ in range(calls):
+        RESPONSES.inc("benchmark", "200")
+    inc = (time.perf_counter() - start) / calls * 1e9
+    REGISTRY.clear()
+
+    print(f"metrics off:        {best[False]:8.1f} us CPU/request")
+    print(f"metrics on:         {best[True]:8.1f} us CPU/request")
+    print(f"overhead:           {best[True] - best[False]:8.1f} us ({(best[True] / best[False] - 1) * 100:.1f}%)")
+    print(f"histogram observe:  {observe:8.0f} ns")
+    print(f"counter increment:  {inc:8.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Micro-benchmarks of the hot paths behind the API, so regressions show up in numbers.
+
+Run from the repository root with `python -m benchmarks.bench_micro`. Times ReceiptData.calculate_points,
+ReceiptBaseSchema.load and the ReceiptTracker operations the endpoints call, in lazy and eager points modes, over a
+seeded corpus and reports the p50/p95/p99 of each call.
+"""
+
+import argparse
+import itertools
+import logging
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.timing import latency_summary, time_calls
+from receipt_service import ReceiptTracker
+from schema import ReceiptBaseSchema
+
+
+def main() -> None:
+    """Runs the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=2000, help="Receipts in the corpus.")
+    parser.add_argument("--calls", type=int, default=20000, help="Calls timed per benchmark.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    schema = ReceiptBaseSchema()
+    bodies = list(generate_corpus(args.receipts, seed=args.seed))
+    receipts = [schema.load(body) for body in bodies]
+
+    body_cycle = itertools.cycle(bodies)
+    latencies, elapsed = time_calls(lambda: schema.load(next(body_cycle)), args.calls)
+    print(f"{'ReceiptBaseSchema.load':<36} {latency_summary(latencies, elapsed)}")
+    receipt_cycle = itertools.cycle(receipts)
+    latencies, elapsed = time_calls(lambda: next(receipt_cycle).calculate_points(), args.calls)
+    print(f"{'ReceiptData.calculate_points':<36} {latency_summary(latencies, elapsed)}")
+
+    tracker = ReceiptTracker()
+    for eager_points in (False, True):
+        mode = "eager" if eager_points else "lazy"
+        tracker.configure(eager_points=eager_points)
+        tracker.clear()
+        receipt_ids = []
+        latencies, elapsed = time_calls(
+            lambda: receipt_ids.append(tracker.add_receipt(next(receipt_cycle))), args.receipts
+        )
+        print(f"{f'add_receipt ({mode})':<36} {latency_summary(latencies, elapsed)}")
+        latencies, elapsed = time_calls(lambda: tracker.add_receipts(receipts[:100]), args.receipts // 100)
+        print(f"{f'add_receipts x100 ({mode})':<36} {latency_summary(latencies, elapsed)}")
+        # The first lookup of a lazy receipt calculates its points, later ones hit the cache.
+        id_cycle = iter(receipt_ids)
+        latencies, elapsed = time_calls(lambda: tracker.get_points_for_receipt(next(id_cycle)), len(receipt_ids))
+        print(f"{f'get_points_for_receipt first ({mode})':<36} {latency_summary(latencies, elapsed)}")
+        id_cycle = itertools.cycle(receipt_ids)
+        latencies, elapsed = time_calls(lambda: tracker.get_points_for_receipt(next(id_cycle)), args.calls)
+        print(f"{f'get_points_for_receipt again ({mode})':<36} {latency_summary(latencies, elapsed)}")
+        latencies, elapsed = time_calls(lambda: tracker.get_points_for_receipts(receipt_ids[:100]), args.calls // 100)
+        print(f"{f'get_points_for_receipts x100 ({mode})':<36} {latency_summary(latencies, elapsed)}")
+    tracker.configure()
+    tracker.clear()
+
+
+if __name__ == "__main__":
+    main()
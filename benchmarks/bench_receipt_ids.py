@@ -0,0 +1,59 @@
+"""Compares keying receipts on their 36 character string IDs against the 16 byte form the tracker keys them on.
+
+Run from the repository root with `python -m benchmarks.bench_receipt_ids`. Builds a dict of points keyed each way for
+`--ids` time-ordered IDs and reports the memory the keys and dict take per ID, measured with tracemalloc, and the
+time to look up an ID given as a string, which for the 16 byte keys includes packing it first.
+"""
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from typing import Callable
+
+from receipt_service import generate_receipt_id, receipt_id_from_bytes, receipt_id_to_bytes
+
+
+def build(ids: list[bytes], key: Callable[[str], str | bytes]) -> tuple[dict, float]:
+    """Returns a dict of points keyed by each ID, and the bytes it retains per ID. Each key is made from a new string
+    ID, as the tracker's keys are, so the keys' own memory is counted."""
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    keyed = {key(receipt_id_from_bytes(id_bytes)): 1 for id_bytes in ids}
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return keyed, retained / len(ids)
+
+
+def lookup_ns(keyed: dict, lookups: list[str], key: Callable[[str], str | bytes]) -> float:
+    """Returns the nanoseconds per lookup of an ID given as a string."""
+    start = time.perf_counter()
+    for receipt_id in lookups:
+        keyed[key(receipt_id)]
+    return (time.perf_counter() - start) / len(lookups) * 1e9
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ids", type=int, default=10_000_000)
+    parser.add_argument("--lookups", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    ids = [generate_receipt_id() for _ in range(args.ids)]
+    # New strings, as a request's ID would be, so lookups can't hit a cached hash.
+    lookups = [receipt_id_from_bytes(id_bytes) for id_bytes in random.Random(args.seed).choices(ids, k=args.lookups)]
+
+    for name, key in (("str keys", str), ("16 byte keys", receipt_id_to_bytes)):
+        keyed, per_id = build(ids, key)
+        per_lookup = lookup_ns(keyed, lookups, key)
+        print(f"{name:13} {per_id:6.0f} bytes/id  {per_id * args.ids / 2**20:8.0f} MiB  {per_lookup:6.0f} ns/lookup")
+        del keyed
+
+
+if __name__ == "__main__":
+    main()
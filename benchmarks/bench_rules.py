@@ -0,0 +1,65 @@
+"""Compares scoring receipts with the compiled rule set against the hand-written rules.
+
+Run from the repository root with `python -m benchmarks.bench_rules`. Scores a seeded corpus with the exercise's
+rules written out by hand, with the compiled default rule set, and with the compiled rule set's
+per rule breakdown that debug logging and points traces use.
+"""
+
+import argparse
+import time
+from typing import Callable
+
+from benchmarks.corpus import generate_corpus
+from receipt_service import ReceiptData
+from rules import DEFAULT_RULES_VERSION, get_rule_set
+from schema import ReceiptBaseSchema
+
+
+def hand_written_points(receipt: ReceiptData) -> int:
+    """Scores a receipt with the exercise's rules written out by hand, as calculate_points did before the rule
+    engine."""
+    points = sum(char.isalnum() for char in receipt.retailer)
+    points += 50 if receipt.total_cents % 100 == 0 else 0
+    points += 25 if receipt.total_cents % 25 == 0 else 0
+    points += len(receipt.items) // 2 * 5
+    points += sum(item.calculate_item_points() for item in receipt.items)
+    points += 6 if receipt.purchaseDate.day % 2 != 0 else 0
+    purchase_time = receipt.purchaseTime
+    points += 10 if (purchase_time.hour == 14 and purchase_time.minute > 0) or purchase_time.hour == 15 else 0
+    return points
+
+
+def ns_per_receipt(score: Callable[[ReceiptData], object], receipts: list[ReceiptData], rounds: int) -> float:
+    """Returns the best time in nanoseconds per receipt over `rounds` passes of the corpus."""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for receipt in receipts:
+            score(receipt)
+        best = min(best, time.perf_counter() - start)
+    return best / len(receipts) * 1e9
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    schema = ReceiptBaseSchema()
+    receipts = [schema.load(body) for body in generate_corpus(args.receipts, seed=args.seed)]
+    compiled = get_rule_set(DEFAULT_RULES_VERSION)
+    assert all(compiled.score(receipt) == hand_written_points(receipt) for receipt in receipts)
+
+    hand_written = ns_per_receipt(hand_written_points, receipts, args.rounds)
+    fused = ns_per_receipt(compiled.score, receipts, args.rounds)
+    breakdown = ns_per_receipt(compiled.breakdown, receipts, args.rounds)
+    print(f"hand-written rules:  {hand_written:8.0f} ns/receipt")
+    print(f"compiled rules:      {fused:8.0f} ns/receipt ({hand_written / fused:.2f}x)")
+    print(f"compiled breakdown:  {breakdown:8.0f} ns/receipt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compares request throughput of the Flask development server and the gunicorn production config.
+
+Run from the repository root with `python -m benchmarks.bench_server`. Each server is started as a subprocess and
+loaded by client threads, each on its own keep-alive connection, that submit a receipt and then get its points.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.corpus import generate_corpus
+
+SERVERS = {
+    "flask dev server": [sys.executable, "-m", "flask", "--app", "app", "run", "--port", "{port}", "--with-threads"],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn_config.py", "--bind", "127.0.0.1:{port}", "app:app"],
+}
+
+
+def free_port() -> int:
+    """Returns a port nothing is listening on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port: int, timeout: float = 30) -> None:
+    """Blocks until the server accepts connections."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Server on port {port} didn't start")
+
+
+def run_client(port: int, bodies: list[bytes]) -> int:
+    """Submits each receipt and gets its points over one keep-alive connection, returning the requests made."""
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    for body in bodies:
+        connection.request("POST", "/receipts/process", body, {"Content-Type": "application/json"})
+        receipt_id = json.loads(connection.getresponse().read())["id"]
+        connection.request("GET", f"/receipts/{receipt_id}/points")
+        connection.getresponse().read()
+    connection.close()
+    return 2 * len(bodies)
+
+
+def requests_per_second(command: list[str], clients: int, bodies: list[bytes]) -> float:
+    """Starts the server and returns the requests per second the clients get through."""
+    port = free_port()
+    env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+    server = subprocess.Popen(
+        [part.format(port=port) for part in command], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_server(port)
+        per_client = [bodies[index::clients] for index in range(clients)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            total = sum(executor.map(lambda client_bodies: run_client(port, client_bodies), per_client))
+        return total / (time.perf_counter() - start)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bodies = [json.dumps(body).encode() for body in generate_corpus(args.receipts, seed=args.seed)]
+    for name, command in SERVERS.items():
+        rate = requests_per_second(command, args.clients, bodies)
+        print(f"{name:>16}: {rate:8.0f} requests/s with {args.clients} clients")
+
+
+if __name__ == "__main__":
+    main()
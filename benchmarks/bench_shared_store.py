@@ -0,0 +1,104 @@
+"""Measures the shared store's lookup latency and what pipelining saves on batches.
+
+Run from the repository root with `python -m benchmarks.bench_shared_store`. Starts the store daemon in a process of
+its own, writes a corpus of receipts to it as another worker would, then times looking them up through the tracker,
+which has none of them locally: one at a time, and in batches of `--batch-size` sent as one pipeline against the same
+batch looked up one receipt at a time. Also times the raw client get and batched writes.
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.timing import latency_summary, time_calls
+from exceptions import ReceiptStorageException
+from receipt_service import ReceiptData, ReceiptTracker, receipt_id_to_bytes
+from shared_store import SharedReceiptStore
+
+
+def wait_for_store(store: SharedReceiptStore, timeout: float = 10.0) -> None:
+    """Waits for the store daemon to start listening."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            store.ping()
+            return
+        except ReceiptStorageException:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    directory = tempfile.mkdtemp(prefix="store-")
+    path = os.path.join(directory, "store.sock")
+    server = subprocess.Popen([sys.executable, "-m", "store_server", path], stderr=subprocess.DEVNULL)
+    try:
+        store = SharedReceiptStore(path)
+        wait_for_store(store)
+        corpus = [ReceiptData(**body) for body in generate_corpus(1000, seed=args.seed)]
+        tracker = ReceiptTracker()
+        ids = [tracker.new_receipt_id() for _ in range(args.receipts)]
+        rows = [
+            (receipt_id_to_bytes(receipt_id), None, corpus[i % len(corpus)].model_dump_json(exclude_none=True).encode())
+            for i, receipt_id in enumerate(ids)
+        ]
+        start = time.perf_counter()
+        for i in range(0, len(rows), args.batch_size):
+            store.put_many(rows[i : i + args.batch_size])
+        elapsed = time.perf_counter() - start
+        print(f"wrote {len(rows)} receipts in batches of {args.batch_size}: {len(rows) / elapsed:9.0f} receipts/s")
+
+        tracker.configure(shared=store)
+        # The first lookup of each receipt calculates its points and writes them back; time the ones after.
+        tracker.get_points_for_receipts(ids)
+        counter = iter(range(args.requests * 2))
+        size = args.batch_size
+
+        def single() -> None:
+            tracker.get_points_for_receipt(ids[next(counter) % len(ids)])
+
+        def raw_get() -> None:
+            store.get(rows[next(counter) % len(rows)][0])
+
+        def batch_pipelined() -> None:
+            i = next(counter) * size % len(ids)
+            tracker.get_points_for_receipts(ids[i : i + size])
+
+        def batch_one_at_a_time() -> None:
+            i = next(counter) * size % len(ids)
+            for receipt_id in ids[i : i + size]:
+                tracker.get_points_for_receipt(receipt_id)
+
+        batches = max(1, args.requests // size)
+        for name, call, count in [
+            ("client get", raw_get, args.requests),
+            ("tracker points, one receipt", single, args.requests),
+            (f"tracker points, {size} pipelined", batch_pipelined, batches),
+            (f"tracker points, {size} one at a time", batch_one_at_a_time, batches),
+        ]:
+            counter = iter(range(count))
+            latencies, elapsed = time_calls(call, count)
+            print(f"  {name:40} {latency_summary(latencies, elapsed)}")
+        tracker.configure()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Measures writing a snapshot of the tracker, restarting from it against replaying the log, and lookups after.
+
+Run from the repository root with `python -m benchmarks.bench_snapshot`. Adds `--receipts` receipts to a tracker
+persisting them to an append-only log, writes a snapshot of it, then restarts the tracker from the log alone and from
+the snapshot alone, timing each, and times looking up points from the restored snapshot one receipt at a time and in
+batches. Files are written to a temporary directory unless --directory is given.
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.timing import latency_summary, time_calls
+from receipt_service import ReceiptTracker
+from receipt_stats import ReceiptStatsIndex
+from schema import ReceiptBaseSchema
+from snapshot import ReceiptSnapshot
+from storage import AppendOnlyLogBackend
+
+
+def restart(eager_points: bool, **components: object) -> float:
+    """Drops everything the tracker holds, then configures it with components, returning the seconds that took."""
+    tracker = ReceiptTracker()
+    tracker.configure(eager_points=eager_points)
+    tracker.clear()
+    start = time.perf_counter()
+    tracker.configure(eager_points=eager_points, stats=ReceiptStatsIndex(), **components)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--lazy", action="store_true", help="Keep whole receipts rather than eager points records.")
+    parser.add_argument("--directory", default=None)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    directory = args.directory or tempfile.mkdtemp()
+    log_path = os.path.join(directory, "receipts.log")
+    snapshot_path = os.path.join(directory, "receipts.snapshot")
+    eager_points = not args.lazy
+    schema = ReceiptBaseSchema()
+    receipts = itertools.cycle([schema.load(body) for body in generate_corpus(1000, seed=0)])
+    tracker = ReceiptTracker()
+    tracker.configure(eager_points=eager_points, stats=ReceiptStatsIndex(), storage=AppendOnlyLogBackend(log_path))
+    ids = []
+    for added in range(0, args.receipts, args.batch_size):
+        ids += tracker.add_receipts(list(itertools.islice(receipts, min(args.batch_size, args.receipts - added))))
+
+    start = time.perf_counter()
+    tracker.write_snapshot(snapshot_path)
+    elapsed = time.perf_counter() - start
+    print(f"snapshot write:    {elapsed:8.2f} s  ({os.path.getsize(snapshot_path) / 2**20:.0f} MiB)")
+    tracker.close()
+
+    elapsed = restart(eager_points, storage=AppendOnlyLogBackend(log_path))
+    print(f"restart from log:  {elapsed:8.2f} s  ({os.path.getsize(log_path) / 2**20:.0f} MiB)")
+    tracker.close()
+    elapsed = restart(eager_points, snapshot=ReceiptSnapshot(snapshot_path))
+    print(f"restart from snapshot: {elapsed * 1e3:8.2f} ms")
+
+    rng = random.Random(0)
+    for name, call, count in [
+        ("points, one receipt", lambda: tracker.get_points_for_receipt(rng.choice(ids)), args.requests),
+        ("points, 100 receipts", lambda: tracker.get_points_for_receipts(rng.sample(ids, 100)), args.requests // 100),
+    ]:
+        latencies, elapsed = time_calls(call, count)
+        print(f"  {name:24} {latency_summary(latencies, elapsed)}")
+
+    tracker.configure(eager_points=eager_points)
+    tracker.clear()
+    if args.directory is None:
+        os.remove(log_path)
+        os.remove(snapshot_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Shows the stats endpoints answering in the same time however many receipts are stored.
+
+Run from the repository root with `python -m benchmarks.bench_stats`. Grows a stats index to each of `--sizes` receipts,
+recording a seeded corpus over and over, and at each size times every stats endpoint through the Flask test client,
+alongside the scan of every receipt the totals by retailer would take without the index. Also reports what recording
+a receipt in the index costs, which is paid once as it's added.
+"""
+
+import argparse
+import logging
+import time
+
+from app import create_app
+from benchmarks.corpus import generate_corpus
+from benchmarks.timing import latency_summary, time_calls
+from receipt_service import ReceiptData, ReceiptTracker
+from receipt_stats import ReceiptStatsIndex
+
+PATHS = [
+    "/receipts/stats",
+    "/receipts/stats/retailers",
+    "/receipts/stats/dates?start=2023-01-01&end=2023-12-31",
+    "/receipts/stats/hours",
+    "/receipts/stats/points",
+]
+
+
+def scan_by_retailer(receipts: list[tuple[ReceiptData, int]], size: int) -> dict[str, list[int]]:
+    """Totals the first `size` receipts by retailer the way it'd be done without the index, cycling through the
+    corpus to stand in for a store of that size."""
+    totals = {}
+    for i in range(size):
+        receipt, points = receipts[i % len(receipts)]
+        group = totals.setdefault(receipt.retailer, [0, 0, 0])
+        group[0] += 1
+        group[1] += receipt.total_cents
+        group[2] += points
+    return totals
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--corpus", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    models = [ReceiptData(**body) for body in generate_corpus(args.corpus, seed=args.seed)]
+    receipts = [(receipt, receipt.calculate_points()) for receipt in models]
+    client = create_app().test_client()
+    index = ReceiptStatsIndex()
+    tracker = ReceiptTracker()
+    stats, tracker.stats = tracker.stats, index
+
+    recorded = 0
+    record_seconds = 0.0
+    for size in sorted(args.sizes):
+        while recorded < size:
+            batch = receipts[: min(len(receipts), size - recorded)]
+            start = time.perf_counter()
+            index.record(batch)
+            record_seconds += time.perf_counter() - start
+            recorded += len(batch)
+        print(f"{size} receipts stored ({record_seconds / recorded * 1e6:.2f} us to record each)")
+        for path in PATHS:
+            latencies, elapsed = time_calls(lambda: client.get(path), args.requests)
+            print(f"  {path:55} {latency_summary(latencies, elapsed)}")
+        start = time.perf_counter()
+        scan_by_retailer(receipts, size)
+        print(f"  {'scan by retailer without the index':55} {(time.perf_counter() - start) * 1e6:9.1f} us")
+    tracker.stats = stats
+
+
+if __name__ == "__main__":
+    main()
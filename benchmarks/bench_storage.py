@@ -0,0 +1,75 @@
+"""Measures write throughput to the append-only receipt log and how long the tracker takes to restart from it.
+
+Run from the repository root with `python -m benchmarks.bench_storage`. The log is written to a temporary directory
+unless --path is given.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.corpus import generate_corpus
+from receipt_service import ReceiptTracker
+from schema import ReceiptBaseSchema
+from storage import AppendOnlyLogBackend
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--receipts", type=int, default=10_000_000, help="Receipts to write in batches.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Receipts per add_receipts call.")
+    parser.add_argument("--single-receipts", type=int, default=20_000, help="Receipts to write one per call.")
+    parser.add_argument("--threads", type=int, default=16, help="Threads adding single receipts.")
+    parser.add_argument("--commit-interval", type=float, default=0.0)
+    parser.add_argument("--lazy", action="store_true", help="Keep whole receipts rather than eager points records.")
+    parser.add_argument("--path", default=None)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    # Cycle through a pool of distinct receipts; the write path costs the same whether or not receipts repeat.
+    schema = ReceiptBaseSchema()
+    pool = [schema.load(body) for body in generate_corpus(1000, seed=0)]
+    path = args.path or os.path.join(tempfile.mkdtemp(), "receipts.log")
+    tracker = ReceiptTracker()
+    eager_points = not args.lazy
+    tracker.configure(
+        eager_points=eager_points, storage=AppendOnlyLogBackend(path, commit_interval=args.commit_interval)
+    )
+
+    receipts = itertools.cycle(pool)
+    start = time.perf_counter()
+    for written in range(0, args.receipts, args.batch_size):
+        tracker.add_receipts(list(itertools.islice(receipts, min(args.batch_size, args.receipts - written))))
+    elapsed = time.perf_counter() - start
+    print(f"batched writes:  {args.receipts / elapsed:10.0f} receipts/s ({args.receipts} in {elapsed:.1f}s)")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(tracker.add_receipt, itertools.islice(receipts, args.single_receipts)))
+    elapsed = time.perf_counter() - start
+    print(
+        f"single writes:   {args.single_receipts / elapsed:10.0f} receipts/s "
+        f"({args.threads} threads, each waiting for its fsync)"
+    )
+
+    total = args.receipts + args.single_receipts
+    tracker.configure(eager_points=eager_points)
+    tracker.clear()
+    print(f"log size:        {os.path.getsize(path) / 2**20:10.0f} MiB for {total} receipts")
+
+    start = time.perf_counter()
+    tracker.configure(eager_points=eager_points, storage=AppendOnlyLogBackend(path))
+    elapsed = time.perf_counter() - start
+    print(f"restart replay:  {elapsed:10.1f} s ({total / elapsed:.0f} receipts/s)")
+    tracker.configure(eager_points=eager_points)
+    if args.path is None:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Reports the memory the ReceiptTracker holds per million receipts in the lazy and eager points modes.
+
+Run from the repository root with `python -m benchmarks.bench_tracker_memory`.
+"""
+
+import argparse
+import gc
+import logging
+import tracemalloc
+
+from benchmarks.corpus import generate_corpus
+from receipt_service import ReceiptTracker
+from schema import ReceiptBaseSchema
+
+
+def bytes_per_receipt(eager_points: bool, corpus: list[dict]) -> float:
+    """Returns the bytes retained by the tracker per receipt added, including the receipt models it keeps."""
+    schema = ReceiptBaseSchema()
+    tracker = ReceiptTracker()
+    tracker.clear()
+    tracker.configure(eager_points=eager_points)
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for body in corpus:
+        receipt_id = tracker.add_receipt(schema.load(body))
+        tracker.get_points_for_receipt(receipt_id)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return retained / len(corpus)
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--receipts", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    corpus = list(generate_corpus(args.receipts, seed=args.seed))
+    for mode, eager_points in (("lazy", False), ("eager", True)):
+        per_receipt = bytes_per_receipt(eager_points, corpus)
+        print(f"{mode:>5}: {per_receipt:8.0f} bytes/receipt, {per_receipt * 1e6 / 2**20:8.0f} MiB per million receipts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Compares the per-request CPU cost of receipt validation before and after the single-pass decode.
+
+Run from the repository root with `python -m benchmarks.bench_validation`.
+"""
+
+import argparse
+import time
+from typing import Callable
+
+import marshmallow as ma
+
+from benchmarks.corpus import generate_corpus
+from receipt_service import ReceiptData
+from schema import ReceiptBaseSchema, ReceiptInputSchema
+
+# The schema as it was before the single-pass decode, without the post-load hook that builds the model.
+LegacyReceiptSchema = ma.Schema.from_dict(dict(ReceiptBaseSchema._declared_fields), name="LegacyReceiptSchema")
+
+
+def triple_parse(schema: ma.Schema, body: dict) -> ReceiptData:
+    """The old path: a fresh schema load in pre-load, the flask-smorest load, then a Pydantic parse."""
+    LegacyReceiptSchema().load(body)
+    return ReceiptData(**schema.load(body))
+
+
+def single_parse(schema: ma.Schema, body: dict) -> ReceiptData:
+    """The new path: one schema load that yields the model."""
+    return schema.load(body)
+
+
+def cpu_per_request(
+    parse: Callable[[ma.Schema, dict], ReceiptData], schema: ma.Schema, corpus: list[dict], rounds: int
+) -> float:
+    """Returns the best CPU time in microseconds per receipt over `rounds` passes of the corpus."""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.process_time()
+        for body in corpus:
+            parse(schema, body)
+        best = min(best, time.process_time() - start)
+    return best / len(corpus) * 1e6
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--receipts", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = list(generate_corpus(args.receipts, seed=args.seed))
+    before = cpu_per_request(triple_parse, LegacyReceiptSchema(), corpus, args.rounds)
+    after = cpu_per_request(single_parse, ReceiptInputSchema(), corpus, args.rounds)
+    print(f"triple parse: {before:8.1f} us/request")
+    print(f"single parse: {after:8.1f} us/request")
+    print(f"speedup:      {before / after:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Seeded generator for realistic receipt corpora used by the benchmarks."""
+
+import random
+from datetime import date, timedelta
+from typing import Iterator
+
+RETAILERS = [
+    "Target",
+    "Walgreens",
+    "M&M Corner Market",
+    "Costco Wholesale",
+    "Whole Foods Market",
+    "7-Eleven",
+    "Trader Joes",
+    "CVS Pharmacy",
+]
+DESCRIPTIONS = [
+    "Gatorade",
+    "Mountain Dew 12PK",
+    "Emils Cheese Pizza",
+    "Knorr Creamy Chicken",
+    "Doritos Nacho Cheese",
+    "   Klarbrunn 12-PK 12 FL OZ  ",
+    "Pepsi - 12-oz",
+    "Dasani",
+    "Bananas",
+    "Whole Milk 1 Gal",
+]
+
+
+def generate_receipt(rng: random.Random, num_items: int | None = None) -> dict:
+    """Generates a single receipt request body in the format accepted by POST /receipts/process."""
+    if num_items is None:
+        num_items = rng.randint(1, 12)
+    prices = [rng.randint(0, 2500) for _ in range(num_items)]
+    purchase_date = date(2022, 1, 1) + timedelta(days=rng.randint(0, 1095))
+    return {
+        "retailer": rng.choice(RETAILERS),
+        "purchaseDate": purchase_date.isoformat(),
+        "purchaseTime": f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}",
+        "items": [
+            {"shortDescription": rng.choice(DESCRIPTIONS), "price": f"{price / 100:.2f}"} for price in prices
+        ],
+        "total": f"{sum(prices) / 100:.2f}",
+    }
+
+
+def generate_corpus(size: int, seed: int = 0, num_items: int | None = None) -> Iterator[dict]:
+    """Yields `size` receipts from a generator seeded with `seed` so runs are reproducible."""
+    rng = random.Random(seed)
+    for _ in range(size):
+        yield generate_receipt(rng, num_items)
@@ -0,0 +1,26 @@
+"""Timing helpers shared by the benchmarks."""
+
+import time
+from typing import Callable
+
+import numpy as np
+
+
+def latency_summary(latencies: list[float], elapsed: float) -> str:
+    """Formats the p50/p95/p99 of latencies in seconds, in microseconds, with the throughput over elapsed seconds."""
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1e6, [50, 95, 99])
+    return (
+        f"p50 {p50:9.1f} us  p95 {p95:9.1f} us  p99 {p99:9.1f} us  "
+        f"{len(latencies) / elapsed:9.0f} ops/s ({len(latencies)} ops)"
+    )
+
+
+def time_calls(call: Callable[[], object], count: int) -> tuple[list[float], float]:
+    """Makes `count` calls, returning the latency of each and the total elapsed seconds."""
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        call_start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - call_start)
+    return latencies, time.perf_counter() - start
@@ -0,0 +1,89 @@
+"""Defines a vectorized points calculation for scoring large batches of receipts at once, e.g. for backfills."""
+
+from dataclasses import dataclass
+from typing import Iterable, Self
+
+import numpy as np
+
+from receipt_service import ReceiptData
+
+# The purchase time rule awards points from 2:01pm up to 3:59pm, as minutes since midnight.
+PURCHASE_TIME_START_MINUTE = 14 * 60 + 1
+PURCHASE_TIME_END_MINUTE = 16 * 60
+
+
+@dataclass(frozen=True)
+class ReceiptColumns:
+    """A batch of receipts in columnar form, with one entry per receipt or per item in flat arrays.
+
+    The items of receipt `i` are at `item_offsets[i]:item_offsets[i + 1]` in the per item arrays."""
+
+    retailer_alnum_counts: np.ndarray
+    totals_cents: np.ndarray
+    purchase_days: np.ndarray
+    purchase_minutes: np.ndarray
+    item_offsets: np.ndarray
+    description_lengths: np.ndarray
+    item_prices_cents: np.ndarray
+
+    def __len__(self: Self) -> int:
+        return len(self.totals_cents)
+
+    @classmethod
+    def from_receipts(cls: type[Self], receipts: Iterable[ReceiptData]) -> Self:
+        """Builds the columns for a batch of receipts."""
+        retailer_alnum_counts = []
+        totals_cents = []
+        purchase_days = []
+        purchase_minutes = []
+        item_offsets = [0]
+        description_lengths = []
+        item_prices_cents = []
+        for receipt in receipts:
+            retailer_alnum_counts.append(sum(char.isalnum() for char in receipt.retailer))
+            totals_cents.append(receipt.total_cents)
+            purchase_days.append(receipt.purchaseDate.day)
+            purchase_minutes.append(receipt.purchaseTime.hour * 60 + receipt.purchaseTime.minute)
+            for item in receipt.items:
+                description_lengths.append(len(item.shortDescription.strip()))
+                item_prices_cents.append(item.price_cents)
+            item_offsets.append(len(item_prices_cents))
+        return cls(
+            retailer_alnum_counts=np.array(retailer_alnum_counts, dtype=np.int64),
+            totals_cents=np.array(totals_cents, dtype=np.int64),
+            purchase_days=np.array(purchase_days, dtype=np.int64),
+            purchase_minutes=np.array(purchase_minutes, dtype=np.int64),
+            item_offsets=np.array(item_offsets, dtype=np.int64),
+            description_lengths=np.array(description_lengths, dtype=np.int64),
+            item_prices_cents=np.array(item_prices_cents, dtype=np.int64),
+        )
+
+
+def _calculate_item_points_batch(columns: ReceiptColumns) -> np.ndarray:
+    """Calculates the points for every item, mirroring Item.calculate_item_points."""
+    # The price times 0.2 is the price in cents divided by 500, rounded up with integer division.
+    item_points = -(-columns.item_prices_cents // 500)
+    return np.where(columns.description_lengths % 3 == 0, item_points, 0)
+
+
+def calculate_points_batch(columns: ReceiptColumns) -> np.ndarray:
+    """Calculates the total points for every receipt in the batch with the default rules, matching
+    ReceiptData.calculate_points for receipts scored with them."""
+    item_counts = np.diff(columns.item_offsets)
+    # Sum the item points per receipt from the running total at each receipt's item offsets.
+    item_points_running_total = np.concatenate(([0], np.cumsum(_calculate_item_points_batch(columns))))
+    sub_item_points = item_points_running_total[columns.item_offsets[1:]] - item_points_running_total[
+        columns.item_offsets[:-1]
+    ]
+
+    points = columns.retailer_alnum_counts.copy()
+    points += np.where(columns.totals_cents % 100 == 0, 50, 0)
+    points += np.where(columns.totals_cents % 25 == 0, 25, 0)
+    points += item_counts // 2 * 5
+    points += sub_item_points
+    points += np.where(columns.purchase_days % 2 != 0, 6, 0)
+    in_time_window = (columns.purchase_minutes >= PURCHASE_TIME_START_MINUTE) & (
+        columns.purchase_minutes < PURCHASE_TIME_END_MINUTE
+    )
+    points += np.where(in_time_window, 10, 0)
+    return points
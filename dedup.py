@@ -0,0 +1,101 @@
+"""Defines the index the receipt tracker uses to recognise receipts that have already been submitted."""
+
+from collections import OrderedDict
+import hashlib
+import threading
+from typing import TYPE_CHECKING, Self
+
+from metrics import DEDUP_LOOKUPS
+
+if TYPE_CHECKING:
+    from receipt_service import ReceiptData
+
+
+class DedupIndex:
+    """A bounded map from a submission's dedup key to the ID its receipt was given, so a resubmitted receipt gets the
+    same ID back instead of being stored again.
+
+    The key is the client's Idempotency-Key if it sent one, otherwise a canonical hash of the receipt's content. Only
+    the max_entries most recently submitted or resubmitted keys are remembered; a resubmission after its key has been
+    evicted is stored as a new receipt.
+
+    A key stays unsettled from when it's claimed until its receipt has been stored, or couldn't be and the key was
+    released. A duplicate claimed on another thread in that time waits for it to settle, so it's never given an ID
+    that isn't found yet. The thread that claimed the key doesn't wait, as it's the one that goes on to store it."""
+
+    def __init__(self: Self, max_entries: int):
+        self.max_entries = max_entries
+        self._key_to_id: OrderedDict[bytes, str] = OrderedDict()
+        # The ID, claiming thread and settled event of each key claimed but not yet settled.
+        self._unsettled: dict[bytes, tuple[str, int, threading.Event]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(receipt: "ReceiptData", idempotency_key: str | None = None) -> bytes:
+        """Returns the dedup key for a submission, kept apart from content hashes by a prefix."""
+        if idempotency_key is not None:
+            return b"k" + hashlib.blake2b(idempotency_key.encode(), digest_size=16).digest()
+        return b"c" + receipt.canonical_hash()
+
+    def claim(self: Self, key: bytes, receipt_id: str) -> str | None:
+        """Returns the ID already given to the key, once it's settled, or records receipt_id for it and returns None
+        if it's new. A new claim must be settled once its receipt has been stored or the key released."""
+        while True:
+            with self._lock:
+                existing = self._key_to_id.get(key, None)
+                if existing is None:
+                    self._key_to_id[key] = receipt_id
+                    self._unsettled[key] = (receipt_id, threading.get_ident(), threading.Event())
+                    if len(self._key_to_id) > self.max_entries:
+                        self._key_to_id.popitem(last=False)
+                    self.misses += 1
+                    break
+                unsettled = self._unsettled.get(key, None)
+                if unsettled is None or unsettled[1] == threading.get_ident():
+                    self._key_to_id.move_to_end(key)
+                    self.hits += 1
+                    break
+            # Checked again once settled, as the key may have been released for this thread to claim.
+            unsettled[2].wait()
+        DEDUP_LOOKUPS.inc("miss" if existing is None else "hit")
+        return existing
+
+    def settle(self: Self, key: bytes, receipt_id: str) -> None:
+        """Marks a key claimed for receipt_id as settled, waking the duplicates waiting for it."""
+        with self._lock:
+            unsettled = self._unsettled.get(key, None)
+            if unsettled is None or unsettled[0] != receipt_id:
+                return
+            del self._unsettled[key]
+        unsettled[2].set()
+
+    def release(self: Self, key: bytes, receipt_id: str) -> None:
+        """Forgets a key claimed for a receipt that couldn't be stored, so the client's retry is stored afresh."""
+        with self._lock:
+            if self._key_to_id.get(key, None) == receipt_id:
+                del self._key_to_id[key]
+        self.settle(key, receipt_id)
+
+    def stats(self: Self) -> dict[str, int | float]:
+        """Returns the number of keys remembered, the limit, and the hits, misses and hit rate of lookups."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._key_to_id),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self: Self) -> None:
+        """Forgets every key and resets the stats."""
+        with self._lock:
+            self._key_to_id.clear()
+            unsettled = list(self._unsettled.values())
+            self._unsettled.clear()
+            self.hits = self.misses = 0
+        for _, _, settled in unsettled:
+            settled.set()
@@ -7,3 +7,15 @@ class NoReceiptFoundException(Exception):
     def __init__(self, receipt_id: str):
         self.receipt_id = receipt_id
         super().__init__(f"No receipt found for ID: {receipt_id}")
+
+
+class ReceiptStorageException(Exception):
+    """Exception raised when receipts can't be written to or read from the tracker's storage backend."""
+
+
+class IngestQueueFullException(Exception):
+    """Exception raised when a receipt can't be queued for ingest because the queue is full."""
+
+
+class UnknownRulesVersionException(Exception):
+    """Exception raised when no points rule set is registered for a version."""
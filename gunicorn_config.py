@@ -0,0 +1,51 @@
+"""Gunicorn settings for serving the app in production.
+
+Run with `gunicorn -c gunicorn_config.py app:app`. Every setting can be overridden with the environment variable named
+next to it.
+
+The receipts are held in the memory of the process that received them, so the app is served by a single worker process
+with a pool of threads, which all share one thread-safe ReceiptTracker. Running more worker processes would give each
+its own tracker and an ID handed out by one worker would be a 404 on the others, so that's refused unless the workers
+share their receipts through a shared store (FLASK_RECEIPTS_SHARED_STORE_PATH).
+"""
+
+import os
+
+from receipt_service import ReceiptTracker
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', '5001')}")
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", str(4 * (os.cpu_count() or 1))))
+# Seconds to hold idle keep-alive connections open for, so clients reuse them rather than reconnecting per request.
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+# Connections waiting to be accepted before new ones are refused.
+backlog = int(os.environ.get("GUNICORN_BACKLOG", "2048"))
+# Connections held open per worker, including idle keep-alive ones.
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", None)
+# The app is loaded in the worker rather than the master, so threads the tracker starts, e.g. the storage log writer,
+# are running in the process that serves requests.
+preload_app = False
+
+if workers != 1 and not os.environ.get("FLASK_RECEIPTS_SHARED_STORE_PATH"):
+    raise ValueError(
+        "GUNICORN_WORKERS must be 1 without a shared store: each worker process would have its own receipts. Scale "
+        "with GUNICORN_THREADS, or run store_server.py (or Redis) and set FLASK_RECEIPTS_SHARED_STORE_PATH."
+    )
+
+
+def worker_exit(server: object, worker: object) -> None:
+    """Drains the app's async ingest queue into the tracker, writes a last snapshot if snapshots are on, then commits
+    anything queued for the tracker's storage, before the worker exits."""
+    # Imported here rather than at the top, so the master process never loads the app.
+    from app import stop_snapshot_writer
+
+    extensions = getattr(getattr(worker, "wsgi", None), "extensions", {})
+    ingest_queue = extensions.get("receipt_ingest_queue", None)
+    if ingest_queue is not None:
+        ingest_queue.close()
+    stop_snapshot_writer()
+    ReceiptTracker().close()
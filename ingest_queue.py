@@ -0,0 +1,247 @@
+"""Defines the queue receipts go through when they're ingested asynchronously."""
+
+from collections import deque
+import json
+import logging
+import queue
+import threading
+from time import monotonic, perf_counter, sleep
+from typing import Self
+
+from exceptions import IngestQueueFullException
+from metrics import INGEST_FAILED
+from receipt_service import ReceiptData, ReceiptTracker
+from schema import ReceiptBaseSchema
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueue:
+    """A bounded queue of validated receipts, drained into the receipt tracker by a pool of worker threads.
+
+    Submitting a receipt reserves its ID and returns straight away. Each worker takes up to batch_size queued receipts
+    at a time, adds them to the tracker together and calculates their points, so by the time a receipt stops being
+    pending its points are a lookup. When the queue is full, submitting waits up to enqueue_timeout for space before
+    giving up, which pushes back on clients rather than letting the backlog grow without limit.
+
+    A batch the tracker fails to add is retried up to max_attempts times, waiting retry_delay seconds before the first
+    retry and twice as long before each one after. Only the receipts the tracker still doesn't have are retried. Those
+    that still fail are counted as failed and, if dead_letter_path is set, appended to that file as JSON lines of their
+    ID and receipt, in the shape the API takes, so they can be resubmitted.
+
+    Receipts submitted after the queue is closed are added to the tracker straight away instead.
+    """
+
+    # How far back the drain rate is measured over, in seconds.
+    DRAIN_RATE_WINDOW = 10.0
+
+    def __init__(
+        self: Self,
+        max_size: int = 10000,
+        num_workers: int = 4,
+        batch_size: int = 100,
+        enqueue_timeout: float = 0.1,
+        max_attempts: int = 3,
+        retry_delay: float = 0.05,
+        dead_letter_path: str | None = None,
+    ):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.enqueue_timeout = enqueue_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.dead_letter_path = dead_letter_path
+        # Each entry is a receipt's reserved ID, the receipt and the dedup key claimed for it, if any.
+        self._queue: queue.Queue[tuple[str, ReceiptData, bytes | None] | None] = queue.Queue(maxsize=max_size)
+        self._pending: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._rejected = 0
+        self._drained = 0
+        self._retried = 0
+        self._failed = 0
+        self._closed = False
+        self._enqueue_seconds_total = 0.0
+        self._enqueue_seconds_max = 0.0
+        self._recent_batches: deque[tuple[float, int]] = deque()
+        self._workers = [
+            threading.Thread(target=self._drain, name=f"receipt-ingest-{number}", daemon=True)
+            for number in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self: Self, receipt: ReceiptData, idempotency_key: str | None = None) -> str:
+        """Queues a receipt to be added to the tracker and returns the ID it will have, or the ID it already has if the
+        tracker's dedup index recognises it as a duplicate."""
+        if self._closed:
+            return ReceiptTracker().add_receipt(receipt, idempotency_key=idempotency_key)
+        receipt_id = ReceiptTracker.new_receipt_id()
+        dedup = ReceiptTracker().dedup
+        key = None
+        if dedup is not None:
+            key = dedup.key_for(receipt, idempotency_key)
+            existing_id = dedup.claim(key, receipt_id)
+            if existing_id is not None:
+                return existing_id
+        with self._lock:
+            self._pending[receipt_id] = threading.Event()
+        start = perf_counter()
+        try:
+            self._queue.put((receipt_id, receipt, key), timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._lock:
+                del self._pending[receipt_id]
+                self._rejected += 1
+            if key is not None:
+                dedup.release(key, receipt_id)
+            raise IngestQueueFullException()
+        elapsed = perf_counter() - start
+        with self._lock:
+            self._enqueued += 1
+            self._enqueue_seconds_total += elapsed
+            self._enqueue_seconds_max = max(self._enqueue_seconds_max, elapsed)
+        return receipt_id
+
+    def is_pending(self: Self, receipt_id: str) -> bool:
+        """Returns whether a receipt has been submitted but not yet added to the tracker."""
+        return receipt_id in self._pending
+
+    def wait_for(self: Self, receipt_id: str, timeout: float) -> bool:
+        """Waits up to timeout seconds for a pending receipt to be added to the tracker, returning whether it was."""
+        event = self._pending.get(receipt_id, None)
+        return event is None or event.wait(timeout)
+
+    def _drain(self: Self) -> None:
+        """Runs on each worker thread, adding batches of queued receipts to the tracker."""
+        tracker = ReceiptTracker()
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            batch = [entry]
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None:
+                    # Put the stop signal back for after this batch is finished.
+                    self._queue.put(None)
+                    break
+                batch.append(entry)
+            self._process(tracker, batch)
+
+    def _process(self: Self, tracker: ReceiptTracker, batch: list[tuple[str, ReceiptData, bytes | None]]) -> None:
+        """Ingests a batch, gives up on whatever couldn't be added, then settles its dedup keys and stops its receipts
+        being pending, whatever happens."""
+        try:
+            failed = self._ingest(tracker, batch)
+            if failed:
+                self._fail(tracker, failed)
+        except Exception:
+            logger.exception("Failed to give up on a batch of %d receipts", len(batch))
+        finally:
+            if tracker.dedup is not None:
+                for receipt_id, _, key in batch:
+                    if key is not None:
+                        tracker.dedup.settle(key, receipt_id)
+            with self._lock:
+                for receipt_id, _, _ in batch:
+                    self._pending.pop(receipt_id).set()
+                self._drained += len(batch)
+                self._recent_batches.append((monotonic(), len(batch)))
+
+    def _ingest(
+        self: Self, tracker: ReceiptTracker, batch: list[tuple[str, ReceiptData, bytes | None]]
+    ) -> list[tuple[str, ReceiptData, bytes | None]]:
+        """Adds a batch to the tracker and calculates its points, retrying if that fails, and returns the receipts
+        that couldn't be added."""
+        receipt_ids = [receipt_id for receipt_id, _, _ in batch]
+        remaining = batch
+        for attempt in range(self.max_attempts):
+            try:
+                if attempt:
+                    sleep(self.retry_delay * 2 ** (attempt - 1))
+                    with self._lock:
+                        self._retried += 1
+                    # A failed attempt may have stored some of the batch, which mustn't be stored again.
+                    missing = set(tracker.get_points_for_receipts([receipt_id for receipt_id, _, _ in remaining])[1])
+                    remaining = [entry for entry in remaining if entry[0] in missing]
+                if remaining:
+                    tracker.add_receipts(
+                        [receipt for _, receipt, _ in remaining],
+                        receipt_ids=[receipt_id for receipt_id, _, _ in remaining],
+                    )
+                tracker.get_points_for_receipts(receipt_ids)
+                return []
+            except Exception:
+                logger.exception(
+                    "Failed to ingest a batch of %d receipts, attempt %d of %d",
+                    len(remaining),
+                    attempt + 1,
+                    self.max_attempts,
+                )
+        return remaining
+
+    def _fail(self: Self, tracker: ReceiptTracker, batch: list[tuple[str, ReceiptData, bytes | None]]) -> None:
+        """Gives up on a batch: releases its dedup keys, counts its receipts as failed and writes them to the dead
+        letter file, if there is one."""
+        if tracker.dedup is not None:
+            for receipt_id, _, key in batch:
+                if key is not None:
+                    tracker.dedup.release(key, receipt_id)
+        with self._lock:
+            self._failed += len(batch)
+        INGEST_FAILED.inc(amount=len(batch))
+        logger.error("Gave up ingesting receipts %s", ", ".join(receipt_id for receipt_id, _, _ in batch))
+        if self.dead_letter_path is not None:
+            schema = ReceiptBaseSchema()
+            with self._lock, open(self.dead_letter_path, "a") as dead_letters:
+                for receipt_id, receipt, _ in batch:
+                    # Amounts are dumped as Decimals, written out as the strings the API takes.
+                    dead_letters.write(json.dumps({"id": receipt_id, "receipt": schema.dump(receipt)}, default=str))
+                    dead_letters.write("\n")
+
+    def stats(self: Self) -> dict[str, int | float]:
+        """Returns backpressure metrics: the queue depth and capacity, receipts enqueued, rejected because the queue
+        was full and drained from the queue, batches retried, receipts that failed to be added, the average and
+        maximum seconds spent enqueueing, and the receipts drained per second over the last DRAIN_RATE_WINDOW
+        seconds."""
+        now = monotonic()
+        with self._lock:
+            while self._recent_batches and self._recent_batches[0][0] < now - self.DRAIN_RATE_WINDOW:
+                self._recent_batches.popleft()
+            return {
+                "depth": self._queue.qsize(),
+                "max_size": self.max_size,
+                "pending": len(self._pending),
+                "enqueued": self._enqueued,
+                "rejected": self._rejected,
+                "drained": self._drained,
+                "retried": self._retried,
+                "failed": self._failed,
+                "enqueue_seconds_avg": self._enqueue_seconds_total / self._enqueued if self._enqueued else 0.0,
+                "enqueue_seconds_max": self._enqueue_seconds_max,
+                "drain_rate": sum(size for _, size in self._recent_batches) / self.DRAIN_RATE_WINDOW,
+            }
+
+    def close(self: Self) -> None:
+        """Stops the workers once everything queued so far has been drained. Does nothing if already closed."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        # Anything submitted while the queue was closing may have been queued after the workers stopped.
+        tracker = ReceiptTracker()
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if entry is not None:
+                self._process(tracker, [entry])
@@ -0,0 +1,278 @@
+"""Defines the counters and histograms the app records about itself, rendered in the Prometheus text format."""
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+import threading
+from typing import Callable, Self
+
+# Latency buckets in seconds, from 10us up to 5s.
+DEFAULT_BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...], extra: str = "") -> str:
+    """Formats label pairs as `{name="value",...}`, or an empty string if there are none."""
+    pairs = [f'{name}="{value}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _PerThreadValues(ABC):
+    """Keeps a metric's values in a dict per thread, so recording a value takes no lock, and merges them when read.
+
+    The values of threads that have finished are folded into one retired dict when the metric is read, so threads
+    started per request don't pile up."""
+
+    def __init__(self: Self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread_values: list[tuple[threading.Thread, dict]] = []
+        self._retired: dict = {}
+
+    def _new_thread_values(self: Self) -> dict:
+        """Registers and returns the dict of values for the current thread, the first time it records one."""
+        values = self._local.values = {}
+        with self._lock:
+            self._thread_values.append((threading.current_thread(), values))
+        return values
+
+    @abstractmethod
+    def _merge(self: Self, merged: dict, label_values: tuple[str, ...], value: object) -> None:
+        """Adds one thread's value for a set of label values into the merged values."""
+
+    def _merged_values(self: Self) -> dict:
+        """Returns the values of every thread added together, by label values."""
+        merged = {}
+        with self._lock:
+            live = []
+            for thread, values in self._thread_values:
+                if thread.is_alive():
+                    live.append((thread, values))
+                else:
+                    for label_values, value in list(values.items()):
+                        self._merge(self._retired, label_values, value)
+            self._thread_values = live
+            for label_values, value in self._retired.items():
+                self._merge(merged, label_values, value)
+            for _, values in live:
+                for label_values, value in list(values.items()):
+                    self._merge(merged, label_values, value)
+        return merged
+
+    def clear(self: Self) -> None:
+        """Resets the values of every thread."""
+        with self._lock:
+            for _, values in self._thread_values:
+                values.clear()
+            self._retired.clear()
+
+
+class Counter(_PerThreadValues):
+    """A count that only goes up, kept separately for each combination of label values."""
+
+    def __init__(self: Self, registry: "MetricsRegistry", name: str, help: str, label_names: tuple[str, ...] = ()):
+        super().__init__()
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+
+    def inc(self: Self, *label_values: str, amount: int = 1) -> None:
+        """Adds to the count for the label values."""
+        if not self.registry.enabled:
+            return
+        try:
+            values = self._local.values
+        except AttributeError:
+            values = self._new_thread_values()
+        values[label_values] = values.get(label_values, 0) + amount
+
+    def _merge(self: Self, merged: dict, label_values: tuple[str, ...], value: int) -> None:
+        merged[label_values] = merged.get(label_values, 0) + value
+
+    def value(self: Self, *label_values: str) -> int:
+        """Returns the count for the label values."""
+        return self._merged_values().get(label_values, 0)
+
+    def render(self: Self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self._merged_values().items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+class Histogram(_PerThreadValues):
+    """A distribution of observed values counted into buckets, kept separately for each combination of label values.
+
+    Each observation only bumps the count of the one bucket it falls in; the cumulative counts Prometheus expects are
+    added up when the histogram is rendered."""
+
+    def __init__(
+        self: Self,
+        registry: "MetricsRegistry",
+        name: str,
+        help: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__()
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+
+    def observe(self: Self, value: float, *label_values: str) -> None:
+        """Records a value for the label values."""
+        if not self.registry.enabled:
+            return
+        try:
+            values = self._local.values
+        except AttributeError:
+            values = self._new_thread_values()
+        # Per label values: the count in each bucket plus one past the last for +Inf, then the sum of the values.
+        entry = values.get(label_values, None)
+        if entry is None:
+            entry = values[label_values] = [0] * (len(self.buckets) + 2)
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def _merge(self: Self, merged: dict, label_values: tuple[str, ...], value: list) -> None:
+        entry = merged.get(label_values, None)
+        if entry is None:
+            merged[label_values] = list(value)
+        else:
+            merged[label_values] = [total + added for total, added in zip(entry, value)]
+
+    def count(self: Self, *label_values: str) -> int:
+        """Returns how many values have been recorded for the label values."""
+        entry = self._merged_values().get(label_values, None)
+        return 0 if entry is None else sum(entry[:-1])
+
+    def render(self: Self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, entry in sorted(self._merged_values().items()):
+            cumulative = 0
+            for upper_bound, bucket_count in zip((*self.buckets, "+Inf"), entry[:-1]):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, label_values, f'le="{upper_bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {entry[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A value read from a callback whenever the metrics are rendered, e.g. the number of receipts stored."""
+
+    def __init__(self: Self, name: str, help: str, read: Callable[[], float]):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self: Self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class CallbackCounter(Gauge):
+    """A count that only goes up, read from a callback whenever the metrics are rendered, e.g. one kept by the tracker
+    rather than recorded through the registry."""
+
+    def render(self: Self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.read()}"]
+
+
+class MetricsRegistry:
+    """Holds every metric the app records. Recording can be switched off with `enabled`, which makes it a no-op."""
+
+    def __init__(self: Self):
+        self.enabled = True
+        self._metrics: dict[str, Counter | Histogram | Gauge] = {}
+
+    def counter(self: Self, name: str, help: str, label_names: tuple[str, ...] = ()) -> Counter:
+        """Registers a counter, replacing any registered under the same name."""
+        self._metrics[name] = Counter(self, name, help, label_names)
+        return self._metrics[name]
+
+    def histogram(
+        self: Self,
+        name: str,
+        help: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Registers a histogram, replacing any registered under the same name."""
+        self._metrics[name] = Histogram(self, name, help, label_names, buckets)
+        return self._metrics[name]
+
+    def gauge(self: Self, name: str, help: str, read: Callable[[], float]) -> Gauge:
+        """Registers a gauge, replacing any registered under the same name."""
+        self._metrics[name] = Gauge(name, help, read)
+        return self._metrics[name]
+
+    def callback_counter(self: Self, name: str, help: str, read: Callable[[], int]) -> CallbackCounter:
+        """Registers a counter read from a callback, replacing any registered under the same name."""
+        self._metrics[name] = CallbackCounter(name, help, read)
+        return self._metrics[name]
+
+    def clear(self: Self) -> None:
+        """Resets every counter and histogram."""
+        for metric in self._metrics.values():
+            if not isinstance(metric, Gauge):
+                metric.clear()
+
+    def render(self: Self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "receipts_request_seconds", "Time spent handling requests to the receipts API.", ("endpoint", "method", "status")
+)
+RESPONSES = REGISTRY.counter(
+    "receipts_responses_total", "Responses from the receipts API by status code.", ("endpoint", "status")
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "receipts_stage_seconds",
+    "Time spent in each stage of handling a receipt: validate (the whole schema load), model (building the "
+    "ReceiptData), points (calculate_points) and store (adding to the tracker, including any storage backend).",
+    ("stage",),
+)
+POINTS_LOOKUPS = REGISTRY.counter(
+    "receipts_points_lookups_total",
+    "Points lookups by result: cached points or records in memory (hit), calculated from the receipt (calculated), "
+    "read from the spill store (spilled), read from the snapshot restored from (snapshot), read from the shared store "
+    "(shared) or not found (not_found).",
+    ("result",),
+)
+DEDUP_LOOKUPS = REGISTRY.counter(
+    "receipts_dedup_lookups_total",
+    "Submissions checked against the dedup index, by whether they were a duplicate (hit) or new (miss).",
+    ("result",),
+)
+INGEST_FAILED = REGISTRY.counter(
+    "receipts_ingest_failed_total",
+    "Receipts the async ingest queue gave up adding to the tracker after retrying.",
+)
@@ -0,0 +1,144 @@
+"""Defines the codecs the receipts blueprint can decode receipts and encode its small responses with."""
+
+from datetime import datetime
+from http import HTTPStatus
+from time import perf_counter
+from typing import Annotated, Self
+
+from flask import Request, Response
+from flask_smorest import abort
+
+from metrics import STAGE_SECONDS
+from receipt_service import Item, ReceiptData, amount_to_cents
+from schema import ReceiptInputSchema, parse_amount
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+INVALID_RECEIPT_MESSAGE = "The receipt is invalid."
+
+# Shared by every request rather than building the schema for each receipt.
+receipt_input_schema = ReceiptInputSchema()
+
+
+class ReceiptCodec:
+    """Decodes the receipt in a request body and encodes the `{"id": ...}` and `{"points": ...}` responses.
+
+    This codec goes through the marshmallow schema both ways: the receipt is validated by ReceiptInputSchema, and the
+    response is returned as a dict for flask-smorest to dump with the endpoint's response schema."""
+
+    name = "marshmallow"
+
+    def decode_receipt(self: Self, request: Request) -> ReceiptData:
+        """Returns the receipt in the request body, aborting with a 400 if it's invalid."""
+        return receipt_input_schema.load(request.get_json(silent=True))
+
+    def respond(self: Self, data: dict) -> dict | Response:
+        """Returns the response body, or a response that skips the endpoint's response schema."""
+        return data
+
+
+class OrjsonCodec(ReceiptCodec):
+    """Parses the body with orjson before validating it with the schema, and encodes responses straight to JSON with
+    orjson rather than dumping them with the response schema."""
+
+    name = "orjson"
+
+    def __init__(self: Self):
+        if orjson is None:
+            raise ValueError("The orjson codec needs the orjson package installed.")
+
+    def decode_receipt(self: Self, request: Request) -> ReceiptData:
+        data = None
+        if request.is_json:
+            try:
+                data = orjson.loads(request.get_data())
+            except orjson.JSONDecodeError:
+                pass
+        return receipt_input_schema.load(data)
+
+    def respond(self: Self, data: dict) -> Response:
+        return Response(orjson.dumps(data), mimetype="application/json")
+
+
+if msgspec is not None:
+    # Mirror ReceiptBaseSchema, so a body is accepted by the msgspec codec exactly when the schema accepts it.
+
+    class _ItemStruct(msgspec.Struct, forbid_unknown_fields=True):
+        shortDescription: Annotated[str, msgspec.Meta(pattern=r"^[\w\s\-]+$")]
+        price: str | int | float
+
+    class _ReceiptStruct(msgspec.Struct, forbid_unknown_fields=True):
+        retailer: Annotated[str, msgspec.Meta(pattern=r"^[\w\s\-&]+$")]
+        purchaseDate: str
+        purchaseTime: str
+        items: Annotated[list[_ItemStruct], msgspec.Meta(min_length=1)]
+        total: str | int | float
+
+
+def _amount_to_cents(amount: str | int | float) -> int:
+    """Converts a dollar amount to cents, rejecting anything the schema's amount fields would."""
+    parsed = parse_amount(amount)
+    if parsed is None:
+        raise ValueError(f"Not a valid amount: {amount!r}")
+    return amount_to_cents(parsed)
+
+
+class MsgspecCodec(ReceiptCodec):
+    """Decodes the body straight into typed structs with msgspec, checking the same constraints as the schema in the
+    same pass, and builds the receipt from them without a second validation. Responses are encoded with msgspec.
+
+    A body that fails validation gets the same 400 as with the schema, but without the per field error messages."""
+
+    name = "msgspec"
+
+    def __init__(self: Self):
+        if msgspec is None:
+            raise ValueError("The msgspec codec needs the msgspec package installed.")
+        self._decoder = msgspec.json.Decoder(_ReceiptStruct)
+        self._encoder = msgspec.json.Encoder()
+
+    def decode_receipt(self: Self, request: Request) -> ReceiptData:
+        start = perf_counter()
+        try:
+            if not request.is_json:
+                raise ValueError("The receipt must be sent as JSON.")
+            decoded = self._decoder.decode(request.get_data())
+            receipt = ReceiptData.model_construct(
+                retailer=decoded.retailer,
+                purchaseDate=datetime.strptime(decoded.purchaseDate, "%Y-%m-%d").date(),
+                purchaseTime=datetime.strptime(decoded.purchaseTime, "%H:%M").time(),
+                items=[
+                    Item.model_construct(
+                        shortDescription=item.shortDescription, price_cents=_amount_to_cents(item.price)
+                    )
+                    for item in decoded.items
+                ],
+                total_cents=_amount_to_cents(decoded.total),
+            )
+        except (msgspec.ValidationError, msgspec.DecodeError, ValueError):
+            abort(http_status_code=HTTPStatus.BAD_REQUEST, message=INVALID_RECEIPT_MESSAGE)
+        finally:
+            STAGE_SECONDS.observe(perf_counter() - start, "validate")
+        return receipt
+
+    def respond(self: Self, data: dict) -> Response:
+        return Response(self._encoder.encode(data), mimetype="application/json")
+
+
+CODECS: dict[str, type[ReceiptCodec]] = {codec.name: codec for codec in (ReceiptCodec, OrjsonCodec, MsgspecCodec)}
+
+
+def get_codec(name: str) -> ReceiptCodec:
+    """Returns a new codec by name."""
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown receipt codec {name!r}, expected one of {', '.join(CODECS)}.") from None
@@ -1,144 +1,1287 @@
 """Defines the logic behind points calculation for a receipt."""
 
-from typing import Self
-from pydantic import BaseModel, Field
+from typing import Iterator, Self
+from pydantic import BaseModel, Field, model_validator
 from datetime import time, date
+from decimal import Decimal, InvalidOperation
+import hashlib
+import numpy as np
+import os
+import struct
 import uuid
 import logging
+import threading
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic, perf_counter, time_ns
+from dedup import DedupIndex
 from exceptions import NoReceiptFoundException
-import math
+from metrics import POINTS_LOOKUPS, STAGE_SECONDS
+from receipt_stats import ReceiptStatsIndex
+from shared_store import SharedReceiptStatsIndex, SharedReceiptStore
+from rules import DEFAULT_RULES_VERSION, get_rule_set
+from snapshot import (
+    RECORD_JSON,
+    RECORD_NONE,
+    RECORD_PACKED,
+    ReceiptSnapshot,
+    SnapshotEntry,
+    columns_from_rows,
+    merge_columns,
+    write_snapshot_file,
+)
+from storage import ReceiptStorageBackend, SqliteSpillStore
 
 logger = logging.getLogger(__name__)
 
+# Set to a list to collect the rule breakdown of every receipt scored in the current context, e.g. for a sampled
+# request trace. Left as None, scoring skips the breakdown entirely.
+points_trace: ContextVar[list[dict] | None] = ContextVar("points_trace", default=None)
+
+
+class StringTable:
+    """Hands out a small number for each distinct string, so packed receipts can refer to their retailer and item
+    descriptions by number and every receipt naming "Gatorade" shares the one string.
+
+    Each number index hands out counts as a reference to its string, given back with release once the packed receipt
+    holding it is removed. A string nothing refers to any more is dropped and its number handed out again, so the
+    table grows with the number of distinct strings held rather than every string ever seen. While the table is held,
+    nothing is dropped, so a copy of packed receipts can be read against it."""
+
+    def __init__(self: Self):
+        self._strings: list[str | None] = []
+        self._string_to_index: dict[str, int] = {}
+        self._references: list[int] = []
+        self._free: list[int] = []
+        self._holds = 0
+        self._unreferenced: set[int] = set()
+        self._lock = threading.Lock()
+
+    def index(self: Self, string: str) -> int:
+        """Returns the number for a string, adding it to the table if it's new, and counts a reference to it."""
+        with self._lock:
+            index = self._string_to_index.get(string, None)
+            if index is None:
+                if self._free:
+                    index = self._free.pop()
+                    self._strings[index] = string
+                else:
+                    index = len(self._strings)
+                    self._strings.append(string)
+                    self._references.append(0)
+                self._string_to_index[string] = index
+            self._references[index] += 1
+        return index
+
+    def release(self: Self, indexes: list[int]) -> None:
+        """Gives back references handed out by index, dropping the strings nothing refers to any more, or once the
+        table stops being held if it is."""
+        with self._lock:
+            for index in indexes:
+                self._references[index] -= 1
+                if self._references[index] == 0:
+                    if self._holds:
+                        self._unreferenced.add(index)
+                    else:
+                        self._drop(index)
+
+    def _drop(self: Self, index: int) -> None:
+        """Removes an unreferenced string and frees its number. Must hold the lock."""
+        string = self._strings[index]
+        # A snapshot's table can hold the same string twice, and only one of them is looked up.
+        if self._string_to_index.get(string, None) == index:
+            del self._string_to_index[string]
+        self._strings[index] = None
+        self._free.append(index)
+
+    @contextmanager
+    def held(self: Self) -> Iterator[None]:
+        """Keeps every string in the table under its number until the block exits."""
+        with self._lock:
+            self._holds += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._holds -= 1
+                if not self._holds:
+                    for index in self._unreferenced:
+                        if self._references[index] == 0:
+                            self._drop(index)
+                    self._unreferenced.clear()
+
+    def adopt(self: Self, strings: list[str]) -> bool:
+        """Gives each of a list of strings its position in the list as its number, e.g. to take on the numbering of a
+        snapshot's packed receipts, if the table holds none of them yet or the list carries on from what it holds.
+        Returns whether it did."""
+        with self._lock:
+            if self._strings != strings[: len(self._strings)]:
+                return False
+            for string in strings[len(self._strings) :]:
+                self._string_to_index[string] = len(self._strings)
+                self._strings.append(string)
+                self._references.append(0)
+        return True
+
+    def copy(self: Self) -> list[str]:
+        """Returns the strings in the table, in order of their numbers, with an empty string for each free number."""
+        with self._lock:
+            return ["" if string is None else string for string in self._strings]
+
+    def __getitem__(self: Self, index: int) -> str:
+        return self._strings[index]
+
+    def __len__(self: Self) -> int:
+        """Returns how many strings the table holds."""
+        return len(self._string_to_index)
+
+
+# The retailer names, item descriptions and rules versions of the receipts held by the tracker.
+RECEIPT_STRINGS = StringTable()
+
+# A packed receipt starts with the retailer's string number, the rules version's string number plus one (0 for
+# none), the purchase date as an ordinal, the purchase time in microseconds since midnight and the total in cents. The
+# string numbers of the item descriptions follow, then the item prices in cents.
+_PACKED_HEADER = struct.Struct("<IIIQQ")
+_PACKED_ITEM_SIZE = struct.calcsize("<IQ")
+
+
+def amount_to_cents(amount: str | int | float | Decimal) -> int:
+    """Converts a dollar amount to a whole number of cents, without going through floating point arithmetic."""
+    try:
+        cents = Decimal(str(amount)) * 100
+    except InvalidOperation:
+        raise ValueError(f"Not a valid amount: {amount!r}") from None
+    if not cents.is_finite() or cents != cents.to_integral_value():
+        raise ValueError(f"Not a valid amount with at most two decimal places: {amount!r}")
+    return int(cents)
+
+
+def _convert_amount_to_cents(data: object, amount_field: str) -> object:
+    """Replaces a dollar amount in the raw input to a model with its `<field>_cents` equivalent."""
+    if isinstance(data, dict) and amount_field in data:
+        data = dict(data)
+        data[f"{amount_field}_cents"] = amount_to_cents(data.pop(amount_field))
+    return data
+
 
 class Item(BaseModel):
-    """Defines an item on the receipt."""
+    """Defines an item on the receipt.
+
+    The price is held as a whole number of cents. It can be given in dollars as `price` and is converted on the way
+    in."""
 
     shortDescription: str = Field(
         min_length=1,
     )
-    price: float = Field(
-        gte=0,
+    price_cents: int = Field(
+        ge=0,
     )
 
+    @model_validator(mode="before")
+    @classmethod
+    def _convert_price(cls: type[Self], data: object) -> object:
+        return _convert_amount_to_cents(data, "price")
+
+    @property
+    def price(self: Self) -> Decimal:
+        """The price in dollars."""
+        return Decimal(self.price_cents).scaleb(-2)
+
     def calculate_item_points(self: Self) -> int:
         """Calculates the points for an individual item:
 
         'If the trimmed length of the item description is a multiple of 3, multiply the price by 0.2 and round up to the nearest integer.
         The result is the number of points earned.'
+
+        The price times 0.2 is the price in cents divided by 500, which is rounded up with integer division.
         """
         if len(self.shortDescription.strip()) % 3 == 0:
-            return math.ceil(self.price * 0.2)
+            return -(-self.price_cents // 500)
         return 0
 
 
 class ReceiptData(BaseModel):
-    """Defines the full receipt."""
+    """Defines the full receipt.
+
+    The total is held as a whole number of cents. It can be given in dollars as `total` and is converted on the way
+    in. The receipt is scored with the points rules version it was submitted under, which the tracker records when
+    it's added under anything but the default rules; a receipt without one is scored with the default rules."""
 
     retailer: str = Field(min_length=1)
     purchaseDate: date
     purchaseTime: time
     items: list[Item] = Field(min_length=1)
-    total: float = Field(gte=0)
+    total_cents: int = Field(ge=0)
+    rules_version: str | None = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def _convert_total(cls: type[Self], data: object) -> object:
+        return _convert_amount_to_cents(data, "total")
+
+    @property
+    def total(self: Self) -> Decimal:
+        """The total in dollars."""
+        return Decimal(self.total_cents).scaleb(-2)
 
-    def _calculate_alphanumeric_points(self: Self) -> int:
-        """One point for every alphanumeric character in the retailer name."""
-        return sum(char.isalnum() for char in self.retailer)
+    @classmethod
+    def from_validated(cls: type[Self], data: dict) -> Self:
+        """Builds a receipt from data that has already been validated by the API schema.
 
-    def _calculate_round_dollar_total_points(self: Self) -> int:
-        """50 points if the total is a round dollar amount with no cents."""
-        return 50 if self.total.is_integer() else 0
+        The schema checks are a superset of the model's field constraints, so Pydantic validation is skipped here
+        rather than parsing the receipt a second time."""
+        items = [
+            Item.model_construct(shortDescription=item["shortDescription"], price_cents=int(item["price"] * 100))
+            for item in data["items"]
+        ]
+        return cls.model_construct(
+            retailer=data["retailer"],
+            purchaseDate=data["purchaseDate"],
+            purchaseTime=data["purchaseTime"],
+            items=items,
+            total_cents=int(data["total"] * 100),
+        )
 
-    def _calculate_quarter_multiple_total_points(self: Self) -> int:
-        """25 points if the total is a multiple of 0.25."""
-        return 25 if self.total % 0.25 == 0 else 0
+    def to_packed(self: Self) -> bytes:
+        """Packs the receipt into a flat bytes record, with its strings replaced by their numbers in RECEIPT_STRINGS.
 
-    def _calculate_item_length_points(self: Self) -> int:
-        """5 points for every two items on the receipt."""
-        return len(self.items) // 2 * 5
+        Raises struct.error if an amount is too large to pack, or ValueError if the purchase time has a timezone."""
+        if self.purchaseTime.tzinfo is not None:
+            raise ValueError("Can't pack a purchase time with a timezone.")
+        purchase_time = self.purchaseTime
+        purchase_microseconds = (
+            (purchase_time.hour * 60 + purchase_time.minute) * 60 + purchase_time.second
+        ) * 1_000_000 + purchase_time.microsecond
+        items = self.items
+        retailer = RECEIPT_STRINGS.index(self.retailer)
+        rules_version = None if self.rules_version is None else RECEIPT_STRINGS.index(self.rules_version)
+        descriptions = [RECEIPT_STRINGS.index(item.shortDescription) for item in items]
+        try:
+            return _PACKED_HEADER.pack(
+                retailer,
+                0 if rules_version is None else rules_version + 1,
+                self.purchaseDate.toordinal(),
+                purchase_microseconds,
+                self.total_cents,
+            ) + struct.pack(f"<{len(items)}I{len(items)}Q", *descriptions, *[item.price_cents for item in items])
+        except struct.error:
+            RECEIPT_STRINGS.release([retailer, *descriptions, *([] if rules_version is None else [rules_version])])
+            raise
 
-    def _calculate_sub_item_points(self: Self) -> int:
-        """Calculates the points for each item on the receipt."""
-        return sum(item.calculate_item_points() for item in self.items)
+    @classmethod
+    def from_packed(cls: type[Self], packed: bytes, strings: StringTable | list[str] = RECEIPT_STRINGS) -> Self:
+        """Rebuilds a receipt packed by to_packed, without validating it again. The strings are looked up in
+        RECEIPT_STRINGS, or the table it was packed against, e.g. a snapshot's."""
+        retailer, rules_version, purchase_date, purchase_microseconds, total_cents = _PACKED_HEADER.unpack_from(packed)
+        num_items = (len(packed) - _PACKED_HEADER.size) // _PACKED_ITEM_SIZE
+        items = struct.unpack_from(f"<{num_items}I{num_items}Q", packed, _PACKED_HEADER.size)
+        purchase_seconds, microsecond = divmod(purchase_microseconds, 1_000_000)
+        purchase_minutes, second = divmod(purchase_seconds, 60)
+        return cls.model_construct(
+            retailer=strings[retailer],
+            purchaseDate=date.fromordinal(purchase_date),
+            purchaseTime=time(*divmod(purchase_minutes, 60), second, microsecond),
+            items=[
+                Item.model_construct(shortDescription=strings[description], price_cents=price_cents)
+                for description, price_cents in zip(items[:num_items], items[num_items:])
+            ],
+            total_cents=total_cents,
+            rules_version=None if rules_version == 0 else strings[rules_version - 1],
+        )
 
-    def _calculate_purchase_day_odd_points(self: Self) -> int:
-        """6 points if the day in the purchase date is odd."""
-        return 6 if self.purchaseDate.day % 2 != 0 else 0
+    def canonical_hash(self: Self) -> bytes:
+        """Returns a digest of the receipt's content that's the same for every submission of the same receipt, however
+        its JSON was formatted. Strings are length prefixed so no choice of characters can make two receipts collide."""
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(
+            f"{len(self.retailer)}:{self.retailer}|{self.purchaseDate.isoformat()}|"
+            f"{self.purchaseTime.hour}:{self.purchaseTime.minute}|{self.total_cents}".encode()
+        )
+        for item in self.items:
+            hasher.update(f"|{len(item.shortDescription)}:{item.shortDescription}|{item.price_cents}".encode())
+        return hasher.digest()
 
-    def _calculate_purchase_time_points(self: Self) -> int:
-        """10 points if the time of purchase is after 2:00pm and before 4:00pm."""
-        if self.purchaseTime.hour == 14:
-            return 10 if self.purchaseTime.minute > 0 else 0
-        return 10 if self.purchaseTime.hour > 14 and self.purchaseTime.hour < 16 else 0
+    def rule_breakdown(self: Self) -> dict[str, int]:
+        """Returns the points awarded by each rule, keyed by rule name."""
+        return get_rule_set(self.rules_version or DEFAULT_RULES_VERSION).breakdown(self)
 
     def calculate_points(self: Self) -> int:
-        """Calculates the total points for the receipt.
+        """Calculates the total points for the receipt with the compiled rules for its version.
 
         And prove I'm still not a large language model."""
 
-        points = 0
+        start = perf_counter()
+        trace = points_trace.get()
+        # Only build the per rule breakdown when something will read it, so scoring allocates nothing for logging.
+        if trace is not None or logger.isEnabledFor(logging.DEBUG):
+            breakdown = self.rule_breakdown()
+            points = sum(breakdown.values())
+            logger.debug("Points for receipt from %s: %d, by rule: %s", self.retailer, points, breakdown)
+            if trace is not None:
+                trace.append({"retailer": self.retailer, "points": points, "rules": breakdown})
+        else:
+            points = get_rule_set(self.rules_version or DEFAULT_RULES_VERSION).score(self)
 
-        points += self._calculate_alphanumeric_points()
-        logger.debug(f"Alphanumeric - Retailer name: {self.retailer}, new total points: {points}")
+        STAGE_SECONDS.observe(perf_counter() - start, "points")
+        return points
 
-        points += self._calculate_round_dollar_total_points()
-        logger.debug(f"Round Dollar Total - Total: {self.total}, new total points: {points}")
 
-        points += self._calculate_quarter_multiple_total_points()
-        logger.debug(f"Total Multiple of 0.25 - Total: {self.total}, new total points: {points}")
+class ReceiptIdGenerator:
+    """Generates 16 byte receipt IDs laid out as version 7 UUIDs: a millisecond timestamp, then a counter, then random
+    bits. IDs from the same generator sort in the order they were generated, even within a millisecond or if the
+    clock steps back, so receipts added around the same time have neighbouring IDs."""
 
-        points += self._calculate_item_length_points()
-        logger.debug(f"5 points / pair - Num items: {len(self.items)}, new total points: {points}")
+    # The counter starts from a random value below this each millisecond, leaving room to count up within it.
+    COUNTER_START_LIMIT = 1 << 11
+    COUNTER_LIMIT = 1 << 12
 
-        points += self._calculate_sub_item_points()
-        logger.debug(f"Item based points, new total points: {points}")
+    def __init__(self: Self):
+        self._lock = threading.Lock()
+        self._last_millisecond = 0
+        self._counter = 0
 
-        points += self._calculate_purchase_day_odd_points()
-        logger.debug(f"Odd Date - Purchase date: {self.purchaseDate}, new total points: {points}")
+    def __call__(self: Self) -> bytes:
+        random_bits = int.from_bytes(os.urandom(8), "big")
+        with self._lock:
+            millisecond = time_ns() // 1_000_000
+            if millisecond > self._last_millisecond:
+                self._last_millisecond = millisecond
+                self._counter = random_bits % self.COUNTER_START_LIMIT
+            else:
+                # Borrow from the next millisecond if the counter runs out.
+                self._counter += 1
+                if self._counter == self.COUNTER_LIMIT:
+                    self._last_millisecond += 1
+                    self._counter = 0
+            millisecond, counter = self._last_millisecond, self._counter
+        value = (millisecond << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | (random_bits & ((1 << 62) - 1))
+        return value.to_bytes(16, "big")
 
-        points += self._calculate_purchase_time_points()
-        logger.debug(f"Time after 2 before 4 - Purchase time: {self.purchaseTime}, new total points: {points}")
 
-        return points
+generate_receipt_id = ReceiptIdGenerator()
+
+
+def receipt_id_to_bytes(receipt_id: str) -> bytes:
+    """Packs a receipt ID into the 16 bytes the tracker keys receipts on. Raises a ValueError if it isn't a UUID."""
+    try:
+        id_bytes = bytes.fromhex(receipt_id.replace("-", ""))
+        if len(id_bytes) == 16:
+            return id_bytes
+    except ValueError:
+        pass
+    return uuid.UUID(receipt_id).bytes
+
+
+def receipt_id_from_bytes(id_bytes: bytes) -> str:
+    """Formats the bytes a receipt is keyed on back into its canonical string ID."""
+    hex_id = id_bytes.hex()
+    return f"{hex_id[:8]}-{hex_id[8:12]}-{hex_id[12:16]}-{hex_id[16:20]}-{hex_id[20:]}"
+
+
+def renumber_packed(packed: bytes, numbers: list[int]) -> bytes:
+    """Changes the string numbers in a packed receipt, numbering string i as numbers[i] instead."""
+    retailer, rules_version, purchase_date, purchase_microseconds, total_cents = _PACKED_HEADER.unpack_from(packed)
+    num_items = (len(packed) - _PACKED_HEADER.size) // _PACKED_ITEM_SIZE
+    descriptions = struct.unpack_from(f"<{num_items}I", packed, _PACKED_HEADER.size)
+    return (
+        _PACKED_HEADER.pack(
+            numbers[retailer],
+            0 if rules_version == 0 else numbers[rules_version - 1] + 1,
+            purchase_date,
+            purchase_microseconds,
+            total_cents,
+        )
+        + struct.pack(f"<{num_items}I", *[numbers[description] for description in descriptions])
+        + packed[_PACKED_HEADER.size + num_items * 4 :]
+    )
+
+
+def packed_string_numbers(packed: bytes) -> list[int]:
+    """Returns the numbers of the strings a packed receipt refers to."""
+    retailer, rules_version = _PACKED_HEADER.unpack_from(packed)[:2]
+    num_items = (len(packed) - _PACKED_HEADER.size) // _PACKED_ITEM_SIZE
+    numbers = [retailer, *struct.unpack_from(f"<{num_items}I", packed, _PACKED_HEADER.size)]
+    if rules_version:
+        numbers.append(rules_version - 1)
+    return numbers
+
+
+def estimate_receipt_size(receipt: ReceiptData) -> int:
+    """Estimates the bytes of memory a receipt model takes up, including its items."""
+    size = (
+        sys.getsizeof(receipt)
+        + sys.getsizeof(receipt.__dict__)
+        + sys.getsizeof(receipt.__pydantic_fields_set__)
+        + sys.getsizeof(receipt.retailer)
+        + sys.getsizeof(receipt.purchaseDate)
+        + sys.getsizeof(receipt.purchaseTime)
+        + sys.getsizeof(receipt.total_cents)
+        + sys.getsizeof(receipt.items)
+    )
+    for item in receipt.items:
+        size += (
+            sys.getsizeof(item)
+            + sys.getsizeof(item.__dict__)
+            + sys.getsizeof(item.__pydantic_fields_set__)
+            + sys.getsizeof(item.shortDescription)
+            + sys.getsizeof(item.price_cents)
+        )
+    return size
+
+
+# How the tracker holds a receipt in lazy mode: packed by ReceiptData.to_packed, or the model itself in the rare case it
+# can't be packed.
+CompactReceipt = bytes | ReceiptData
+
+
+def compact_receipt(receipt: ReceiptData) -> CompactReceipt:
+    """Packs a receipt for the tracker to hold, keeping it as it is if it can't be packed."""
+    try:
+        return receipt.to_packed()
+    except (struct.error, ValueError):
+        return receipt
+
+
+def release_compact(compact: CompactReceipt) -> None:
+    """Lets go of the strings of a receipt the tracker no longer holds. Must be called once for each compact_receipt
+    result that was held."""
+    if not isinstance(compact, ReceiptData):
+        RECEIPT_STRINGS.release(packed_string_numbers(compact))
+
+
+def expand_receipt(compact: CompactReceipt) -> ReceiptData:
+    """Rebuilds the receipt model from the form the tracker holds it in."""
+    return compact if isinstance(compact, ReceiptData) else ReceiptData.from_packed(compact)
+
+
+def estimate_compact_size(compact: CompactReceipt) -> int:
+    """Estimates the bytes of memory a receipt held by the tracker takes up, not counting its shared strings."""
+    return estimate_receipt_size(compact) if isinstance(compact, ReceiptData) else sys.getsizeof(compact)
+
+
+# The bytes taken by an eager points entry in the shard: its key and points, and its slot in the dict.
+EAGER_ENTRY_SIZE = sys.getsizeof(bytes(16)) + sys.getsizeof(1000) + 3 * 8
+
+
+class CapacityPolicy(BaseModel):
+    """Limits on the receipts the tracker keeps in memory before evicting the least recently used ones.
+
+    Each limit is split evenly across the tracker's shards. The TTL evicts receipts that haven't been added or looked
+    up for that many seconds."""
+
+    max_entries: int | None = Field(default=None, gt=0)
+    max_bytes: int | None = Field(default=None, gt=0)
+    ttl: float | None = Field(default=None, gt=0)
+
+
+class ReceiptShard:
+    """One lock-striped partition of the receipts held by the tracker, keyed by the 16 byte form of their IDs.
+
+    In eager mode a receipt is only its points in receipt_id_to_eager_points, plus the offset of its payload in the
+    storage backend if there is one. The receipts and eager points are plain dicts unless there's a capacity policy,
+    when they're OrderedDicts kept in least recently used order, with the least recently used first, as an OrderedDict
+    roughly doubles the memory an eager entry takes."""
+
+    __slots__ = (
+        "lock",
+        "receipt_id_to_data",
+        "receipt_id_to_points",
+        "receipt_id_to_eager_points",
+        "receipt_id_to_payload_offset",
+        "key_to_access_time",
+        "bytes_used",
+        "hits",
+        "misses",
+        "evictions",
+    )
+
+    def __init__(self: Self):
+        # Re-entrant so a points calculation holding the lock can look the receipt up through _get_receipt.
+        self.lock = threading.RLock()
+        self.receipt_id_to_data: dict[bytes, CompactReceipt] = {}
+        self.receipt_id_to_points: dict[bytes, int] = {}
+        self.receipt_id_to_eager_points: dict[bytes, int] = {}
+        self.receipt_id_to_payload_offset: dict[bytes, int] = {}
+        # Only filled in when there's a TTL.
+        self.key_to_access_time: dict[bytes, float] = {}
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
 
 class ReceiptTracker:
-    """Singleton class to track receipts by ID."""
+    """Thread-safe singleton class to track receipts by ID.
 
-    receipt_id_to_data: dict[str, ReceiptData] = {}
-    receipt_id_to_points: dict[str, int] = {}
+    Receipts are spread over a fixed number of shards by their ID, each with its own lock, so concurrent requests
+    only contend when they touch the same shard rather than all waiting on one global lock."""
+
+    NUM_SHARDS = 16
+    eager_points: bool = False
+    storage: ReceiptStorageBackend | None = None
+    capacity: CapacityPolicy | None = None
+    spill: SqliteSpillStore | None = None
+    rules_version: str = DEFAULT_RULES_VERSION
+    dedup: DedupIndex | None = None
+    stats: ReceiptStatsIndex | None = None
+    shared: SharedReceiptStore | None = None
+    snapshot: ReceiptSnapshot | None = None
+    _shards: list[ReceiptShard]
     _instance = None
+    _instance_lock = threading.Lock()
 
     def __new__(cls: "ReceiptTracker") -> "ReceiptTracker":
-        if cls._instance is None:
-            cls._instance = super(ReceiptTracker, cls).__new__(cls)
+        with cls._instance_lock:
+            if cls._instance is None:
+                instance = super(ReceiptTracker, cls).__new__(cls)
+                instance._shards = [ReceiptShard() for _ in range(cls.NUM_SHARDS)]
+                # Batches of receipts being stored, by number, with their ID bytes and the storage offset before they
+                # were appended, so a snapshot knows which receipts it may have caught half stored.
+                instance._writes_lock = threading.Lock()
+                instance._writes_in_flight: dict[int, tuple[list[bytes], int | None]] = {}
+                instance._write_number = 0
+                # The IDs of receipts stored while a snapshot is copying the shards, which it leaves out.
+                instance._snapshot_skipped_ids: set[bytes] | None = None
+                instance._snapshot_lock = threading.Lock()
+                cls._instance = instance
         return cls._instance
 
-    def add_receipt(self, receipt_data: dict) -> str:
-        """Adds a receipt to the tracker."""
-        receipt_id = str(uuid.uuid4())
-        self.receipt_id_to_data[receipt_id] = receipt_data
-        logger.info(f"Added receipt with ID: {receipt_id}")
-        logger.debug(f"Current receipt records: {self.receipt_id_to_data}")
+    def configure(
+        self,
+        eager_points: bool = False,
+        storage: ReceiptStorageBackend | None = None,
+        capacity: CapacityPolicy | None = None,
+        spill: SqliteSpillStore | None = None,
+        rules_version: str = DEFAULT_RULES_VERSION,
+        dedup: DedupIndex | None = None,
+        stats: ReceiptStatsIndex | None = None,
+        shared: SharedReceiptStore | None = None,
+        snapshot: ReceiptSnapshot | None = None,
+    ) -> None:
+        """Configures how the tracker stores and scores receipts.
+
+        With eager_points set, points are calculated when a receipt is added and only the points are kept rather than
+        the full receipt, so getting the points is a pure lookup.
+
+        With a storage backend, every receipt added is persisted to it before its ID is handed out, and switching to a
+        new backend loads the receipts already stored in it.
+
+        With a capacity policy, the least recently used receipts are evicted from memory once a limit is reached and
+        spilled to the spill store, which getting the points falls back to for receipts that aren't in memory.
+
+        Receipts added are scored with the points rules of rules_version, including when they're scored later on.
+
+        With a dedup index, a receipt submitted again, or with an Idempotency-Key seen before, gets the ID it was
+        given the first time rather than being stored again.
+
+        With a stats index, running totals of the receipts are kept up to date as they're added, including the ones
+        loaded from storage, which means every receipt is scored when it's added even without eager_points.
+
+        With a shared store, every receipt added is also written to it before its ID is handed out, and getting the
+        points falls back to it for receipts that aren't in this process, so worker processes sharing the store all
+        see each other's receipts.
+
+        With a snapshot written by write_snapshot, the tracker is restored from it: getting the points falls back to
+        the snapshot for receipts that aren't in memory, reading them from the mapped file, and its stats are added to
+        the stats index. A storage backend set at the same time only has the receipts stored after the snapshot was
+        taken loaded from it."""
+        get_rule_set(rules_version)
+        self.rules_version = rules_version
+        self.dedup = dedup
+        self.stats = stats
+        self.eager_points = eager_points
+        if shared is not self.shared:
+            if self.shared is not None:
+                self.shared.close()
+            self.shared = shared
+        if spill is not self.spill:
+            if self.spill is not None:
+                self.spill.close()
+            self.spill = spill
+        if capacity != self.capacity:
+            self._apply_capacity(capacity)
+        if snapshot is not self.snapshot:
+            if self.snapshot is not None:
+                self.snapshot.close()
+            self.snapshot = snapshot
+            if snapshot is not None:
+                self._restore_snapshot()
+        if storage is not self.storage:
+            if self.storage is not None:
+                self.storage.close()
+            self.storage = storage
+            if storage is not None:
+                self._load_from_storage()
+
+    def _apply_capacity(self, capacity: CapacityPolicy | None) -> None:
+        """Switches the shards' receipts to least recently used order if there's now a capacity policy, or back to
+        plain dicts if there isn't.
+
+        Receipts already held are sized and, with a TTL, given the current time as their last access, as neither is
+        tracked without a policy, then evicted if they're over the new limits."""
+        # The policy is only set once the shards are OrderedDicts, and unset before they stop being, as lookups only
+        # reorder the receipts while there's a policy.
+        if capacity is None:
+            self.capacity = None
+        container = dict if capacity is None else OrderedDict
+        for shard in self._shards:
+            with shard.lock:
+                if type(shard.receipt_id_to_data) is not container:
+                    shard.receipt_id_to_data = container(shard.receipt_id_to_data)
+                    shard.receipt_id_to_eager_points = container(shard.receipt_id_to_eager_points)
+                if capacity is None:
+                    shard.key_to_access_time.clear()
+                    shard.bytes_used = 0
+                    continue
+                shard.bytes_used = len(shard.receipt_id_to_eager_points) * EAGER_ENTRY_SIZE + sum(
+                    estimate_compact_size(compact) for compact in shard.receipt_id_to_data.values()
+                )
+                if capacity.ttl is None:
+                    shard.key_to_access_time.clear()
+                else:
+                    now = monotonic()
+                    for key in (*shard.receipt_id_to_data, *shard.receipt_id_to_eager_points):
+                        shard.key_to_access_time.setdefault(key, now)
+        self.capacity = capacity
+        if capacity is not None:
+            for shard in self._shards:
+                with shard.lock:
+                    self._enforce_capacity(shard)
+
+    def _restore_snapshot(self) -> None:
+        """Takes on the string numbering and stats of a newly set snapshot."""
+        # In a fresh process the string table is empty, so the snapshot's numbering can be kept as it is, and the
+        # next snapshot can carry its packed receipts over without renumbering them.
+        RECEIPT_STRINGS.adopt(self.snapshot.strings)
+        if self.snapshot.stats is not None and self._snapshot_stats() is not None:
+            self.stats.load_state(self.snapshot.stats)
+        logger.info("Restored %d receipts from the snapshot %s", len(self.snapshot), self.snapshot.path)
+
+    def _snapshot_stats(self) -> ReceiptStatsIndex | None:
+        """Returns the stats index if its totals are kept in snapshots. Shared stats are kept in the shared store."""
+        return None if isinstance(self.stats, SharedReceiptStatsIndex) else self.stats
+
+    def _load_from_storage(self) -> None:
+        """Rebuilds the shards from the receipts in the storage backend, from where the snapshot left off if there's
+        one."""
+        start = perf_counter()
+        count = 0
+        start_offset = 0
+        if self.snapshot is not None and self.snapshot.log_offset is not None:
+            start_offset = self.snapshot.log_offset
+        for stored in self.storage.replay(start_offset):
+            id_bytes = receipt_id_to_bytes(stored.receipt_id)
+            if self.snapshot is not None and id_bytes in self.snapshot:
+                continue
+            shard = self._shard_for(id_bytes)
+            receipt = None
+            points = stored.points
+            if self.eager_points:
+                if points is None:
+                    receipt = ReceiptData.model_validate_json(stored.payload)
+                    points = receipt.calculate_points()
+                self._insert_eager_points(shard, id_bytes, points, stored.offset)
+            else:
+                receipt = ReceiptData.model_validate_json(stored.payload)
+                self._insert_receipt(shard, id_bytes, receipt)
+                if points is not None:
+                    shard.receipt_id_to_points[id_bytes] = points
+            self._enforce_capacity(shard)
+            # Shared stats outlive the worker processes, and already count every receipt from when it was added.
+            if self.stats is not None and not isinstance(self.stats, SharedReceiptStatsIndex):
+                if receipt is None:
+                    receipt = ReceiptData.model_validate_json(stored.payload)
+                self.stats.record([(receipt, receipt.calculate_points() if points is None else points)])
+            count += 1
+        logger.info("Loaded %d receipts from storage in %.3fs", count, perf_counter() - start)
+
+    def close(self) -> None:
+        """Closes the storage backend, spill store, shared store and snapshot, committing anything still queued for
+        them."""
+        self.configure(
+            eager_points=self.eager_points, rules_version=self.rules_version, dedup=self.dedup, stats=self.stats
+        )
+
+    def clear(self) -> None:
+        """Removes every receipt from the tracker, including any spilled to disk, and resets the cache stats. A
+        snapshot it was restored from is let go of, and replaced on disk by the next snapshot written."""
+        for shard in self._shards:
+            with shard.lock:
+                for compact in shard.receipt_id_to_data.values():
+                    release_compact(compact)
+                shard.receipt_id_to_data.clear()
+                shard.receipt_id_to_points.clear()
+                shard.receipt_id_to_eager_points.clear()
+                shard.receipt_id_to_payload_offset.clear()
+                shard.key_to_access_time.clear()
+                shard.bytes_used = shard.hits = shard.misses = shard.evictions = 0
+        if self.spill is not None:
+            self.spill.clear()
+        if self.dedup is not None:
+            self.dedup.clear()
+        if self.stats is not None:
+            self.stats.clear()
+        if self.shared is not None:
+            self.shared.clear()
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def write_snapshot(self, path: str) -> int:
+        """Writes the receipts held in memory, and those in the snapshot the tracker was restored from, to a snapshot
+        file at path, returning how many receipts it holds.
+
+        Requests carry on being served while it's written. Each shard's lock is only held while its receipts are
+        copied, and receipts stored while the shards are being copied are left out, stats and all, to be loaded from
+        the storage backend on restore. Receipts spilled from memory aren't included."""
+        with self._snapshot_lock:
+            start = perf_counter()
+            with self._writes_lock:
+                in_flight = list(self._writes_in_flight.values())
+                skipped = self._snapshot_skipped_ids = {id_bytes for ids, _ in in_flight for id_bytes in ids}
+                storage_offsets = [offset for _, offset in in_flight if offset is not None]
+                log_offset = min(storage_offsets, default=None if self.storage is None else self.storage.end_offset())
+                stats = self._snapshot_stats()
+                stats_state = None if stats is None else stats.dump_state()
+            # The string table is held until it's copied, so the copied receipts' strings keep their numbers.
+            with RECEIPT_STRINGS.held():
+                try:
+                    copies = []
+                    for shard in self._shards:
+                        with shard.lock:
+                            copies.append(
+                                (
+                                    shard.receipt_id_to_eager_points.copy(),
+                                    shard.receipt_id_to_data.copy(),
+                                    shard.receipt_id_to_points.copy(),
+                                )
+                            )
+                finally:
+                    with self._writes_lock:
+                        self._snapshot_skipped_ids = None
+                strings = RECEIPT_STRINGS.copy()
+
+            snapshot = self.snapshot
+            numbers = None
+            if snapshot is not None and strings[: len(snapshot.strings)] != snapshot.strings:
+                # The receipts packed in memory number their strings differently from the snapshot's, so they're
+                # renumbered into its table, extended with the strings it doesn't have. Its table can name a string
+                # more than once, as free numbers are written as empty strings.
+                string_to_number = {string: number for number, string in enumerate(snapshot.strings)}
+                memory_strings, strings, numbers = strings, list(snapshot.strings), []
+                for string in memory_strings:
+                    if string not in string_to_number:
+                        string_to_number[string] = len(strings)
+                        strings.append(string)
+                    numbers.append(string_to_number[string])
+
+            old_points = {}
+            rows = []
+            for eager_points, data, points in copies:
+                for id_bytes, receipt_points in eager_points.items():
+                    rows.append((id_bytes, receipt_points, RECORD_NONE, b""))
+                for id_bytes, compact in data.items():
+                    if isinstance(compact, ReceiptData):
+                        kind, record = RECORD_JSON, compact.model_dump_json(exclude_none=True).encode()
+                    else:
+                        kind, record = RECORD_PACKED, compact if numbers is None else renumber_packed(compact, numbers)
+                    rows.append((id_bytes, points.get(id_bytes, None), kind, record))
+                # Points calculated for receipts in the old snapshot are cached without the receipts.
+                old_points.update((id_bytes, value) for id_bytes, value in points.items() if id_bytes not in data)
+            new_columns = columns_from_rows(row for row in rows if row[0] not in skipped)
+
+            old_columns = None if snapshot is None else snapshot.columns()
+            if old_columns is not None and old_points:
+                ids = np.array(list(old_points), dtype="S16")
+                positions = old_columns.ids.searchsorted(ids)
+                found = positions < len(old_columns.ids)
+                found[found] = old_columns.ids[positions[found]] == ids[found]
+                points_column = old_columns.points.copy()
+                points_column[positions[found]] = np.array(list(old_points.values()), dtype="<i8")[found]
+                old_columns = old_columns._replace(points=points_column)
+            columns = merge_columns(old_columns, new_columns)
+            write_snapshot_file(path, columns, strings, stats_state, log_offset)
+        logger.info("Wrote a snapshot of %d receipts to %s in %.3fs", len(columns.ids), path, perf_counter() - start)
+        return len(columns.ids)
+
+    def cache_stats(self) -> dict[str, int]:
+        """Returns counters for lookups answered from memory (hits) or the spill store (misses), evictions from memory
+        and reads of the spill store, and how many receipts and estimated bytes are currently held in memory."""
+        stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "spill_reads": 0 if self.spill is None else self.spill.reads,
+            "entries": 0,
+            "bytes": 0,
+        }
+        for shard in self._shards:
+            stats["hits"] += shard.hits
+            stats["misses"] += shard.misses
+            stats["evictions"] += shard.evictions
+            stats["entries"] += len(shard.receipt_id_to_data) + len(shard.receipt_id_to_eager_points)
+            stats["bytes"] += shard.bytes_used
+        return stats
+
+    def _insert_receipt(self, shard: ReceiptShard, id_bytes: bytes, receipt: ReceiptData) -> None:
+        """Adds a whole receipt to a shard, packed. Must hold the shard's lock."""
+        compact = compact_receipt(receipt)
+        replaced = shard.receipt_id_to_data.get(id_bytes, None)
+        shard.receipt_id_to_data[id_bytes] = compact
+        if replaced is not None:
+            release_compact(replaced)
+        if self.capacity is not None:
+            if replaced is not None:
+                shard.bytes_used -= estimate_compact_size(replaced)
+            shard.bytes_used += estimate_compact_size(compact)
+            if self.capacity.ttl is not None:
+                shard.key_to_access_time[id_bytes] = monotonic()
+
+    def _insert_eager_points(
+        self, shard: ReceiptShard, id_bytes: bytes, points: int, payload_offset: int | None = None
+    ) -> None:
+        """Adds a receipt's eager points to a shard, with the offset of its payload in storage. Must hold the shard's
+        lock."""
+        shard.receipt_id_to_eager_points[id_bytes] = points
+        if payload_offset is not None:
+            shard.receipt_id_to_payload_offset[id_bytes] = payload_offset
+        if self.capacity is not None:
+            shard.bytes_used += EAGER_ENTRY_SIZE
+            if self.capacity.ttl is not None:
+                shard.key_to_access_time[id_bytes] = monotonic()
+
+    def _touch(self, shard: ReceiptShard, entries: dict, key: bytes) -> None:
+        """Marks a receipt in a shard as the most recently used. Must hold the shard's lock."""
+        shard.hits += 1
+        if self.capacity is not None and key in entries:
+            entries.move_to_end(key)
+            if self.capacity.ttl is not None:
+                shard.key_to_access_time[key] = monotonic()
+
+    def _enforce_capacity(self, shard: ReceiptShard) -> None:
+        """Evicts the least recently used receipts from a shard until it's within the capacity policy, spilling them
+        to the spill store. Must hold the shard's lock."""
+        if self.capacity is None:
+            return
+        entries = shard.receipt_id_to_eager_points if self.eager_points else shard.receipt_id_to_data
+        max_entries = max_bytes = None
+        if self.capacity.max_entries is not None:
+            max_entries = max(1, self.capacity.max_entries // self.NUM_SHARDS)
+        if self.capacity.max_bytes is not None:
+            max_bytes = self.capacity.max_bytes // self.NUM_SHARDS
+        expired_before = None if self.capacity.ttl is None else monotonic() - self.capacity.ttl
+
+        spilled = []
+        while entries:
+            key = next(iter(entries))
+            if not (
+                (max_entries is not None and len(entries) > max_entries)
+                or (max_bytes is not None and shard.bytes_used > max_bytes)
+                or (expired_before is not None and shard.key_to_access_time[key] < expired_before)
+            ):
+                break
+            value = entries.pop(key)
+            shard.key_to_access_time.pop(key, None)
+            shard.evictions += 1
+            if self.eager_points:
+                shard.bytes_used -= EAGER_ENTRY_SIZE
+                shard.receipt_id_to_payload_offset.pop(key, None)
+                spilled.append((key, value, None))
+            else:
+                shard.bytes_used -= estimate_compact_size(value)
+                points = shard.receipt_id_to_points.pop(key, None)
+                payload = expand_receipt(value).model_dump_json(exclude_none=True).encode()
+                release_compact(value)
+                spilled.append((key, points, payload))
+        if spilled and self.spill is not None:
+            self.spill.put_many(spilled)
+
+    def _shard_for(self, id_bytes: bytes) -> ReceiptShard:
+        """Returns the shard that holds the receipt with the given ID bytes."""
+        return self._shards[hash(id_bytes) % self.NUM_SHARDS]
+
+    @property
+    def receipt_id_to_data(self) -> dict[str, ReceiptData]:
+        """A snapshot of every receipt held across the shards, rebuilt as models, by ID."""
+        receipts = {}
+        for shard in self._shards:
+            # Expanded under the lock, as a removed receipt's string numbers can be handed out again.
+            with shard.lock:
+                receipts.update(
+                    (receipt_id_from_bytes(k), expand_receipt(v)) for k, v in shard.receipt_id_to_data.items()
+                )
+        return receipts
+
+    @property
+    def receipt_id_to_points(self) -> dict[str, int]:
+        """A snapshot of every calculated points value held across the shards, by ID."""
+        return {
+            receipt_id_from_bytes(k): v for shard in self._shards for k, v in shard.receipt_id_to_points.copy().items()
+        }
+
+    @property
+    def receipt_id_to_eager_points(self) -> dict[str, int]:
+        """A snapshot of every eager points value held across the shards, by ID."""
+        return {
+            receipt_id_from_bytes(k): v
+            for shard in self._shards
+            for k, v in shard.receipt_id_to_eager_points.copy().items()
+        }
+
+    @property
+    def receipt_id_to_payload_offset(self) -> dict[str, int]:
+        """A snapshot of the storage offset of every eager receipt's payload held across the shards, by ID."""
+        return {
+            receipt_id_from_bytes(k): v
+            for shard in self._shards
+            for k, v in shard.receipt_id_to_payload_offset.copy().items()
+        }
+
+    @staticmethod
+    def new_receipt_id() -> str:
+        """Generates a new time-ordered receipt ID."""
+        return receipt_id_from_bytes(generate_receipt_id())
+
+    def add_receipt(self, receipt_data: ReceiptData, idempotency_key: str | None = None) -> str:
+        """Adds a receipt to the tracker, or returns the ID it already has if it's a duplicate."""
+        receipt_id = self.new_receipt_id()
+        if self.dedup is not None:
+            key = self.dedup.key_for(receipt_data, idempotency_key)
+            existing_id = self.dedup.claim(key, receipt_id)
+            if existing_id is not None:
+                logger.info("Receipt is a duplicate of ID: %s", existing_id)
+                return existing_id
+            self._store_claimed([(receipt_id, receipt_data)], [key])
+        else:
+            self._store([(receipt_id, receipt_data)])
+        logger.info("Added receipt with ID: %s", receipt_id)
         return receipt_id
 
+    def add_receipts(self, receipts: list[ReceiptData], receipt_ids: list[str] | None = None) -> list[str]:
+        """Adds many receipts to the tracker at once, taking each shard's lock once for all of its new receipts.
+
+        The receipts are given new IDs, or the IDs they already have if they're duplicates, unless IDs reserved with
+        new_receipt_id are passed in, in which case the caller has already checked for duplicates."""
+        if receipt_ids is not None:
+            self._store(list(zip(receipt_ids, receipts)))
+        elif self.dedup is None:
+            receipt_ids = [self.new_receipt_id() for _ in receipts]
+            self._store(list(zip(receipt_ids, receipts)))
+        else:
+            receipt_ids = []
+            entries = []
+            keys = []
+            for receipt in receipts:
+                receipt_id = self.new_receipt_id()
+                key = self.dedup.key_for(receipt)
+                existing_id = self.dedup.claim(key, receipt_id)
+                if existing_id is None:
+                    entries.append((receipt_id, receipt))
+                    keys.append(key)
+                receipt_ids.append(existing_id or receipt_id)
+            self._store_claimed(entries, keys)
+        logger.info("Added batch of %d receipts", len(receipt_ids))
+        return receipt_ids
+
+    def _store_claimed(self, entries: list[tuple[str, ReceiptData]], keys: list[bytes]) -> None:
+        """Stores new receipts whose dedup keys were just claimed, releasing the keys if they can't be stored, then
+        settles the keys."""
+        try:
+            self._store(entries)
+        except Exception:
+            for (receipt_id, _), key in zip(entries, keys):
+                self.dedup.release(key, receipt_id)
+            raise
+        finally:
+            for (receipt_id, _), key in zip(entries, keys):
+                self.dedup.settle(key, receipt_id)
+
+    def _store(self, entries: list[tuple[str, ReceiptData]]) -> None:
+        """Records the rules version new receipts are scored with, persists them to the storage backend, if there is
+        one, then adds them to their shards and records them in the stats."""
+        start = perf_counter()
+        # Receipts without a version are scored with the default rules, so only other versions need recording. The
+        # receipt is copied rather than changed in place under the caller.
+        if self.rules_version != DEFAULT_RULES_VERSION:
+            stamp = {"rules_version": self.rules_version}
+            entries = [
+                (receipt_id, receipt if receipt.rules_version else receipt.model_copy(update=stamp))
+                for receipt_id, receipt in entries
+            ]
+        if self.eager_points or self.stats is not None:
+            all_points = [receipt.calculate_points() for _, receipt in entries]
+        else:
+            all_points = [None] * len(entries)
+        ids = [receipt_id_to_bytes(receipt_id) for receipt_id, _ in entries]
+        write_number = self._begin_write(ids)
+        try:
+            self._write(entries, ids, all_points)
+        except BaseException:
+            self._end_write(write_number)
+            raise
+        stats_receipts = None
+        if self.stats is not None:
+            stats_receipts = [(receipt, points) for (_, receipt), points in zip(entries, all_points)]
+        self._end_write(write_number, stats_receipts)
+        STAGE_SECONDS.observe(perf_counter() - start, "store")
+
+    def _write(self, entries: list[tuple[str, ReceiptData]], ids: list[bytes], all_points: list[int | None]) -> None:
+        """Persists receipts to the storage backend and shared store, if there are any, then adds them to their
+        shards."""
+        if self.storage is not None or self.shared is not None:
+            payloads = [receipt.model_dump_json(exclude_none=True).encode() for _, receipt in entries]
+        if self.storage is not None:
+            # Only eager points are persisted, so a lazily scoring tracker's log reads back the same with stats on.
+            stored_points = all_points if self.eager_points else [None] * len(entries)
+            offsets = self.storage.append(
+                [
+                    (receipt_id, points, payload)
+                    for (receipt_id, _), points, payload in zip(entries, stored_points, payloads)
+                ]
+            )
+        else:
+            offsets = [None] * len(entries)
+        if self.shared is not None:
+            self.shared.put_many(
+                [
+                    (id_bytes, points, payload)
+                    for id_bytes, points, payload in zip(ids, all_points, payloads)
+                ]
+            )
+
+        shard_to_entries: dict[int, list[tuple[bytes, ReceiptData, int | None, int | None]]] = {}
+        for id_bytes, (_, receipt), points, offset in zip(ids, entries, all_points, offsets):
+            shard_index = hash(id_bytes) % self.NUM_SHARDS
+            shard_to_entries.setdefault(shard_index, []).append((id_bytes, receipt, points, offset))
+        for shard_index, shard_entries in shard_to_entries.items():
+            shard = self._shards[shard_index]
+            with shard.lock:
+                for id_bytes, receipt, points, offset in shard_entries:
+                    if self.eager_points:
+                        self._insert_eager_points(shard, id_bytes, points, offset)
+                    else:
+                        self._insert_receipt(shard, id_bytes, receipt)
+                        # Points already calculated for the stats are kept rather than calculated again when looked up.
+                        if points is not None:
+                            shard.receipt_id_to_points[id_bytes] = points
+                self._enforce_capacity(shard)
+
+    def _begin_write(self, ids: list[bytes]) -> int:
+        """Registers a batch of receipts as being stored, returning its number for _end_write."""
+        with self._writes_lock:
+            self._write_number += 1
+            storage_offset = None if self.storage is None else self.storage.end_offset()
+            self._writes_in_flight[self._write_number] = (ids, storage_offset)
+            if self._snapshot_skipped_ids is not None:
+                self._snapshot_skipped_ids.update(ids)
+            return self._write_number
+
+    def _end_write(self, write_number: int, stats_receipts: list[tuple[ReceiptData, int]] | None = None) -> None:
+        """Deregisters a batch of receipts once it's been stored, or failed to be, recording the given receipts and
+        their points in the stats.
+
+        Stats kept in snapshots are recorded under the same lock as the batch is deregistered with, so the totals a
+        snapshot takes are of exactly the receipts that aren't in flight."""
+        stats = None if not stats_receipts else self.stats
+        if isinstance(stats, SharedReceiptStatsIndex):
+            # Kept in the shared store rather than in snapshots, so other batches needn't wait on it.
+            stats.record(stats_receipts)
+            stats = None
+        with self._writes_lock:
+            if stats is not None:
+                stats.record(stats_receipts)
+            del self._writes_in_flight[write_number]
+
+    @staticmethod
+    def _lookup_bytes(receipt_id: str) -> bytes:
+        """Returns the bytes to look a receipt up by, raising NoReceiptFoundException if its ID isn't a UUID, as no
+        receipt is ever given one."""
+        try:
+            return receipt_id_to_bytes(receipt_id)
+        except ValueError:
+            raise NoReceiptFoundException(receipt_id) from None
+
     def _get_receipt(self, receipt_id: str) -> ReceiptData:
-        """Retrieves a receipt from the tracker."""
-        receipt = self.receipt_id_to_data.get(receipt_id, None)
+        """Retrieves a receipt from the tracker, falling back to the spill store if it was evicted from memory."""
+        id_bytes = self._lookup_bytes(receipt_id)
+        shard = self._shard_for(id_bytes)
+        with shard.lock:
+            compact = shard.receipt_id_to_data.get(id_bytes, None)
+            receipt = None if compact is None else expand_receipt(compact)
+        if receipt is None and self.spill is not None:
+            spilled = self.spill.get(id_bytes)
+            if spilled is not None and spilled[1] is not None:
+                receipt = ReceiptData.model_validate_json(spilled[1])
+        if receipt is None and self.snapshot is not None:
+            entry = self.snapshot.get(id_bytes)
+            if entry is not None and entry.kind != RECORD_NONE:
+                receipt = self._expand_snapshot_entry(entry)
+        if receipt is None and self.shared is not None:
+            shared = self.shared.get(id_bytes)
+            if shared is not None:
+                receipt = ReceiptData.model_validate_json(shared[1])
         if receipt is None:
-            logger.debug(
-                f"Receipt not found for ID: {receipt_id}, current records: {list(self.receipt_id_to_data.keys())}"
-            )
+            logger.debug("Receipt not found for ID: %s", receipt_id)
             raise NoReceiptFoundException(receipt_id)
         return receipt
 
+    def _get_spilled_points(self, shard: ReceiptShard, id_bytes: bytes) -> int | None:
+        """Returns the points for a receipt that was spilled to disk, calculating and recording them if they hadn't
+        been yet, or None if the receipt was never spilled. Must hold the shard's lock."""
+        if self.spill is None:
+            return None
+        spilled = self.spill.get(id_bytes)
+        if spilled is None:
+            return None
+        shard.misses += 1
+        points, payload = spilled
+        if points is None:
+            points = ReceiptData.model_validate_json(payload).calculate_points()
+            self.spill.set_points(id_bytes, points)
+        return points
+
+    def _expand_snapshot_entry(self, entry: SnapshotEntry) -> ReceiptData:
+        """Rebuilds the receipt model from its record in the snapshot."""
+        if entry.kind == RECORD_PACKED:
+            return ReceiptData.from_packed(entry.record, self.snapshot.strings)
+        return ReceiptData.model_validate_json(entry.record)
+
+    def _get_snapshot_points(self, shard: ReceiptShard, id_bytes: bytes) -> int | None:
+        """Returns the points for a receipt in the snapshot the tracker was restored from, calculating and caching
+        them in the shard if they hadn't been yet, or None if it isn't in the snapshot. Must hold the shard's lock."""
+        if self.snapshot is None:
+            return None
+        points = shard.receipt_id_to_points.get(id_bytes, None)
+        if points is not None:
+            return points
+        entry = self.snapshot.get(id_bytes)
+        if entry is None:
+            return None
+        points = entry.points
+        if points is None:
+            points = self._expand_snapshot_entry(entry).calculate_points()
+            shard.receipt_id_to_points[id_bytes] = points
+        return points
+
+    def _get_shared_points(self, ids: list[bytes]) -> dict[bytes, int]:
+        """Returns the points of the receipts with the given ID bytes that are in the shared store, read in one
+        pipeline, calculating and recording the ones whose points hadn't been calculated yet."""
+        found = {}
+        calculated = []
+        for id_bytes, shared in zip(ids, self.shared.get_many(ids)):
+            if shared is None:
+                continue
+            points, payload = shared
+            if points is None:
+                points = ReceiptData.model_validate_json(payload).calculate_points()
+                calculated.append((id_bytes, points))
+            found[id_bytes] = points
+        if calculated:
+            self.shared.set_points_many(calculated)
+        return found
+
     def get_points_for_receipt(self, receipt_id: str) -> int:
         """Returns the points awarded for a receipt."""
-        # First check if we've calculated the points before to save time.
-        if receipt_id in self.receipt_id_to_points:
-            return self.receipt_id_to_points[receipt_id]
-        receipt = self._get_receipt(receipt_id)
-        points = receipt.calculate_points()
-        self.receipt_id_to_points[receipt_id] = points
-        logger.info(f"Calculated points: {points} for receipt ID: {receipt_id}")
+        id_bytes = self._lookup_bytes(receipt_id)
+        shard = self._shard_for(id_bytes)
+        if self.eager_points:
+            with shard.lock:
+                points = shard.receipt_id_to_eager_points.get(id_bytes, None)
+                if points is not None:
+                    self._touch(shard, shard.receipt_id_to_eager_points, id_bytes)
+                    POINTS_LOOKUPS.inc("hit")
+                    return points
+                points = self._get_spilled_points(shard, id_bytes)
+                lookup = "spilled"
+                if points is None:
+                    points = self._get_snapshot_points(shard, id_bytes)
+                    lookup = "snapshot"
+            if points is not None:
+                POINTS_LOOKUPS.inc(lookup)
+                return points
+            if self.shared is not None:
+                points = self._get_shared_points([id_bytes]).get(id_bytes, None)
+                if points is not None:
+                    POINTS_LOOKUPS.inc("shared")
+                    return points
+            POINTS_LOOKUPS.inc("not_found")
+            raise NoReceiptFoundException(receipt_id)
+        # First check if we've calculated the points before to save time. Without a capacity policy there's no
+        # recency to update, and single dict reads are atomic, so cache hits don't need to take the lock.
+        if self.capacity is None:
+            points = shard.receipt_id_to_points.get(id_bytes, None)
+            if points is not None:
+                shard.hits += 1
+                POINTS_LOOKUPS.inc("hit")
+                return points
+        with shard.lock:
+            # Check again under the lock in case another thread calculated the points while we were waiting.
+            points = shard.receipt_id_to_points.get(id_bytes, None)
+            if points is not None:
+                self._touch(shard, shard.receipt_id_to_data, id_bytes)
+                POINTS_LOOKUPS.inc("hit")
+                return points
+            if id_bytes not in shard.receipt_id_to_data:
+                points = self._get_spilled_points(shard, id_bytes)
+                if points is not None:
+                    POINTS_LOOKUPS.inc("spilled")
+                    return points
+                points = self._get_snapshot_points(shard, id_bytes)
+                if points is not None:
+                    POINTS_LOOKUPS.inc("snapshot")
+                    return points
+                if self.shared is not None:
+                    points = self._get_shared_points([id_bytes]).get(id_bytes, None)
+                    if points is not None:
+                        POINTS_LOOKUPS.inc("shared")
+                        return points
+            try:
+                receipt = self._get_receipt(receipt_id)
+            except NoReceiptFoundException:
+                POINTS_LOOKUPS.inc("not_found")
+                raise
+            POINTS_LOOKUPS.inc("calculated")
+            points = receipt.calculate_points()
+            shard.receipt_id_to_points[id_bytes] = points
+            self._touch(shard, shard.receipt_id_to_data, id_bytes)
+        logger.info("Calculated points: %d for receipt ID: %s", points, receipt_id)
         return points
+
+    def get_points_for_receipts(self, receipt_ids: list[str]) -> tuple[dict[str, int], list[str]]:
+        """Returns the points awarded for many receipts, along with the IDs that no receipt was found for."""
+        points = {}
+        not_found = []
+        unique_ids = list(dict.fromkeys(receipt_ids))
+        shared_points = {}
+        if self.shared is not None:
+            # Receipts other workers added are read from the shared store in one pipeline rather than one at a time.
+            elsewhere = {}
+            for receipt_id in unique_ids:
+                try:
+                    id_bytes = receipt_id_to_bytes(receipt_id)
+                except ValueError:
+                    continue
+                shard = self._shard_for(id_bytes)
+                if (
+                    id_bytes not in shard.receipt_id_to_data
+                    and id_bytes not in shard.receipt_id_to_eager_points
+                    and (self.snapshot is None or id_bytes not in self.snapshot)
+                ):
+                    elsewhere[receipt_id] = id_bytes
+            if elsewhere:
+                shared_points = self._get_shared_points(list(elsewhere.values()))
+        for receipt_id in unique_ids:
+            if shared_points:
+                found = shared_points.get(elsewhere.get(receipt_id, None), None)
+                if found is not None:
+                    POINTS_LOOKUPS.inc("shared")
+                    points[receipt_id] = found
+                    continue
+            try:
+                points[receipt_id] = self.get_points_for_receipt(receipt_id)
+            except NoReceiptFoundException:
+                not_found.append(receipt_id)
+        return points, not_found
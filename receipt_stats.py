@@ -0,0 +1,189 @@
+"""Defines the secondary indexes the receipt tracker keeps of running totals over the receipts it stores."""
+
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+from decimal import Decimal
+import logging
+import threading
+from typing import TYPE_CHECKING, Iterable, Self
+
+if TYPE_CHECKING:
+    from receipt_service import ReceiptData
+
+logger = logging.getLogger(__name__)
+
+
+class ReceiptAggregate:
+    """Running totals of a group of receipts: how many there are, their total spend in cents and the points awarded."""
+
+    __slots__ = ("count", "total_cents", "points")
+
+    def __init__(self: Self, count: int = 0, total_cents: int = 0, points: int = 0):
+        self.count = count
+        self.total_cents = total_cents
+        self.points = points
+
+    def add(self: Self, total_cents: int, points: int) -> None:
+        """Adds a receipt to the totals."""
+        self.count += 1
+        self.total_cents += total_cents
+        self.points += points
+
+    def copy(self: Self) -> "ReceiptAggregate":
+        return ReceiptAggregate(self.count, self.total_cents, self.points)
+
+    def to_dict(self: Self) -> dict[str, int | Decimal]:
+        """Returns the totals with the spend in dollars."""
+        return {"count": self.count, "total": Decimal(self.total_cents).scaleb(-2), "points": self.points}
+
+    def __eq__(self: Self, other: object) -> bool:
+        if not isinstance(other, ReceiptAggregate):
+            return NotImplemented
+        return (self.count, self.total_cents, self.points) == (other.count, other.total_cents, other.points)
+
+    def __repr__(self: Self) -> str:
+        return f"ReceiptAggregate(count={self.count}, total_cents={self.total_cents}, points={self.points})"
+
+
+def _add_to_group(groups: dict[object, ReceiptAggregate], key: object, total_cents: int, points: int) -> bool:
+    """Adds a receipt to the totals of its group, returning whether it's the group's first."""
+    aggregate = groups.get(key, None)
+    is_new = aggregate is None
+    if is_new:
+        aggregate = groups[key] = ReceiptAggregate()
+    aggregate.add(total_cents, points)
+    return is_new
+
+
+class ReceiptStatsIndex:
+    """Running totals of the receipts stored, overall and grouped by retailer, purchase date, hour of purchase and
+    points band, updated as each receipt is added so queries never scan the receipts themselves.
+
+    A query costs the same however many receipts are stored: a date range sums the totals of the days in it that have
+    receipts, found by bisecting a sorted list of those days, and every other query reads its groups directly. Points
+    bands are points_band_width wide, e.g. 0-24, 25-49 and so on for the default of 25."""
+
+    def __init__(self: Self, points_band_width: int = 25):
+        self.points_band_width = points_band_width
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self: Self) -> None:
+        self._totals = ReceiptAggregate()
+        self._by_retailer: dict[str, ReceiptAggregate] = {}
+        self._by_date: dict[int, ReceiptAggregate] = {}
+        # The date ordinals in _by_date in order, for range queries.
+        self._dates: list[int] = []
+        self._by_hour: dict[int, ReceiptAggregate] = {}
+        self._by_points_band: dict[int, ReceiptAggregate] = {}
+
+    def clear(self: Self) -> None:
+        """Resets every total."""
+        with self._lock:
+            self._clear()
+
+    def record(self: Self, receipts: Iterable[tuple["ReceiptData", int]]) -> None:
+        """Adds receipts, each with the points it was awarded, to the totals."""
+        with self._lock:
+            for receipt, points in receipts:
+                total_cents = receipt.total_cents
+                self._totals.add(total_cents, points)
+                _add_to_group(self._by_retailer, receipt.retailer, total_cents, points)
+                ordinal = receipt.purchaseDate.toordinal()
+                if _add_to_group(self._by_date, ordinal, total_cents, points):
+                    insort(self._dates, ordinal)
+                _add_to_group(self._by_hour, receipt.purchaseTime.hour, total_cents, points)
+                _add_to_group(self._by_points_band, points // self.points_band_width, total_cents, points)
+
+    def dump_state(self: Self) -> dict:
+        """Returns every total as JSON-serializable lists of count, total in cents and points, keyed by group."""
+        with self._lock:
+            groups = {
+                "retailer": self._by_retailer,
+                "date": self._by_date,
+                "hour": self._by_hour,
+                "band": self._by_points_band,
+            }
+            return {
+                "points_band_width": self.points_band_width,
+                "totals": [self._totals.count, self._totals.total_cents, self._totals.points],
+                **{
+                    group: [
+                        [key, aggregate.count, aggregate.total_cents, aggregate.points]
+                        for key, aggregate in totals.items()
+                    ]
+                    for group, totals in groups.items()
+                },
+            }
+
+    def load_state(self: Self, state: dict) -> None:
+        """Adds totals returned by dump_state to these. Band totals are skipped if the bands were a different width."""
+        with self._lock:
+            self._totals.count += state["totals"][0]
+            self._totals.total_cents += state["totals"][1]
+            self._totals.points += state["totals"][2]
+            groups = [("retailer", self._by_retailer), ("date", self._by_date), ("hour", self._by_hour)]
+            if state["points_band_width"] == self.points_band_width:
+                groups.append(("band", self._by_points_band))
+            else:
+                logger.warning(
+                    "Skipping points band totals %d points wide, as the bands are now %d points wide",
+                    state["points_band_width"],
+                    self.points_band_width,
+                )
+            for group, totals in groups:
+                for key, count, total_cents, points in state[group]:
+                    aggregate = totals.get(key, None)
+                    if aggregate is None:
+                        aggregate = totals[key] = ReceiptAggregate()
+                        if group == "date":
+                            insort(self._dates, key)
+                    aggregate.count += count
+                    aggregate.total_cents += total_cents
+                    aggregate.points += points
+
+    def totals(self: Self) -> ReceiptAggregate:
+        """Returns the totals of every receipt."""
+        with self._lock:
+            return self._totals.copy()
+
+    def by_retailer(self: Self, retailer: str | None = None) -> dict[str, ReceiptAggregate]:
+        """Returns the totals of each retailer's receipts, or only of the given retailer's if it has any."""
+        with self._lock:
+            if retailer is not None:
+                aggregate = self._by_retailer.get(retailer, None)
+                return {} if aggregate is None else {retailer: aggregate.copy()}
+            return {name: aggregate.copy() for name, aggregate in self._by_retailer.items()}
+
+    def by_date_range(self: Self, start: date | None = None, end: date | None = None) -> ReceiptAggregate:
+        """Returns the totals of the receipts purchased between the start and end dates inclusive, either of which can
+        be left open."""
+        result = ReceiptAggregate()
+        with self._lock:
+            low = 0 if start is None else bisect_left(self._dates, start.toordinal())
+            high = len(self._dates) if end is None else bisect_right(self._dates, end.toordinal())
+            for ordinal in self._dates[low:high]:
+                aggregate = self._by_date[ordinal]
+                result.count += aggregate.count
+                result.total_cents += aggregate.total_cents
+                result.points += aggregate.points
+        return result
+
+    def by_date(self: Self) -> dict[date, ReceiptAggregate]:
+        """Returns the totals of the receipts purchased on each date that has any, in order."""
+        with self._lock:
+            return {date.fromordinal(ordinal): self._by_date[ordinal].copy() for ordinal in self._dates}
+
+    def by_hour(self: Self) -> dict[int, ReceiptAggregate]:
+        """Returns the totals of the receipts purchased in each hour of the day that has any."""
+        with self._lock:
+            return {hour: self._by_hour[hour].copy() for hour in sorted(self._by_hour)}
+
+    def by_points_band(self: Self) -> list[tuple[int, int, ReceiptAggregate]]:
+        """Returns the lowest and highest points of each band that has receipts, in order, with their totals."""
+        width = self.points_band_width
+        with self._lock:
+            return [
+                (band * width, (band + 1) * width - 1, self._by_points_band[band].copy())
+                for band in sorted(self._by_points_band)
+            ]
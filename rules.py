@@ -0,0 +1,287 @@
+"""Defines the points rules as data, and compiles each versioned set of them into a single scoring function."""
+
+from dataclasses import dataclass
+from datetime import date, time
+from decimal import Decimal
+from fractions import Fraction
+import json
+from typing import TYPE_CHECKING, Annotated, Callable, Literal, Self, Union
+
+from pydantic import BaseModel, Field, TypeAdapter
+
+from exceptions import UnknownRulesVersionException
+
+if TYPE_CHECKING:
+    from receipt_service import ReceiptData
+
+
+class _Constants:
+    """Collects the constants a compiled rule set refers to, handing back the name each is bound to.
+
+    Values are never pasted into the generated source, only the names they're bound to in its namespace."""
+
+    def __init__(self: Self):
+        self.namespace: dict[str, object] = {}
+
+    def __call__(self: Self, value: object) -> str:
+        name = f"_c{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+
+def _ceil_fraction_of_cents(cents_expression: str, fraction: Fraction, constant: _Constants) -> str:
+    """Returns an expression for the dollar amount in cents times a fraction, rounded up to a whole point."""
+    return f"-(-{cents_expression} * {constant(fraction.numerator)} // {constant(fraction.denominator * 100)})"
+
+
+class RetailerAlphanumericRule(BaseModel):
+    """Points for every alphanumeric character in the retailer name."""
+
+    kind: Literal["retailer_alphanumeric"] = "retailer_alphanumeric"
+    name: str
+    points: int = 1
+
+    def expression(self: Self, constant: _Constants) -> str:
+        return f"{constant(self.points)} * sum(char.isalnum() for char in retailer)"
+
+
+class RoundDollarTotalRule(BaseModel):
+    """Points if the total is a round dollar amount with no cents."""
+
+    kind: Literal["round_dollar_total"] = "round_dollar_total"
+    name: str
+    points: int
+
+    def expression(self: Self, constant: _Constants) -> str:
+        return f"({constant(self.points)} if total_cents % 100 == 0 else 0)"
+
+
+class TotalMultipleRule(BaseModel):
+    """Points if the total is a multiple of an amount, e.g. 0.25."""
+
+    kind: Literal["total_multiple"] = "total_multiple"
+    name: str
+    multiple: Decimal = Field(gt=0, decimal_places=2)
+    points: int
+
+    def expression(self: Self, constant: _Constants) -> str:
+        return f"({constant(self.points)} if total_cents % {constant(int(self.multiple * 100))} == 0 else 0)"
+
+
+class ItemGroupRule(BaseModel):
+    """Points for every group of a number of items on the receipt, e.g. every two items."""
+
+    kind: Literal["item_groups"] = "item_groups"
+    name: str
+    group_size: int = Field(gt=0)
+    points: int
+
+    def expression(self: Self, constant: _Constants) -> str:
+        return f"len(items) // {constant(self.group_size)} * {constant(self.points)}"
+
+
+class ItemDescriptionLengthRule(BaseModel):
+    """Points for each item whose trimmed description length is a multiple of a number: the price times a multiplier,
+    rounded up."""
+
+    kind: Literal["item_description_length"] = "item_description_length"
+    name: str
+    length_multiple: int = Field(gt=0)
+    price_multiplier: Decimal
+
+    def expression(self: Self, constant: _Constants) -> str:
+        item_points = _ceil_fraction_of_cents("item.price_cents", Fraction(self.price_multiplier), constant)
+        length_multiple = constant(self.length_multiple)
+        return (
+            f"sum({item_points} for item in items if len(item.shortDescription.strip()) % {length_multiple} == 0)"
+        )
+
+
+class OddPurchaseDayRule(BaseModel):
+    """Points if the day in the purchase date is odd."""
+
+    kind: Literal["odd_purchase_day"] = "odd_purchase_day"
+    name: str
+    points: int
+
+    def expression(self: Self, constant: _Constants) -> str:
+        return f"({constant(self.points)} if purchase_date.day % 2 == 1 else 0)"
+
+
+class PurchaseTimeWindowRule(BaseModel):
+    """Points if the time of purchase is after the start and before the end, to the minute."""
+
+    kind: Literal["purchase_time_window"] = "purchase_time_window"
+    name: str
+    after: time
+    before: time
+    points: int
+
+    def expression(self: Self, constant: _Constants) -> str:
+        after = constant(self.after.hour * 60 + self.after.minute)
+        before = constant(self.before.hour * 60 + self.before.minute)
+        return (
+            f"({constant(self.points)} if {after} < purchase_time.hour * 60 + purchase_time.minute < {before} else 0)"
+        )
+
+
+class PurchaseDateWindowRule(BaseModel):
+    """Promo points if the purchase date falls between two dates, inclusive, optionally only at one retailer."""
+
+    kind: Literal["purchase_date_window"] = "purchase_date_window"
+    name: str
+    start: date
+    end: date
+    retailer: str | None = None
+    points: int
+
+    def expression(self: Self, constant: _Constants) -> str:
+        condition = f"{constant(self.start)} <= purchase_date <= {constant(self.end)}"
+        if self.retailer is not None:
+            condition += f" and retailer == {constant(self.retailer)}"
+        return f"({constant(self.points)} if {condition} else 0)"
+
+
+class RetailerMultiplierRule(BaseModel):
+    """Promo multiplier on the points from every other rule for receipts from a retailer, rounded up.
+
+    Multipliers are applied after all the other rules, in the order they're listed."""
+
+    kind: Literal["retailer_multiplier"] = "retailer_multiplier"
+    name: str
+    retailer: str
+    multiplier: Decimal = Field(ge=0)
+
+    def multiplied(self: Self, points_expression: str, constant: _Constants) -> str:
+        multiplier = Fraction(self.multiplier)
+        numerator, denominator = constant(multiplier.numerator), constant(multiplier.denominator)
+        return (
+            f"(-(-{points_expression} * {numerator} // {denominator}) if retailer == {constant(self.retailer)} "
+            f"else {points_expression})"
+        )
+
+
+Rule = Annotated[
+    Union[
+        RetailerAlphanumericRule,
+        RoundDollarTotalRule,
+        TotalMultipleRule,
+        ItemGroupRule,
+        ItemDescriptionLengthRule,
+        OddPurchaseDayRule,
+        PurchaseTimeWindowRule,
+        PurchaseDateWindowRule,
+        RetailerMultiplierRule,
+    ],
+    Field(discriminator="kind"),
+]
+
+
+class RuleSet(BaseModel):
+    """A versioned set of points rules. A receipt's points are the sum of the points from each rule."""
+
+    version: str = Field(min_length=1)
+    rules: list[Rule]
+
+
+@dataclass(frozen=True)
+class CompiledRuleSet:
+    """A rule set compiled into functions that score a receipt in one pass, with no per rule calls.
+
+    score returns the total points; breakdown returns the points from each rule by name, for debugging."""
+
+    rule_set: RuleSet
+    score: Callable[["ReceiptData"], int]
+    breakdown: Callable[["ReceiptData"], dict[str, int]]
+    source: str
+
+
+# The receipt fields the generated functions read into locals before evaluating the rules.
+_PROLOGUE = """
+    retailer = receipt.retailer
+    total_cents = receipt.total_cents
+    items = receipt.items
+    purchase_date = receipt.purchaseDate
+    purchase_time = receipt.purchaseTime
+"""
+
+
+def compile_rule_set(rule_set: RuleSet) -> CompiledRuleSet:
+    """Generates and compiles the score and breakdown functions for a rule set."""
+    constant = _Constants()
+    additive = [rule for rule in rule_set.rules if not isinstance(rule, RetailerMultiplierRule)]
+    multipliers = [rule for rule in rule_set.rules if isinstance(rule, RetailerMultiplierRule)]
+    expressions = [rule.expression(constant) for rule in additive]
+
+    score_source = "def score(receipt):" + _PROLOGUE
+    score_source += f"    points = {' + '.join(expressions) or '0'}\n"
+    breakdown_source = "def breakdown(receipt):" + _PROLOGUE + "    points = {}\n"
+    for rule, expression in zip(additive, expressions):
+        breakdown_source += f"    points[{constant(rule.name)}] = {expression}\n"
+    breakdown_source += "    subtotal = sum(points.values())\n"
+    for rule in multipliers:
+        score_source += f"    points = {rule.multiplied('points', constant)}\n"
+        breakdown_source += f"    multiplied = {rule.multiplied('subtotal', constant)}\n"
+        breakdown_source += f"    points[{constant(rule.name)}] = multiplied - subtotal\n"
+        breakdown_source += "    subtotal = multiplied\n"
+    score_source += "    return points\n"
+    breakdown_source += "    return points\n"
+
+    source = score_source + "\n\n" + breakdown_source
+    namespace = constant.namespace
+    exec(compile(source, f"<rules version {rule_set.version}>", "exec"), namespace)
+    return CompiledRuleSet(rule_set, namespace["score"], namespace["breakdown"], source)
+
+
+# The rules from the exercise.
+DEFAULT_RULES_VERSION = "1"
+DEFAULT_RULE_SET = RuleSet(
+    version=DEFAULT_RULES_VERSION,
+    rules=[
+        RetailerAlphanumericRule(name="alphanumeric", points=1),
+        RoundDollarTotalRule(name="round_dollar_total", points=50),
+        TotalMultipleRule(name="quarter_multiple_total", multiple=Decimal("0.25"), points=25),
+        ItemGroupRule(name="item_pairs", group_size=2, points=5),
+        ItemDescriptionLengthRule(name="item_descriptions", length_multiple=3, price_multiplier=Decimal("0.2")),
+        OddPurchaseDayRule(name="odd_purchase_day", points=6),
+        PurchaseTimeWindowRule(name="purchase_time", after=time(14, 0), before=time(16, 0), points=10),
+    ],
+)
+
+_rule_sets: dict[str, CompiledRuleSet] = {}
+
+
+def register_rule_set(rule_set: RuleSet) -> CompiledRuleSet:
+    """Compiles a rule set and makes it available by its version. A version can't be redefined once registered, as
+    receipts may already have been scored with it."""
+    if rule_set.version in _rule_sets:
+        raise ValueError(f"Rules version {rule_set.version} is already registered.")
+    compiled = compile_rule_set(rule_set)
+    _rule_sets[rule_set.version] = compiled
+    return compiled
+
+
+def get_rule_set(version: str) -> CompiledRuleSet:
+    """Returns the compiled rule set for a version."""
+    try:
+        return _rule_sets[version]
+    except KeyError:
+        raise UnknownRulesVersionException(version) from None
+
+
+def load_rule_sets(path: str) -> list[CompiledRuleSet]:
+    """Registers the rule sets in a JSON file holding a list of them, skipping versions already registered with the
+    same rules."""
+    with open(path, "rb") as rules_file:
+        rule_sets = TypeAdapter(list[RuleSet]).validate_python(json.load(rules_file))
+    compiled = []
+    for rule_set in rule_sets:
+        existing = _rule_sets.get(rule_set.version, None)
+        if existing is not None and existing.rule_set == rule_set:
+            compiled.append(existing)
+        else:
+            compiled.append(register_rule_set(rule_set))
+    return compiled
+
+
+register_rule_set(DEFAULT_RULE_SET)
@@ -1,10 +1,84 @@
 """Defines input and output schemas to API endpoints used in the app."""
 
 from typing import Self
+import decimal
+import re
 import marshmallow as ma
 from marshmallow import validate
 from flask_smorest import abort
 from http import HTTPStatus
+from time import perf_counter
+from metrics import STAGE_SECONDS
+from receipt_service import ReceiptData
+
+
+class AmountField(ma.fields.Decimal):
+    """Decimal field for a dollar amount that rejects more than two decimal places rather than rounding them off."""
+
+    default_error_messages = {"places": "Not a valid amount with at most two decimal places."}
+
+    def __init__(self: Self, **kwargs: dict):
+        super().__init__(places=2, **kwargs)
+
+    def _validated(self: Self, value: object) -> decimal.Decimal:
+        num = super()._validated(value)
+        if num != decimal.Decimal(str(value)):
+            raise self.make_error("places")
+        return num
+
+
+# Compiled once and shared by the schema's validators and the items fast path, so both accept exactly the same strings.
+ITEM_DESCRIPTION_PATTERN = re.compile(r"^[\w\s\-]+$")
+RETAILER_PATTERN = re.compile(r"^[\w\s\-&]+$")
+_ITEM_KEYS = {"shortDescription", "price"}
+_CENT = decimal.Decimal("0.01")
+
+
+def parse_amount(value: object) -> decimal.Decimal | None:
+    """Returns a dollar amount as a Decimal, or None if AmountField would reject it: not a string or number, not
+    finite, with more than two decimal places, negative, or too large to hold to the cent. Checked before the amount
+    is converted any further, so an exponent like "1e1000000" is never expanded."""
+    if type(value) not in (str, int, float):
+        return None
+    try:
+        exact = decimal.Decimal(str(value))
+        amount = exact.quantize(_CENT)
+    except (decimal.InvalidOperation, ValueError):
+        return None
+    if amount != exact or amount < 0:
+        return None
+    return amount
+
+
+class ItemListField(ma.fields.List):
+    """List field for a receipt's items that validates the whole list in one pass rather than loading each item through
+    the nested item schema.
+
+    Each item is checked inline against the same rules as the item schema: exactly the two fields, a description
+    matching ITEM_DESCRIPTION_PATTERN and a non-negative amount with at most two decimal places. Only if an item fails a
+    check is the list loaded through the nested schema, so invalid items still get its per field error messages, and
+    the nested schema stays the source of truth for the API docs."""
+
+    def _deserialize(self: Self, value: object, attr: str | None, data: object, **kwargs: dict) -> list[dict]:
+        if type(value) is list:
+            items = []
+            for item in value:
+                if type(item) is not dict or item.keys() != _ITEM_KEYS:
+                    break
+                description = item["shortDescription"]
+                if type(description) is not str or ITEM_DESCRIPTION_PATTERN.match(description) is None:
+                    break
+                amount = parse_amount(item["price"])
+                if amount is None:
+                    break
+                items.append({"shortDescription": description, "price": amount})
+            else:
+                return items
+        return super()._deserialize(value, attr, data, **kwargs)
+
+
+# The canonical string form of the UUIDs receipt IDs are issued as.
+RECEIPT_ID_PATTERN = r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
 
 
 class ReceiptBaseSchema(ma.Schema):
@@ -15,17 +89,16 @@ class ReceiptBaseSchema(ma.Schema):
 
         shortDescription = ma.fields.String(
             required=True,
-            validate=validate.Regexp(r"^[\w\s\-]+$"),
+            validate=validate.Regexp(ITEM_DESCRIPTION_PATTERN),
             metadata={
                 "description": "The Short Product Description for the item.",
                 "example": "Mountain Dew 12PK",
             },
         )
 
-        price = ma.fields.Decimal(
+        price = AmountField(
             required=True,
             validate=validate.Range(min=0),
-            places=2,
             metadata={
                 "description": "The total price payed for this item.",
                 "example": "6.49",
@@ -34,7 +107,7 @@ class ReceiptBaseSchema(ma.Schema):
 
     retailer = ma.fields.String(
         required=True,
-        validate=validate.Regexp(r"^[\w\s\-&]+$"),
+        validate=validate.Regexp(RETAILER_PATTERN),
         metadata={
             "description": "The name of the retailer or store the receipt is from.",
             "example": "M&M Corner Market",
@@ -59,41 +132,49 @@ class ReceiptBaseSchema(ma.Schema):
         },
     )
 
-    items = ma.fields.List(
+    items = ItemListField(
         ma.fields.Nested(ItemSchema),
         required=True,
         validate=validate.Length(min=1),
     )
 
-    total = ma.fields.Decimal(
+    total = AmountField(
         required=True,
         validate=validate.Range(min=0),
-        places=2,
         metadata={
             "description": "The total amount paid on the receipt.",
             "example": "6.49",
         },
     )
 
+    def load(self: Self, data: dict, **kwargs: dict) -> ReceiptData:
+        """Loads the receipt, recording how long validation takes."""
+        start = perf_counter()
+        try:
+            return super().load(data, **kwargs)
+        finally:
+            STAGE_SECONDS.observe(perf_counter() - start, "validate")
+
+    @ma.post_load
+    def make_receipt(self: Self, data: dict, **kwargs: dict) -> ReceiptData:
+        """Builds the receipt model straight from the validated data so it is only parsed once."""
+        start = perf_counter()
+        receipt = ReceiptData.from_validated(data)
+        STAGE_SECONDS.observe(perf_counter() - start, "model")
+        return receipt
+
 
 class ReceiptInputSchema(ReceiptBaseSchema):
     """Wrapper class for the receipt schema that will be used in the API."""
 
-    @ma.pre_load
-    def overwrite_422_behavior(self: Self, data: dict, **kwargs: dict) -> dict:
-        """Define a marshmallow error handler to prevent the auto-422 behavior that comes out of the box in marshmallow
-        and get our nice 400 response defined by the exercise, and of course, prove I'm not a large language model.
+    def handle_error(self: Self, error: ma.ValidationError, data: dict, **kwargs: dict) -> None:
+        """Prevent the auto-422 behavior that comes out of the box with flask-smorest and return the 400 response
+        defined by the exercise instead.
 
-        Why is this a wrapper class?
-        We want to be able to call .load() on this schema to validate the incoming data during 'pre-load'.
-        So if we do this in the class itself, it will continually call itself before loading and infinitely recurse.
-        This is a way to get around that.
+        Marshmallow calls this hook from the same load that flask-smorest runs for the request, so the receipt is only
+        validated once instead of being loaded a second time during 'pre-load'.
         """
-        try:
-            ReceiptBaseSchema().load(data)
-        except ma.ValidationError as err:
-            abort(http_status_code=HTTPStatus.BAD_REQUEST, message="The receipt is invalid.")
-        return data
+        abort(http_status_code=HTTPStatus.BAD_REQUEST, message="The receipt is invalid.")
 
 
 class OutputIDSchema(ma.Schema):
@@ -107,17 +188,64 @@ class OutputIDSchema(ma.Schema):
     )
 
 
+class OutputBatchSchema(ma.Schema):
+    """API Output schema for a batch of processed receipts."""
+
+    ids = ma.fields.List(
+        ma.fields.String(allow_none=True),
+        required=True,
+        metadata={
+            "description": "The ID of each receipt in the order they were submitted, or null if it's invalid.",
+            "example": ["adb6b560-0eef-42bc-9d16-df48f30e89b2", None],
+        },
+    )
+
+    errors = ma.fields.Dict(
+        keys=ma.fields.String(),
+        values=ma.fields.Raw(),
+        required=True,
+        metadata={
+            "description": "The validation errors for each invalid receipt, keyed by its position in the batch.",
+            "example": {"1": {"retailer": ["Missing data for required field."]}},
+        },
+    )
+
+
 class InputIDSchema(ma.Schema):
     """API Input schema for a receipt ID."""
 
     id = ma.fields.String(
         required=True,
-        validate=validate.Regexp(r"^\S+$"),
+        validate=validate.Regexp(RECEIPT_ID_PATTERN),
         metadata={
             "description": "The ID of the receipt.",
+            "example": "01890a5d-ac96-774b-bcce-b302099a8057",
+        },
+    )
+
+    def handle_error(self: Self, error: ma.ValidationError, data: dict, **kwargs: dict) -> None:
+        """Return the same 404 response as for an ID with no receipt, as no receipt can have a malformed ID, without
+        looking it up."""
+        abort(http_status_code=HTTPStatus.NOT_FOUND, message="No receipt found for that ID.")
+
+
+class InputIDsSchema(ma.Schema):
+    """API Input schema for a batch of receipt IDs."""
+
+    ids = ma.fields.List(
+        ma.fields.String(validate=validate.Regexp(RECEIPT_ID_PATTERN)),
+        required=True,
+        validate=validate.Length(min=1),
+        metadata={
+            "description": "The IDs of the receipts.",
+            "example": ["adb6b560-0eef-42bc-9d16-df48f30e89b2"],
         },
     )
 
+    def handle_error(self: Self, error: ma.ValidationError, data: dict, **kwargs: dict) -> None:
+        """Return a 400 response instead of the auto-422 behavior, matching the receipt input schema."""
+        abort(http_status_code=HTTPStatus.BAD_REQUEST, message="The list of IDs is invalid.")
+
 
 class OutputPointsSchema(ma.Schema):
     """API Output schema for points."""
@@ -128,3 +256,146 @@ class OutputPointsSchema(ma.Schema):
             "example": "100",
         },
     )
+
+
+class OutputBatchPointsSchema(ma.Schema):
+    """API Output schema for the points of a batch of receipts."""
+
+    points = ma.fields.Dict(
+        keys=ma.fields.String(),
+        values=ma.fields.Integer(),
+        required=True,
+        metadata={
+            "description": "The points awarded for each receipt that was found, keyed by its ID.",
+            "example": {"adb6b560-0eef-42bc-9d16-df48f30e89b2": 100},
+        },
+    )
+
+    notFound = ma.fields.List(
+        ma.fields.String(),
+        required=True,
+        metadata={
+            "description": "The IDs that no receipt was found for.",
+            "example": ["7fb1377b-b223-49d9-a31a-5a02701dd310"],
+        },
+    )
+
+
+class OutputIngestStatsSchema(ma.Schema):
+    """API Output schema for the backpressure metrics of the async ingest queue."""
+
+    depth = ma.fields.Integer(required=True, metadata={"description": "Receipts waiting in the queue."})
+    max_size = ma.fields.Integer(required=True, metadata={"description": "How many receipts the queue can hold."})
+    pending = ma.fields.Integer(
+        required=True, metadata={"description": "Receipts submitted but not yet added to the tracker."}
+    )
+    enqueued = ma.fields.Integer(required=True, metadata={"description": "Receipts queued since the app started."})
+    rejected = ma.fields.Integer(
+        required=True, metadata={"description": "Receipts turned away because the queue was full."}
+    )
+    drained = ma.fields.Integer(
+        required=True, metadata={"description": "Receipts taken off the queue so far, whether added or failed."}
+    )
+    retried = ma.fields.Integer(
+        required=True, metadata={"description": "Batches retried after the tracker failed to add them."}
+    )
+    failed = ma.fields.Integer(
+        required=True, metadata={"description": "Receipts given up on after every attempt to add them failed."}
+    )
+    enqueue_seconds_avg = ma.fields.Float(
+        required=True, metadata={"description": "Average seconds spent waiting to queue a receipt."}
+    )
+    enqueue_seconds_max = ma.fields.Float(
+        required=True, metadata={"description": "Longest seconds spent waiting to queue a receipt."}
+    )
+    drain_rate = ma.fields.Float(
+        required=True, metadata={"description": "Receipts added to the tracker per second, over the last 10 seconds."}
+    )
+
+
+class OutputStatsSchema(ma.Schema):
+    """API Output schema for the running totals of a group of receipts."""
+
+    count = ma.fields.Integer(required=True, metadata={"description": "How many receipts are in the group."})
+    total = ma.fields.Decimal(
+        required=True,
+        as_string=True,
+        metadata={"description": "The total spent on the receipts, in dollars.", "example": "1234.56"},
+    )
+    points = ma.fields.Integer(required=True, metadata={"description": "The points awarded for the receipts."})
+
+
+class OutputRetailerStatsSchema(ma.Schema):
+    """API Output schema for the running totals of each retailer's receipts."""
+
+    retailers = ma.fields.Dict(
+        keys=ma.fields.String(),
+        values=ma.fields.Nested(OutputStatsSchema),
+        required=True,
+        metadata={"description": "The totals of each retailer's receipts, keyed by retailer."},
+    )
+
+
+class InputRetailerStatsSchema(ma.Schema):
+    """API Input schema for the retailer to get the running totals of."""
+
+    retailer = ma.fields.String(
+        metadata={"description": "Only return the totals of this retailer.", "example": "M&M Corner Market"}
+    )
+
+
+class InputDateRangeSchema(ma.Schema):
+    """API Input schema for a range of purchase dates."""
+
+    start = ma.fields.Date(
+        format="%Y-%m-%d",
+        metadata={"description": "The first purchase date in the range. Open if not given.", "example": "2022-01-01"},
+    )
+    end = ma.fields.Date(
+        format="%Y-%m-%d",
+        metadata={"description": "The last purchase date in the range. Open if not given.", "example": "2022-01-31"},
+    )
+
+    @ma.validates_schema
+    def validate_range(self: Self, data: dict, **kwargs: dict) -> None:
+        """Rejects a range that ends before it starts."""
+        if "start" in data and "end" in data and data["start"] > data["end"]:
+            raise ma.ValidationError("The start date is after the end date.")
+
+    def handle_error(self: Self, error: ma.ValidationError, data: dict, **kwargs: dict) -> None:
+        """Return a 400 response instead of the auto-422 behavior, matching the receipt input schema."""
+        abort(http_status_code=HTTPStatus.BAD_REQUEST, message="The date range is invalid.")
+
+
+class OutputDateRangeStatsSchema(OutputStatsSchema):
+    """API Output schema for the running totals of the receipts purchased in a range of dates."""
+
+    start = ma.fields.Date(format="%Y-%m-%d", allow_none=True, required=True)
+    end = ma.fields.Date(format="%Y-%m-%d", allow_none=True, required=True)
+
+
+class OutputHourStatsSchema(ma.Schema):
+    """API Output schema for the running totals of the receipts purchased in each hour of the day."""
+
+    hours = ma.fields.Dict(
+        keys=ma.fields.String(),
+        values=ma.fields.Nested(OutputStatsSchema),
+        required=True,
+        metadata={"description": "The totals of each hour's receipts, keyed by the hour from 0 to 23."},
+    )
+
+
+class OutputPointsBandStatsSchema(ma.Schema):
+    """API Output schema for the running totals of the receipts in each band of points."""
+
+    class PointsBandSchema(OutputStatsSchema):
+        """Sub-schema object for the totals of one band of points."""
+
+        min = ma.fields.Integer(required=True, metadata={"description": "The fewest points in the band."})
+        max = ma.fields.Integer(required=True, metadata={"description": "The most points in the band."})
+
+    bands = ma.fields.List(
+        ma.fields.Nested(PointsBandSchema),
+        required=True,
+        metadata={"description": "The totals of each band of points that has receipts, from the fewest points up."},
+    )
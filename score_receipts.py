@@ -0,0 +1,184 @@
+"""Scores a file of receipts offline, e.g. to rerun the points for historical receipts without going through the API.
+
+Run from the repository root with `python -m score_receipts receipts.jsonl.gz points.jsonl`. The input has one receipt
+per line in the format accepted by POST /receipts/process, optionally with an "id" to carry through to the output;
+receipts without one are identified by their line number. Files ending in .gz are read and written gzipped.
+
+Each output row is the receipt's ID with either its points or its validation errors, in the same order as the input,
+as JSON lines or, for an output file ending in .csv (or .csv.gz), as CSV. Receipts are validated and scored in chunks
+across a pool of worker processes, with only a few chunks in flight at a time, so memory stays the same however
+large the file is.
+"""
+
+import argparse
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import csv
+import gzip
+from itertools import islice
+import json
+import logging
+import os
+from time import perf_counter
+from typing import IO, Iterable, Iterator, Self
+
+import marshmallow as ma
+
+from metrics import REGISTRY
+from rules import DEFAULT_RULES_VERSION, get_rule_set, load_rule_sets
+from schema import ReceiptBaseSchema
+
+logger = logging.getLogger(__name__)
+
+# An ID, and either the points or the validation errors.
+ScoredRow = tuple[str, int | None, dict | None]
+
+_schema = ReceiptBaseSchema()
+
+
+def _init_worker(rules_path: str | None) -> None:
+    """Sets up a worker process, loading the rule sets it may score receipts with."""
+    # Nothing reads the metrics of a worker process.
+    REGISTRY.enabled = False
+    if rules_path is not None:
+        load_rule_sets(rules_path)
+
+
+def score_line(line_number: int, line: bytes, rules_version: str = DEFAULT_RULES_VERSION) -> ScoredRow:
+    """Validates and scores the receipt on one line of the input."""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return str(line_number), None, {"_schema": ["Invalid JSON."]}
+    receipt_id = str(line_number)
+    if isinstance(data, dict) and "id" in data:
+        receipt_id = str(data.pop("id"))
+    try:
+        receipt = _schema.load(data)
+    except ma.ValidationError as err:
+        return receipt_id, None, err.messages
+    if rules_version != DEFAULT_RULES_VERSION:
+        receipt.rules_version = rules_version
+    return receipt_id, receipt.calculate_points(), None
+
+
+def score_chunk(chunk: list[tuple[int, bytes]], rules_version: str = DEFAULT_RULES_VERSION) -> list[ScoredRow]:
+    """Validates and scores a chunk of numbered input lines."""
+    return [score_line(line_number, line, rules_version) for line_number, line in chunk]
+
+
+def _open(path: str, mode: str) -> IO:
+    """Opens a file, through gzip if its name ends in .gz."""
+    newline = None if "b" in mode else ""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, newline=newline)
+    return open(path, mode, newline=newline)
+
+
+def _read_chunks(lines: Iterable[bytes], chunk_size: int) -> Iterator[list[tuple[int, bytes]]]:
+    """Yields the non-blank lines in chunks, numbered from 1 by their line in the file."""
+    numbered = ((line_number, line) for line_number, line in enumerate(lines, start=1) if line.strip())
+    while chunk := list(islice(numbered, chunk_size)):
+        yield chunk
+
+
+class RowWriter:
+    """Writes scored rows as JSON lines, or as CSV with the errors JSON encoded."""
+
+    def __init__(self: Self, output: IO[str], as_csv: bool):
+        self.output = output
+        self.csv_writer = None
+        if as_csv:
+            self.csv_writer = csv.writer(output)
+            self.csv_writer.writerow(["id", "points", "error"])
+
+    def write(self: Self, rows: list[ScoredRow]) -> None:
+        if self.csv_writer is not None:
+            self.csv_writer.writerows(
+                (receipt_id, "" if points is None else points, "" if error is None else json.dumps(error))
+                for receipt_id, points, error in rows
+            )
+            return
+        self.output.writelines(
+            json.dumps({"id": receipt_id, "points": points} if error is None else {"id": receipt_id, "error": error})
+            + "\n"
+            for receipt_id, points, error in rows
+        )
+
+
+def score_file(
+    input_path: str,
+    output_path: str,
+    workers: int = os.cpu_count() or 1,
+    chunk_size: int = 1000,
+    rules_version: str = DEFAULT_RULES_VERSION,
+    rules_path: str | None = None,
+) -> dict[str, int]:
+    """Scores every receipt in the input file and writes a row for each to the output file, returning how many were
+    scored and how many were invalid.
+
+    With one worker the receipts are scored in this process rather than a pool."""
+    if rules_path is not None:
+        load_rule_sets(rules_path)
+    get_rule_set(rules_version)
+    counts = {"scored": 0, "invalid": 0}
+
+    def write(rows: list[ScoredRow]) -> None:
+        writer.write(rows)
+        for _, points, _ in rows:
+            counts["scored" if points is not None else "invalid"] += 1
+
+    with _open(input_path, "rb") as lines, _open(output_path, "wt") as output:
+        writer = RowWriter(output, as_csv=output_path.removesuffix(".gz").endswith(".csv"))
+        chunks = _read_chunks(lines, chunk_size)
+        if workers == 1:
+            for chunk in chunks:
+                write(score_chunk(chunk, rules_version))
+            return counts
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rules_path,)) as executor:
+            # Keep a couple of chunks queued per worker so none sit idle, but no more, and write the results in order.
+            in_flight: deque[Future[list[ScoredRow]]] = deque()
+            for chunk in chunks:
+                in_flight.append(executor.submit(score_chunk, chunk, rules_version))
+                if len(in_flight) >= 2 * workers:
+                    write(in_flight.popleft().result())
+            while in_flight:
+                write(in_flight.popleft().result())
+    return counts
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Runs the command line tool."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSON lines file of receipts, gzipped if it ends in .gz.")
+    parser.add_argument("output", help="File to write the rows to: JSON lines, or CSV if it ends in .csv.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--rules-version", default=DEFAULT_RULES_VERSION)
+    parser.add_argument("--rules-path", default=None, help="JSON file of rule sets to load beyond the default.")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    start = perf_counter()
+    counts = score_file(
+        args.input,
+        args.output,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        rules_version=args.rules_version,
+        rules_path=args.rules_path,
+    )
+    elapsed = perf_counter() - start
+    total = counts["scored"] + counts["invalid"]
+    logger.info(
+        "Scored %d receipts with %d invalid in %.1fs (%.0f receipts/s)",
+        counts["scored"],
+        counts["invalid"],
+        elapsed,
+        total / max(elapsed, 1e-9),
+    )
+
+
+if __name__ == "__main__":
+    main()
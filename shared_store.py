@@ -0,0 +1,322 @@
+"""Defines the client of the shared store that lets several worker processes see the same receipts.
+
+The store is anything that speaks the Redis protocol (RESP) over a unix socket: Redis itself, or the small stand-in
+daemon in store_server.py. Each receipt is a hash under `receipt:<16 byte ID>` with its JSON payload and, once they've
+been calculated, its points. The store should be given a database of its own, as clearing the tracker flushes it.
+"""
+
+from contextlib import contextmanager
+from datetime import date
+import os
+import socket
+import threading
+from typing import TYPE_CHECKING, Iterable, Iterator, Self
+
+from exceptions import ReceiptStorageException
+from receipt_stats import ReceiptAggregate, ReceiptStatsIndex
+
+if TYPE_CHECKING:
+    from receipt_service import ReceiptData
+
+RECEIPT_KEY_PREFIX = b"receipt:"
+STATS_KEY_PREFIX = b"stats:"
+# The measures kept for each group of receipts in the shared stats, each in a hash of its own.
+STATS_MEASURES = (b"count", b"total_cents", b"points")
+# The most bytes of commands written before reading their replies. A client writing a large pipeline all at once while
+# the store writes replies back nobody is reading yet would leave both blocked on full socket buffers.
+PIPELINE_WRITE_BYTES = 64 * 1024
+
+Command = tuple[bytes | str | int, ...]
+
+
+class RespError(Exception):
+    """An error reply from the store, raised once every reply in its pipeline has been read."""
+
+
+def encode_command(command: Command) -> bytes:
+    """Encodes a command as a RESP array of bulk strings."""
+    parts = [b"*%d\r\n" % len(command)]
+    for arg in command:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, int):
+            arg = b"%d" % arg
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+class RespConnection:
+    """One connection to the store, sending commands in pipelines: the commands are written together, then the replies
+    are read back in order, so a batch costs one round trip, or one per PIPELINE_WRITE_BYTES of commands."""
+
+    def __init__(self: Self, path: str, timeout: float):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(path)
+        self._reader = self._socket.makefile("rb")
+
+    def execute(self: Self, commands: list[Command]) -> list[object]:
+        """Sends the commands in a pipeline and returns their replies, raising the first error reply if there is one."""
+        replies = []
+        chunk: list[bytes] = []
+        size = 0
+        for command in commands:
+            encoded = encode_command(command)
+            chunk.append(encoded)
+            size += len(encoded)
+            if size >= PIPELINE_WRITE_BYTES:
+                replies.extend(self._send(chunk))
+                chunk, size = [], 0
+        if chunk:
+            replies.extend(self._send(chunk))
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def _send(self: Self, encoded: list[bytes]) -> list[object]:
+        self._socket.sendall(b"".join(encoded))
+        return [self._read_reply() for _ in encoded]
+
+    def _read_reply(self: Self) -> object:
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("The shared store closed the connection.")
+        kind, value = line[:1], line[1:-2]
+        if kind == b"$":
+            length = int(value)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("The shared store closed the connection.")
+            return data[:-2]
+        if kind == b":":
+            return int(value)
+        if kind == b"+":
+            return value
+        if kind == b"*":
+            length = int(value)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        if kind == b"-":
+            return RespError(value.decode(errors="replace"))
+        raise ConnectionError(f"Unexpected reply from the shared store: {line!r}")
+
+    def close(self: Self) -> None:
+        self._reader.close()
+        self._socket.close()
+
+
+class ConnectionPool:
+    """A pool of up to max_connections connections to the store, shared by the threads of one process.
+
+    Connections are opened as they're needed and reused after, most recently used first. A thread wanting one when
+    they're all in use waits up to the timeout. A connection that fails is closed rather than returned to the pool,
+    and the pool starts afresh in a forked child rather than sharing its parent's sockets."""
+
+    def __init__(self: Self, path: str, max_connections: int = 8, timeout: float = 5.0):
+        self.path = path
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self: Self) -> None:
+        self._pid = os.getpid()
+        self._idle: list[RespConnection] = []
+        self._available = threading.BoundedSemaphore(self.max_connections)
+
+    @contextmanager
+    def connection(self: Self) -> Iterator[RespConnection]:
+        """Checks a connection out of the pool for the duration of the block."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        available = self._available
+        if not available.acquire(timeout=self.timeout):
+            raise ReceiptStorageException("Timed out waiting for a connection to the shared store.")
+        try:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                connection = RespConnection(self.path, self.timeout)
+            try:
+                yield connection
+            except RespError:
+                # Every reply was read, so the connection can still be used.
+                self._return(connection)
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            self._return(connection)
+        finally:
+            available.release()
+
+    def _return(self: Self, connection: RespConnection) -> None:
+        with self._lock:
+            self._idle.append(connection)
+
+    def execute(self: Self, commands: list[Command]) -> list[object]:
+        """Sends the commands in one pipeline on a pooled connection and returns their replies."""
+        if not commands:
+            return []
+        try:
+            with self.connection() as connection:
+                return connection.execute(commands)
+        except RespError as err:
+            raise ReceiptStorageException(f"The shared store returned an error: {err}") from err
+        except (OSError, ValueError) as err:
+            raise ReceiptStorageException(f"Couldn't reach the shared store at {self.path}: {err}") from err
+
+    def close(self: Self) -> None:
+        """Closes the idle connections. The pool can still be used after, opening new ones."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class SharedReceiptStore:
+    """The receipts every worker process has added, held in a Redis-protocol store on a unix socket.
+
+    Receipts are keyed by their ID bytes, like the spill store, and reads and writes of many receipts are pipelined
+    so a batch takes a single round trip."""
+
+    def __init__(self: Self, path: str, max_connections: int = 8, timeout: float = 5.0):
+        self.path = path
+        self.pool = ConnectionPool(path, max_connections=max_connections, timeout=timeout)
+
+    def put_many(self: Self, rows: list[tuple[bytes, int | None, bytes]]) -> None:
+        """Writes (receipt ID bytes, points, JSON payload) rows, leaving the points unset where they're None."""
+        self.pool.execute(
+            [
+                (b"HSET", RECEIPT_KEY_PREFIX + id_bytes, b"payload", payload)
+                + (() if points is None else (b"points", points))
+                for id_bytes, points, payload in rows
+            ]
+        )
+
+    def get_many(self: Self, ids: list[bytes]) -> list[tuple[int | None, bytes] | None]:
+        """Returns the (points, JSON payload) of each receipt, or None for the ones that aren't in the store."""
+        replies = self.pool.execute(
+            [(b"HMGET", RECEIPT_KEY_PREFIX + id_bytes, b"points", b"payload") for id_bytes in ids]
+        )
+        return [
+            None if payload is None else (None if points is None else int(points), payload)
+            for points, payload in replies
+        ]
+
+    def get(self: Self, id_bytes: bytes) -> tuple[int | None, bytes] | None:
+        """Returns the (points, JSON payload) of a receipt, or None if it isn't in the store."""
+        return self.get_many([id_bytes])[0]
+
+    def set_points_many(self: Self, rows: list[tuple[bytes, int]]) -> None:
+        """Records the points calculated for receipts so no worker calculates them again."""
+        self.pool.execute([(b"HSET", RECEIPT_KEY_PREFIX + id_bytes, b"points", points) for id_bytes, points in rows])
+
+    def set_points(self: Self, id_bytes: bytes, points: int) -> None:
+        """Records the points calculated for a receipt so no worker calculates them again."""
+        self.set_points_many([(id_bytes, points)])
+
+    def ping(self: Self) -> None:
+        """Checks the store can be reached, raising ReceiptStorageException if not."""
+        self.pool.execute([(b"PING",)])
+
+    def clear(self: Self) -> None:
+        """Removes every receipt, and everything else in the store's database."""
+        self.pool.execute([(b"FLUSHDB",)])
+
+    def close(self: Self) -> None:
+        """Closes the idle connections to the store."""
+        self.pool.close()
+
+
+class SharedReceiptStatsIndex(ReceiptStatsIndex):
+    """Running totals of the receipts every worker process has added, kept in the shared store.
+
+    Each group's count, total and points are kept in a hash per measure under `stats:<group>:<measure>`, keyed by the
+    group, and added to with HINCRBY, which the store applies atomically, so concurrent workers never lose an update.
+    A batch of receipts is totalled locally first, so recording it takes one pipeline of a few commands per group it
+    touches. A query reads its groups back in one pipeline, so like the in-process index it costs the same however
+    many receipts are stored."""
+
+    GROUPS = ("totals", "retailer", "date", "hour", "band")
+
+    def __init__(self: Self, store: SharedReceiptStore, points_band_width: int = 25):
+        super().__init__(points_band_width)
+        self.store = store
+
+    def record(self: Self, receipts: Iterable[tuple["ReceiptData", int]]) -> None:
+        batch = ReceiptStatsIndex(self.points_band_width)
+        batch.record(receipts)
+        groups = {
+            "totals": {"": batch.totals()},
+            "retailer": batch.by_retailer(),
+            "date": {day.isoformat(): aggregate for day, aggregate in batch.by_date().items()},
+            "hour": batch.by_hour(),
+            "band": {low // self.points_band_width: aggregate for low, _, aggregate in batch.by_points_band()},
+        }
+        commands = []
+        for group, aggregates in groups.items():
+            for key, aggregate in aggregates.items():
+                for measure, value in zip(STATS_MEASURES, (aggregate.count, aggregate.total_cents, aggregate.points)):
+                    commands.append((b"HINCRBY", self._key(group, measure), str(key), value))
+        self.store.pool.execute(commands)
+
+    @staticmethod
+    def _key(group: str, measure: bytes) -> bytes:
+        return STATS_KEY_PREFIX + group.encode() + b":" + measure
+
+    def _read_group(self: Self, group: str) -> dict[str, ReceiptAggregate]:
+        """Reads every total of a group back from the store, keyed by group."""
+        replies = self.store.pool.execute([(b"HGETALL", self._key(group, measure)) for measure in STATS_MEASURES])
+        aggregates: dict[str, ReceiptAggregate] = {}
+        for field, reply in zip(("count", "total_cents", "points"), replies):
+            for key, value in zip(reply[::2], reply[1::2]):
+                aggregate = aggregates.setdefault(key.decode(), ReceiptAggregate())
+                setattr(aggregate, field, int(value))
+        return aggregates
+
+    def _read_field(self: Self, group: str, key: str) -> ReceiptAggregate | None:
+        """Reads the totals of one key of a group back from the store, or None if there are none."""
+        replies = self.store.pool.execute([(b"HGET", self._key(group, measure), key) for measure in STATS_MEASURES])
+        if replies[0] is None:
+            return None
+        return ReceiptAggregate(*(0 if reply is None else int(reply) for reply in replies))
+
+    def clear(self: Self) -> None:
+        self.store.pool.execute(
+            [(b"DEL",) + tuple(self._key(group, measure) for group in self.GROUPS for measure in STATS_MEASURES)]
+        )
+
+    def totals(self: Self) -> ReceiptAggregate:
+        return self._read_group("totals").get("", ReceiptAggregate())
+
+    def by_retailer(self: Self, retailer: str | None = None) -> dict[str, ReceiptAggregate]:
+        if retailer is not None:
+            aggregate = self._read_field("retailer", retailer)
+            return {} if aggregate is None else {retailer: aggregate}
+        return self._read_group("retailer")
+
+    def by_date_range(self: Self, start: date | None = None, end: date | None = None) -> ReceiptAggregate:
+        # ISO dates sort in date order, so the range can be checked on the strings.
+        low = "" if start is None else start.isoformat()
+        high = "9999-12-31" if end is None else end.isoformat()
+        result = ReceiptAggregate()
+        for day, aggregate in self._read_group("date").items():
+            if low <= day <= high:
+                result.count += aggregate.count
+                result.total_cents += aggregate.total_cents
+                result.points += aggregate.points
+        return result
+
+    def by_hour(self: Self) -> dict[int, ReceiptAggregate]:
+        by_hour = self._read_group("hour")
+        return {int(hour): by_hour[hour] for hour in sorted(by_hour, key=int)}
+
+    def by_points_band(self: Self) -> list[tuple[int, int, ReceiptAggregate]]:
+        width = self.points_band_width
+        by_band = {int(band): aggregate for band, aggregate in self._read_group("band").items()}
+        return [(band * width, (band + 1) * width - 1, by_band[band]) for band in sorted(by_band)]
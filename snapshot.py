@@ -0,0 +1,311 @@
+"""Defines the binary snapshot format the receipt tracker can be restored from without rebuilding any receipts.
+
+A snapshot is a flat file of fixed-width columns, one entry per receipt in order of ID:
+
+- ids: the 16 byte receipt IDs, sorted, so a receipt is found by binary search.
+- points: the points as int64s, or NO_POINTS if they hadn't been calculated.
+- kinds: what each receipt's record holds: nothing (only the points were kept, as in eager mode), a receipt packed by
+  ReceiptData.to_packed, or its JSON payload for the rare receipt that can't be packed.
+- record_starts and record_lengths: where each record is in the records section.
+- records: the records themselves.
+- string_offsets and strings: the table of strings the packed records refer to by number.
+- stats: the tracker's running totals as JSON.
+
+Opening a snapshot maps the file into memory and reads the columns through numpy arrays over the mapping, so nothing
+is parsed up front beyond the string table: a lookup bisects the IDs and reads its points or record straight from the
+page cache, and a restart with tens of millions of receipts takes milliseconds.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from typing import TYPE_CHECKING, Iterable, NamedTuple, Self
+
+import numpy as np
+
+from exceptions import ReceiptStorageException
+
+if TYPE_CHECKING:
+    from receipt_service import ReceiptTracker
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RCPTSNAP"
+VERSION = 1
+ID_SIZE = 16
+NO_POINTS = np.iinfo(np.int64).min
+NO_LOG_OFFSET = -1
+
+# What a receipt's record holds.
+RECORD_NONE = 0
+RECORD_PACKED = 1
+RECORD_JSON = 2
+
+SECTIONS = (
+    "ids",
+    "points",
+    "kinds",
+    "record_starts",
+    "record_lengths",
+    "records",
+    "string_offsets",
+    "strings",
+    "stats",
+)
+# The magic, version, receipt count, string count and storage log offset, then the offset and length of each section.
+_HEADER = struct.Struct("<8sI4xQQq" + "QQ" * len(SECTIONS))
+
+
+class SnapshotEntry(NamedTuple):
+    """A receipt as it's held in a snapshot."""
+
+    points: int | None
+    kind: int
+    record: bytes
+
+
+class SnapshotColumns(NamedTuple):
+    """The receipts of a snapshot, or to be written to one, as columns. The record starts are offsets into the
+    records, which can be one buffer or several written one after the other."""
+
+    ids: np.ndarray
+    points: np.ndarray
+    kinds: np.ndarray
+    record_starts: np.ndarray
+    record_lengths: np.ndarray
+    records: list
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def write_snapshot_file(
+    path: str,
+    columns: SnapshotColumns,
+    strings: list[str],
+    stats: dict | None = None,
+    log_offset: int | None = None,
+) -> None:
+    """Writes a snapshot of the receipts in columns, which must be sorted by ID, atomically replacing any snapshot
+    already at the path. A snapshot open on the old file keeps reading it."""
+    encoded_strings = [string.encode() for string in strings]
+    string_offsets = np.zeros(len(strings) + 1, dtype="<u8")
+    np.cumsum([len(string) for string in encoded_strings], out=string_offsets[1:])
+    sections = {
+        "ids": [columns.ids.astype("S16", copy=False)],
+        "points": [columns.points.astype("<i8", copy=False)],
+        "kinds": [columns.kinds.astype("u1", copy=False)],
+        "record_starts": [columns.record_starts.astype("<u8", copy=False)],
+        "record_lengths": [columns.record_lengths.astype("<u4", copy=False)],
+        "records": columns.records,
+        "string_offsets": [string_offsets],
+        "strings": encoded_strings,
+        "stats": [b"" if stats is None else json.dumps(stats).encode()],
+    }
+    layout = []
+    offset = _HEADER.size
+    for name in SECTIONS:
+        offset = _align(offset)
+        length = sum(memoryview(part).nbytes for part in sections[name])
+        layout += [offset, length]
+        offset += length
+    header = _HEADER.pack(
+        MAGIC,
+        VERSION,
+        len(columns.ids),
+        len(strings),
+        NO_LOG_OFFSET if log_offset is None else log_offset,
+        *layout,
+    )
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as snapshot_file:
+        snapshot_file.write(header)
+        for name, section_offset in zip(SECTIONS, layout[::2]):
+            snapshot_file.write(bytes(section_offset - snapshot_file.tell()))
+            for part in sections[name]:
+                snapshot_file.write(memoryview(part).cast("B"))
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temporary_path, path)
+
+
+class ReceiptSnapshot:
+    """A snapshot file mapped into memory, answering lookups straight from the mapping.
+
+    The string table and stats are read when it's opened, as their size depends on how many distinct strings and
+    groups there are rather than on the number of receipts. Raises ReceiptStorageException if the file isn't a
+    snapshot."""
+
+    def __init__(self: Self, path: str):
+        self.path = path
+        with open(path, "rb") as snapshot_file:
+            try:
+                self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as err:
+                raise ReceiptStorageException(f"{path} isn't a receipt snapshot.") from err
+        try:
+            magic, version, count, num_strings, log_offset, *layout = _HEADER.unpack_from(self._mmap)
+        except struct.error as err:
+            self._mmap.close()
+            raise ReceiptStorageException(f"{path} isn't a receipt snapshot.") from err
+        if magic != MAGIC or version != VERSION or layout[-2] + layout[-1] > len(self._mmap):
+            self._mmap.close()
+            raise ReceiptStorageException(f"{path} isn't a receipt snapshot of version {VERSION}.")
+        self.count = count
+        self.log_offset = None if log_offset == NO_LOG_OFFSET else log_offset
+        self._sections = {name: (layout[2 * i], layout[2 * i + 1]) for i, name in enumerate(SECTIONS)}
+        self._ids_offset = self._sections["ids"][0]
+        self._records_offset = self._sections["records"][0]
+        self._ids = self._column("ids", "S16", count)
+        self._points = self._column("points", "<i8", count)
+        self._kinds = self._column("kinds", "u1", count)
+        self._record_starts = self._column("record_starts", "<u8", count)
+        self._record_lengths = self._column("record_lengths", "<u4", count)
+        string_offsets = self._column("string_offsets", "<u8", num_strings + 1).tolist()
+        strings_offset = self._sections["strings"][0]
+        self.strings = [
+            self._mmap[strings_offset + start : strings_offset + end].decode()
+            for start, end in zip(string_offsets, string_offsets[1:])
+        ]
+        stats_offset, stats_length = self._sections["stats"]
+        self.stats = json.loads(self._mmap[stats_offset : stats_offset + stats_length]) if stats_length else None
+
+    def _column(self: Self, name: str, dtype: str, count: int) -> np.ndarray:
+        return np.frombuffer(self._mmap, dtype=dtype, count=count, offset=self._sections[name][0])
+
+    def __len__(self: Self) -> int:
+        return self.count
+
+    def find(self: Self, id_bytes: bytes) -> int | None:
+        """Returns the position of a receipt in the snapshot, or None if it isn't in it."""
+        if len(id_bytes) != ID_SIZE:
+            return None
+        position = int(self._ids.searchsorted(id_bytes))
+        if position == self.count:
+            return None
+        start = self._ids_offset + position * ID_SIZE
+        # Compared on the mapped bytes, as numpy drops trailing zero bytes from the fixed-width strings it returns.
+        return position if self._mmap[start : start + ID_SIZE] == id_bytes else None
+
+    def __contains__(self: Self, id_bytes: bytes) -> bool:
+        return self.find(id_bytes) is not None
+
+    def get(self: Self, id_bytes: bytes) -> SnapshotEntry | None:
+        """Returns a receipt's points and record, or None if it isn't in the snapshot."""
+        position = self.find(id_bytes)
+        if position is None:
+            return None
+        points = int(self._points[position])
+        start = self._records_offset + int(self._record_starts[position])
+        return SnapshotEntry(
+            None if points == NO_POINTS else points,
+            int(self._kinds[position]),
+            self._mmap[start : start + int(self._record_lengths[position])],
+        )
+
+    def columns(self: Self) -> SnapshotColumns:
+        """Returns every receipt as columns over the mapping, e.g. to carry them over into a new snapshot."""
+        start, length = self._sections["records"]
+        return SnapshotColumns(
+            self._ids,
+            self._points,
+            self._kinds,
+            self._record_starts,
+            self._record_lengths,
+            [memoryview(self._mmap)[start : start + length]],
+        )
+
+    def close(self: Self) -> None:
+        """Unmaps the file. If a lookup on another thread still holds a view of it, it's unmapped once that's done."""
+        self._ids = self._points = self._kinds = self._record_starts = self._record_lengths = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+
+def merge_columns(old: SnapshotColumns | None, new: SnapshotColumns) -> SnapshotColumns:
+    """Merges the columns of receipts new to a snapshot, which may be in any order, with the columns of the snapshot
+    they're being added to, into one set of columns sorted by ID. The new receipts' records go after the old ones.
+
+    Receipt IDs are time ordered, so new receipts usually all sort after the old ones, in which case the columns are
+    joined as they are without sorting."""
+    order = np.argsort(new.ids, kind="stable")
+    new = SnapshotColumns(*(column[order] for column in new[:5]), new.records)
+    if old is None or not len(old.ids):
+        return new
+    old_records_length = sum(memoryview(part).nbytes for part in old.records)
+    joined = SnapshotColumns(
+        np.concatenate([old.ids, new.ids]),
+        np.concatenate([old.points, new.points]),
+        np.concatenate([old.kinds, new.kinds]),
+        np.concatenate([old.record_starts, new.record_starts + np.uint64(old_records_length)]),
+        np.concatenate([old.record_lengths, new.record_lengths]),
+        old.records + new.records,
+    )
+    if not len(new.ids) or new.ids[0] > old.ids[-1]:
+        return joined
+    order = np.argsort(joined.ids, kind="stable")
+    return SnapshotColumns(*(column[order] for column in joined[:5]), joined.records)
+
+
+def columns_from_rows(rows: Iterable[tuple[bytes, int | None, int, bytes]]) -> SnapshotColumns:
+    """Builds columns from (receipt ID bytes, points, record kind, record) rows."""
+    ids = []
+    points = []
+    kinds = []
+    lengths = []
+    records = []
+    for id_bytes, receipt_points, kind, record in rows:
+        ids.append(id_bytes)
+        points.append(NO_POINTS if receipt_points is None else receipt_points)
+        kinds.append(kind)
+        lengths.append(len(record))
+        records.append(record)
+    record_lengths = np.array(lengths, dtype="<u4")
+    record_starts = np.zeros(len(lengths), dtype="<u8")
+    np.cumsum(record_lengths[:-1], out=record_starts[1:])
+    return SnapshotColumns(
+        np.array(ids, dtype="S16"),
+        np.array(points, dtype="<i8"),
+        np.array(kinds, dtype="u1"),
+        record_starts,
+        record_lengths,
+        [b"".join(records)],
+    )
+
+
+class SnapshotWriter:
+    """Writes snapshots of the receipt tracker every interval seconds from a background thread, so requests carry on
+    being served while a snapshot is written, and a last one when it's closed."""
+
+    def __init__(self: Self, tracker: "ReceiptTracker", path: str, interval: float = 300.0):
+        self.tracker = tracker
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="receipt-snapshot-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self: Self) -> None:
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self: Self) -> None:
+        """Writes a snapshot now, logging rather than raising if it fails, as the previous snapshot is still there."""
+        try:
+            self.tracker.write_snapshot(self.path)
+        except (OSError, ReceiptStorageException):
+            logger.exception("Failed to write a receipt snapshot to %s", self.path)
+
+    def close(self: Self) -> None:
+        """Stops the background thread and writes a last snapshot."""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join()
+        self.write()
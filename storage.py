@@ -0,0 +1,260 @@
+"""Defines the storage backends the receipt tracker can persist receipts to."""
+
+from abc import ABC, abstractmethod
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator, NamedTuple, Self
+
+from exceptions import ReceiptStorageException
+
+logger = logging.getLogger(__name__)
+
+
+class StoredReceipt(NamedTuple):
+    """A receipt as it's written to and read back from storage."""
+
+    receipt_id: str
+    points: int | None
+    payload: bytes
+    offset: int
+
+
+class ReceiptStorageBackend(ABC):
+    """Base class for a durable store of receipts sitting behind the receipt tracker.
+
+    The tracker keeps serving lookups from memory; a backend records every receipt added so the tracker can be rebuilt
+    from it after a restart. A backend must implement every abstract method to be created; flush and close do nothing
+    unless overridden."""
+
+    @abstractmethod
+    def append(self: Self, entries: list[tuple[str, int | None, bytes]]) -> list[int]:
+        """Writes (receipt ID, points, JSON payload) entries and returns the offset each payload is stored at."""
+
+    @abstractmethod
+    def read_payload(self: Self, offset: int) -> bytes:
+        """Reads back the JSON payload stored at an offset returned by append."""
+
+    @abstractmethod
+    def replay(self: Self, start_offset: int = 0) -> Iterator[StoredReceipt]:
+        """Yields every stored receipt in the order they were written, from the one at start_offset on."""
+
+    @abstractmethod
+    def end_offset(self: Self) -> int:
+        """Returns the offset the next receipt appended will be stored at."""
+
+    def flush(self: Self) -> None:
+        """Blocks until everything appended so far is durable."""
+
+    def close(self: Self) -> None:
+        """Flushes and releases the backend."""
+
+
+class AppendOnlyLogBackend(ReceiptStorageBackend):
+    """Stores receipts in a local append-only log file, one receipt per line.
+
+    Each line is `<receipt ID>\\t<points>\\t<JSON payload>\\n`, with the points left empty if they weren't calculated
+    when the receipt was added. Keeping the ID and points ahead of the payload means an eager points tracker can be
+    rebuilt without parsing any JSON.
+
+    Writes are group committed: appends from any number of threads are queued, and a single writer thread writes
+    everything queued with one write and one fsync. While one fsync is in progress the next group builds up, and
+    commit_interval can hold the writer back between commits to batch more appends into each fsync. With
+    wait_for_commit set, append only returns once its entries have been fsynced.
+    """
+
+    def __init__(self: Self, path: str, commit_interval: float = 0.0, wait_for_commit: bool = True):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.wait_for_commit = wait_for_commit
+        self._file = open(path, "ab")
+        self._recover_torn_write()
+        self._end_offset = self._file.tell()
+        self._committed_offset = self._end_offset
+        self._pending: list[bytes] = []
+        self._enqueued_sequence = 0
+        self._committed_sequence = 0
+        self._error: OSError | None = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._writer = threading.Thread(target=self._write_pending, name="receipt-log-writer", daemon=True)
+        self._writer.start()
+
+    def _recover_torn_write(self: Self) -> None:
+        """Truncates a partly written last line left behind by a crash, so new lines aren't appended onto it."""
+        size = os.fstat(self._file.fileno()).st_size
+        with open(self.path, "rb") as log:
+            position = size
+            while position > 0:
+                chunk_start = max(0, position - 65536)
+                log.seek(chunk_start)
+                chunk = log.read(position - chunk_start)
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    position = chunk_start + newline + 1
+                    break
+                position = chunk_start
+        if position != size:
+            logger.warning("Truncating %d bytes of a torn write at the end of %s", size - position, self.path)
+            self._file.truncate(position)
+        self._file.seek(position)
+
+    def _write_pending(self: Self) -> None:
+        """Runs on the writer thread, committing each group of queued lines with a single write and fsync."""
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                lines, self._pending = self._pending, []
+                sequence = self._enqueued_sequence
+                end_offset = self._end_offset
+            try:
+                self._file.write(b"".join(lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError as err:
+                logger.exception("Failed to write to the receipt log %s", self.path)
+                with self._condition:
+                    self._error = err
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._committed_sequence = sequence
+                self._committed_offset = end_offset
+                self._condition.notify_all()
+            if self.commit_interval:
+                time.sleep(self.commit_interval)
+
+    def _wait_for(self: Self, sequence: int) -> None:
+        """Blocks until the given append sequence number has been committed. Must hold the condition."""
+        while self._committed_sequence < sequence:
+            if self._error is not None:
+                raise ReceiptStorageException(f"The receipt log {self.path} can't be written to.") from self._error
+            self._condition.wait()
+
+    def append(self: Self, entries: list[tuple[str, int | None, bytes]]) -> list[int]:
+        """Queues the entries for the writer thread and returns the offset of each payload in the log."""
+        lines = [
+            b"%s\t%s\t%s\n" % (receipt_id.encode(), b"" if points is None else b"%d" % points, payload)
+            for receipt_id, points, payload in entries
+        ]
+        offsets = []
+        with self._condition:
+            if self._error is not None or self._closed:
+                raise ReceiptStorageException(f"The receipt log {self.path} can't be written to.") from self._error
+            for line in lines:
+                offsets.append(self._end_offset)
+                self._end_offset += len(line)
+            self._pending.extend(lines)
+            self._enqueued_sequence += 1
+            sequence = self._enqueued_sequence
+            self._condition.notify_all()
+            if self.wait_for_commit:
+                self._wait_for(sequence)
+        return offsets
+
+    def read_payload(self: Self, offset: int) -> bytes:
+        """Reads the JSON payload from the line starting at the offset."""
+        with self._condition:
+            if offset >= self._committed_offset:
+                self._wait_for(self._enqueued_sequence)
+        with open(self.path, "rb") as log:
+            log.seek(offset)
+            return log.readline().rstrip(b"\n").split(b"\t", 2)[2]
+
+    def replay(self: Self, start_offset: int = 0) -> Iterator[StoredReceipt]:
+        """Reads the log back from the line starting at start_offset, or from the start if the log is shorter."""
+        self.flush()
+        offset = start_offset
+        if offset > self._committed_offset:
+            logger.warning("%s ends before offset %d, so it's read back from the start", self.path, offset)
+            offset = 0
+        with open(self.path, "rb", buffering=1 << 20) as log:
+            log.seek(offset)
+            for line in log:
+                receipt_id, points, payload = line.rstrip(b"\n").split(b"\t", 2)
+                yield StoredReceipt(receipt_id.decode(), int(points) if points else None, payload, offset)
+                offset += len(line)
+
+    def end_offset(self: Self) -> int:
+        with self._condition:
+            return self._end_offset
+
+    def flush(self: Self) -> None:
+        """Waits for the writer thread to commit everything queued so far."""
+        with self._condition:
+            self._wait_for(self._enqueued_sequence)
+
+    def close(self: Self) -> None:
+        """Commits everything queued, then stops the writer thread and closes the log."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._writer.join()
+        self._file.close()
+
+
+class SqliteSpillStore:
+    """An on-disk SQLite table that receipts evicted from the tracker's memory are spilled to.
+
+    Rows are keyed by the receipt ID bytes and hold the receipt's points, if they've been calculated, and its JSON
+    payload, if the whole receipt was evicted rather than just an eager points record. A temporary store's database is
+    deleted when it's closed."""
+
+    def __init__(self: Self, path: str, temporary: bool = False):
+        self.path = path
+        self.temporary = temporary
+        # Lookups of spilled receipts, whether or not they were found.
+        self.reads = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS spilled_receipts (id BLOB PRIMARY KEY, points INTEGER, payload BLOB)"
+        )
+
+    def put_many(self: Self, rows: list[tuple[bytes, int | None, bytes | None]]) -> None:
+        """Writes (receipt ID bytes, points, JSON payload) rows, replacing any already spilled under the same ID."""
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO spilled_receipts VALUES (?, ?, ?)", rows)
+
+    def get(self: Self, id_bytes: bytes) -> tuple[int | None, bytes | None] | None:
+        """Returns the (points, JSON payload) spilled for a receipt, or None if it was never spilled."""
+        with self._lock:
+            self.reads += 1
+            return self._connection.execute(
+                "SELECT points, payload FROM spilled_receipts WHERE id = ?", (id_bytes,)
+            ).fetchone()
+
+    def set_points(self: Self, id_bytes: bytes, points: int) -> None:
+        """Records the points calculated for a spilled receipt so they aren't calculated again."""
+        with self._lock:
+            self._connection.execute("UPDATE spilled_receipts SET points = ? WHERE id = ?", (points, id_bytes))
+
+    def __len__(self: Self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM spilled_receipts").fetchone()[0]
+
+    def clear(self: Self) -> None:
+        """Removes every spilled receipt and resets the read count."""
+        with self._lock:
+            self._connection.execute("DELETE FROM spilled_receipts")
+            self.reads = 0
+
+    def close(self: Self) -> None:
+        """Closes the database, deleting it if the store is temporary."""
+        with self._lock:
+            self._connection.close()
+            if self.temporary:
+                for path in (self.path, f"{self.path}-wal", f"{self.path}-shm"):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
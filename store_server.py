@@ -0,0 +1,264 @@
+"""A small Redis-protocol store daemon for sharing receipts between worker processes on one host.
+
+Run from the repository root with `python -m store_server /tmp/receipts.sock`, then point every worker at the socket
+with FLASK_RECEIPTS_SHARED_STORE_PATH. It serves the subset of Redis commands the shared store client uses, plus a few
+for poking at it with redis-cli, over RESP on a unix socket. It keeps everything in memory in one asyncio event loop,
+so commands from every connection are applied one at a time, and is a stand-in for a local Redis, which can be used
+instead unchanged.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import threading
+from typing import Callable, Self
+
+logger = logging.getLogger(__name__)
+
+Value = bytes | dict[bytes, bytes]
+
+
+class SimpleString(bytes):
+    """A status reply, like OK, sent as a RESP simple string rather than a bulk string."""
+
+
+class CommandError(Exception):
+    """An error replied to the client for a command it sent, leaving the connection open."""
+
+
+WRONG_TYPE = CommandError("WRONGTYPE Operation against a key holding the wrong kind of value")
+
+# The fewest arguments each command takes after its name.
+MIN_ARGS = {
+    b"ECHO": 1,
+    b"GET": 1,
+    b"SET": 2,
+    b"DEL": 1,
+    b"EXISTS": 1,
+    b"HSET": 3,
+    b"HGET": 2,
+    b"HMGET": 2,
+    b"HGETALL": 1,
+    b"HINCRBY": 3,
+}
+
+
+def encode_reply(reply: object) -> bytes:
+    """Encodes a reply in RESP."""
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, SimpleString):
+        return b"+" + reply + b"\r\n"
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, CommandError):
+        return b"-" + str(reply).encode() + b"\r\n"
+    return b"*%d\r\n" % len(reply) + b"".join(encode_reply(item) for item in reply)
+
+
+def _parse_command(buffer: bytearray, pos: int) -> tuple[list[bytes], int] | None:
+    """Parses the command starting at pos, returning it and where the next one starts, or None if it's incomplete.
+
+    Commands are RESP arrays of bulk strings, or inline, as words on a line, as typed into telnet."""
+    end = buffer.find(b"\r\n", pos)
+    if end < 0:
+        return None
+    if buffer[pos : pos + 1] != b"*":
+        return bytes(buffer[pos:end]).split(), end + 2
+    command = []
+    cursor = end + 2
+    for _ in range(int(buffer[pos + 1 : end])):
+        end = buffer.find(b"\r\n", cursor)
+        if end < 0:
+            return None
+        if buffer[cursor : cursor + 1] != b"$":
+            raise ValueError(f"expected '$', got {bytes(buffer[cursor : cursor + 1])!r}")
+        start = end + 2
+        cursor = start + int(buffer[cursor + 1 : end]) + 2
+        if cursor > len(buffer):
+            return None
+        command.append(bytes(buffer[start : cursor - 2]))
+    return command, cursor
+
+
+def parse_commands(buffer: bytearray) -> list[list[bytes]]:
+    """Parses every complete command at the start of the buffer and removes them from it, leaving any partly received
+    command for when the rest arrives. Raises ValueError if the buffer isn't RESP."""
+    commands = []
+    pos = 0
+    while (parsed := _parse_command(buffer, pos)) is not None:
+        command, pos = parsed
+        if command:
+            commands.append(command)
+    del buffer[:pos]
+    return commands
+
+
+class StoreServer:
+    """Serves an in-memory key-value store of strings and hashes over RESP on a unix socket."""
+
+    def __init__(self: Self, path: str):
+        self.path = path
+        self.data: dict[bytes, Value] = {}
+        self._commands: dict[bytes, Callable[[list[bytes]], object]] = {
+            b"PING": self._ping,
+            b"ECHO": lambda args: args[0],
+            b"GET": self._get,
+            b"SET": self._set,
+            b"DEL": self._del,
+            b"EXISTS": lambda args: sum(key in self.data for key in args),
+            b"HSET": self._hset,
+            b"HGET": lambda args: self._hash(args[0]).get(args[1], None),
+            b"HMGET": self._hmget,
+            b"HGETALL": lambda args: [part for item in self._hash(args[0]).items() for part in item],
+            b"HINCRBY": self._hincrby,
+            b"DBSIZE": lambda args: len(self.data),
+            b"FLUSHDB": self._flushdb,
+        }
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self._thread: threading.Thread | None = None
+
+    def execute(self: Self, command: list[bytes]) -> object:
+        """Runs a command, returning its reply, or the error to reply with."""
+        name = command[0].upper()
+        handler = self._commands.get(name, None)
+        if handler is None:
+            return CommandError(f"ERR unknown command '{command[0].decode(errors='replace')}'")
+        if len(command) - 1 < MIN_ARGS.get(name, 0):
+            return CommandError(f"ERR wrong number of arguments for '{command[0].decode(errors='replace')}' command")
+        try:
+            return handler(command[1:])
+        except CommandError as err:
+            return err
+
+    def _ping(self: Self, args: list[bytes]) -> object:
+        return args[0] if args else SimpleString(b"PONG")
+
+    def _get(self: Self, args: list[bytes]) -> bytes | None:
+        value = self.data.get(args[0], None)
+        if isinstance(value, dict):
+            raise WRONG_TYPE
+        return value
+
+    def _set(self: Self, args: list[bytes]) -> SimpleString | None:
+        key, value = args[0], args[1]
+        if b"NX" in (arg.upper() for arg in args[2:]) and key in self.data:
+            return None
+        self.data[key] = value
+        return SimpleString(b"OK")
+
+    def _del(self: Self, args: list[bytes]) -> int:
+        return sum(self.data.pop(key, None) is not None for key in args)
+
+    def _hash(self: Self, key: bytes, create: bool = False) -> dict[bytes, bytes]:
+        """Returns the hash at a key, which is empty, or created if asked, if there's nothing there."""
+        value = self.data.get(key, None)
+        if value is None:
+            value = {}
+            if create:
+                self.data[key] = value
+        elif not isinstance(value, dict):
+            raise WRONG_TYPE
+        return value
+
+    def _hset(self: Self, args: list[bytes]) -> int:
+        if len(args) % 2 == 0:
+            raise CommandError("ERR wrong number of arguments for 'hset' command")
+        fields = self._hash(args[0], create=True)
+        added = 0
+        for field, value in zip(args[1::2], args[2::2]):
+            added += field not in fields
+            fields[field] = value
+        return added
+
+    def _hmget(self: Self, args: list[bytes]) -> list[bytes | None]:
+        fields = self._hash(args[0])
+        return [fields.get(field, None) for field in args[1:]]
+
+    def _hincrby(self: Self, args: list[bytes]) -> int:
+        try:
+            value = int(self._hash(args[0]).get(args[1], b"0")) + int(args[2])
+        except ValueError:
+            raise CommandError("ERR hash value is not an integer") from None
+        self._hash(args[0], create=True)[args[1]] = b"%d" % value
+        return value
+
+    def _flushdb(self: Self, args: list[bytes]) -> SimpleString:
+        self.data.clear()
+        return SimpleString(b"OK")
+
+    async def _handle_connection(self: Self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answers the commands sent on a connection until it's closed. The replies to every command that arrived
+        together, e.g. a client's pipeline, are written back together."""
+        buffer = bytearray()
+        try:
+            while data := await reader.read(65536):
+                buffer += data
+                replies = []
+                for command in parse_commands(buffer):
+                    if command[0].upper() == b"QUIT":
+                        writer.write(b"".join(replies) + encode_reply(SimpleString(b"OK")))
+                        return
+                    replies.append(encode_reply(self.execute(command)))
+                writer.write(b"".join(replies))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        except ValueError as err:
+            writer.write(encode_reply(CommandError(f"ERR Protocol error: {err}")))
+        finally:
+            writer.close()
+
+    async def _start(self: Self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle_connection, path=self.path)
+        logger.info("Serving the shared receipt store on %s", self.path)
+
+    def serve_forever(self: Self) -> None:
+        """Serves the store until interrupted."""
+
+        async def serve() -> None:
+            await self._start()
+            async with self._server:
+                await self._server.serve_forever()
+
+        asyncio.run(serve())
+
+    def start(self: Self) -> None:
+        """Starts serving the store from a background thread, returning once it's listening."""
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._start())
+        self._thread = threading.Thread(target=self._loop.run_forever, name="store-server", daemon=True)
+        self._thread.start()
+
+    def stop(self: Self) -> None:
+        """Stops a store started with start."""
+
+        async def shutdown() -> None:
+            self._server.close()
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def main() -> None:
+    """Runs the store daemon."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("socket", help="Path of the unix socket to listen on.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    StoreServer(args.socket).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
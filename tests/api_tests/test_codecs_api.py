@@ -0,0 +1,136 @@
+"""Tests the process and points endpoints with each receipt codec."""
+
+from copy import deepcopy
+from http import HTTPStatus
+from typing import Self
+from unittest.mock import patch
+
+from flask import Flask
+import pytest
+
+from app import create_app
+from receipt_codecs import CODECS, get_codec
+from receipt_service import ReceiptTracker
+from tests.api_tests.conftest import STANDARD_INPUT_BODY_1, STANDARD_INPUT_BODY_2, STANDARD_RECEIPT_1
+
+
+def changed(body: dict, **changes: object) -> dict:
+    """Returns a copy of a request body with some fields changed, or removed if changed to `...`."""
+    body = deepcopy(body)
+    for field_name, value in changes.items():
+        if value is ...:
+            del body[field_name]
+        else:
+            body[field_name] = value
+    return body
+
+
+def with_item(**changes: object) -> dict:
+    """Returns a copy of the first standard request body with its first item changed."""
+    body = deepcopy(STANDARD_INPUT_BODY_1)
+    body["items"][0] = changed(body["items"][0], **changes)
+    return body
+
+
+INVALID_BODIES = [
+    {},
+    [],
+    changed(STANDARD_INPUT_BODY_1, retailer=...),
+    changed(STANDARD_INPUT_BODY_1, retailer=None),
+    changed(STANDARD_INPUT_BODY_1, retailer="%"),
+    changed(STANDARD_INPUT_BODY_1, retailer=""),
+    changed(STANDARD_INPUT_BODY_1, retailer=5),
+    changed(STANDARD_INPUT_BODY_1, purchaseDate="01/02/2022"),
+    changed(STANDARD_INPUT_BODY_1, purchaseDate="2022-02-30"),
+    changed(STANDARD_INPUT_BODY_1, purchaseTime="01:02:03"),
+    changed(STANDARD_INPUT_BODY_1, purchaseTime="25:00"),
+    changed(STANDARD_INPUT_BODY_1, items=[]),
+    changed(STANDARD_INPUT_BODY_1, items={}),
+    changed(STANDARD_INPUT_BODY_1, total="abc"),
+    changed(STANDARD_INPUT_BODY_1, total="-1.00"),
+    changed(STANDARD_INPUT_BODY_1, total="1.001"),
+    changed(STANDARD_INPUT_BODY_1, total=True),
+    changed(STANDARD_INPUT_BODY_1, total="NaN"),
+    changed(STANDARD_INPUT_BODY_1, total="1e1000000"),
+    changed(STANDARD_INPUT_BODY_1, total="123456789012345678901234567.00"),
+    changed(STANDARD_INPUT_BODY_1, total=1e300),
+    changed(STANDARD_INPUT_BODY_1, unexpected="field"),
+    with_item(shortDescription=...),
+    with_item(shortDescription="&"),
+    with_item(price=...),
+    with_item(price=6.499),
+    with_item(price="Infinity"),
+    with_item(price="1E+1000000"),
+    with_item(price=10**30),
+    with_item(unexpected="field"),
+]
+
+
+@pytest.fixture(params=list(CODECS))
+def codec_app(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch):
+    """Creates a testing app using each codec in turn."""
+    monkeypatch.setenv("FLASK_RECEIPTS_CODEC", f'"{request.param}"')
+    app = create_app()
+    app.config["TESTING"] = True
+    yield app
+
+
+class TestCodecsAPI:
+    """Tests that every codec behaves the same through the API."""
+
+    @pytest.mark.parametrize(
+        ("body", "points"),
+        [
+            (STANDARD_INPUT_BODY_1, 28),
+            (STANDARD_INPUT_BODY_2, 109),
+            (changed(STANDARD_INPUT_BODY_2, total=9), 109),
+            (changed(STANDARD_INPUT_BODY_2, total=9.0), 109),
+        ],
+    )
+    def test_process_and_get_points(self: Self, codec_app: Flask, body: dict, points: int) -> None:
+        """Tests that a receipt decoded by the codec is stored and scored, with responses encoded as JSON."""
+        client = codec_app.test_client()
+        response = client.post("/receipts/process", json=body)
+        assert response.status_code == HTTPStatus.OK
+        assert response.mimetype == "application/json"
+        receipt_id = response.json["id"]
+
+        response = client.get(f"/receipts/{receipt_id}/points")
+        assert response.status_code == HTTPStatus.OK
+        assert response.mimetype == "application/json"
+        assert response.json == {"points": points}
+
+    def test_decoded_receipt_matches_model(self: Self, codec_app: Flask) -> None:
+        """Tests that the codec decodes the body into the same receipt the model would."""
+        with patch.object(ReceiptTracker, "add_receipt", return_value="1") as add_receipt:
+            codec_app.test_client().post("/receipts/process", json=STANDARD_INPUT_BODY_1)
+        add_receipt.assert_called_once_with(STANDARD_RECEIPT_1, idempotency_key=None)
+
+    @pytest.mark.parametrize("body", INVALID_BODIES)
+    def test_process_invalid_body(self: Self, codec_app: Flask, body: object) -> None:
+        """Tests that the codec rejects exactly what the schema rejects, with the same 400 response."""
+        response = codec_app.test_client().post("/receipts/process", json=body)
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert response.json["message"] == "The receipt is invalid."
+
+    @pytest.mark.parametrize("amount", ["1e2", "12345678901234567890123456.00", " 9.00 ", "-0.00"])
+    def test_process_valid_amount(self: Self, codec_app: Flask, amount: str) -> None:
+        """Tests that the codec accepts the amounts at the edges of what the schema accepts."""
+        response = codec_app.test_client().post("/receipts/process", json=with_item(price=amount))
+        assert response.status_code == HTTPStatus.OK
+        response = codec_app.test_client().post("/receipts/process", json=changed(STANDARD_INPUT_BODY_1, total=amount))
+        assert response.status_code == HTTPStatus.OK
+
+    @pytest.mark.parametrize(
+        ("data", "content_type"),
+        [(b'{"retailer": ', "application/json"), (b"retailer=Target", "application/x-www-form-urlencoded")],
+    )
+    def test_process_not_json(self: Self, codec_app: Flask, data: bytes, content_type: str) -> None:
+        """Tests that a body that isn't JSON is rejected with a 400."""
+        response = codec_app.test_client().post("/receipts/process", data=data, content_type=content_type)
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_unknown_codec(self: Self) -> None:
+        """Tests that configuring a codec that doesn't exist fails."""
+        with pytest.raises(ValueError):
+            get_codec("pickle")
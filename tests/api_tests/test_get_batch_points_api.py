@@ -0,0 +1,62 @@
+"""Tests the batch points api."""
+
+from http import HTTPStatus
+from typing import Self
+from unittest.mock import patch
+
+from flask import Flask
+from flask.testing import FlaskClient
+import pytest
+
+from tests.api_tests.test_get_points_api import RECEIPT_ID_1, RECEIPT_ID_2, UNKNOWN_RECEIPT_ID, fake__get_receipt
+
+
+@patch("receipt_service.ReceiptTracker._get_receipt", fake__get_receipt)
+class TestGetBatchPointsAPI:
+    """Tests the batch points api."""
+
+    api_path = "/receipts/points"
+
+    def test_get_batch_points_standard_request(self: Self, client: FlaskClient) -> None:
+        """Tests a standard request to the batch points endpoint."""
+
+        response = client.post(
+            self.api_path,
+            json={"ids": [RECEIPT_ID_1, RECEIPT_ID_2]},
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.json == {"points": {RECEIPT_ID_1: 28, RECEIPT_ID_2: 109}, "notFound": []}
+
+    def test_get_batch_points_not_found(self: Self, client: FlaskClient) -> None:
+        """Tests that IDs with no receipt are listed separately without failing the request."""
+
+        response = client.post(
+            self.api_path,
+            json={"ids": [UNKNOWN_RECEIPT_ID, RECEIPT_ID_1, UNKNOWN_RECEIPT_ID]},
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.json == {"points": {RECEIPT_ID_1: 28}, "notFound": [UNKNOWN_RECEIPT_ID]}
+
+    @pytest.mark.parametrize(
+        "body",
+        [{}, {"ids": []}, {"ids": RECEIPT_ID_1}, {"ids": ["1 2"]}, {"ids": [RECEIPT_ID_1, "1"]}, [RECEIPT_ID_1]],
+    )
+    def test_get_batch_points_invalid_request(self: Self, client: FlaskClient, body: dict | list) -> None:
+        """Tests an invalid request to the batch points endpoint."""
+
+        response = client.post(
+            self.api_path,
+            json=body,
+        )
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert response.json["message"] == "The list of IDs is invalid."
+
+    def test_get_batch_points_too_large(self: Self, app: Flask, client: FlaskClient) -> None:
+        """Tests a request to the batch points endpoint with more IDs than allowed."""
+
+        app.config["RECEIPTS_MAX_BATCH_SIZE"] = 1
+        response = client.post(
+            self.api_path,
+            json={"ids": [RECEIPT_ID_1, RECEIPT_ID_2]},
+        )
+        assert response.status_code == HTTPStatus.BAD_REQUEST
@@ -1,20 +1,28 @@
 """Tests the get points api."""
 
 from http import HTTPStatus
+import logging
 from typing import Self
 from unittest.mock import patch
 
+from flask import Flask
 from flask.testing import FlaskClient
+import pytest
 from exceptions import NoReceiptFoundException
-from receipt_service import ReceiptData
+from receipt_service import ReceiptData, ReceiptTracker, points_trace
 from tests.api_tests.conftest import STANDARD_RECEIPT_1, STANDARD_RECEIPT_2
 
 
+RECEIPT_ID_1 = "01890a5d-ac96-774b-bcce-b302099a8057"
+RECEIPT_ID_2 = "01890a5d-ac97-7c3d-8f4a-5e2b1c0d9e8f"
+UNKNOWN_RECEIPT_ID = "01890a5d-ac98-7000-8000-000000000000"
+
+
 def fake__get_receipt(self: Self, id: str) -> ReceiptData:
     """Fake method to return a standard receipt."""
-    if id == "1":
+    if id == RECEIPT_ID_1:
         return STANDARD_RECEIPT_1
-    if id == "2":
+    if id == RECEIPT_ID_2:
         return STANDARD_RECEIPT_2
     raise NoReceiptFoundException(id)
 
@@ -23,8 +31,8 @@ def fake__get_receipt(self: Self, id: str) -> ReceiptData:
 class TestGetPointsAPI:
     """Tests the get points api."""
 
-    api_path_1 = "/receipts/1/points"
-    api_path_2 = "/receipts/2/points"
+    api_path_1 = f"/receipts/{RECEIPT_ID_1}/points"
+    api_path_2 = f"/receipts/{RECEIPT_ID_2}/points"
 
     def test_get_points_standard_request(self: Self, client: FlaskClient) -> None:
         """Tests a standard request to the get points endpoint."""
@@ -48,8 +56,32 @@ class TestGetPointsAPI:
         """Tests an invalid request to the get points endpoint."""
 
         response = client.get(
-            "/receipts/3/points",
+            f"/receipts/{UNKNOWN_RECEIPT_ID}/points",
         )
 
         assert response.status_code == HTTPStatus.NOT_FOUND
         assert response.json["message"] == "No receipt found for that ID."
+
+    @pytest.mark.parametrize("receipt_id", ["3", "not-a-uuid", RECEIPT_ID_1[:-1], RECEIPT_ID_1 + "0"])
+    def test_get_points_malformed_id(self: Self, client: FlaskClient, receipt_id: str) -> None:
+        """Tests that a malformed ID gets a 404 without being looked up."""
+
+        with patch.object(ReceiptTracker, "get_points_for_receipt") as get_points_for_receipt:
+            response = client.get(f"/receipts/{receipt_id}/points")
+
+        assert response.status_code == HTTPStatus.NOT_FOUND
+        assert response.json["message"] == "No receipt found for that ID."
+        get_points_for_receipt.assert_not_called()
+
+    def test_get_points_sampled_trace(
+        self: Self, app: Flask, client: FlaskClient, caplog: pytest.LogCaptureFixture
+    ) -> None:
+        """Tests that a request sampled for tracing logs the rule breakdown of the receipt it scored."""
+        app.config["RECEIPTS_TRACE_SAMPLE_RATE"] = 1.0
+        ReceiptTracker().clear()
+        with caplog.at_level(logging.INFO, logger="app"):
+            response = client.get(self.api_path_1)
+        assert response.status_code == HTTPStatus.OK
+        assert f"Points trace for GET {self.api_path_1}" in caplog.text
+        assert "'item_descriptions': 6" in caplog.text
+        assert points_trace.get() is None
@@ -0,0 +1,77 @@
+"""Tests the api with async ingest on."""
+
+from http import HTTPStatus
+import threading
+from typing import Self
+from unittest.mock import patch
+
+from flask import Flask
+from flask.testing import FlaskClient
+import pytest
+
+from app import create_app
+from exceptions import IngestQueueFullException
+from receipt_service import ReceiptTracker
+from tests.api_tests.conftest import STANDARD_INPUT_BODY_1
+
+
+@pytest.fixture()
+def async_app(monkeypatch: pytest.MonkeyPatch):
+    """Creates a fake testing app with async ingest on."""
+    monkeypatch.setenv("FLASK_RECEIPTS_ASYNC_INGEST", "true")
+    monkeypatch.setenv("FLASK_RECEIPTS_PENDING_WAIT", "0.01")
+    ReceiptTracker().clear()
+    app = create_app()
+    app.config["TESTING"] = True
+    yield app
+    app.extensions["receipt_ingest_queue"].close()
+    ReceiptTracker().clear()
+
+
+@pytest.fixture()
+def async_client(async_app: Flask):
+    """Creates a fake testing client for the async ingest app."""
+    with async_app.test_client() as client:
+        yield client
+
+
+class TestIngestAPI:
+    """Tests the process and get points apis with async ingest on."""
+
+    def test_process_then_get_points(self: Self, async_client: FlaskClient) -> None:
+        """Tests that a queued receipt's points can be fetched once it's drained."""
+        response = async_client.post("/receipts/process", json=STANDARD_INPUT_BODY_1)
+        assert response.status_code == HTTPStatus.OK
+        receipt_id = response.json["id"]
+        async_client.application.extensions["receipt_ingest_queue"].wait_for(receipt_id, timeout=5)
+
+        response = async_client.get(f"/receipts/{receipt_id}/points")
+        assert response.status_code == HTTPStatus.OK
+        assert response.json == {"points": 28}
+
+        response = async_client.get("/receipts/ingest/stats")
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["enqueued"] == response.json["drained"] == 1
+
+    def test_get_points_pending(self: Self, async_client: FlaskClient) -> None:
+        """Tests that a receipt still queued gets a 202 with a retry hint."""
+        release = threading.Event()
+        with patch("receipt_service.ReceiptTracker.add_receipts", lambda *args, **kwargs: release.wait()):
+            receipt_id = async_client.post("/receipts/process", json=STANDARD_INPUT_BODY_1).json["id"]
+            response = async_client.get(f"/receipts/{receipt_id}/points")
+            release.set()
+        assert response.status_code == HTTPStatus.ACCEPTED
+        assert response.headers["Retry-After"] == "1"
+        assert response.json["message"] == "The receipt is still being processed."
+
+    def test_process_queue_full(self: Self, async_client: FlaskClient) -> None:
+        """Tests that a full ingest queue is answered with a 503 and a retry hint."""
+        with patch("ingest_queue.IngestQueue.submit", side_effect=IngestQueueFullException):
+            response = async_client.post("/receipts/process", json=STANDARD_INPUT_BODY_1)
+        assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+        assert response.headers["Retry-After"] == "1"
+
+    def test_stats_without_async_ingest(self: Self, client: FlaskClient) -> None:
+        """Tests that the stats endpoint 404s when async ingest is off."""
+        response = client.get("/receipts/ingest/stats")
+        assert response.status_code == HTTPStatus.NOT_FOUND
@@ -0,0 +1,61 @@
+"""Tests the metrics api."""
+
+from http import HTTPStatus
+from typing import Self
+
+from flask.testing import FlaskClient
+import pytest
+
+from metrics import POINTS_LOOKUPS, REGISTRY, RESPONSES, STAGE_SECONDS
+from receipt_service import ReceiptTracker
+from tests.api_tests.conftest import STANDARD_INPUT_BODY_1
+from tests.api_tests.test_get_points_api import UNKNOWN_RECEIPT_ID
+
+
+class TestMetricsAPI:
+    """Tests the metrics api."""
+
+    @pytest.fixture(autouse=True)
+    def metrics_reset(self: Self):
+        """Resets the metrics and the tracker between tests."""
+        REGISTRY.clear()
+        ReceiptTracker().clear()
+        yield
+        REGISTRY.enabled = True
+        ReceiptTracker().clear()
+
+    def test_requests_are_recorded(self: Self, client: FlaskClient) -> None:
+        """Tests that responses, stages and points lookups are recorded and served."""
+        receipt_id = client.post("/receipts/process", json=STANDARD_INPUT_BODY_1).json["id"]
+        client.get(f"/receipts/{receipt_id}/points")
+        client.get(f"/receipts/{receipt_id}/points")
+        client.get(f"/receipts/{UNKNOWN_RECEIPT_ID}/points")
+        client.post("/receipts/process", json={})
+
+        assert RESPONSES.value("/receipts/process", "200") == 1
+        assert RESPONSES.value("/receipts/process", "400") == 1
+        assert RESPONSES.value("/receipts/<string:id>/points", "200") == 2
+        assert RESPONSES.value("/receipts/<string:id>/points", "404") == 1
+        # The points calculated for the stats when the receipt was added are kept, so neither lookup calculates them.
+        assert POINTS_LOOKUPS.value("calculated") == 0
+        assert POINTS_LOOKUPS.value("hit") == 2
+        assert POINTS_LOOKUPS.value("not_found") == 1
+        for stage in ("validate", "model", "points", "store"):
+            assert STAGE_SECONDS.count(stage) >= 1
+
+        response = client.get("/metrics")
+        assert response.status_code == HTTPStatus.OK
+        assert response.mimetype == "text/plain"
+        body = response.get_data(as_text=True)
+        assert 'receipts_responses_total{endpoint="/receipts/process",status="400"} 1' in body
+        assert "receipts_stored 1" in body
+        # Both lookups found the receipt in memory, the first calculating its points.
+        assert "# TYPE receipts_cache_hits_total counter\nreceipts_cache_hits_total 2" in body
+        for name in ("receipts_cache_misses_total", "receipts_cache_evictions_total", "receipts_spill_reads_total"):
+            assert f"{name} 0" in body
+
+    def test_metrics_disabled(self: Self, client: FlaskClient) -> None:
+        """Tests that the metrics endpoint 404s when metrics are switched off."""
+        REGISTRY.enabled = False
+        response = client.get("/metrics")
+        assert response.status_code == HTTPStatus.NOT_FOUND
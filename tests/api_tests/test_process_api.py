@@ -1,5 +1,6 @@
 """Tests the process endpoint."""
 
+from copy import deepcopy
 from http import HTTPStatus
 from typing import Self
 from unittest.mock import patch
@@ -7,10 +8,14 @@ from unittest.mock import patch
 from flask.testing import FlaskClient
 import pytest
 
-from tests.api_tests.conftest import STANDARD_INPUT_BODY_1, STANDARD_INPUT_BODY_2
+from app import create_app
+from receipt_service import ReceiptTracker
+from tests.api_tests.conftest import STANDARD_INPUT_BODY_1, STANDARD_INPUT_BODY_2, STANDARD_RECEIPT_1
 
+RECEIPT_ID = "01890a5d-ac96-774b-bcce-b302099a8057"
 
-@patch("receipt_service.uuid.uuid4", lambda: "1")
+
+@patch.object(ReceiptTracker, "new_receipt_id", staticmethod(lambda: RECEIPT_ID))
 class TestProcessAPI:
     """Tests the process API endpoint."""
 
@@ -24,7 +29,18 @@ class TestProcessAPI:
             json=STANDARD_INPUT_BODY_1,
         )
         assert response.status_code == HTTPStatus.OK
-        assert response.json == {"id": "1"}
+        assert response.json == {"id": RECEIPT_ID}
+
+    def test_process_stores_receipt_model(self: Self, client: FlaskClient) -> None:
+        """Tests that the validated request body is stored as the receipt model."""
+
+        with patch.object(ReceiptTracker, "add_receipt", return_value=RECEIPT_ID) as add_receipt:
+            response = client.post(
+                self.api_path,
+                json=STANDARD_INPUT_BODY_1,
+            )
+        assert response.status_code == HTTPStatus.OK
+        add_receipt.assert_called_once_with(STANDARD_RECEIPT_1, idempotency_key=None)
 
     def test_process_standard_request_2(self: Self, client: FlaskClient) -> None:
         """Tests a standard request to the process endpoint."""
@@ -34,7 +50,7 @@ class TestProcessAPI:
             json=STANDARD_INPUT_BODY_2,
         )
         assert response.status_code == HTTPStatus.OK
-        assert response.json == {"id": "1"}
+        assert response.json == {"id": RECEIPT_ID}
 
     @pytest.mark.parametrize("field_name", ["retailer", "purchaseDate", "purchaseTime", "items", "total"])
     def test_process_missing_fields(
@@ -44,7 +60,7 @@ class TestProcessAPI:
     ) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         del input_body[field_name]
 
@@ -64,7 +80,7 @@ class TestProcessAPI:
     ) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         input_body[field_name] = None
 
@@ -79,7 +95,7 @@ class TestProcessAPI:
     def test_process_item_missing_short_description(self: Self, client: FlaskClient) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         del input_body["items"][0]["shortDescription"]
 
@@ -94,7 +110,7 @@ class TestProcessAPI:
     def test_process_item_missing_price(self: Self, client: FlaskClient) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         del input_body["items"][0]["price"]
 
@@ -109,7 +125,7 @@ class TestProcessAPI:
     def test_process_item_invalid_price(self: Self, client: FlaskClient) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         input_body["items"][0]["price"] = 6.499
 
@@ -124,7 +140,7 @@ class TestProcessAPI:
     def test_process_item_invalid_short_description(self: Self, client: FlaskClient) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         input_body["items"][0]["shortDescription"] = "&"
 
@@ -139,7 +155,7 @@ class TestProcessAPI:
     def test_process_invalid_retailer(self: Self, client: FlaskClient) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         input_body["retailer"] = "%"
 
@@ -154,7 +170,7 @@ class TestProcessAPI:
     def test_process_invalid_purchase_date(self: Self, client: FlaskClient) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         input_body["purchaseDate"] = "01/02/2022"  # Wrong format
 
@@ -169,7 +185,7 @@ class TestProcessAPI:
     def test_process_invalid_purchase_time(self: Self, client: FlaskClient) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         input_body["purchaseTime"] = "01:02:03"  # Wrong format
 
@@ -184,7 +200,7 @@ class TestProcessAPI:
     def test_process_invalid_total(self: Self, client: FlaskClient) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         input_body["total"] = 6.499
 
@@ -199,7 +215,7 @@ class TestProcessAPI:
     def test_process_invalid_items_amount(self: Self, client: FlaskClient) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         input_body["items"] = []
 
@@ -214,7 +230,7 @@ class TestProcessAPI:
     def test_process_invalid_item(self: Self, client: FlaskClient) -> None:
         """Tests an invalid request to the process endpoint."""
 
-        input_body = STANDARD_INPUT_BODY_1.copy()
+        input_body = deepcopy(STANDARD_INPUT_BODY_1)
 
         input_body["items"][0] = {}
 
@@ -225,3 +241,27 @@ class TestProcessAPI:
 
         assert response.status_code == HTTPStatus.BAD_REQUEST
         assert response.json["message"] == "The receipt is invalid."
+
+
+class TestProcessDedupAPI:
+    """Tests the process API endpoint with deduplication on."""
+
+    api_path = "/receipts/process"
+
+    def test_process_dedup(self: Self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Tests that with deduplication on, resubmissions and reused idempotency keys get the original ID."""
+        monkeypatch.setenv("FLASK_RECEIPTS_DEDUP_MAX_ENTRIES", "100")
+        client = create_app().test_client()
+        try:
+            first_id = client.post(self.api_path, json=STANDARD_INPUT_BODY_1).json["id"]
+            assert client.post(self.api_path, json=deepcopy(STANDARD_INPUT_BODY_1)).json["id"] == first_id
+            keyed_id = client.post(
+                self.api_path, json=STANDARD_INPUT_BODY_2, headers={"Idempotency-Key": "retry-1"}
+            ).json["id"]
+            assert keyed_id != first_id
+            response = client.post(self.api_path, json=STANDARD_INPUT_BODY_1, headers={"Idempotency-Key": "retry-1"})
+            assert response.json["id"] == keyed_id
+            assert ReceiptTracker().dedup.stats()["hits"] == 2
+        finally:
+            ReceiptTracker().configure()
+            ReceiptTracker().clear()
@@ -0,0 +1,107 @@
+"""Tests the batch process endpoint."""
+
+from copy import deepcopy
+from http import HTTPStatus
+import json
+from typing import Self
+
+from flask import Flask
+from flask.testing import FlaskClient
+import pytest
+
+from receipt_service import ReceiptTracker
+from tests.api_tests.conftest import (
+    STANDARD_INPUT_BODY_1,
+    STANDARD_INPUT_BODY_2,
+    STANDARD_RECEIPT_1,
+    STANDARD_RECEIPT_2,
+)
+
+
+class TestProcessBatchAPI:
+    """Tests the batch process API endpoint."""
+
+    api_path = "/receipts/process/batch"
+
+    @pytest.fixture(autouse=True)
+    def tracker_reset(self: Self):
+        """Resets the tracker between tests."""
+        ReceiptTracker().clear()
+        yield
+        ReceiptTracker().clear()
+
+    def test_process_batch_standard_request(self: Self, client: FlaskClient) -> None:
+        """Tests a standard request to the batch process endpoint."""
+
+        response = client.post(
+            self.api_path,
+            json=[STANDARD_INPUT_BODY_1, STANDARD_INPUT_BODY_2],
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["errors"] == {}
+        id_1, id_2 = response.json["ids"]
+        assert ReceiptTracker().receipt_id_to_data == {id_1: STANDARD_RECEIPT_1, id_2: STANDARD_RECEIPT_2}
+
+    def test_process_batch_ndjson_request(self: Self, client: FlaskClient) -> None:
+        """Tests a request to the batch process endpoint with an NDJSON body."""
+
+        response = client.post(
+            self.api_path,
+            data="\n".join([json.dumps(STANDARD_INPUT_BODY_1), "", json.dumps(STANDARD_INPUT_BODY_2), ""]),
+            content_type="application/x-ndjson",
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["errors"] == {}
+        assert len(response.json["ids"]) == 2
+
+    def test_process_batch_invalid_receipts(self: Self, client: FlaskClient) -> None:
+        """Tests that invalid receipts in a batch are reported without rejecting the valid ones."""
+
+        input_body = deepcopy(STANDARD_INPUT_BODY_2)
+        input_body["retailer"] = "%"
+
+        response = client.post(
+            self.api_path,
+            json=[input_body, STANDARD_INPUT_BODY_1, None],
+        )
+        assert response.status_code == HTTPStatus.OK
+        invalid_id, valid_id, none_id = response.json["ids"]
+        assert invalid_id is None and none_id is None
+        assert set(response.json["errors"]) == {"0", "2"}
+        assert "retailer" in response.json["errors"]["0"]
+        assert ReceiptTracker().receipt_id_to_data == {valid_id: STANDARD_RECEIPT_1}
+
+    def test_process_batch_invalid_ndjson_line(self: Self, client: FlaskClient) -> None:
+        """Tests that a line of an NDJSON body that isn't JSON is reported as an invalid receipt."""
+
+        response = client.post(
+            self.api_path,
+            data="{not json\n" + json.dumps(STANDARD_INPUT_BODY_1),
+            content_type="application/x-ndjson",
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["ids"][0] is None
+        assert response.json["errors"] == {"0": {"_schema": ["Invalid JSON."]}}
+
+    @pytest.mark.parametrize("body", [STANDARD_INPUT_BODY_1, "not json"])
+    def test_process_batch_not_an_array(self: Self, client: FlaskClient, body: dict | str) -> None:
+        """Tests an invalid request to the batch process endpoint."""
+
+        response = client.post(
+            self.api_path,
+            data=json.dumps(body) if isinstance(body, dict) else body,
+            content_type="application/json",
+        )
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert response.json["message"] == "The batch must be a JSON array of receipts."
+
+    def test_process_batch_too_large(self: Self, app: Flask, client: FlaskClient) -> None:
+        """Tests a request to the batch process endpoint with more receipts than allowed."""
+
+        app.config["RECEIPTS_MAX_BATCH_SIZE"] = 1
+        response = client.post(
+            self.api_path,
+            json=[STANDARD_INPUT_BODY_1, STANDARD_INPUT_BODY_2],
+        )
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert ReceiptTracker().receipt_id_to_data == {}
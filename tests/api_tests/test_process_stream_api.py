@@ -0,0 +1,163 @@
+"""Tests the streaming process endpoint."""
+
+from copy import deepcopy
+from http import HTTPStatus
+import io
+import json
+from typing import Self
+
+from flask import Flask
+from flask.testing import FlaskClient
+import pytest
+
+from metrics import REQUEST_SECONDS
+from receipt_service import ReceiptTracker
+from tests.api_tests.conftest import (
+    STANDARD_INPUT_BODY_1,
+    STANDARD_INPUT_BODY_2,
+    STANDARD_RECEIPT_1,
+    STANDARD_RECEIPT_2,
+)
+
+
+class CountingStream(io.BytesIO):
+    """Request body that counts the lines read from it, to check it's read as the response is streamed."""
+
+    lines_read = 0
+
+    def readline(self: Self, size: int | None = -1) -> bytes:
+        line = super().readline(size)
+        if line:
+            self.lines_read += 1
+        return line
+
+
+class TestProcessStreamAPI:
+    """Tests the streaming process API endpoint."""
+
+    api_path = "/receipts/process/stream"
+
+    @pytest.fixture(autouse=True)
+    def tracker_reset(self: Self):
+        """Resets the tracker between tests."""
+        ReceiptTracker().clear()
+        yield
+        ReceiptTracker().clear()
+
+    def post_lines(self: Self, client: FlaskClient, lines: list[str]) -> list[dict]:
+        """Posts the lines as an NDJSON body and returns the result lines."""
+        response = client.post(self.api_path, data="\n".join(lines), content_type="application/x-ndjson")
+        assert response.status_code == HTTPStatus.OK
+        assert response.mimetype == "application/x-ndjson"
+        return [json.loads(line) for line in response.get_data().splitlines()]
+
+    def test_process_stream_standard_request(self: Self, client: FlaskClient) -> None:
+        """Tests a standard request to the streaming process endpoint."""
+
+        results = self.post_lines(client, [json.dumps(STANDARD_INPUT_BODY_1), "", json.dumps(STANDARD_INPUT_BODY_2)])
+        id_1, id_2 = (result["id"] for result in results)
+        assert ReceiptTracker().receipt_id_to_data == {id_1: STANDARD_RECEIPT_1, id_2: STANDARD_RECEIPT_2}
+
+    def test_process_stream_invalid_lines(self: Self, client: FlaskClient) -> None:
+        """Tests that invalid lines are reported by line number in order without rejecting the valid ones."""
+
+        input_body = deepcopy(STANDARD_INPUT_BODY_2)
+        input_body["retailer"] = "%"
+
+        results = self.post_lines(client, [json.dumps(input_body), "", "{not json", json.dumps(STANDARD_INPUT_BODY_1)])
+        assert len(results) == 3
+        assert results[0]["line"] == 1 and "retailer" in results[0]["errors"]
+        assert results[1] == {"line": 3, "errors": {"_schema": ["Invalid JSON."]}}
+        assert ReceiptTracker().receipt_id_to_data == {results[2]["id"]: STANDARD_RECEIPT_1}
+
+    def test_process_stream_line_too_long(self: Self, app: Flask, client: FlaskClient) -> None:
+        """Tests that a line over the max length is skipped and reported."""
+
+        app.config["RECEIPTS_STREAM_MAX_LINE_BYTES"] = 100
+        results = self.post_lines(client, [json.dumps(STANDARD_INPUT_BODY_2), "{}"])
+        assert results[0] == {"line": 1, "errors": {"_schema": ["Line too long."]}}
+        assert results[1]["line"] == 2 and "retailer" in results[1]["errors"]
+
+    @pytest.mark.parametrize("line_ending", ["\n", "\r\n", ""])
+    def test_process_stream_line_at_max_length(self: Self, app: Flask, client: FlaskClient, line_ending: str) -> None:
+        """Tests that a line exactly the max length, not counting its line ending, is accepted and one byte longer
+        isn't."""
+
+        line = json.dumps(STANDARD_INPUT_BODY_1)
+        app.config["RECEIPTS_STREAM_MAX_LINE_BYTES"] = len(line)
+        body = line + line_ending
+        response = client.post(self.api_path, data=body, content_type="application/x-ndjson")
+        assert "id" in json.loads(response.get_data())
+        app.config["RECEIPTS_STREAM_MAX_LINE_BYTES"] = len(line) - 1
+        response = client.post(self.api_path, data=body, content_type="application/x-ndjson")
+        assert json.loads(response.get_data()) == {"line": 1, "errors": {"_schema": ["Line too long."]}}
+
+    @pytest.mark.parametrize("batch_size", [1, 2, 100])
+    def test_process_stream_batches(self: Self, app: Flask, client: FlaskClient, batch_size: int) -> None:
+        """Tests that every receipt gets its own ID in order whatever the batch size."""
+
+        app.config["RECEIPTS_STREAM_BATCH_SIZE"] = batch_size
+        results = self.post_lines(client, [json.dumps(STANDARD_INPUT_BODY_1), "{}"] * 3)
+        assert ["id" in result for result in results] == [True, False] * 3
+        assert len({result["id"] for result in results[::2]}) == 3
+        assert len(ReceiptTracker().receipt_id_to_data) == 3
+
+    def test_process_stream_chunked_request(self: Self, app: Flask, client: FlaskClient) -> None:
+        """Tests that a chunked body with no Content-Length is read incrementally, with results streamed back before
+        the rest of the body is read."""
+
+        app.config["RECEIPTS_STREAM_BATCH_SIZE"] = 1
+        stream = CountingStream((json.dumps(STANDARD_INPUT_BODY_1) + "\n").encode() * 5)
+        response = client.post(
+            self.api_path,
+            input_stream=stream,
+            content_type="application/x-ndjson",
+            headers={"Transfer-Encoding": "chunked"},
+            # Set by servers that handle chunked requests, e.g. gunicorn and the development server.
+            environ_overrides={"wsgi.input_terminated": True},
+            buffered=False,
+        )
+        assert response.status_code == HTTPStatus.OK
+        results = response.iter_encoded()
+        assert "id" in json.loads(next(results))
+        assert stream.lines_read < 5
+        assert len([json.loads(line) for line in results]) == 4
+        assert stream.lines_read == 5
+        response.close()
+        assert len(ReceiptTracker().receipt_id_to_data) == 5
+
+    def test_process_stream_invalid_lines_flushed(self: Self, app: Flask, client: FlaskClient) -> None:
+        """Tests that the results of invalid lines are streamed back a batch at a time too, rather than held until a
+        batch of valid receipts is read."""
+
+        app.config["RECEIPTS_STREAM_BATCH_SIZE"] = 2
+        stream = CountingStream(b"{}\n" * 6)
+        response = client.post(
+            self.api_path,
+            input_stream=stream,
+            content_type="application/x-ndjson",
+            headers={"Transfer-Encoding": "chunked"},
+            environ_overrides={"wsgi.input_terminated": True},
+            buffered=False,
+        )
+        results = response.iter_encoded()
+        assert json.loads(next(results))["line"] == 1
+        assert stream.lines_read == 2
+        assert [json.loads(line)["line"] for line in results] == [2, 3, 4, 5, 6]
+        response.close()
+
+    def test_process_stream_latency_recorded_when_streamed(self: Self, client: FlaskClient) -> None:
+        """Tests that the request's latency is recorded once the response has been streamed, not when it's started."""
+
+        labels = (self.api_path, "POST", "200")
+        before = REQUEST_SECONDS.count(*labels)
+        response = client.post(
+            self.api_path,
+            data=json.dumps(STANDARD_INPUT_BODY_1),
+            content_type="application/x-ndjson",
+            buffered=False,
+        )
+        assert "id" in json.loads(next(response.iter_encoded()))
+        assert REQUEST_SECONDS.count(*labels) == before
+        response.close()
+        assert REQUEST_SECONDS.count(*labels) == before + 1
@@ -0,0 +1,106 @@
+"""Tests the receipt stats endpoints."""
+
+from http import HTTPStatus
+from typing import Self
+
+from flask.testing import FlaskClient
+import pytest
+
+from receipt_service import ReceiptTracker
+from tests.api_tests.conftest import STANDARD_INPUT_BODY_1, STANDARD_INPUT_BODY_2
+
+
+class TestStatsAPI:
+    """Tests the receipt stats API endpoints."""
+
+    @pytest.fixture(autouse=True)
+    def receipts(self: Self, client: FlaskClient):
+        """Submits both standard receipts, the first one twice, and resets the tracker after the test."""
+        ReceiptTracker().clear()
+        for body in (STANDARD_INPUT_BODY_1, STANDARD_INPUT_BODY_2, STANDARD_INPUT_BODY_1):
+            client.post("/receipts/process", json=body)
+        yield
+        ReceiptTracker().clear()
+
+    def test_get_stats(self: Self, client: FlaskClient) -> None:
+        """Tests the totals of every receipt."""
+
+        response = client.get("/receipts/stats")
+        assert response.status_code == HTTPStatus.OK
+        assert response.json == {"count": 3, "total": "79.70", "points": 165}
+
+    def test_get_retailer_stats(self: Self, client: FlaskClient) -> None:
+        """Tests the totals of each retailer, and of only one."""
+
+        response = client.get("/receipts/stats/retailers")
+        assert response.status_code == HTTPStatus.OK
+        assert response.json == {
+            "retailers": {
+                "Target": {"count": 2, "total": "70.70", "points": 56},
+                "M&M Corner Market": {"count": 1, "total": "9.00", "points": 109},
+            }
+        }
+        response = client.get("/receipts/stats/retailers", query_string={"retailer": "M&M Corner Market"})
+        assert response.json == {"retailers": {"M&M Corner Market": {"count": 1, "total": "9.00", "points": 109}}}
+
+    @pytest.mark.parametrize(
+        "query, expected",
+        [
+            ({}, {"start": None, "end": None, "count": 3, "total": "79.70", "points": 165}),
+            (
+                {"start": "2022-01-02", "end": "2022-03-20"},
+                {"start": "2022-01-02", "end": "2022-03-20", "count": 1, "total": "9.00", "points": 109},
+            ),
+            ({"end": "2022-01-01"}, {"start": None, "end": "2022-01-01", "count": 2, "total": "70.70", "points": 56}),
+        ],
+    )
+    def test_get_date_stats(self: Self, client: FlaskClient, query: dict, expected: dict) -> None:
+        """Tests the totals of a range of purchase dates."""
+
+        response = client.get("/receipts/stats/dates", query_string=query)
+        assert response.status_code == HTTPStatus.OK
+        assert response.json == expected
+
+    @pytest.mark.parametrize("query", [{"start": "2022-13-01"}, {"start": "2022-03-20", "end": "2022-01-01"}])
+    def test_get_date_stats_invalid_range(self: Self, client: FlaskClient, query: dict) -> None:
+        """Tests an invalid range of purchase dates."""
+
+        response = client.get("/receipts/stats/dates", query_string=query)
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert response.json["message"] == "The date range is invalid."
+
+    def test_get_hour_stats(self: Self, client: FlaskClient) -> None:
+        """Tests the totals of each hour of purchase."""
+
+        response = client.get("/receipts/stats/hours")
+        assert response.status_code == HTTPStatus.OK
+        assert response.json == {
+            "hours": {
+                "13": {"count": 2, "total": "70.70", "points": 56},
+                "14": {"count": 1, "total": "9.00", "points": 109},
+            }
+        }
+
+    def test_get_points_band_stats(self: Self, client: FlaskClient) -> None:
+        """Tests the totals of each band of points."""
+
+        response = client.get("/receipts/stats/points")
+        assert response.status_code == HTTPStatus.OK
+        assert response.json == {
+            "bands": [
+                {"min": 25, "max": 49, "count": 2, "total": "70.70", "points": 56},
+                {"min": 100, "max": 124, "count": 1, "total": "9.00", "points": 109},
+            ]
+        }
+
+    def test_stats_disabled(self: Self, client: FlaskClient) -> None:
+        """Tests that the stats endpoints are a 404 when stats are off."""
+
+        tracker = ReceiptTracker()
+        stats = tracker.stats
+        tracker.stats = None
+        try:
+            for path in ("", "/retailers", "/dates", "/hours", "/points"):
+                assert client.get(f"/receipts/stats{path}").status_code == HTTPStatus.NOT_FOUND
+        finally:
+            tracker.stats = stats
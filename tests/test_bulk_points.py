@@ -0,0 +1,68 @@
+"""Tests the bulk_points module."""
+
+from datetime import date, time
+from typing import Self
+
+from hypothesis import given, settings, strategies as st
+import numpy as np
+
+from bulk_points import ReceiptColumns, calculate_points_batch
+from receipt_service import Item, ReceiptData
+from tests.api_tests.conftest import STANDARD_RECEIPT_1, STANDARD_RECEIPT_2
+
+# Strings made of the characters the API allows in retailer names and item descriptions.
+retailers = st.text(alphabet=st.sampled_from("abcXYZ019 -&_é"), min_size=1, max_size=30)
+descriptions = st.text(alphabet=st.sampled_from("abcXYZ019 -_"), min_size=1, max_size=30)
+cents = st.integers(min_value=0, max_value=10_000_000)
+
+items = st.builds(
+    lambda description, price_cents: Item(shortDescription=description, price=f"{price_cents / 100:.2f}"),
+    descriptions,
+    cents,
+)
+receipts = st.builds(
+    lambda retailer, purchase_date, purchase_time, receipt_items, total_cents: ReceiptData(
+        retailer=retailer,
+        purchaseDate=purchase_date,
+        purchaseTime=purchase_time,
+        items=receipt_items,
+        total=f"{total_cents / 100:.2f}",
+    ),
+    retailers,
+    st.dates(min_value=date(2000, 1, 1), max_value=date(2100, 12, 31)),
+    st.times(),
+    st.lists(items, min_size=1, max_size=8),
+    cents,
+)
+
+
+class TestCalculatePointsBatch:
+    """Tests the calculate_points_batch function."""
+
+    def test_calculate_points_batch_exercise_examples(self: Self) -> None:
+        """Tests the examples provided by the exercise."""
+        columns = ReceiptColumns.from_receipts([STANDARD_RECEIPT_1, STANDARD_RECEIPT_2])
+        assert calculate_points_batch(columns).tolist() == [28, 109]
+
+    def test_calculate_points_batch_purchase_time_boundaries(self: Self) -> None:
+        """Tests the purchase time rule at the edges of the window."""
+        boundary_receipts = [
+            ReceiptData(
+                retailer="a",
+                purchaseDate=date(2025, 1, 2),
+                purchaseTime=purchase_time,
+                items=[Item(shortDescription="ab", price=1.01)],
+                total=1.01,
+            )
+            for purchase_time in (time(14, 0, 59), time(14, 1), time(15, 59, 59), time(16, 0))
+        ]
+        columns = ReceiptColumns.from_receipts(boundary_receipts)
+        assert calculate_points_batch(columns).tolist() == [1, 11, 11, 1]
+
+    @settings(max_examples=300, deadline=None)
+    @given(st.lists(receipts, min_size=1, max_size=20))
+    def test_calculate_points_batch_matches_calculate_points(self: Self, batch: list[ReceiptData]) -> None:
+        """Tests the batch calculation matches calculating the points for each receipt one at a time."""
+        points = calculate_points_batch(ReceiptColumns.from_receipts(batch))
+        assert points.dtype == np.int64
+        assert points.tolist() == [receipt.calculate_points() for receipt in batch]
@@ -0,0 +1,157 @@
+"""Tests the dedup module."""
+
+import threading
+from typing import Self
+from unittest.mock import patch
+
+import pytest
+
+from dedup import DedupIndex
+from receipt_service import ReceiptData, ReceiptTracker
+from tests.api_tests.conftest import STANDARD_INPUT_BODY_1, STANDARD_RECEIPT_1, STANDARD_RECEIPT_2
+
+
+class TestDedupIndex:
+    """Tests the DedupIndex class."""
+
+    def test_claim(self: Self) -> None:
+        """Tests that the first claim of a key records its ID and later claims get that ID back."""
+        index = DedupIndex(max_entries=10)
+        assert index.claim(b"a", "1") is None
+        assert index.claim(b"a", "2") == "1"
+        assert index.claim(b"b", "3") is None
+        assert index.stats() == {"entries": 2, "max_entries": 10, "hits": 1, "misses": 2, "hit_rate": 1 / 3}
+
+    def test_least_recently_used_key_is_evicted(self: Self) -> None:
+        """Tests that the index stays within max_entries by forgetting the least recently used key."""
+        index = DedupIndex(max_entries=2)
+        index.claim(b"a", "1")
+        index.claim(b"b", "2")
+        index.claim(b"a", "3")  # Makes "b" the least recently used.
+        index.claim(b"c", "4")
+        assert index.stats()["entries"] == 2
+        assert index.claim(b"a", "5") == "1"
+        assert index.claim(b"b", "6") is None
+
+    def test_release(self: Self) -> None:
+        """Tests that releasing a key only forgets it if it's still claimed for the same ID."""
+        index = DedupIndex(max_entries=10)
+        index.claim(b"a", "1")
+        index.release(b"a", "2")
+        assert index.claim(b"a", "3") == "1"
+        index.release(b"a", "1")
+        assert index.claim(b"a", "4") is None
+
+    def test_duplicate_waits_for_claim_to_settle(self: Self) -> None:
+        """Tests that a duplicate claimed on another thread waits until the key is settled, getting its ID if the
+        receipt was stored or claiming the key itself if it was released."""
+        index = DedupIndex(max_entries=10)
+        index.claim(b"a", "1")
+        index.claim(b"b", "2")
+        results = {}
+
+        def claim(key: bytes, receipt_id: str) -> None:
+            results[key] = index.claim(key, receipt_id)
+
+        threads = [threading.Thread(target=claim, args=args) for args in [(b"a", "3"), (b"b", "4")]]
+        for thread in threads:
+            thread.start()
+        threads[0].join(0.05)
+        assert results == {}
+        index.settle(b"a", "1")
+        index.release(b"b", "2")
+        for thread in threads:
+            thread.join(5)
+        assert results == {b"a": "1", b"b": None}
+        index.settle(b"b", "4")
+        assert index.claim(b"b", "5") == "4"
+
+    def test_key_for(self: Self) -> None:
+        """Tests that content keys match however the receipt was built, and idempotency keys are kept apart."""
+        same_receipt = ReceiptData(**{**STANDARD_INPUT_BODY_1, "total": 35.35})
+        assert DedupIndex.key_for(same_receipt) == DedupIndex.key_for(STANDARD_RECEIPT_1)
+        assert DedupIndex.key_for(STANDARD_RECEIPT_1) != DedupIndex.key_for(STANDARD_RECEIPT_2)
+        assert DedupIndex.key_for(STANDARD_RECEIPT_1, "retry-1") == DedupIndex.key_for(STANDARD_RECEIPT_2, "retry-1")
+        assert DedupIndex.key_for(STANDARD_RECEIPT_1, "retry-1") != DedupIndex.key_for(STANDARD_RECEIPT_1)
+
+
+class TestReceiptTrackerDedup:
+    """Tests the receipttracker class with a dedup index."""
+
+    @pytest.fixture(autouse=True)
+    def tracker_reset(self: Self):
+        """Resets the tracker between tests."""
+        ReceiptTracker().configure(dedup=DedupIndex(max_entries=100))
+        yield
+        tracker = ReceiptTracker()
+        tracker.configure()
+        tracker.clear()
+
+    def test_add_receipt_duplicates(self: Self) -> None:
+        """Tests that duplicates get the original ID back without being stored again."""
+        tracker = ReceiptTracker()
+        receipt_id = tracker.add_receipt(STANDARD_RECEIPT_1)
+        with patch.object(ReceiptTracker, "_store") as store:
+            assert tracker.add_receipt(STANDARD_RECEIPT_1.model_copy()) == receipt_id
+        store.assert_not_called()
+        assert tracker.add_receipt(STANDARD_RECEIPT_2) != receipt_id
+        assert len(tracker.receipt_id_to_data) == 2
+
+    def test_add_receipt_idempotency_key(self: Self) -> None:
+        """Tests that an idempotency key maps to the ID it was first used for, whatever the receipt."""
+        tracker = ReceiptTracker()
+        receipt_id = tracker.add_receipt(STANDARD_RECEIPT_1, idempotency_key="retry-1")
+        assert tracker.add_receipt(STANDARD_RECEIPT_2, idempotency_key="retry-1") == receipt_id
+        assert tracker.add_receipt(STANDARD_RECEIPT_1, idempotency_key="retry-2") != receipt_id
+
+    def test_add_receipts_duplicates(self: Self) -> None:
+        """Tests that duplicates in and across batches get the original IDs back."""
+        tracker = ReceiptTracker()
+        id_1, id_2, id_3 = tracker.add_receipts([STANDARD_RECEIPT_1, STANDARD_RECEIPT_2, STANDARD_RECEIPT_1])
+        assert id_1 == id_3 != id_2
+        assert tracker.add_receipts([STANDARD_RECEIPT_2]) == [id_2]
+        assert len(tracker.receipt_id_to_data) == 2
+        assert tracker.dedup.stats()["hits"] == 2
+
+    def test_concurrent_duplicate_gets_stored_id(self: Self) -> None:
+        """Tests that a duplicate submitted while the original is still being stored waits for it, so the ID it gets
+        back is found."""
+        tracker = ReceiptTracker()
+        storing = threading.Event()
+        release = threading.Event()
+        store = ReceiptTracker._store
+
+        def blocked_store(tracker: ReceiptTracker, *args: list, **kwargs: dict) -> None:
+            storing.set()
+            release.wait()
+            store(tracker, *args, **kwargs)
+
+        results = {}
+
+        def add_duplicate() -> None:
+            receipt_id = tracker.add_receipt(STANDARD_RECEIPT_1.model_copy())
+            results["duplicate"] = (receipt_id, tracker.get_points_for_receipt(receipt_id))
+
+        with patch.object(ReceiptTracker, "_store", blocked_store):
+            original = threading.Thread(target=lambda: results.update(original=tracker.add_receipt(STANDARD_RECEIPT_1)))
+            original.start()
+            storing.wait(5)
+            duplicate = threading.Thread(target=add_duplicate)
+            duplicate.start()
+            duplicate.join(0.05)
+            try:
+                assert duplicate.is_alive()
+            finally:
+                release.set()
+            original.join(5)
+            duplicate.join(5)
+        assert results == {"original": results["original"], "duplicate": (results["original"], 28)}
+
+    def test_failed_store_releases_key(self: Self) -> None:
+        """Tests that a receipt that couldn't be stored is stored afresh when it's retried."""
+        tracker = ReceiptTracker()
+        with patch.object(ReceiptTracker, "_store", side_effect=OSError):
+            with pytest.raises(OSError):
+                tracker.add_receipt(STANDARD_RECEIPT_1)
+        receipt_id = tracker.add_receipt(STANDARD_RECEIPT_1)
+        assert tracker.get_points_for_receipt(receipt_id) == 28
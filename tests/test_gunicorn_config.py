@@ -0,0 +1,55 @@
+"""Tests the gunicorn_config module."""
+
+import importlib
+from types import SimpleNamespace
+from typing import Self
+from unittest.mock import patch
+
+import pytest
+
+import gunicorn_config
+from ingest_queue import IngestQueue
+from receipt_service import ReceiptTracker
+from tests.api_tests.conftest import STANDARD_RECEIPT_1
+
+
+class TestGunicornConfig:
+    """Tests the gunicorn settings."""
+
+    def test_settings_from_environment(self: Self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Tests that the settings are read from the environment."""
+        monkeypatch.setenv("PORT", "8000")
+        monkeypatch.setenv("GUNICORN_THREADS", "16")
+        monkeypatch.setenv("GUNICORN_KEEPALIVE", "30")
+        monkeypatch.setenv("GUNICORN_BACKLOG", "64")
+        config = importlib.reload(gunicorn_config)
+        assert (config.bind, config.workers, config.threads) == ("0.0.0.0:8000", 1, 16)
+        assert (config.keepalive, config.backlog) == (30, 64)
+
+    def test_multiple_workers_refused(self: Self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Tests that more than one worker process is refused, since workers wouldn't share receipts."""
+        monkeypatch.setenv("GUNICORN_WORKERS", "2")
+        with pytest.raises(ValueError):
+            importlib.reload(gunicorn_config)
+
+    def test_multiple_workers_with_shared_store(self: Self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Tests that more than one worker process is allowed when the workers share a store."""
+        monkeypatch.setenv("GUNICORN_WORKERS", "4")
+        monkeypatch.setenv("FLASK_RECEIPTS_SHARED_STORE_PATH", '"/tmp/receipts.sock"')
+        assert importlib.reload(gunicorn_config).workers == 4
+        monkeypatch.delenv("GUNICORN_WORKERS")
+        importlib.reload(gunicorn_config)
+
+    def test_worker_exit_drains_ingest_queue_first(self: Self) -> None:
+        """Tests that a worker exiting drains the app's ingest queue into the tracker before closing the tracker."""
+        tracker = ReceiptTracker()
+        tracker.configure()
+        ingest_queue = IngestQueue(num_workers=1)
+        receipt_id = ingest_queue.submit(STANDARD_RECEIPT_1)
+        pending_when_closed = []
+        worker = SimpleNamespace(wsgi=SimpleNamespace(extensions={"receipt_ingest_queue": ingest_queue}))
+        with patch("receipt_service.ReceiptTracker.close", lambda _: pending_when_closed.append(ingest_queue.stats())):
+            gunicorn_config.worker_exit(None, worker)
+        assert pending_when_closed[0]["pending"] == 0
+        assert tracker.get_points_for_receipt(receipt_id) == 28
+        tracker.clear()
@@ -0,0 +1,211 @@
+"""Tests the ingest_queue module."""
+
+import json
+from pathlib import Path
+import threading
+from typing import Self
+from unittest.mock import patch
+
+import pytest
+
+from app import create_app
+from exceptions import IngestQueueFullException, NoReceiptFoundException
+from ingest_queue import IngestQueue
+from metrics import INGEST_FAILED
+from receipt_service import ReceiptData, ReceiptTracker
+from receipt_stats import ReceiptStatsIndex
+from tests.api_tests.conftest import (
+    STANDARD_INPUT_BODY_1,
+    STANDARD_INPUT_BODY_2,
+    STANDARD_RECEIPT_1,
+    STANDARD_RECEIPT_2,
+)
+
+
+class TestIngestQueue:
+    """Tests the IngestQueue class."""
+
+    @pytest.fixture(autouse=True)
+    def tracker_reset(self: Self):
+        """Resets the tracker between tests."""
+        tracker = ReceiptTracker()
+        tracker.configure()
+        tracker.clear()
+        yield
+        tracker.clear()
+
+    def test_submitted_receipts_are_drained_into_the_tracker(self: Self) -> None:
+        """Tests that queued receipts end up in the tracker under the IDs submit returned."""
+        ingest_queue = IngestQueue(num_workers=2, batch_size=10)
+        receipt_ids = [ingest_queue.submit(receipt) for receipt in [STANDARD_RECEIPT_1, STANDARD_RECEIPT_2] * 50]
+        ingest_queue.close()
+        tracker = ReceiptTracker()
+        assert not any(ingest_queue.is_pending(receipt_id) for receipt_id in receipt_ids)
+        assert tracker.get_points_for_receipt(receipt_ids[0]) == 28
+        assert tracker.get_points_for_receipt(receipt_ids[1]) == 109
+        stats = ingest_queue.stats()
+        assert stats["enqueued"] == stats["drained"] == 100
+        assert stats["depth"] == stats["pending"] == stats["rejected"] == 0
+        assert stats["drain_rate"] > 0
+
+    def test_wait_for_pending_receipt(self: Self) -> None:
+        """Tests that a receipt is pending until a worker drains it, and wait_for returns once it has."""
+        release = threading.Event()
+        add_receipts = ReceiptTracker.add_receipts
+
+        def blocked_add_receipts(tracker: ReceiptTracker, *args: list, **kwargs: dict) -> list[str]:
+            release.wait()
+            return add_receipts(tracker, *args, **kwargs)
+
+        with patch("receipt_service.ReceiptTracker.add_receipts", blocked_add_receipts):
+            ingest_queue = IngestQueue(num_workers=1)
+            receipt_id = ingest_queue.submit(STANDARD_RECEIPT_1)
+            assert ingest_queue.is_pending(receipt_id)
+            assert not ingest_queue.wait_for(receipt_id, timeout=0.01)
+            release.set()
+            assert ingest_queue.wait_for(receipt_id, timeout=5)
+            ingest_queue.close()
+        assert not ingest_queue.is_pending(receipt_id)
+        assert ingest_queue.wait_for("unknown", timeout=0)
+
+    def test_submit_to_full_queue(self: Self) -> None:
+        """Tests that submitting to a full queue raises once the enqueue timeout passes."""
+        release = threading.Event()
+        with patch("receipt_service.ReceiptTracker.add_receipts", lambda *args, **kwargs: release.wait()):
+            ingest_queue = IngestQueue(max_size=1, num_workers=1, batch_size=1, enqueue_timeout=0.01)
+            # The worker takes the first receipt and blocks, the second fills the queue.
+            first_id = ingest_queue.submit(STANDARD_RECEIPT_1)
+            while ingest_queue.stats()["depth"]:
+                pass
+            ingest_queue.submit(STANDARD_RECEIPT_1)
+            with pytest.raises(IngestQueueFullException):
+                ingest_queue.submit(STANDARD_RECEIPT_1)
+            stats = ingest_queue.stats()
+            assert stats["depth"] == 1
+            assert stats["pending"] == 2
+            assert stats["rejected"] == 1
+            assert ingest_queue.is_pending(first_id)
+            release.set()
+            ingest_queue.close()
+
+    def test_close_drains_queued_receipts(self: Self) -> None:
+        """Tests that closing the queue while receipts are still queued waits for them to be added to the tracker."""
+        release = threading.Event()
+        add_receipts = ReceiptTracker.add_receipts
+
+        def blocked_add_receipts(tracker: ReceiptTracker, *args: list, **kwargs: dict) -> list[str]:
+            release.wait()
+            return add_receipts(tracker, *args, **kwargs)
+
+        with patch("receipt_service.ReceiptTracker.add_receipts", blocked_add_receipts):
+            ingest_queue = IngestQueue(num_workers=1, batch_size=5)
+            receipt_ids = [ingest_queue.submit(STANDARD_RECEIPT_1) for _ in range(20)]
+            assert ingest_queue.stats()["depth"] > 0
+            closing = threading.Thread(target=ingest_queue.close)
+            closing.start()
+            release.set()
+            closing.join(5)
+        assert not closing.is_alive()
+        points = {receipt_id: 28 for receipt_id in receipt_ids}
+        assert ReceiptTracker().get_points_for_receipts(receipt_ids) == (points, [])
+        assert ingest_queue.stats()["drained"] == 20 and ingest_queue.stats()["pending"] == 0
+        ingest_queue.close()
+
+    def test_failed_batch_retried(self: Self) -> None:
+        """Tests that a batch the tracker fails to add is retried and added."""
+        add_receipts = ReceiptTracker.add_receipts
+        failures = [RuntimeError("disk full")]
+
+        def flaky_add_receipts(tracker: ReceiptTracker, *args: list, **kwargs: dict) -> list[str]:
+            if failures:
+                raise failures.pop()
+            return add_receipts(tracker, *args, **kwargs)
+
+        with patch("receipt_service.ReceiptTracker.add_receipts", flaky_add_receipts):
+            ingest_queue = IngestQueue(num_workers=1, retry_delay=0)
+            receipt_id = ingest_queue.submit(STANDARD_RECEIPT_1)
+            ingest_queue.close()
+        assert ReceiptTracker().get_points_for_receipt(receipt_id) == 28
+        stats = ingest_queue.stats()
+        assert (stats["retried"], stats["failed"], stats["drained"]) == (1, 0, 1)
+
+    def test_failed_batch_dead_lettered(self: Self, tmp_path: Path) -> None:
+        """Tests that a batch that fails every attempt is counted as failed and written to the dead letter file, from
+        which its receipts can be resubmitted."""
+        dead_letter_path = str(tmp_path / "dead_letters.jsonl")
+        failed_before = INGEST_FAILED.value()
+        with patch("receipt_service.ReceiptTracker.add_receipts", side_effect=RuntimeError("disk full")):
+            ingest_queue = IngestQueue(
+                num_workers=1, batch_size=1, max_attempts=2, retry_delay=0, dead_letter_path=dead_letter_path
+            )
+            receipt_ids = [ingest_queue.submit(receipt) for receipt in [STANDARD_RECEIPT_1, STANDARD_RECEIPT_2]]
+            ingest_queue.close()
+        stats = ingest_queue.stats()
+        assert (stats["retried"], stats["failed"], stats["drained"], stats["pending"]) == (2, 2, 2, 0)
+        assert INGEST_FAILED.value() == failed_before + 2
+        with pytest.raises(NoReceiptFoundException):
+            ReceiptTracker().get_points_for_receipt(receipt_ids[0])
+
+        with open(dead_letter_path) as dead_letters:
+            entries = [json.loads(line) for line in dead_letters]
+        assert [entry["id"] for entry in entries] == receipt_ids
+        assert [entry["receipt"] for entry in entries] == [STANDARD_INPUT_BODY_1, STANDARD_INPUT_BODY_2]
+        client = create_app().test_client()
+        for entry in entries:
+            response = client.post("/receipts/process", json=entry["receipt"])
+            assert response.status_code == 200
+            assert client.get(f"/receipts/{response.json['id']}/points").status_code == 200
+
+    def test_partly_failed_batch_retries_only_unstored_receipts(self: Self) -> None:
+        """Tests that when a failed attempt stored some of a batch, only the rest is retried, so nothing is stored or
+        counted twice."""
+        add_receipts = ReceiptTracker.add_receipts
+        release = threading.Event()
+        calls = []
+
+        def partly_failing_add_receipts(
+            tracker: ReceiptTracker, receipts: list[ReceiptData], receipt_ids: list[str]
+        ) -> list[str]:
+            calls.append(receipt_ids)
+            release.wait()
+            if len(calls) == 2:
+                add_receipts(tracker, receipts[:1], receipt_ids=receipt_ids[:1])
+                raise RuntimeError("disk full")
+            return add_receipts(tracker, receipts, receipt_ids=receipt_ids)
+
+        tracker = ReceiptTracker()
+        tracker.configure(stats=ReceiptStatsIndex())
+        with patch("receipt_service.ReceiptTracker.add_receipts", partly_failing_add_receipts):
+            ingest_queue = IngestQueue(num_workers=1, batch_size=2, retry_delay=0)
+            # The worker takes the first receipt and blocks, so the next two are drained as one batch.
+            first_id = ingest_queue.submit(STANDARD_RECEIPT_1)
+            while ingest_queue.stats()["depth"]:
+                pass
+            receipt_ids = [ingest_queue.submit(receipt) for receipt in [STANDARD_RECEIPT_1, STANDARD_RECEIPT_2]]
+            release.set()
+            ingest_queue.close()
+        assert calls == [[first_id], receipt_ids, receipt_ids[1:]]
+        assert tracker.get_points_for_receipts(receipt_ids) == ({receipt_ids[0]: 28, receipt_ids[1]: 109}, [])
+        assert tracker.stats.totals().count == 3
+        assert ingest_queue.stats()["failed"] == 0
+
+    def test_unwritable_dead_letter_file(self: Self, tmp_path: Path) -> None:
+        """Tests that failing to write the dead letter file still stops the batch's receipts being pending."""
+        dead_letter_path = str(tmp_path / "missing" / "dead_letters.jsonl")
+        with patch("receipt_service.ReceiptTracker.add_receipts", side_effect=RuntimeError("disk full")):
+            ingest_queue = IngestQueue(num_workers=1, max_attempts=1, dead_letter_path=dead_letter_path)
+            receipt_id = ingest_queue.submit(STANDARD_RECEIPT_1)
+            assert ingest_queue.wait_for(receipt_id, timeout=5)
+            # The worker is still running, so later receipts are still drained.
+            assert ingest_queue.wait_for(ingest_queue.submit(STANDARD_RECEIPT_2), timeout=5)
+            ingest_queue.close()
+        stats = ingest_queue.stats()
+        assert (stats["failed"], stats["drained"], stats["pending"]) == (2, 2, 0)
+
+    def test_submit_after_close(self: Self) -> None:
+        """Tests that a receipt submitted after the queue is closed is added to the tracker straight away."""
+        ingest_queue = IngestQueue(num_workers=1)
+        ingest_queue.close()
+        receipt_id = ingest_queue.submit(STANDARD_RECEIPT_1)
+        assert not ingest_queue.is_pending(receipt_id)
+        assert ReceiptTracker().get_points_for_receipt(receipt_id) == 28
@@ -0,0 +1,94 @@
+"""Tests the metrics module."""
+
+import threading
+from typing import Self
+
+from metrics import MetricsRegistry
+
+
+class TestMetricsRegistry:
+    """Tests the MetricsRegistry class and its metrics."""
+
+    def test_counter(self: Self) -> None:
+        """Tests that counters are kept per label values and rendered."""
+        registry = MetricsRegistry()
+        counter = registry.counter("responses_total", "Responses.", ("status",))
+        counter.inc("200")
+        counter.inc("200")
+        counter.inc("404", amount=3)
+        assert counter.value("200") == 2
+        assert counter.value("404") == 3
+        assert registry.render() == (
+            "# HELP responses_total Responses.\n"
+            "# TYPE responses_total counter\n"
+            'responses_total{status="200"} 2\n'
+            'responses_total{status="404"} 3\n'
+        )
+
+    def test_histogram(self: Self) -> None:
+        """Tests that histograms render cumulative bucket counts, the sum and the count."""
+        registry = MetricsRegistry()
+        histogram = registry.histogram("seconds", "Seconds.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        assert histogram.count() == 4
+        assert registry.render() == (
+            "# HELP seconds Seconds.\n"
+            "# TYPE seconds histogram\n"
+            'seconds_bucket{le="0.1"} 2\n'
+            'seconds_bucket{le="1.0"} 3\n'
+            'seconds_bucket{le="+Inf"} 4\n'
+            "seconds_sum 2.65\n"
+            "seconds_count 4\n"
+        )
+
+    def test_gauge(self: Self) -> None:
+        """Tests that gauges are read when rendered."""
+        registry = MetricsRegistry()
+        values = iter([1, 2])
+        registry.gauge("stored", "Stored.", lambda: next(values))
+        assert registry.render().endswith("stored 1\n")
+        assert registry.render().endswith("stored 2\n")
+
+    def test_disabled_and_clear(self: Self) -> None:
+        """Tests that nothing is recorded while disabled, and clear resets what was."""
+        registry = MetricsRegistry()
+        counter = registry.counter("total", "Total.")
+        histogram = registry.histogram("seconds", "Seconds.")
+        registry.enabled = False
+        counter.inc()
+        histogram.observe(1.0)
+        assert counter.value() == histogram.count() == 0
+        registry.enabled = True
+        counter.inc()
+        registry.clear()
+        assert counter.value() == 0
+
+    def test_values_from_threads(self: Self) -> None:
+        """Tests that values recorded on other threads, running or finished, are added together when read."""
+        registry = MetricsRegistry()
+        counter = registry.counter("total", "Total.")
+        histogram = registry.histogram("seconds", "Seconds.", buckets=(1.0,))
+        recorded = threading.Barrier(5)
+        release = threading.Event()
+
+        def record() -> None:
+            counter.inc()
+            histogram.observe(0.5)
+            recorded.wait()
+            release.wait()
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        recorded.wait()
+        counter.inc()
+        assert counter.value() == 5 and histogram.count() == 4
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert counter.value() == 5
+        # Read again once the finished threads' values have been folded into the retired ones.
+        assert counter.value() == 5
+        assert registry.render().endswith('seconds_bucket{le="+Inf"} 4\nseconds_sum 2.0\nseconds_count 4\n')
+        assert counter._thread_values == [(threading.current_thread(), {(): 1})]
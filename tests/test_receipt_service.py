@@ -1,11 +1,43 @@
 """Tests the receipt_service"""
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import logging
+import threading
+import time as time_module
 from typing import Self
-from unittest.mock import patch
+from unittest.mock import PropertyMock, patch
 from exceptions import NoReceiptFoundException
-from receipt_service import Item, ReceiptData, ReceiptTracker
+from receipt_service import (
+    CapacityPolicy,
+    Item,
+    ReceiptData,
+    ReceiptIdGenerator,
+    ReceiptTracker,
+    RECEIPT_STRINGS,
+    amount_to_cents,
+    compact_receipt,
+    estimate_compact_size,
+    estimate_receipt_size,
+    expand_receipt,
+    points_trace,
+    receipt_id_from_bytes,
+    receipt_id_to_bytes,
+)
+from receipt_stats import ReceiptStatsIndex
+from storage import SqliteSpillStore
 from datetime import date, time
+from decimal import Decimal
+from hypothesis import given, settings, strategies as st
+import math
 import pytest
+import uuid
+from tests.api_tests.conftest import STANDARD_RECEIPT_1
+from tests.test_bulk_points import receipts
+
+RECEIPT_ID_1 = "01890a5d-ac96-774b-bcce-b302099a8057"
+RECEIPT_ID_2 = "01890a5d-ac97-7c3d-8f4a-5e2b1c0d9e8f"
 
 
 class TestItem:
@@ -32,7 +64,7 @@ class TestReceiptData:
 
     @pytest.mark.parametrize("retailer, expected_value", [("aaa111* ", 6), ("   ", 0)])
     def test_calculate_alphanumeric_points(self: Self, retailer: str, expected_value: int) -> None:
-        """Tests the alphanumeric points calculation method."""
+        """Tests the alphanumeric points rule."""
         receipt = ReceiptData(
             retailer=retailer,
             purchaseDate=date(2025, 1, 1),
@@ -40,11 +72,11 @@ class TestReceiptData:
             items=[Item(shortDescription="abc", price=10.00)],
             total=1.00,
         )
-        assert receipt._calculate_alphanumeric_points() == expected_value
+        assert receipt.rule_breakdown()["alphanumeric"] == expected_value
 
     @pytest.mark.parametrize("total, expected_value", [(1.00, 50), (1.01, 0)])
     def test_calculate_round_dollar_total_points(self: Self, total: float, expected_value: int) -> None:
-        """Tests the round dollar total points calculation method."""
+        """Tests the round dollar total points rule."""
         receipt = ReceiptData(
             retailer="aaa",
             purchaseDate=date(2025, 1, 1),
@@ -52,11 +84,11 @@ class TestReceiptData:
             items=[Item(shortDescription="abc", price=10.00)],
             total=total,
         )
-        assert receipt._calculate_round_dollar_total_points() == expected_value
+        assert receipt.rule_breakdown()["round_dollar_total"] == expected_value
 
     @pytest.mark.parametrize("total, expected_value", [(1.00, 25), (1.01, 0)])
     def test_calculate_quarter_multiple_total_points(self: Self, total: float, expected_value: int) -> None:
-        """Tests the quarter multiple total points calculation method."""
+        """Tests the quarter multiple total points rule."""
         receipt = ReceiptData(
             retailer="aaa",
             purchaseDate=date(2025, 1, 1),
@@ -64,7 +96,7 @@ class TestReceiptData:
             items=[Item(shortDescription="abc", price=10.00)],
             total=total,
         )
-        assert receipt._calculate_quarter_multiple_total_points() == expected_value
+        assert receipt.rule_breakdown()["quarter_multiple_total"] == expected_value
 
     @pytest.mark.parametrize(
         "items, expected_value",
@@ -76,7 +108,7 @@ class TestReceiptData:
         ],
     )
     def test_calculate_item_length_points(self: Self, items: list[Item], expected_value: int) -> None:
-        """Tests the item length points calculation method when there are two items."""
+        """Tests the item length points rule for every two items."""
         receipt = ReceiptData(
             retailer="aaa",
             purchaseDate=date(2025, 1, 1),
@@ -84,7 +116,7 @@ class TestReceiptData:
             items=items,
             total=1.00,
         )
-        assert receipt._calculate_item_length_points() == expected_value
+        assert receipt.rule_breakdown()["item_pairs"] == expected_value
 
     @pytest.mark.parametrize(
         "items, expected_value",
@@ -95,7 +127,7 @@ class TestReceiptData:
         ],
     )
     def test_calculate_sub_item_points(self: Self, items: list[Item], expected_value: int) -> None:
-        """Tests the sub item points calculation method."""
+        """Tests the sub item points rule."""
         receipt = ReceiptData(
             retailer="aaa",
             purchaseDate=date(2025, 1, 1),
@@ -103,14 +135,14 @@ class TestReceiptData:
             items=items,
             total=1.00,
         )
-        assert receipt._calculate_sub_item_points() == expected_value
+        assert receipt.rule_breakdown()["item_descriptions"] == expected_value
 
     @pytest.mark.parametrize(
         "purchase_date, expected_value",
         [(date(2025, 1, 1), 6), (date(2025, 1, 2), 0)],
     )
     def test_calculate_purchase_day_odd_points(self: Self, purchase_date: date, expected_value: int) -> None:
-        """Tests the purchase day odd points calculation method."""
+        """Tests the purchase day odd points rule."""
         receipt = ReceiptData(
             retailer="aaa",
             purchaseDate=purchase_date,
@@ -118,14 +150,14 @@ class TestReceiptData:
             items=[Item(shortDescription="abc", price=10.00)],
             total=1.00,
         )
-        assert receipt._calculate_purchase_day_odd_points() == expected_value
+        assert receipt.rule_breakdown()["odd_purchase_day"] == expected_value
 
     @pytest.mark.parametrize(
         "purchase_time, expected_value",
         [(time(14, 0, 0), 0), (time(13, 59, 59), 0), (time(16, 0, 0), 0), (time(15, 59, 59), 10), (time(14, 1, 0), 10)],
     )
     def test_calculate_purchase_time_points(self: Self, purchase_time: time, expected_value: int) -> None:
-        """Tests the purchase time points calculation method."""
+        """Tests the purchase time points rule."""
         receipt = ReceiptData(
             retailer="aaa",
             purchaseDate=date(2025, 1, 1),
@@ -133,7 +165,7 @@ class TestReceiptData:
             items=[Item(shortDescription="abc", price=10.00)],
             total=1.00,
         )
-        assert receipt._calculate_purchase_time_points() == expected_value
+        assert receipt.rule_breakdown()["purchase_time"] == expected_value
 
     def test_calculate_points_exercise_example_1(self: Self) -> None:
         """Test the example provided by the exercise."""
@@ -176,8 +208,236 @@ class TestReceiptData:
 
         assert receipt.calculate_points() == 109
 
+    def test_calculate_points_trace(self: Self, caplog: pytest.LogCaptureFixture) -> None:
+        """Tests that the rule breakdown is collected into a points trace and logged at debug level."""
+        receipt = ReceiptData(
+            retailer="M&M Corner Market",
+            purchaseDate=date(2022, 3, 20),
+            purchaseTime=time(14, 33),
+            items=[Item(shortDescription="Gatorade", price="2.25")] * 4,
+            total="9.00",
+        )
+        token = points_trace.set([])
+        try:
+            with caplog.at_level(logging.DEBUG, logger="receipt_service"):
+                assert receipt.calculate_points() == 109
+            trace = points_trace.get()
+        finally:
+            points_trace.reset(token)
+        breakdown = {
+            "alphanumeric": 14,
+            "round_dollar_total": 50,
+            "quarter_multiple_total": 25,
+            "item_pairs": 10,
+            "item_descriptions": 0,
+            "odd_purchase_day": 0,
+            "purchase_time": 10,
+        }
+        assert trace == [{"retailer": "M&M Corner Market", "points": 109, "rules": breakdown}]
+        assert str(breakdown) in caplog.text
+
+    def test_calculate_points_skips_breakdown(self: Self) -> None:
+        """Tests that the rule breakdown isn't built when nothing reads it."""
+        receipt = ReceiptData(
+            retailer="Target",
+            purchaseDate=date(2022, 1, 1),
+            purchaseTime=time(13, 1),
+            items=[Item(shortDescription="ab", price="1.00")],
+            total="1.00",
+        )
+        with patch("receipt_service.ReceiptData.rule_breakdown") as rule_breakdown:
+            assert receipt.calculate_points() == 6 + 50 + 25 + 6
+        rule_breakdown.assert_not_called()
+
+
+def legacy_float_points(receipt: ReceiptData) -> int:
+    """The points rules as they were implemented on float dollar amounts, before amounts were held in cents."""
+    total = float(receipt.total)
+    # The rules that don't involve amounts are the same either way.
+    breakdown = receipt.rule_breakdown()
+    points = breakdown["alphanumeric"] + breakdown["item_pairs"] + breakdown["odd_purchase_day"]
+    points += breakdown["purchase_time"]
+    points += 50 if total.is_integer() else 0
+    points += 25 if total % 0.25 == 0 else 0
+    for item in receipt.items:
+        if len(item.shortDescription.strip()) % 3 == 0:
+            points += math.ceil(float(item.price) * 0.2)
+    return points
+
+
+class TestIntegerCents:
+    """Tests amounts are held and scored as integer cents."""
+
+    @pytest.mark.parametrize("amount, cents", [("6.49", 649), (6.49, 649), (Decimal("12.00"), 1200), (3, 300)])
+    def test_amount_to_cents(self: Self, amount: str | float | Decimal | int, cents: int) -> None:
+        """Tests converting dollar amounts to cents."""
+        assert amount_to_cents(amount) == cents
+
+    @pytest.mark.parametrize("amount", ["6.499", 0.1 + 0.2, "abc", "NaN", "Infinity"])
+    def test_amount_to_cents_invalid(self: Self, amount: str | float) -> None:
+        """Tests that amounts that aren't a whole number of cents are rejected."""
+        with pytest.raises(ValueError):
+            amount_to_cents(amount)
+
+    def test_amounts_round_trip_through_json(self: Self) -> None:
+        """Tests that a receipt dumped to JSON is read back with the same amounts."""
+        receipt = ReceiptData(
+            retailer="aaa",
+            purchaseDate=date(2025, 1, 1),
+            purchaseTime=time(0, 0, 0),
+            items=[Item(shortDescription="abc", price="0.15")],
+            total="0.15",
+        )
+        assert receipt.items[0].price_cents == 15 and receipt.total == Decimal("0.15")
+        assert ReceiptData.model_validate_json(receipt.model_dump_json()) == receipt
+
+    @settings(max_examples=500, deadline=None)
+    @given(
+        total_cents=st.integers(min_value=0, max_value=10**12),
+        prices_cents=st.lists(st.integers(min_value=0, max_value=10**12), min_size=1, max_size=5),
+        description_length=st.integers(min_value=1, max_value=9),
+    )
+    def test_matches_float_implementation(
+        self: Self, total_cents: int, prices_cents: list[int], description_length: int
+    ) -> None:
+        """Tests the integer rules award the same points as the float rules for amounts floats can hold exactly."""
+        receipt = ReceiptData(
+            retailer="aaa",
+            purchaseDate=date(2025, 1, 1),
+            purchaseTime=time(14, 30),
+            items=[Item(shortDescription="a" * description_length, price_cents=price) for price in prices_cents],
+            total_cents=total_cents,
+        )
+        assert receipt.calculate_points() == legacy_float_points(receipt)
+
+    @pytest.mark.parametrize(
+        "total, price, exact_total_points, exact_item_points",
+        [
+            # Too many digits for a float to keep the cents, so the float total looks like a round dollar amount.
+            ("1000000000000000.01", "0.00", 0, 0),
+            ("0.00", "100000000000000002.50", 75, 20000000000000001),
+        ],
+    )
+    def test_large_amounts_differ_from_float_implementation(
+        self: Self, total: str, price: str, exact_total_points: int, exact_item_points: int
+    ) -> None:
+        """Tests that where floats lose precision, the integer rules award the points exact arithmetic gives."""
+        receipt = ReceiptData(
+            retailer="a",
+            purchaseDate=date(2025, 1, 2),
+            purchaseTime=time(0, 0),
+            items=[Item(shortDescription="abc", price=price)],
+            total=total,
+        )
+        assert receipt.calculate_points() == 1 + exact_total_points + exact_item_points
+        assert receipt.calculate_points() != legacy_float_points(receipt)
+
+
+class TestCompactReceipt:
+    """Tests the packed form the tracker holds receipts in."""
+
+    @given(receipts)
+    @settings(max_examples=200)
+    def test_pack_round_trip(self: Self, receipt: ReceiptData) -> None:
+        """Tests that a packed receipt is rebuilt exactly, including the time to the microsecond."""
+        assert ReceiptData.from_packed(receipt.to_packed()) == receipt
+
+    def test_pack_keeps_rules_version(self: Self) -> None:
+        """Tests that the rules version a receipt was stamped with survives packing."""
+        receipt = STANDARD_RECEIPT_1.model_copy(update={"rules_version": "2"})
+        assert ReceiptData.from_packed(receipt.to_packed()).rules_version == "2"
 
-@patch("receipt_service.uuid.uuid4", lambda: "1")
+    def test_packed_strings_are_shared(self: Self) -> None:
+        """Tests that receipts rebuilt from packed records share one copy of each repeated string."""
+        first = expand_receipt(compact_receipt(STANDARD_RECEIPT_1))
+        second = expand_receipt(compact_receipt(STANDARD_RECEIPT_1.model_copy(deep=True)))
+        assert first.retailer is second.retailer
+        assert first.items[0].shortDescription is second.items[0].shortDescription
+        assert RECEIPT_STRINGS[RECEIPT_STRINGS.index("Target")] == "Target"
+
+    def test_packed_is_smaller(self: Self) -> None:
+        """Tests that the packed record is much smaller than the model it replaces."""
+        compact = compact_receipt(STANDARD_RECEIPT_1)
+        assert isinstance(compact, bytes)
+        assert estimate_compact_size(compact) * 5 < estimate_receipt_size(STANDARD_RECEIPT_1)
+
+    def test_unpackable_receipt_is_kept_as_model(self: Self) -> None:
+        """Tests that a receipt with an amount too large to pack is held as the model instead."""
+        receipt = STANDARD_RECEIPT_1.model_copy(update={"total_cents": 2**64})
+        assert compact_receipt(receipt) is receipt
+        assert expand_receipt(receipt) is receipt
+
+    def test_released_strings_are_dropped(self: Self) -> None:
+        """Tests that a string is dropped once its last reference is released, but not while the table is held, and
+        that its number is handed out again."""
+        number = RECEIPT_STRINGS.index("Released retailer")
+        assert RECEIPT_STRINGS.index("Released retailer") == number
+        RECEIPT_STRINGS.release([number])
+        with RECEIPT_STRINGS.held():
+            RECEIPT_STRINGS.release([number])
+            assert RECEIPT_STRINGS[number] == "Released retailer"
+        assert RECEIPT_STRINGS[number] is None
+        assert RECEIPT_STRINGS.copy()[number] == ""
+        assert RECEIPT_STRINGS.index("Another retailer") == number
+        RECEIPT_STRINGS.release([number])
+
+    def test_unpackable_receipt_releases_strings(self: Self) -> None:
+        """Tests that the strings of a receipt that fails to pack aren't kept."""
+        before = len(RECEIPT_STRINGS)
+        compact_receipt(STANDARD_RECEIPT_1.model_copy(update={"retailer": "Unpackable retailer", "total_cents": 2**64}))
+        assert len(RECEIPT_STRINGS) == before
+
+
+class TestReceiptIds:
+    """Tests how receipt IDs are generated and packed."""
+
+    def test_ids_are_version_7_uuids(self: Self) -> None:
+        """Tests that new IDs are canonical version 7 UUIDs that pack into their 16 bytes and back."""
+        receipt_id = ReceiptTracker.new_receipt_id()
+        parsed = uuid.UUID(receipt_id)
+        assert (parsed.version, parsed.variant) == (7, uuid.RFC_4122)
+        assert str(parsed) == receipt_id
+        assert receipt_id_to_bytes(receipt_id) == parsed.bytes
+        assert receipt_id_from_bytes(parsed.bytes) == receipt_id
+
+    def test_ids_are_time_ordered(self: Self) -> None:
+        """Tests that IDs sort in the order they were generated, including within a millisecond and past the end of
+        the counter."""
+        generate = ReceiptIdGenerator()
+        with patch("receipt_service.time_ns", return_value=1_700_000_000_000_000_000):
+            ids = [generate() for _ in range(ReceiptIdGenerator.COUNTER_LIMIT + 10)]
+        with patch("receipt_service.time_ns", return_value=1_600_000_000_000_000_000):
+            ids.append(generate())  # The clock stepping back doesn't break the order.
+        assert ids == sorted(ids)
+        assert len(set(ids)) == len(ids)
+
+    def test_ids_are_unique_across_threads(self: Self) -> None:
+        """Tests that IDs generated concurrently don't repeat."""
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            ids = list(executor.map(lambda _: ReceiptTracker.new_receipt_id(), range(5000)))
+        assert len(set(ids)) == len(ids)
+
+    def test_other_ids_are_rejected(self: Self) -> None:
+        """Tests that IDs that aren't UUIDs don't pack, while other spellings of a UUID pack to its bytes."""
+        for receipt_id in ["1", "not-a-uuid", RECEIPT_ID_1[:-1], RECEIPT_ID_1 + "0"]:
+            with pytest.raises(ValueError):
+                receipt_id_to_bytes(receipt_id)
+        assert receipt_id_to_bytes("{01890A5D-AC96-774B-BCCE-B302099A8057}") == receipt_id_to_bytes(RECEIPT_ID_1)
+
+    def test_other_ids_are_not_found(self: Self) -> None:
+        """Tests that looking up an ID that isn't a UUID finds nothing, and adding a receipt under one is refused."""
+        tracker = ReceiptTracker()
+        with pytest.raises(NoReceiptFoundException):
+            tracker.get_points_for_receipt("1")
+        with pytest.raises(NoReceiptFoundException):
+            tracker._get_receipt("1")
+        assert tracker.get_points_for_receipts(["1", RECEIPT_ID_1]) == ({}, ["1", RECEIPT_ID_1])
+        with pytest.raises(ValueError):
+            tracker.add_receipts([STANDARD_RECEIPT_1], receipt_ids=["1"])
+        assert tracker.receipt_id_to_data == {}
+
+
+@patch.object(ReceiptTracker, "new_receipt_id", staticmethod(lambda: RECEIPT_ID_1))
 @patch("receipt_service.ReceiptData.calculate_points", lambda self: 1)
 class TestReceiptTracker:
     """Tests the receipttracker class."""
@@ -187,8 +447,8 @@ class TestReceiptTracker:
         """Resets the tracker between tests."""
         yield
         tracker = ReceiptTracker()
-        tracker.receipt_id_to_data = {}
-        tracker.receipt_id_to_points = {}
+        tracker.clear()
+        tracker.configure()
 
     def test_add_receipt(self: Self) -> None:
         """Tests the add_receipt method."""
@@ -201,7 +461,48 @@ class TestReceiptTracker:
             total=1.00,
         )
         tracker.add_receipt(receipt)
-        assert tracker.receipt_id_to_data == {"1": receipt}
+        assert tracker.receipt_id_to_data == {RECEIPT_ID_1: receipt}
+
+    def test_add_receipt_debug_logging_is_constant_time(self: Self, caplog: pytest.LogCaptureFixture) -> None:
+        """Tests that debug logging doesn't format the whole store on every insert or miss."""
+        tracker = ReceiptTracker()
+        receipt = ReceiptData(
+            retailer="aaa",
+            purchaseDate=date(2025, 1, 1),
+            purchaseTime=time(0, 0),
+            items=[Item(shortDescription="abc", price=10.00)],
+            total=1.00,
+        )
+        with caplog.at_level(logging.DEBUG, logger="receipt_service"), patch.object(
+            ReceiptTracker, "receipt_id_to_data", new_callable=PropertyMock
+        ) as receipt_id_to_data:
+            tracker.add_receipt(receipt)
+            with pytest.raises(NoReceiptFoundException):
+                tracker._get_receipt(RECEIPT_ID_2)
+        receipt_id_to_data.assert_not_called()
+
+    @pytest.mark.parametrize("eager_points", [False, True])
+    def test_add_receipts(self: Self, eager_points: bool) -> None:
+        """Tests the add_receipts method."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=eager_points)
+        receipts = [
+            ReceiptData(
+                retailer="aaa",
+                purchaseDate=date(2025, 1, 1),
+                purchaseTime=time(0, 0, 0),
+                items=[Item(shortDescription="abc", price=price)],
+                total=1.00,
+            )
+            for price in (1.00, 2.00)
+        ]
+        with patch.object(ReceiptTracker, "new_receipt_id", side_effect=[RECEIPT_ID_1, RECEIPT_ID_2]):
+            assert tracker.add_receipts(receipts) == [RECEIPT_ID_1, RECEIPT_ID_2]
+        if eager_points:
+            assert tracker.receipt_id_to_eager_points == {RECEIPT_ID_1: 1, RECEIPT_ID_2: 1}
+        else:
+            assert tracker.receipt_id_to_data == {RECEIPT_ID_1: receipts[0], RECEIPT_ID_2: receipts[1]}
+        assert tracker.get_points_for_receipt(RECEIPT_ID_2) == 1
 
     def test_get_receipt_valid(self: Self) -> None:
         """Tests the get_receipt method with a valid receipt."""
@@ -214,13 +515,13 @@ class TestReceiptTracker:
             total=1.00,
         )
         tracker.add_receipt(receipt)
-        assert tracker._get_receipt("1") == receipt
+        assert tracker._get_receipt(RECEIPT_ID_1) == receipt
 
     def test_get_receipt_invalid(self: Self) -> None:
         """Tests the get_receipt method with an invalid receipt."""
         tracker = ReceiptTracker()
         with pytest.raises(NoReceiptFoundException):
-            tracker._get_receipt("1")
+            tracker._get_receipt(RECEIPT_ID_1)
 
     def test_get_points_for_receipt_valid(self: Self) -> None:
         """Tests the get_points_for_receipt method with a valid receipt."""
@@ -233,8 +534,20 @@ class TestReceiptTracker:
             total=1.00,
         )
         tracker.add_receipt(receipt)
-        assert tracker.get_points_for_receipt("1") == 1
-        assert tracker.receipt_id_to_points == {"1": 1}
+        assert tracker.get_points_for_receipt(RECEIPT_ID_1) == 1
+        assert tracker.receipt_id_to_points == {RECEIPT_ID_1: 1}
+
+    def test_points_calculated_for_stats_are_kept(self: Self) -> None:
+        """Tests that a lazily scoring tracker keeps the points it calculates for the stats when a receipt is added,
+        rather than calculating them again when they're first looked up."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=False, stats=ReceiptStatsIndex())
+        with patch("receipt_service.ReceiptData.calculate_points", return_value=1) as calculate_points:
+            tracker.add_receipt(STANDARD_RECEIPT_1)
+            assert tracker.get_points_for_receipt(RECEIPT_ID_1) == 1
+            assert tracker.get_points_for_receipts([RECEIPT_ID_1]) == ({RECEIPT_ID_1: 1}, [])
+        assert calculate_points.call_count == 1
+        assert tracker.receipt_id_to_points == {RECEIPT_ID_1: 1}
 
     def test_get_points_for_receipt_already_gotten_once(self: Self) -> None:
         """Tests the get_points_for_receipt method with a valid receipt that has already been gotten once."""
@@ -247,5 +560,245 @@ class TestReceiptTracker:
             total=1.00,
         )
         tracker.add_receipt(receipt)
-        tracker.get_points_for_receipt("1")
-        tracker.get_points_for_receipt("1")  # second call should reference the cache.
+        tracker.get_points_for_receipt(RECEIPT_ID_1)
+        tracker.get_points_for_receipt(RECEIPT_ID_1)  # second call should reference the cache.
+
+    def test_add_receipt_eager_points(self: Self) -> None:
+        """Tests the add_receipt method calculates points up front and only keeps the points in eager mode."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=True)
+        receipt = ReceiptData(
+            retailer="aaa",
+            purchaseDate=date(2025, 1, 1),
+            purchaseTime=time(0, 0, 0),
+            items=[Item(shortDescription="abc", price=10.00)],
+            total=1.00,
+        )
+        tracker.add_receipt(receipt)
+        assert tracker.receipt_id_to_data == {}
+        assert tracker.receipt_id_to_eager_points == {RECEIPT_ID_1: 1}
+        assert tracker.receipt_id_to_payload_offset == {}
+
+    def test_get_points_for_receipt_eager_points(self: Self) -> None:
+        """Tests the get_points_for_receipt method is a lookup of the kept points in eager mode."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=True)
+        receipt = ReceiptData(
+            retailer="aaa",
+            purchaseDate=date(2025, 1, 1),
+            purchaseTime=time(0, 0, 0),
+            items=[Item(shortDescription="abc", price=10.00)],
+            total=1.00,
+        )
+        tracker.add_receipt(receipt)
+        with patch("receipt_service.ReceiptData.calculate_points") as calculate_points:
+            assert tracker.get_points_for_receipt(RECEIPT_ID_1) == 1
+        calculate_points.assert_not_called()
+        with pytest.raises(NoReceiptFoundException):
+            tracker.get_points_for_receipt(RECEIPT_ID_2)
+
+    def test_get_points_for_receipts(self: Self) -> None:
+        """Tests the get_points_for_receipts method with a mix of valid and invalid receipts."""
+        tracker = ReceiptTracker()
+        receipt = ReceiptData(
+            retailer="aaa",
+            purchaseDate=date(2025, 1, 1),
+            purchaseTime=time(0, 0, 0),
+            items=[Item(shortDescription="abc", price=10.00)],
+            total=1.00,
+        )
+        tracker.add_receipt(receipt)
+        assert tracker.get_points_for_receipts([RECEIPT_ID_2, RECEIPT_ID_1, RECEIPT_ID_2]) == (
+            {RECEIPT_ID_1: 1},
+            [RECEIPT_ID_2],
+        )
+
+
+class TestReceiptTrackerConcurrency:
+    """Stress tests the receipttracker class from many threads at once."""
+
+    @pytest.fixture(autouse=True)
+    def tracker_reset(self: Self):
+        """Resets the tracker between tests."""
+        yield
+        ReceiptTracker().clear()
+
+    def test_concurrent_add_and_get_points(self: Self) -> None:
+        """Tests that concurrent adds and points lookups don't lose receipts or calculate points more than once."""
+        num_threads = 8
+        receipts_per_thread = 100
+        calculated_ids = Counter()
+        counter_lock = threading.Lock()
+
+        def fake_calculate_points(self: ReceiptData) -> int:
+            """Counts each calculation by receipt and hands the GIL to another thread to widen any race window."""
+            with counter_lock:
+                calculated_ids[self.retailer] += 1
+            time_module.sleep(0)
+            return len(self.retailer)
+
+        def add_receipts(thread_number: int) -> list[tuple[str, ReceiptData]]:
+            """Adds receipts from one thread."""
+            added = []
+            for receipt_number in range(receipts_per_thread):
+                receipt = ReceiptData(
+                    retailer="a" * (1 + (thread_number * receipts_per_thread + receipt_number) % 50),
+                    purchaseDate=date(2025, 1, 1),
+                    purchaseTime=time(0, 0, 0),
+                    items=[Item(shortDescription="abc", price=10.00)],
+                    total=1.00,
+                )
+                added.append((ReceiptTracker().add_receipt(receipt), receipt))
+            return added
+
+        tracker = ReceiptTracker()
+        with patch("receipt_service.ReceiptData.calculate_points", fake_calculate_points):
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                added = [pair for result in executor.map(add_receipts, range(num_threads)) for pair in result]
+                # Every thread looks up every receipt so the same IDs are requested concurrently.
+                lookups = [
+                    executor.submit(lambda: {rid: tracker.get_points_for_receipt(rid) for rid, _ in added})
+                    for _ in range(num_threads)
+                ]
+                results = [lookup.result() for lookup in lookups]
+
+        assert len(added) == num_threads * receipts_per_thread
+        assert len({receipt_id for receipt_id, _ in added}) == len(added)
+        assert tracker.receipt_id_to_data == {receipt_id: receipt for receipt_id, receipt in added}
+        expected_points = {receipt_id: len(receipt.retailer) for receipt_id, receipt in added}
+        assert all(result == expected_points for result in results)
+        assert tracker.receipt_id_to_points == expected_points
+        # The tracker rebuilds a receipt from its packed form to score it, so the calculations are counted rather than
+        # matched to receipt objects.
+        assert sum(calculated_ids.values()) == len(added)
+
+
+@patch.object(ReceiptTracker, "NUM_SHARDS", 1)
+class TestReceiptTrackerCapacity:
+    """Tests the receipttracker class with a capacity policy, using a single shard so eviction order is predictable."""
+
+    @pytest.fixture(autouse=True)
+    def tracker_reset(self: Self):
+        """Resets the tracker between tests."""
+        yield
+        tracker = ReceiptTracker()
+        tracker.clear()
+        tracker.configure()
+
+    @pytest.fixture()
+    def spill(self: Self, tmp_path: Path) -> SqliteSpillStore:
+        """Creates a spill store in a temporary directory."""
+        return SqliteSpillStore(str(tmp_path / "spill.db"))
+
+    @staticmethod
+    def make_receipt(retailer: str) -> ReceiptData:
+        """Creates a receipt whose points are the length of the retailer name."""
+        return ReceiptData(
+            retailer=retailer,
+            purchaseDate=date(2025, 1, 2),
+            purchaseTime=time(0, 0, 0),
+            items=[Item(shortDescription="ab", price=1.01)],
+            total=1.01,
+        )
+
+    @pytest.mark.parametrize("eager_points", [False, True])
+    def test_max_entries_evicts_least_recently_used(
+        self: Self, spill: SqliteSpillStore, eager_points: bool
+    ) -> None:
+        """Tests that the least recently used receipt is evicted and spilled, and its points still available."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=eager_points, capacity=CapacityPolicy(max_entries=2), spill=spill)
+        id_a = tracker.add_receipt(self.make_receipt("a"))
+        id_bb = tracker.add_receipt(self.make_receipt("bb"))
+        tracker.get_points_for_receipt(id_a)  # Makes "bb" the least recently used.
+        id_ccc = tracker.add_receipt(self.make_receipt("ccc"))
+
+        assert tracker.cache_stats()["entries"] == 2
+        assert tracker.cache_stats()["evictions"] == 1
+        assert len(spill) == 1
+        assert tracker.get_points_for_receipts([id_a, id_bb, id_ccc]) == ({id_a: 1, id_bb: 2, id_ccc: 3}, [])
+        assert tracker.cache_stats()["misses"] == 1
+        if not eager_points:
+            assert set(tracker.receipt_id_to_data) == {id_a, id_ccc}
+            assert tracker._get_receipt(id_bb) == self.make_receipt("bb")
+        with pytest.raises(NoReceiptFoundException):
+            tracker.get_points_for_receipt(str(uuid.UUID(int=0)))
+
+    def test_spilled_points_are_kept(self: Self, spill: SqliteSpillStore) -> None:
+        """Tests that points calculated before or after a receipt is spilled aren't calculated again."""
+        tracker = ReceiptTracker()
+        tracker.configure(capacity=CapacityPolicy(max_entries=1), spill=spill)
+        id_a = tracker.add_receipt(self.make_receipt("a"))
+        tracker.get_points_for_receipt(id_a)
+        id_bb = tracker.add_receipt(self.make_receipt("bb"))
+        tracker.add_receipt(self.make_receipt("ccc"))
+
+        with patch("receipt_service.ReceiptData.calculate_points", return_value=100) as calculate_points:
+            assert tracker.get_points_for_receipt(id_a) == 1
+            assert tracker.get_points_for_receipt(id_bb) == 100
+            assert tracker.get_points_for_receipt(id_bb) == 100
+        assert calculate_points.call_count == 1
+
+    def test_evicted_strings_are_dropped(self: Self, spill: SqliteSpillStore) -> None:
+        """Tests that the strings of evicted and cleared receipts are dropped, so the string table only holds the
+        strings of the receipts in memory."""
+        tracker = ReceiptTracker()
+        tracker.configure(capacity=CapacityPolicy(max_entries=2), spill=spill)
+        strings_before, numbers_before = len(RECEIPT_STRINGS), len(RECEIPT_STRINGS.copy())
+        receipt_ids = [tracker.add_receipt(self.make_receipt(f"Retailer {number}")) for number in range(100)]
+        # The two receipts held share one item description, and the numbers of dropped strings are handed out again.
+        assert len(RECEIPT_STRINGS) <= strings_before + 3
+        assert len(RECEIPT_STRINGS.copy()) <= numbers_before + 4
+        assert tracker._get_receipt(receipt_ids[0]) == self.make_receipt("Retailer 0")
+        assert set(tracker.receipt_id_to_data) == set(receipt_ids[-2:])
+        tracker.clear()
+        assert "Retailer 99" not in RECEIPT_STRINGS.copy()
+
+    def test_max_bytes(self: Self, spill: SqliteSpillStore) -> None:
+        """Tests that receipts are evicted to stay within the byte budget."""
+        receipt_size = estimate_compact_size(compact_receipt(self.make_receipt("a")))
+        tracker = ReceiptTracker()
+        tracker.configure(capacity=CapacityPolicy(max_bytes=receipt_size * 3), spill=spill)
+        for _ in range(5):
+            tracker.add_receipt(self.make_receipt("a"))
+        stats = tracker.cache_stats()
+        assert (stats["entries"], stats["evictions"], stats["bytes"]) == (3, 2, receipt_size * 3)
+
+    def test_ttl(self: Self, spill: SqliteSpillStore) -> None:
+        """Tests that receipts that haven't been used within the TTL are evicted on the next insert."""
+        tracker = ReceiptTracker()
+        tracker.configure(capacity=CapacityPolicy(ttl=10), spill=spill)
+        with patch("receipt_service.monotonic", return_value=0):
+            id_a = tracker.add_receipt(self.make_receipt("a"))
+            id_bb = tracker.add_receipt(self.make_receipt("bb"))
+        with patch("receipt_service.monotonic", return_value=5):
+            tracker.get_points_for_receipt(id_a)
+        with patch("receipt_service.monotonic", return_value=12):
+            tracker.add_receipt(self.make_receipt("ccc"))
+
+        assert tracker.cache_stats()["evictions"] == 1
+        assert id_bb not in tracker.receipt_id_to_data
+        assert tracker.get_points_for_receipt(id_bb) == 2
+
+    @pytest.mark.parametrize("eager_points", [False, True])
+    def test_policy_set_on_populated_tracker(self: Self, spill: SqliteSpillStore, eager_points: bool) -> None:
+        """Tests that receipts added before a capacity policy is set are sized, timed and evicted under it."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=eager_points)
+        with patch("receipt_service.monotonic", return_value=0):
+            id_a = tracker.add_receipt(self.make_receipt("a"))
+            tracker.configure(eager_points=eager_points, capacity=CapacityPolicy(ttl=10, max_bytes=10**6), spill=spill)
+        assert tracker.cache_stats()["bytes"] > 0
+        with patch("receipt_service.monotonic", return_value=12):
+            tracker.add_receipt(self.make_receipt("bb"))
+
+        assert tracker.cache_stats()["evictions"] == 1
+        assert tracker.get_points_for_receipt(id_a) == 1
+
+    def test_policy_set_over_its_limit(self: Self, spill: SqliteSpillStore) -> None:
+        """Tests that setting a capacity policy evicts the receipts already held over its limits straight away."""
+        tracker = ReceiptTracker()
+        receipt_ids = [tracker.add_receipt(self.make_receipt("a")) for _ in range(3)]
+        tracker.configure(capacity=CapacityPolicy(max_entries=1), spill=spill)
+        assert tracker.cache_stats()["entries"] == 1
+        assert tracker.get_points_for_receipts(receipt_ids) == ({receipt_id: 1 for receipt_id in receipt_ids}, [])
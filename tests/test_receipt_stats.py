@@ -0,0 +1,142 @@
+"""Tests the receipt_stats module."""
+
+from datetime import date
+from decimal import Decimal
+import json
+from pathlib import Path
+from typing import Self
+
+import pytest
+
+from receipt_service import ReceiptTracker
+from receipt_stats import ReceiptAggregate, ReceiptStatsIndex
+from storage import AppendOnlyLogBackend
+from tests.api_tests.conftest import STANDARD_RECEIPT_1, STANDARD_RECEIPT_2
+
+
+class TestReceiptStatsIndex:
+    """Tests the ReceiptStatsIndex class."""
+
+    @pytest.fixture()
+    def index(self: Self) -> ReceiptStatsIndex:
+        """Returns an index of both standard receipts, the first one twice."""
+        index = ReceiptStatsIndex()
+        index.record([(STANDARD_RECEIPT_1, 28), (STANDARD_RECEIPT_2, 109), (STANDARD_RECEIPT_1, 28)])
+        return index
+
+    def test_totals(self: Self, index: ReceiptStatsIndex) -> None:
+        """Tests the totals of every receipt."""
+        assert index.totals() == ReceiptAggregate(count=3, total_cents=7970, points=165)
+        assert index.totals().to_dict() == {"count": 3, "total": Decimal("79.70"), "points": 165}
+
+    def test_by_retailer(self: Self, index: ReceiptStatsIndex) -> None:
+        """Tests the totals of each retailer, and of only one."""
+        assert index.by_retailer() == {
+            "Target": ReceiptAggregate(count=2, total_cents=7070, points=56),
+            "M&M Corner Market": ReceiptAggregate(count=1, total_cents=900, points=109),
+        }
+        assert index.by_retailer("Target") == {"Target": ReceiptAggregate(count=2, total_cents=7070, points=56)}
+        assert index.by_retailer("Walmart") == {}
+
+    @pytest.mark.parametrize(
+        "start, end, expected",
+        [
+            (None, None, ReceiptAggregate(3, 7970, 165)),
+            (date(2022, 1, 1), date(2022, 1, 1), ReceiptAggregate(2, 7070, 56)),
+            (date(2022, 1, 2), None, ReceiptAggregate(1, 900, 109)),
+            (None, date(2022, 3, 19), ReceiptAggregate(2, 7070, 56)),
+            (date(2022, 1, 2), date(2022, 3, 19), ReceiptAggregate()),
+        ],
+    )
+    def test_by_date_range(
+        self: Self, index: ReceiptStatsIndex, start: date | None, end: date | None, expected: ReceiptAggregate
+    ) -> None:
+        """Tests that a date range includes both of its ends and can be left open at either."""
+        assert index.by_date_range(start, end) == expected
+
+    def test_by_hour(self: Self, index: ReceiptStatsIndex) -> None:
+        """Tests the totals of each hour of purchase."""
+        assert index.by_hour() == {13: ReceiptAggregate(2, 7070, 56), 14: ReceiptAggregate(1, 900, 109)}
+
+    def test_by_points_band(self: Self) -> None:
+        """Tests that receipts fall into bands of the configured width, including on a band's edges."""
+        index = ReceiptStatsIndex(points_band_width=10)
+        index.record([(STANDARD_RECEIPT_1, 28), (STANDARD_RECEIPT_1, 20), (STANDARD_RECEIPT_2, 109)])
+        assert index.by_points_band() == [
+            (20, 29, ReceiptAggregate(2, 7070, 48)),
+            (100, 109, ReceiptAggregate(1, 900, 109)),
+        ]
+
+    def test_dump_and_load_state(self: Self, index: ReceiptStatsIndex) -> None:
+        """Tests that an index's state is added to another's, without the bands if they're of a different width."""
+        state = json.loads(json.dumps(index.dump_state()))
+        loaded = ReceiptStatsIndex()
+        loaded.record([(STANDARD_RECEIPT_2, 109)])
+        loaded.load_state(state)
+        assert loaded.totals() == ReceiptAggregate(4, 8870, 274)
+        assert loaded.by_retailer("Target") == {"Target": ReceiptAggregate(2, 7070, 56)}
+        assert loaded.by_date_range(date(2022, 1, 2)) == ReceiptAggregate(2, 1800, 218)
+        assert loaded.by_hour() == {13: ReceiptAggregate(2, 7070, 56), 14: ReceiptAggregate(2, 1800, 218)}
+        assert loaded.by_points_band() == [
+            (25, 49, ReceiptAggregate(2, 7070, 56)),
+            (100, 124, ReceiptAggregate(2, 1800, 218)),
+        ]
+
+        narrower = ReceiptStatsIndex(points_band_width=10)
+        narrower.load_state(state)
+        assert narrower.totals() == ReceiptAggregate(3, 7970, 165)
+        assert narrower.by_points_band() == []
+
+    def test_clear(self: Self, index: ReceiptStatsIndex) -> None:
+        """Tests that clearing resets every total."""
+        index.clear()
+        assert index.totals() == ReceiptAggregate()
+        assert index.by_retailer() == {} and index.by_hour() == {} and index.by_points_band() == []
+        assert index.by_date_range() == ReceiptAggregate()
+
+
+class TestReceiptTrackerStats:
+    """Tests the receipttracker class with a stats index."""
+
+    @pytest.fixture(autouse=True)
+    def tracker_reset(self: Self):
+        """Resets the tracker between tests."""
+        ReceiptTracker().configure(stats=ReceiptStatsIndex())
+        yield
+        tracker = ReceiptTracker()
+        tracker.configure()
+        tracker.clear()
+
+    @pytest.mark.parametrize("eager_points", [False, True])
+    def test_add_receipts(self: Self, eager_points: bool) -> None:
+        """Tests that receipts are counted as they're added, one at a time or in a batch, in either points mode."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=eager_points, stats=tracker.stats)
+        tracker.add_receipt(STANDARD_RECEIPT_1)
+        tracker.add_receipts([STANDARD_RECEIPT_2, STANDARD_RECEIPT_1])
+        assert tracker.stats.totals() == ReceiptAggregate(3, 7970, 165)
+        tracker.clear()
+        assert tracker.stats.totals() == ReceiptAggregate()
+
+    def test_lazy_points_not_persisted(self: Self, tmp_path: Path) -> None:
+        """Tests that scoring receipts for the stats doesn't change what a lazily scoring tracker persists."""
+        tracker = ReceiptTracker()
+        tracker.configure(storage=AppendOnlyLogBackend(str(tmp_path / "receipts.log")), stats=tracker.stats)
+        tracker.add_receipt(STANDARD_RECEIPT_1)
+        tracker.close()
+        assert [stored.points for stored in AppendOnlyLogBackend(str(tmp_path / "receipts.log")).replay()] == [None]
+
+    @pytest.mark.parametrize("eager_points", [False, True])
+    def test_loaded_from_storage(self: Self, tmp_path: Path, eager_points: bool) -> None:
+        """Tests that receipts loaded from storage are counted."""
+        log_path = str(tmp_path / "receipts.log")
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=eager_points, storage=AppendOnlyLogBackend(log_path), stats=tracker.stats)
+        tracker.add_receipts([STANDARD_RECEIPT_1, STANDARD_RECEIPT_2])
+        tracker.close()
+        tracker.clear()
+
+        tracker.configure(eager_points=eager_points, storage=AppendOnlyLogBackend(log_path), stats=tracker.stats)
+        assert tracker.stats.totals() == ReceiptAggregate(2, 4435, 137)
+        assert tracker.stats.by_hour() == {13: ReceiptAggregate(1, 3535, 28), 14: ReceiptAggregate(1, 900, 109)}
+        tracker.close()
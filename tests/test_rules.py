@@ -0,0 +1,179 @@
+"""Tests the rules module."""
+
+from datetime import date, time
+from decimal import Decimal
+import json
+from pathlib import Path
+from typing import Self
+
+from hypothesis import given, settings
+import pytest
+
+from app import create_app
+from exceptions import UnknownRulesVersionException
+from receipt_service import Item, ReceiptData, ReceiptTracker
+from rules import (
+    DEFAULT_RULE_SET,
+    ItemGroupRule,
+    PurchaseDateWindowRule,
+    RetailerAlphanumericRule,
+    RetailerMultiplierRule,
+    RuleSet,
+    compile_rule_set,
+    get_rule_set,
+    load_rule_sets,
+    register_rule_set,
+)
+from tests.api_tests.conftest import STANDARD_RECEIPT_1, STANDARD_RECEIPT_2
+from tests.test_bulk_points import receipts
+
+
+def hand_written_points(receipt: ReceiptData) -> int:
+    """The exercise's rules written out by hand, to check the compiled default rule set against."""
+    points = sum(char.isalnum() for char in receipt.retailer)
+    points += 50 if receipt.total_cents % 100 == 0 else 0
+    points += 25 if receipt.total_cents % 25 == 0 else 0
+    points += len(receipt.items) // 2 * 5
+    points += sum(item.calculate_item_points() for item in receipt.items)
+    points += 6 if receipt.purchaseDate.day % 2 != 0 else 0
+    purchase_time = receipt.purchaseTime
+    points += 10 if (purchase_time.hour == 14 and purchase_time.minute > 0) or purchase_time.hour == 15 else 0
+    return points
+
+
+PROMO_RULE_SET = RuleSet(
+    version="test-promo",
+    rules=[
+        RetailerAlphanumericRule(name="alphanumeric", points=1),
+        ItemGroupRule(name="item_pairs", group_size=2, points=5),
+        PurchaseDateWindowRule(
+            name="new_year", start=date(2022, 1, 1), end=date(2022, 1, 7), retailer="Target", points=100
+        ),
+        RetailerMultiplierRule(name="target_bonus", retailer="Target", multiplier=Decimal("1.5")),
+    ],
+)
+register_rule_set(PROMO_RULE_SET)
+
+
+class TestCompiledRuleSet:
+    """Tests compiling rule sets."""
+
+    @given(receipts)
+    @settings(max_examples=500, deadline=None)
+    def test_default_rules_match_hand_written_rules(self: Self, receipt: ReceiptData) -> None:
+        """Tests that the compiled default rules score every receipt like the hand-written rules."""
+        compiled = get_rule_set(DEFAULT_RULE_SET.version)
+        assert compiled.score(receipt) == hand_written_points(receipt)
+        assert sum(compiled.breakdown(receipt).values()) == compiled.score(receipt)
+
+    def test_default_rules_exercise_examples(self: Self) -> None:
+        """Tests the exercise examples with the default rules."""
+        assert STANDARD_RECEIPT_1.calculate_points() == 28
+        assert STANDARD_RECEIPT_2.calculate_points() == 109
+
+    def test_promo_rules(self: Self) -> None:
+        """Tests date window and retailer multiplier rules, and the breakdown of what each added."""
+        compiled = get_rule_set(PROMO_RULE_SET.version)
+        # 6 alphanumeric + 10 for two pairs + 100 for the new year promo, then times 1.5.
+        assert compiled.score(STANDARD_RECEIPT_1) == 174
+        assert compiled.breakdown(STANDARD_RECEIPT_1) == {
+            "alphanumeric": 6,
+            "item_pairs": 10,
+            "new_year": 100,
+            "target_bonus": 58,
+        }
+        # No promos apply outside Target, leaving 14 alphanumeric + 10 for two pairs.
+        assert compiled.score(STANDARD_RECEIPT_2) == 24
+
+    def test_multiplier_rounds_up(self: Self) -> None:
+        """Tests that multiplied points are rounded up to a whole point."""
+        rule_set = RuleSet(
+            version="unregistered",
+            rules=[
+                RetailerAlphanumericRule(name="alphanumeric"),
+                RetailerMultiplierRule(name="bonus", retailer="abc", multiplier=Decimal("1.1")),
+            ],
+        )
+        receipt = ReceiptData(
+            retailer="abc",
+            purchaseDate=date(2022, 1, 1),
+            purchaseTime=time(0, 0),
+            items=[Item(shortDescription="a", price="1.00")],
+            total="1.00",
+        )
+        assert compile_rule_set(rule_set).score(receipt) == 4
+
+    def test_constants_are_not_pasted_into_source(self: Self) -> None:
+        """Tests that values from a rule set, like retailer names, are bound as names rather than made into code."""
+        rule_set = RuleSet(
+            version="unregistered",
+            rules=[RetailerMultiplierRule(name="bonus", retailer='") or __import__("os") or ("', multiplier=2)],
+        )
+        compiled = compile_rule_set(rule_set)
+        assert "__import__" not in compiled.source
+        assert compiled.score(STANDARD_RECEIPT_1) == 0
+
+
+class TestRuleSetRegistry:
+    """Tests registering and looking up rule sets."""
+
+    @pytest.fixture(autouse=True)
+    def tracker_reset(self: Self):
+        """Resets the tracker between tests."""
+        yield
+        tracker = ReceiptTracker()
+        tracker.configure()
+        tracker.clear()
+
+    def test_unknown_version(self: Self) -> None:
+        """Tests that looking up or configuring an unknown version raises."""
+        with pytest.raises(UnknownRulesVersionException):
+            get_rule_set("missing")
+        with pytest.raises(UnknownRulesVersionException):
+            ReceiptTracker().configure(rules_version="missing")
+
+    def test_version_cant_be_redefined(self: Self) -> None:
+        """Tests that a registered version can't be replaced with different rules."""
+        with pytest.raises(ValueError):
+            register_rule_set(RuleSet(version=DEFAULT_RULE_SET.version, rules=[]))
+
+    def test_load_rule_sets(self: Self, tmp_path: Path) -> None:
+        """Tests loading rule sets from JSON, including loading the same file again."""
+        path = tmp_path / "rules.json"
+        rule_sets = [
+            {
+                "version": "test-json",
+                "rules": [
+                    {"kind": "retailer_alphanumeric", "name": "alphanumeric", "points": 2},
+                    {"kind": "total_multiple", "name": "dollar", "multiple": "1.00", "points": 3},
+                ],
+            }
+        ]
+        path.write_text(json.dumps(rule_sets))
+        (compiled,) = load_rule_sets(str(path))
+        assert load_rule_sets(str(path)) == [compiled]
+        # 2 for each of the 14 alphanumeric characters and 3 for the round total.
+        assert compiled.score(STANDARD_RECEIPT_2) == 31
+
+    @pytest.mark.parametrize("eager_points", [False, True])
+    def test_receipts_keep_their_version(self: Self, eager_points: bool) -> None:
+        """Tests that receipts are scored with the version they were added under after the version changes."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=eager_points, rules_version=PROMO_RULE_SET.version)
+        promo_id = tracker.add_receipt(STANDARD_RECEIPT_1)
+        tracker.configure(eager_points=eager_points)
+        default_id = tracker.add_receipt(STANDARD_RECEIPT_1)
+        assert STANDARD_RECEIPT_1.rules_version is None
+        assert tracker.get_points_for_receipts([promo_id, default_id]) == ({promo_id: 174, default_id: 28}, [])
+
+    def test_create_app_rules_settings(self: Self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Tests that the app loads the rules file and scores new receipts with the configured version."""
+        path = tmp_path / "rules.json"
+        rule_sets = [{"version": "7", "rules": [{"kind": "odd_purchase_day", "name": "odd", "points": 1}]}]
+        path.write_text(json.dumps(rule_sets))
+        monkeypatch.setenv("FLASK_RECEIPTS_RULES_PATH", str(path))
+        monkeypatch.setenv("FLASK_RECEIPTS_RULES_VERSION", "7")
+        create_app()
+        tracker = ReceiptTracker()
+        assert tracker.rules_version == "7"
+        assert tracker.get_points_for_receipt(tracker.add_receipt(STANDARD_RECEIPT_1)) == 1
@@ -0,0 +1,76 @@
+"""Tests the schema module."""
+
+from typing import Self
+
+import marshmallow as ma
+import pytest
+
+from schema import ReceiptBaseSchema
+from tests.api_tests.conftest import STANDARD_INPUT_BODY_1, STANDARD_INPUT_BODY_2
+
+
+class NestedItemsSchema(ReceiptBaseSchema):
+    """The receipt schema with every item loaded through the nested item schema, as the items fast path should match."""
+
+    items = ma.fields.List(
+        ma.fields.Nested(ReceiptBaseSchema.ItemSchema),
+        required=True,
+        validate=ma.validate.Length(min=1),
+    )
+
+
+def load(schema: ma.Schema, body: dict) -> tuple[object, object]:
+    """Loads a receipt, returning the receipt or None and the errors or None."""
+    try:
+        return schema.load(body), None
+    except ma.ValidationError as error:
+        return None, error.messages
+
+
+class TestItemListField:
+    """Tests the ItemListField class."""
+
+    @pytest.mark.parametrize(
+        "item",
+        [
+            {"shortDescription": "Gatorade", "price": "2.25"},
+            {"shortDescription": "Gatorade", "price": 2.25},
+            {"shortDescription": "Gatorade", "price": 2},
+            {"shortDescription": "Gatorade", "price": "1.000"},
+            {"shortDescription": "Gatorade", "price": "1e2"},
+            {"shortDescription": "Gatorade", "price": "-0.00"},
+            {"shortDescription": "Gatorade", "price": "-1.00"},
+            {"shortDescription": "Gatorade", "price": "1.001"},
+            {"shortDescription": "Gatorade", "price": "NaN"},
+            {"shortDescription": "Gatorade", "price": "Infinity"},
+            {"shortDescription": "Gatorade", "price": "1e30"},
+            {"shortDescription": "Gatorade", "price": "six"},
+            {"shortDescription": "Gatorade", "price": True},
+            {"shortDescription": "Gatorade", "price": None},
+            {"shortDescription": "Gatorade\n", "price": "2.25"},
+            {"shortDescription": "&", "price": "2.25"},
+            {"shortDescription": "", "price": "2.25"},
+            {"shortDescription": 5, "price": "2.25"},
+            {"shortDescription": "Gatorade"},
+            {"shortDescription": "Gatorade", "price": "2.25", "extra": 1},
+            {},
+            "Gatorade",
+        ],
+    )
+    def test_same_as_nested_schema(self: Self, item: object) -> None:
+        """Tests that an item after a valid one is loaded to the same receipt, or rejected with the same errors, as
+        through the nested item schema."""
+        body = STANDARD_INPUT_BODY_1 | {"items": [{"shortDescription": "Dasani", "price": "1.40"}, item]}
+        assert load(ReceiptBaseSchema(), body) == load(NestedItemsSchema(), body)
+
+    @pytest.mark.parametrize("items", [[], None, "items", ({"shortDescription": "Dasani", "price": "1.40"},)])
+    def test_not_a_list_of_items(self: Self, items: object) -> None:
+        """Tests that an empty list, or something other than a list, is handled as by the nested item schema."""
+        body = STANDARD_INPUT_BODY_1 | {"items": items}
+        assert load(ReceiptBaseSchema(), body) == load(NestedItemsSchema(), body)
+
+    @pytest.mark.parametrize("body", [STANDARD_INPUT_BODY_1, STANDARD_INPUT_BODY_2])
+    def test_standard_receipts(self: Self, body: dict) -> None:
+        """Tests that the standard receipts are loaded the same as through the nested item schema."""
+        assert load(ReceiptBaseSchema(), body) == load(NestedItemsSchema(), body)
+        assert load(ReceiptBaseSchema(), body)[1] is None
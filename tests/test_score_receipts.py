@@ -0,0 +1,80 @@
+"""Tests the offline scoring tool."""
+
+import csv
+import gzip
+import json
+from pathlib import Path
+from typing import Self
+
+import pytest
+
+from rules import DEFAULT_RULE_SET, RetailerMultiplierRule, RuleSet
+from score_receipts import main, score_file
+from tests.api_tests.conftest import STANDARD_INPUT_BODY_1, STANDARD_INPUT_BODY_2
+
+INPUT_LINES = [
+    json.dumps(STANDARD_INPUT_BODY_1),
+    "",
+    json.dumps({"id": "receipt-2", **STANDARD_INPUT_BODY_2}),
+    json.dumps({**STANDARD_INPUT_BODY_1, "retailer": "%"}),
+    "{not json",
+]
+EXPECTED_ROWS = [
+    {"id": "1", "points": 28},
+    {"id": "receipt-2", "points": 109},
+    {"id": "4", "error": {"retailer": ["String does not match expected pattern."]}},
+    {"id": "5", "error": {"_schema": ["Invalid JSON."]}},
+]
+
+
+def write_input(path: Path, lines: list[str]) -> str:
+    """Writes the lines to a JSON lines file, gzipped if the name ends in .gz."""
+    data = ("\n".join(lines) + "\n").encode()
+    if path.suffix == ".gz":
+        data = gzip.compress(data)
+    path.write_bytes(data)
+    return str(path)
+
+
+def read_rows(path: Path) -> list[dict]:
+    """Reads the rows of a JSON lines output file."""
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+class TestScoreReceipts:
+    """Tests scoring a file of receipts."""
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_score_file(self: Self, tmp_path: Path, workers: int) -> None:
+        """Tests that every line gets a row with its points or errors, in order, whether or not a pool is used."""
+        input_path = write_input(tmp_path / "receipts.jsonl", INPUT_LINES)
+        counts = score_file(input_path, str(tmp_path / "points.jsonl"), workers=workers, chunk_size=2)
+        assert counts == {"scored": 2, "invalid": 2}
+        assert read_rows(tmp_path / "points.jsonl") == EXPECTED_ROWS
+
+    def test_gzip_and_csv(self: Self, tmp_path: Path) -> None:
+        """Tests reading a gzipped input and writing gzipped CSV rows."""
+        input_path = write_input(tmp_path / "receipts.jsonl.gz", INPUT_LINES)
+        main([input_path, str(tmp_path / "points.csv.gz"), "--workers", "2"])
+        with gzip.open(tmp_path / "points.csv.gz", "rt", newline="") as output:
+            rows = list(csv.DictReader(output))
+        assert [(row["id"], row["points"]) for row in rows] == [("1", "28"), ("receipt-2", "109"), ("4", ""), ("5", "")]
+        assert json.loads(rows[3]["error"]) == {"_schema": ["Invalid JSON."]}
+
+    def test_rules_version(self: Self, tmp_path: Path) -> None:
+        """Tests scoring with a rules version loaded from a file."""
+        rule_set = RuleSet(
+            version="score-receipts-test",
+            rules=[*DEFAULT_RULE_SET.rules, RetailerMultiplierRule(name="double", retailer="Target", multiplier=2)],
+        )
+        rules_path = tmp_path / "rules.json"
+        rules_path.write_text(json.dumps([rule_set.model_dump(mode="json")]))
+        input_path = write_input(tmp_path / "receipts.jsonl", INPUT_LINES[:3])
+        score_file(
+            input_path,
+            str(tmp_path / "points.jsonl"),
+            workers=2,
+            rules_version="score-receipts-test",
+            rules_path=str(rules_path),
+        )
+        assert read_rows(tmp_path / "points.jsonl") == [{"id": "1", "points": 56}, {"id": "receipt-2", "points": 109}]
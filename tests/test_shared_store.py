@@ -0,0 +1,201 @@
+"""Tests the shared_store and store_server modules."""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from typing import Iterator, Self
+
+import pytest
+
+from exceptions import ReceiptStorageException
+from receipt_service import ReceiptTracker, receipt_id_to_bytes
+from receipt_stats import ReceiptAggregate
+from shared_store import ConnectionPool, SharedReceiptStatsIndex, SharedReceiptStore
+from storage import AppendOnlyLogBackend
+from store_server import StoreServer, parse_commands
+from tests.api_tests.conftest import STANDARD_RECEIPT_1, STANDARD_RECEIPT_2
+
+
+@pytest.fixture()
+def store_path() -> Iterator[str]:
+    """Serves a fresh store on a unix socket and returns its path, kept short as socket paths are limited in length."""
+    directory = tempfile.mkdtemp(prefix="store-")
+    server = StoreServer(os.path.join(directory, "store.sock"))
+    server.start()
+    yield server.path
+    server.stop()
+    shutil.rmtree(directory)
+
+
+class TestStoreServer:
+    """Tests the StoreServer class."""
+
+    def test_parse_commands(self: Self) -> None:
+        """Tests that complete commands are parsed out of the buffer and a partly received one is left in it."""
+        buffer = bytearray(b"*2\r\n$3\r\nGET\r\n$1\r\na\r\nPING\r\n\r\n*1\r\n$4\r\nPI")
+        assert parse_commands(buffer) == [[b"GET", b"a"], [b"PING"]]
+        buffer += b"NG\r\n"
+        assert parse_commands(buffer) == [[b"PING"]]
+        assert buffer == b""
+
+    def test_commands(self: Self) -> None:
+        """Tests the replies to the commands the store serves, including errors."""
+        server = StoreServer("unused")
+        assert server.execute([b"set", b"a", b"1"]) == b"OK"
+        assert server.execute([b"SET", b"a", b"2", b"NX"]) is None
+        assert server.execute([b"GET", b"a"]) == b"1"
+        assert server.execute([b"HSET", b"h", b"f", b"1", b"g", b"2"]) == 2
+        assert server.execute([b"HINCRBY", b"h", b"f", b"5"]) == 6
+        assert server.execute([b"HMGET", b"h", b"f", b"missing"]) == [b"6", None]
+        assert server.execute([b"HGETALL", b"h"]) == [b"f", b"6", b"g", b"2"]
+        assert server.execute([b"DEL", b"a", b"missing"]) == 1
+        assert server.execute([b"DBSIZE"]) == 1
+        assert str(server.execute([b"GET", b"h"])).startswith("WRONGTYPE")
+        assert str(server.execute([b"HINCRBY", b"h", b"f", b"x"])) == "ERR hash value is not an integer"
+        assert str(server.execute([b"HSET", b"h", b"f"])).startswith("ERR wrong number of arguments")
+        assert str(server.execute([b"NOPE"])) == "ERR unknown command 'NOPE'"
+
+    def test_pipelined_over_socket(self: Self, store_path: str) -> None:
+        """Tests that a pipeline sent in one write is answered in order, errors included, over a raw socket."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(store_path)
+            client.sendall(
+                b"PING\r\n*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\nv\r\n*1\r\n$4\r\nNOPE\r\n*2\r\n$3\r\nGET\r\n$1\r\nk\r\n"
+            )
+            expected = b"+PONG\r\n+OK\r\n-ERR unknown command 'NOPE'\r\n$1\r\nv\r\n"
+            received = b""
+            while len(received) < len(expected):
+                received += client.recv(1024)
+            assert received == expected
+
+
+class TestSharedReceiptStore:
+    """Tests the SharedReceiptStore class."""
+
+    def test_put_and_get(self: Self, store_path: str) -> None:
+        """Tests that receipts written in a batch are read back in a batch, with their points once they're set."""
+        store = SharedReceiptStore(store_path)
+        store.put_many([(b"a" * 16, 28, b'{"a": 1}'), (b"b" * 16, None, b'{"b": 2}')])
+        assert store.get_many([b"a" * 16, b"c" * 16, b"b" * 16]) == [(28, b'{"a": 1}'), None, (None, b'{"b": 2}')]
+        store.set_points(b"b" * 16, 109)
+        assert store.get(b"b" * 16) == (109, b'{"b": 2}')
+        store.clear()
+        assert store.get(b"a" * 16) is None
+        store.close()
+
+    def test_pool_reuses_connections(self: Self, store_path: str) -> None:
+        """Tests that connections are returned to the pool and reused, including after an error reply."""
+        pool = ConnectionPool(store_path, max_connections=1)
+        with pool.connection() as first:
+            pass
+        with pytest.raises(ReceiptStorageException):
+            pool.execute([(b"NOPE",)])
+        with pool.connection() as second:
+            assert second is first
+        pool.close()
+
+    def test_concurrent_threads(self: Self, store_path: str) -> None:
+        """Tests that threads sharing a pool smaller than their number each get their own replies."""
+        store = SharedReceiptStore(store_path, max_connections=2)
+
+        def put_and_get(i: int) -> tuple[int | None, bytes] | None:
+            id_bytes = i.to_bytes(16, "big")
+            store.put_many([(id_bytes, i, b"%d" % i)])
+            return store.get(id_bytes)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            assert list(executor.map(put_and_get, range(200))) == [(i, b"%d" % i) for i in range(200)]
+
+    def test_unreachable(self: Self) -> None:
+        """Tests that a store that can't be reached raises a storage exception."""
+        store = SharedReceiptStore(os.path.join(tempfile.gettempdir(), "no-such-store.sock"), timeout=0.1)
+        with pytest.raises(ReceiptStorageException):
+            store.ping()
+
+
+class TestSharedReceiptStatsIndex:
+    """Tests the SharedReceiptStatsIndex class."""
+
+    def test_groups(self: Self, store_path: str) -> None:
+        """Tests that receipts recorded through two indexes on the same store are totalled together in every group."""
+        store = SharedReceiptStore(store_path)
+        first, second = SharedReceiptStatsIndex(store), SharedReceiptStatsIndex(store)
+        first.record([(STANDARD_RECEIPT_1, 28), (STANDARD_RECEIPT_2, 109)])
+        second.record([(STANDARD_RECEIPT_1, 28)])
+
+        assert second.totals() == ReceiptAggregate(3, 7970, 165)
+        assert first.by_retailer() == {
+            "Target": ReceiptAggregate(2, 7070, 56),
+            "M&M Corner Market": ReceiptAggregate(1, 900, 109),
+        }
+        assert first.by_retailer("Target") == {"Target": ReceiptAggregate(2, 7070, 56)}
+        assert first.by_retailer("Walmart") == {}
+        assert first.by_date_range(end=STANDARD_RECEIPT_1.purchaseDate) == ReceiptAggregate(2, 7070, 56)
+        assert first.by_hour() == {13: ReceiptAggregate(2, 7070, 56), 14: ReceiptAggregate(1, 900, 109)}
+        assert first.by_points_band() == [
+            (25, 49, ReceiptAggregate(2, 7070, 56)),
+            (100, 124, ReceiptAggregate(1, 900, 109)),
+        ]
+        first.clear()
+        assert second.totals() == ReceiptAggregate()
+
+
+class TestReceiptTrackerShared:
+    """Tests the receipttracker class with a shared store."""
+
+    @pytest.fixture(autouse=True)
+    def tracker_reset(self: Self, store_path: str):
+        """Points the tracker at the shared store, and resets it after the test."""
+        shared = SharedReceiptStore(store_path)
+        ReceiptTracker().configure(shared=shared, stats=SharedReceiptStatsIndex(shared))
+        yield
+        tracker = ReceiptTracker()
+        tracker.clear()
+        tracker.configure()
+
+    @pytest.mark.parametrize("eager_points", [False, True])
+    def test_receipts_from_another_process(self: Self, store_path: str, eager_points: bool) -> None:
+        """Tests that receipts added by another process are found through the shared store, one at a time or in a
+        batch, and counted in the shared stats."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=eager_points, shared=tracker.shared, stats=tracker.stats)
+        local_id = tracker.add_receipt(STANDARD_RECEIPT_2)
+        script = (
+            "from receipt_service import ReceiptTracker\n"
+            "from shared_store import SharedReceiptStatsIndex, SharedReceiptStore\n"
+            "from tests.api_tests.conftest import STANDARD_RECEIPT_1\n"
+            f"shared = SharedReceiptStore({store_path!r})\n"
+            "ReceiptTracker().configure(shared=shared, stats=SharedReceiptStatsIndex(shared))\n"
+            "print(ReceiptTracker().add_receipts([STANDARD_RECEIPT_1, STANDARD_RECEIPT_1]))\n"
+        )
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, check=True, text=True).stdout
+        other_id_1, other_id_2 = eval(output)
+
+        assert tracker.get_points_for_receipt(other_id_1) == 28
+        unknown_id = tracker.new_receipt_id()
+        assert tracker.get_points_for_receipts([local_id, other_id_2, unknown_id]) == (
+            {local_id: 109, other_id_2: 28},
+            [unknown_id],
+        )
+        assert tracker.stats.totals() == ReceiptAggregate(3, 7970, 165)
+        # The points of the other process's receipts are recorded for every process once they've been calculated.
+        assert tracker.shared.get(receipt_id_to_bytes(other_id_1))[0] == 28
+
+    def test_restart_with_storage_counts_receipts_once(self: Self, tmp_path: Path) -> None:
+        """Tests that receipts replayed from the log on restart aren't counted again in the shared stats, which already
+        count them from when they were added."""
+        log_path = str(tmp_path / "receipts.log")
+        tracker = ReceiptTracker()
+        tracker.configure(storage=AppendOnlyLogBackend(log_path), shared=tracker.shared, stats=tracker.stats)
+        tracker.add_receipts([STANDARD_RECEIPT_1, STANDARD_RECEIPT_2, STANDARD_RECEIPT_1])
+        for _ in range(2):
+            shared, stats = tracker.shared, tracker.stats
+            tracker.close()
+            tracker.configure(storage=AppendOnlyLogBackend(log_path), shared=shared, stats=stats)
+            assert tracker.stats.totals() == ReceiptAggregate(3, 7970, 165)
+        tracker.close()
@@ -0,0 +1,285 @@
+"""Tests the snapshot module."""
+
+from pathlib import Path
+import subprocess
+import sys
+import threading
+from types import SimpleNamespace
+from typing import Self
+from unittest.mock import patch
+
+import pytest
+
+from app import create_app
+import gunicorn_config
+from exceptions import NoReceiptFoundException, ReceiptStorageException
+from receipt_service import RECEIPT_STRINGS, CapacityPolicy, ReceiptTracker, receipt_id_to_bytes
+from receipt_stats import ReceiptAggregate, ReceiptStatsIndex
+from snapshot import (
+    NO_POINTS,
+    RECORD_JSON,
+    RECORD_NONE,
+    RECORD_PACKED,
+    ReceiptSnapshot,
+    SnapshotEntry,
+    columns_from_rows,
+    merge_columns,
+    write_snapshot_file,
+)
+from storage import AppendOnlyLogBackend
+from tests.api_tests.conftest import STANDARD_INPUT_BODY_1, STANDARD_RECEIPT_1, STANDARD_RECEIPT_2
+
+
+@pytest.fixture()
+def snapshot_path(tmp_path: Path) -> str:
+    """Returns the path of a fresh snapshot file."""
+    return str(tmp_path / "receipts.snapshot")
+
+
+def ids(*numbers: int) -> list[bytes]:
+    """Returns 16 byte IDs for numbers, sorting in the same order, the first ending in a zero byte."""
+    return [number.to_bytes(16, "big") for number in numbers]
+
+
+class TestSnapshotFile:
+    """Tests writing and reading snapshot files."""
+
+    def test_write_and_read(self: Self, snapshot_path: str) -> None:
+        """Tests that receipts written to a snapshot are found with their points and records, and nothing else is."""
+        id_1, id_2, id_3 = ids(256, 2, 3)
+        columns = merge_columns(
+            None,
+            columns_from_rows(
+                [(id_1, 28, RECORD_PACKED, b"packed"), (id_2, None, RECORD_JSON, b"{}"), (id_3, 5, RECORD_NONE, b"")]
+            ),
+        )
+        write_snapshot_file(snapshot_path, columns, ["Target", "Gatorade"], {"totals": [1, 2, 3]}, log_offset=10)
+
+        snapshot = ReceiptSnapshot(snapshot_path)
+        assert len(snapshot) == 3
+        assert snapshot.get(id_1) == SnapshotEntry(28, RECORD_PACKED, b"packed")
+        assert snapshot.get(id_2) == SnapshotEntry(None, RECORD_JSON, b"{}")
+        assert snapshot.get(id_3) == SnapshotEntry(5, RECORD_NONE, b"")
+        assert snapshot.get(ids(4)[0]) is None and ids(1)[0] not in snapshot and b"short" not in snapshot
+        assert snapshot.strings == ["Target", "Gatorade"]
+        assert snapshot.stats == {"totals": [1, 2, 3]} and snapshot.log_offset == 10
+        snapshot.close()
+
+    def test_merge_columns(self: Self) -> None:
+        """Tests that new receipts are merged into an old snapshot's in order of ID, with their records after."""
+        old = columns_from_rows([(id_bytes, 1, RECORD_PACKED, b"old") for id_bytes in ids(1, 3)])
+        new = columns_from_rows([(id_bytes, None, RECORD_JSON, b"new!") for id_bytes in ids(4, 2)])
+        merged = merge_columns(old, new)
+        assert merged.ids.tolist() == ids(1, 2, 3, 4)
+        assert merged.points.tolist() == [1, NO_POINTS, 1, NO_POINTS]
+        assert merged.record_starts.tolist() == [0, 10, 3, 6]
+        assert b"".join(merged.records) == b"oldoldnew!new!"
+
+    def test_empty(self: Self, snapshot_path: str) -> None:
+        """Tests a snapshot with no receipts."""
+        write_snapshot_file(snapshot_path, columns_from_rows([]), [])
+        snapshot = ReceiptSnapshot(snapshot_path)
+        assert len(snapshot) == 0 and snapshot.get(ids(1)[0]) is None
+        assert snapshot.stats is None and snapshot.log_offset is None
+
+    @pytest.mark.parametrize("contents", [b"", b"not a snapshot", b"RCPTSNAP" + bytes(300)])
+    def test_not_a_snapshot(self: Self, snapshot_path: str, contents: bytes) -> None:
+        """Tests that a file that isn't a snapshot raises a storage exception."""
+        Path(snapshot_path).write_bytes(contents)
+        with pytest.raises(ReceiptStorageException):
+            ReceiptSnapshot(snapshot_path)
+
+
+class TestReceiptTrackerSnapshot:
+    """Tests the receipttracker class with snapshots."""
+
+    @pytest.fixture(autouse=True)
+    def tracker_reset(self: Self):
+        """Resets the tracker between tests."""
+        yield
+        tracker = ReceiptTracker()
+        tracker.configure()
+        tracker.clear()
+
+    def restart(
+        self: Self, eager_points: bool, snapshot_path: str, storage: AppendOnlyLogBackend | None = None
+    ) -> None:
+        """Simulates a restart by dropping everything in memory and restoring from the snapshot."""
+        tracker = ReceiptTracker()
+        tracker.configure()
+        tracker.clear()
+        tracker.configure(
+            eager_points=eager_points,
+            stats=ReceiptStatsIndex(),
+            storage=storage,
+            snapshot=ReceiptSnapshot(snapshot_path),
+        )
+
+    @pytest.mark.parametrize("eager_points", [False, True])
+    def test_restore(self: Self, snapshot_path: str, eager_points: bool) -> None:
+        """Tests that receipts and stats are restored from a snapshot, and carried over into the next one along with
+        the receipts added since."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=eager_points, stats=ReceiptStatsIndex())
+        id_1, id_2 = tracker.add_receipts([STANDARD_RECEIPT_1, STANDARD_RECEIPT_2])
+        assert tracker.write_snapshot(snapshot_path) == 2
+
+        self.restart(eager_points, snapshot_path)
+        tracker = ReceiptTracker()
+        assert tracker.receipt_id_to_data == {} and tracker.receipt_id_to_eager_points == {}
+        assert tracker.get_points_for_receipt(id_1) == 28
+        missing_id = tracker.new_receipt_id()
+        assert tracker.get_points_for_receipts([id_1, id_2, missing_id]) == ({id_1: 28, id_2: 109}, [missing_id])
+        assert tracker.stats.totals() == ReceiptAggregate(2, 4435, 137)
+        id_3 = tracker.add_receipt(STANDARD_RECEIPT_2)
+        assert tracker.write_snapshot(snapshot_path) == 3
+
+        self.restart(eager_points, snapshot_path)
+        tracker = ReceiptTracker()
+        assert tracker.get_points_for_receipts([id_1, id_2, id_3]) == ({id_1: 28, id_2: 109, id_3: 109}, [])
+        assert tracker.stats.totals() == ReceiptAggregate(3, 5335, 246)
+        if eager_points:
+            with pytest.raises(NoReceiptFoundException):
+                tracker._get_receipt(id_1)
+        else:
+            assert tracker._get_receipt(id_1) == STANDARD_RECEIPT_1
+            # Points calculated after the first restore were carried over into the second snapshot.
+            assert ReceiptSnapshot(snapshot_path).get(receipt_id_to_bytes(id_1)).points == 28
+
+    def test_restore_in_another_process(self: Self, snapshot_path: str) -> None:
+        """Tests that a snapshot written by another process, which numbered its strings differently, is restored, and
+        that receipts added since are renumbered into its strings in the next one."""
+        script = (
+            "from receipt_service import ReceiptTracker\n"
+            "from tests.api_tests.conftest import STANDARD_RECEIPT_1, STANDARD_RECEIPT_2\n"
+            "tracker = ReceiptTracker()\n"
+            "print(tracker.add_receipts([STANDARD_RECEIPT_2, STANDARD_RECEIPT_1]))\n"
+            f"tracker.write_snapshot({snapshot_path!r})\n"
+        )
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, check=True, text=True).stdout
+        id_1, id_2 = eval(output)
+        RECEIPT_STRINGS.index("A string the other process never saw")
+
+        self.restart(False, snapshot_path)
+        tracker = ReceiptTracker()
+        assert tracker._get_receipt(id_1) == STANDARD_RECEIPT_2
+        id_3 = tracker.add_receipt(STANDARD_RECEIPT_1)
+        tracker.write_snapshot(snapshot_path)
+
+        self.restart(False, snapshot_path)
+        tracker = ReceiptTracker()
+        assert [tracker._get_receipt(receipt_id) for receipt_id in (id_1, id_2, id_3)] == [
+            STANDARD_RECEIPT_2,
+            STANDARD_RECEIPT_1,
+            STANDARD_RECEIPT_1,
+        ]
+
+    @patch.object(ReceiptTracker, "NUM_SHARDS", 1)
+    def test_restore_after_strings_dropped(self: Self, snapshot_path: str) -> None:
+        """Tests that a snapshot is restored when the receipts it holds were packed with the numbers of strings that
+        were dropped along with evicted receipts and handed out again."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=False, capacity=CapacityPolicy(max_entries=1))
+        tracker.add_receipt(STANDARD_RECEIPT_1.model_copy(update={"retailer": "Evicted retailer"}))
+        tracker.add_receipt(STANDARD_RECEIPT_1.model_copy(update={"retailer": "Another evicted retailer"}))
+        # Packed with the number of the first retailer, dropped when its receipt was evicted.
+        receipt = STANDARD_RECEIPT_2.model_copy(update={"retailer": "Held retailer"})
+        id_1 = tracker.add_receipt(receipt)
+        assert "" in RECEIPT_STRINGS.copy()
+        tracker.write_snapshot(snapshot_path)
+
+        self.restart(False, snapshot_path)
+        tracker = ReceiptTracker()
+        assert tracker._get_receipt(id_1) == receipt
+        id_2 = tracker.add_receipt(STANDARD_RECEIPT_1)
+        tracker.write_snapshot(snapshot_path)
+
+        self.restart(False, snapshot_path)
+        tracker = ReceiptTracker()
+        assert [tracker._get_receipt(receipt_id) for receipt_id in (id_1, id_2)] == [receipt, STANDARD_RECEIPT_1]
+
+    def test_receipts_stored_while_writing(self: Self, snapshot_path: str, tmp_path: Path) -> None:
+        """Tests that a receipt being stored while a snapshot is written is left out of it, and is loaded from the log
+        on restore along with the receipts stored after, with every receipt counted in the stats once."""
+        log_path = str(tmp_path / "receipts.log")
+        appending = threading.Event()
+        release = threading.Event()
+
+        class BlockingLogBackend(AppendOnlyLogBackend):
+            def append(self: Self, entries: list[tuple[str, int | None, bytes]]) -> list[int]:
+                appending.set()
+                assert release.wait(5)
+                return super().append(entries)
+
+        tracker = ReceiptTracker()
+        storage = BlockingLogBackend(log_path)
+        tracker.configure(stats=ReceiptStatsIndex(), storage=storage)
+        release.set()
+        id_1 = tracker.add_receipt(STANDARD_RECEIPT_1)
+        release.clear()
+        appending.clear()
+        in_flight = []
+        thread = threading.Thread(target=lambda: in_flight.append(tracker.add_receipt(STANDARD_RECEIPT_2)))
+        thread.start()
+        assert appending.wait(5)
+        assert tracker.write_snapshot(snapshot_path) == 1
+        release.set()
+        thread.join()
+        id_3 = tracker.add_receipt(STANDARD_RECEIPT_1)
+        storage.close()
+
+        self.restart(False, snapshot_path, storage=AppendOnlyLogBackend(log_path))
+        tracker = ReceiptTracker()
+        assert set(tracker.receipt_id_to_data) == {in_flight[0], id_3}
+        assert tracker.get_points_for_receipts([id_1, *in_flight, id_3]) == (
+            {id_1: 28, in_flight[0]: 109, id_3: 28},
+            [],
+        )
+        assert tracker.stats.totals() == ReceiptAggregate(3, 7970, 165)
+
+    def test_create_app_restores_snapshot(self: Self, snapshot_path: str, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Tests that the app writes snapshots to the snapshot path setting and restores from it on startup."""
+        monkeypatch.setenv("FLASK_RECEIPTS_SNAPSHOT_PATH", f'"{snapshot_path}"')
+        app = create_app()
+        assert ReceiptTracker().snapshot is None
+        receipt_id = app.test_client().post("/receipts/process", json=STANDARD_INPUT_BODY_1).json["id"]
+        app.extensions["receipt_snapshot_writer"].close()
+        ReceiptTracker().clear()
+
+        app = create_app()
+        tracker = ReceiptTracker()
+        assert tracker.snapshot.path == snapshot_path
+        assert app.test_client().get(f"/receipts/{receipt_id}/points").json == {"points": 28}
+        assert tracker.stats.totals() == ReceiptAggregate(1, 3535, 28)
+        app.extensions["receipt_snapshot_writer"].close()
+
+    def test_restarts_through_worker_exit(self: Self, snapshot_path: str, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Tests that a worker exiting writes its last snapshot before closing the tracker, so receipts restored from
+        the previous snapshot are carried into the next one across restarts without a log."""
+        monkeypatch.setenv("FLASK_RECEIPTS_SNAPSHOT_PATH", f'"{snapshot_path}"')
+
+        def run_worker(count: int) -> list[str]:
+            """Starts a worker from whatever snapshot there is, adds receipts, and exits it as gunicorn would."""
+            ReceiptTracker().clear()
+            app = create_app()
+            client = app.test_client()
+            ids = [client.post("/receipts/process", json=STANDARD_INPUT_BODY_1).json["id"] for _ in range(count)]
+            gunicorn_config.worker_exit(None, SimpleNamespace(wsgi=app))
+            return ids
+
+        receipt_ids = run_worker(5)
+        receipt_ids += run_worker(2)
+        assert len(ReceiptSnapshot(snapshot_path)) == 7
+        ReceiptTracker().clear()
+        app = create_app()
+        points = {receipt_id: 28 for receipt_id in receipt_ids}
+        assert ReceiptTracker().get_points_for_receipts(receipt_ids) == (points, [])
+        app.extensions["receipt_snapshot_writer"].close()
+
+    def test_create_app_stops_previous_writer(self: Self, snapshot_path: str, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Tests that making another app stops the snapshot writer started for the last one, so only one runs."""
+        monkeypatch.setenv("FLASK_RECEIPTS_SNAPSHOT_PATH", f'"{snapshot_path}"')
+        writers = [create_app().extensions["receipt_snapshot_writer"] for _ in range(3)]
+        assert [writer._thread.is_alive() for writer in writers] == [False, False, True]
+        assert sum(thread.name == "receipt-snapshot-writer" for thread in threading.enumerate()) == 1
+        writers[-1].close()
@@ -0,0 +1,198 @@
+"""Tests the storage module."""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Self
+
+import pytest
+
+from app import create_app
+from exceptions import ReceiptStorageException
+from receipt_service import ReceiptTracker
+from storage import AppendOnlyLogBackend, ReceiptStorageBackend, SqliteSpillStore, StoredReceipt
+from tests.api_tests.conftest import STANDARD_RECEIPT_1, STANDARD_RECEIPT_2
+
+
+@pytest.fixture()
+def log_path(tmp_path: Path) -> str:
+    """Returns the path of a fresh log file."""
+    return str(tmp_path / "receipts.log")
+
+
+class TestReceiptStorageBackend:
+    """Tests the ReceiptStorageBackend class."""
+
+    def test_missing_method(self: Self) -> None:
+        """Tests that a backend missing one of the abstract methods can't be created."""
+
+        class NoReplayBackend(ReceiptStorageBackend):
+            def append(self: Self, entries: list[tuple[str, int | None, bytes]]) -> list[int]:
+                return []
+
+            def read_payload(self: Self, offset: int) -> bytes:
+                return b""
+
+            def end_offset(self: Self) -> int:
+                return 0
+
+        with pytest.raises(TypeError, match="replay"):
+            NoReplayBackend()
+
+
+class TestAppendOnlyLogBackend:
+    """Tests the AppendOnlyLogBackend class."""
+
+    def test_append_and_replay(self: Self, log_path: str) -> None:
+        """Tests that appended receipts are replayed in order with the offsets append returned."""
+        backend = AppendOnlyLogBackend(log_path)
+        offsets = backend.append([("1", 28, b'{"a": 1}'), ("2", None, b'{"b":\\t2}')])
+        offsets += backend.append([("3", 0, b"{}")])
+        backend.close()
+
+        replayed = list(AppendOnlyLogBackend(log_path).replay())
+        assert replayed == [
+            StoredReceipt("1", 28, b'{"a": 1}', offsets[0]),
+            StoredReceipt("2", None, b'{"b":\\t2}', offsets[1]),
+            StoredReceipt("3", 0, b"{}", offsets[2]),
+        ]
+
+    def test_replay_from_offset(self: Self, log_path: str) -> None:
+        """Tests replaying from an offset, and from the start if the offset is past the end of the log."""
+        backend = AppendOnlyLogBackend(log_path)
+        backend.append([("1", 28, b"{}")])
+        end_offset = backend.end_offset()
+        backend.append([("2", 5, b"{}"), ("3", None, b"{}")])
+        assert [stored.receipt_id for stored in backend.replay(end_offset)] == ["2", "3"]
+        assert [stored.receipt_id for stored in backend.replay(backend.end_offset() + 100)] == ["1", "2", "3"]
+        backend.close()
+
+    def test_read_payload(self: Self, log_path: str) -> None:
+        """Tests reading a payload back by its offset, including one that may not be committed yet."""
+        backend = AppendOnlyLogBackend(log_path, wait_for_commit=False)
+        offsets = backend.append([("1", 28, b'{"a": 1}'), ("2", None, b'{"b": 2}')])
+        assert backend.read_payload(offsets[1]) == b'{"b": 2}'
+        assert backend.read_payload(offsets[0]) == b'{"a": 1}'
+        backend.close()
+
+    def test_torn_write_is_truncated(self: Self, log_path: str) -> None:
+        """Tests that a partly written last line from a crash is dropped rather than replayed or appended onto."""
+        backend = AppendOnlyLogBackend(log_path)
+        backend.append([("1", 28, b"{}")])
+        backend.close()
+        with open(log_path, "ab") as log:
+            log.write(b"2\t10\t{")
+
+        backend = AppendOnlyLogBackend(log_path)
+        backend.append([("3", 5, b"{}")])
+        assert [stored.receipt_id for stored in backend.replay()] == ["1", "3"]
+        backend.close()
+
+    def test_concurrent_appends_are_group_committed(self: Self, log_path: str) -> None:
+        """Tests that appends from many threads are all committed and each gets its own offset."""
+        backend = AppendOnlyLogBackend(log_path, commit_interval=0.001)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            offsets = list(
+                executor.map(lambda number: backend.append([(str(number), number, b"{}")])[0], range(200))
+            )
+        backend.close()
+
+        replayed = {stored.receipt_id: stored for stored in AppendOnlyLogBackend(log_path).replay()}
+        assert len(replayed) == 200
+        assert [replayed[str(number)].offset for number in range(200)] == offsets
+        assert all(replayed[str(number)].points == number for number in range(200))
+
+    def test_append_after_close(self: Self, log_path: str) -> None:
+        """Tests that appending to a closed log raises."""
+        backend = AppendOnlyLogBackend(log_path)
+        backend.close()
+        with pytest.raises(ReceiptStorageException):
+            backend.append([("1", 1, b"{}")])
+
+
+class TestReceiptTrackerStorage:
+    """Tests the receipttracker class with a storage backend."""
+
+    @pytest.fixture(autouse=True)
+    def tracker_reset(self: Self):
+        """Resets the tracker between tests."""
+        yield
+        tracker = ReceiptTracker()
+        tracker.configure()
+        tracker.clear()
+
+    @pytest.mark.parametrize("eager_points", [False, True])
+    def test_receipts_survive_restart(self: Self, log_path: str, eager_points: bool) -> None:
+        """Tests that the receipts in the log are loaded back when the tracker starts with it."""
+        tracker = ReceiptTracker()
+        tracker.configure(eager_points=eager_points, storage=AppendOnlyLogBackend(log_path))
+        id_1 = tracker.add_receipt(STANDARD_RECEIPT_1)
+        id_2, = tracker.add_receipts([STANDARD_RECEIPT_2])
+
+        # Simulate a restart by dropping everything in memory and starting again from the log.
+        tracker.configure(eager_points=eager_points)
+        tracker.clear()
+        tracker.configure(eager_points=eager_points, storage=AppendOnlyLogBackend(log_path))
+        assert tracker.get_points_for_receipts([id_1, id_2]) == ({id_1: 28, id_2: 109}, [])
+        if eager_points:
+            assert tracker.receipt_id_to_data == {}
+        else:
+            assert tracker.receipt_id_to_data == {id_1: STANDARD_RECEIPT_1, id_2: STANDARD_RECEIPT_2}
+
+    def test_eager_points_point_at_payload(self: Self, log_path: str) -> None:
+        """Tests that eager receipts keep the offset of their payload in the log."""
+        tracker = ReceiptTracker()
+        backend = AppendOnlyLogBackend(log_path)
+        tracker.configure(eager_points=True, storage=backend)
+        tracker.add_receipt(STANDARD_RECEIPT_1)
+        (payload_offset,) = tracker.receipt_id_to_payload_offset.values()
+        payload = STANDARD_RECEIPT_1.model_dump_json(exclude_none=True).encode()
+        assert backend.read_payload(payload_offset) == payload
+
+    def test_create_app_opens_storage(self: Self, log_path: str, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Tests that the app opens the log set by the storage path setting."""
+        monkeypatch.setenv("FLASK_RECEIPTS_STORAGE_PATH", log_path)
+        create_app()
+        storage = ReceiptTracker().storage
+        assert isinstance(storage, AppendOnlyLogBackend) and storage.path == log_path
+        create_app()
+        assert ReceiptTracker().storage is storage
+
+
+class TestSqliteSpillStore:
+    """Tests the SqliteSpillStore class."""
+
+    def test_put_get_and_set_points(self: Self, tmp_path: Path) -> None:
+        """Tests spilling rows, reading them back and recording points for them."""
+        spill = SqliteSpillStore(str(tmp_path / "spill.db"))
+        spill.put_many([(b"1", None, b"{}"), (b"2", 10, None)])
+        assert spill.get(b"1") == (None, b"{}")
+        assert spill.get(b"3") is None
+        spill.set_points(b"1", 5)
+        assert spill.get(b"1") == (5, b"{}")
+        assert len(spill) == 2
+        assert spill.reads == 3
+        spill.clear()
+        assert len(spill) == 0 and spill.reads == 0
+        spill.close()
+        assert (tmp_path / "spill.db").exists()
+
+    def test_temporary_deleted_on_close(self: Self, tmp_path: Path) -> None:
+        """Tests that a temporary spill store's database is deleted when it's closed."""
+        spill = SqliteSpillStore(str(tmp_path / "spill.db"), temporary=True)
+        spill.put_many([(b"1", None, b"{}")])
+        spill.close()
+        assert list(tmp_path.iterdir()) == []
+
+    def test_create_app_configures_capacity(self: Self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Tests that the app sets a capacity policy and a temporary spill store when a limit is set, and deletes the
+        spill store once it's no longer used."""
+        monkeypatch.setenv("FLASK_RECEIPTS_MAX_ENTRIES", "100")
+        create_app()
+        tracker = ReceiptTracker()
+        assert tracker.capacity.max_entries == 100
+        spill_path = tracker.spill.path
+        assert Path(spill_path).exists()
+        monkeypatch.delenv("FLASK_RECEIPTS_MAX_ENTRIES")
+        create_app()
+        assert tracker.capacity is None and tracker.spill is None
+        assert not Path(spill_path).exists()